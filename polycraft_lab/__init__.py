@@ -11,8 +11,8 @@ from polycraft_lab.installation import PAL_DEFAULT_PATH
 from polycraft_lab.installation.client_tools import launch_polycraft as launch
 from polycraft_lab.envs import make
 
-__all__ = ['cli', 'ect', 'envs', 'examples', 'tests', 'run_cli',
-           'make', 'launch', ]
+__all__ = ['bench', 'cli', 'ect', 'envs', 'examples', 'experiments',
+           'monitoring', 'remote', 'tests', 'run_cli', 'make', 'launch', ]
 
 LOGGING_FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
 
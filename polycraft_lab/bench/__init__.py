@@ -0,0 +1,12 @@
+"""Benchmarks for the Polycraft AI Lab (PAL) bridge, environment and tooling.
+
+The suite runs against a local `FakePolycraftServer` instead of a live game,
+and can be run from the command line with `pal bench`.
+"""
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.bench.suite import compare_to_baseline, load_baseline, \
+    run_benchmarks, save_baseline
+
+__all__ = ['FakePolycraftServer', 'run_benchmarks', 'save_baseline',
+           'load_baseline', 'compare_to_baseline']
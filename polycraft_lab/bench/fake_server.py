@@ -0,0 +1,170 @@
+"""A local stand-in for the socket server exposed by the Polycraft World mod.
+
+The FakePolycraftServer speaks the same protocol as the mod: it reads
+newline-terminated commands and answers each one with a JSON reply, or with a
+length-prefixed msgpack reply once a connection negotiated it. It lets the
+benchmark suite and unit tests exercise the bridge without a running game.
+"""
+import json
+import logging
+import socket
+import struct
+import threading
+from typing import Callable, Dict, Sequence, Tuple
+
+from polycraft_lab.installation.comms import COMMAND_PROTOCOL, DEFAULT_HOST, \
+    PROTOCOL_JSON, PROTOCOL_MSGPACK, msgpack
+
+log = logging.getLogger('pal').getChild('bench').getChild('server')
+
+DEFAULT_REPLY_SIZE = 256  # bytes
+
+_ACCEPT_TIMEOUT = 0.2  # seconds
+
+
+class FakePolycraftServer:
+    """A threaded TCP server that replies to commands like Polycraft World.
+
+    By default every command receives a reply of roughly `reply_size` bytes
+    (measured as JSON) shaped like a block scan. A custom `handler` can build
+    replies instead.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = 0,
+                 reply_size: int = DEFAULT_REPLY_SIZE,
+                 handler: Callable[[str], dict] = None,
+                 protocols: Sequence[str] = (PROTOCOL_JSON, PROTOCOL_MSGPACK)):
+        """Create a new server. It does not listen until `start` is called.
+
+        Args:
+            host (str): The interface to listen on
+            port (int): The port to listen on, or 0 to pick a free port
+            reply_size (int): The approximate size of default replies in bytes
+            handler: A function mapping a received command to a reply dict
+            protocols: The reply encodings clients may switch to
+        """
+        self._host = host
+        self._port = port
+        self._handler = handler
+        self._reply_size = reply_size
+        self._protocols = protocols
+        self._reply_cache: Dict[Tuple[int, str], bytes] = {}
+        self._socket: socket.socket = None
+        self._thread: threading.Thread = None
+        self._running = threading.Event()
+        self.commands_received = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """Return the (host, port) pair this server is listening on."""
+        return self._host, self._port
+
+    @property
+    def reply_size(self) -> int:
+        return self._reply_size
+
+    @reply_size.setter
+    def reply_size(self, new_size: int):
+        self._reply_size = new_size
+
+    def start(self):
+        """Start listening for connections in a background thread."""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self._host, self._port))
+        self._socket.listen()
+        self._socket.settimeout(_ACCEPT_TIMEOUT)
+        self._port = self._socket.getsockname()[1]
+        self._running.set()
+        self._thread = threading.Thread(target=self._serve, daemon=True,
+                                        name=f'fake-polycraft-{self._port}')
+        self._thread.start()
+        log.debug('Fake Polycraft server listening on port %s', self._port)
+
+    def stop(self):
+        """Stop accepting connections and close the listening socket."""
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+        if self._socket is not None:
+            self._socket.close()
+
+    def reply(self, command: str, protocol: str = PROTOCOL_JSON) -> bytes:
+        """Return the encoded reply for the given command."""
+        if self._handler is not None:
+            return _encode(self._handler(command), protocol)
+        key = (self._reply_size, protocol)
+        cached = self._reply_cache.get(key)
+        if cached is None:
+            cached = _encode(_block_scan(self._reply_size), protocol)
+            self._reply_cache[key] = cached
+        return cached
+
+    def _negotiate(self, command: str, protocol: str) -> Tuple[bytes, str]:
+        requested = command[len(COMMAND_PROTOCOL):].strip()
+        if requested in self._protocols and \
+                (requested != PROTOCOL_MSGPACK or msgpack is not None):
+            # The acknowledgement still uses the old encoding
+            return _encode({'protocol': requested}, protocol), requested
+        return _encode({'result': 'FAIL',
+                        'message': f'Unknown protocol {requested}'},
+                       protocol), protocol
+
+    def _serve(self):
+        while self._running.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle_connection,
+                             args=(connection,), daemon=True).start()
+
+    def _handle_connection(self, connection: socket.socket):
+        protocol = PROTOCOL_JSON
+        with connection, connection.makefile('rb') as stream:
+            try:
+                for line in stream:
+                    if not self._running.is_set():
+                        break
+                    command = line.decode().strip()
+                    if not command:
+                        continue
+                    self.commands_received += 1
+                    if command.startswith(COMMAND_PROTOCOL):
+                        reply, protocol = self._negotiate(command, protocol)
+                    else:
+                        reply = self.reply(command, protocol)
+                    connection.sendall(reply)
+            except OSError:
+                # The client went away, which ends the conversation
+                pass
+
+
+def _encode(reply: dict, protocol: str) -> bytes:
+    if protocol == PROTOCOL_MSGPACK:
+        payload = msgpack.packb(reply, use_bin_type=True)
+        return struct.pack('>I', len(payload)) + payload
+    return json.dumps(reply).encode() + b'\n'
+
+
+def _block_scan(size: int) -> dict:
+    """Return a sensor-like reply that encodes to about `size` bytes of JSON."""
+    reply = {'command': 'SENSE_ALL', 'result': 'SUCCESS', 'blocks': []}
+    length = len(json.dumps(reply))
+    index = 0
+    while length < size:
+        block = {'name': 'minecraft:stone', 'pos': [index, 64, -index],
+                 'isAccessible': True}
+        reply['blocks'].append(block)
+        length += len(json.dumps(block)) + 2
+        index += 1
+    return reply
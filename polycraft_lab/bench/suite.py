@@ -0,0 +1,400 @@
+"""Micro-benchmarks for the Polycraft AI Lab hot paths.
+
+Every benchmark runs against local resources only: socket benchmarks talk to a
+FakePolycraftServer, and file benchmarks use a temporary directory. Results are
+summarized as seconds per operation so runs can be compared against a saved
+JSON baseline with `compare_to_baseline`.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+from zipfile import ZipFile
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.installation import PAL_DEFAULT_PATH, PAL_MOD_DIR_NAME, \
+    PAL_TEMP_PATH
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.installation.comms import PROTOCOL_JSON, \
+    PROTOCOL_MSGPACK, PolycraftBridge, msgpack
+from polycraft_lab.installation.placement import POLICY_NONE, POLICY_PACK, \
+    POLICY_SPREAD, ResourceLimits, plan_placement
+
+log = logging.getLogger('pal').getChild('bench')
+
+BENCHMARK_BASELINE_PATH = PAL_DEFAULT_PATH / 'bench' / 'baseline.json'
+
+DEFAULT_REPLY_SIZES = (256, 4 * 1024, 64 * 1024, 1024 * 1024)
+
+DEFAULT_TOLERANCE = 0.25  # A 25% slower median is flagged as a regression
+
+DEFAULT_PLACEMENT_POLICIES = (POLICY_NONE, POLICY_SPREAD, POLICY_PACK)
+
+# Seconds a placement benchmark process may take to start or finish
+_PLACEMENT_TIMEOUT = 60
+
+EXAMPLE_CONFIG_PATH = Path(__file__).absolute().parent.parent / \
+    'examples' / 'pogo_stick_config.json'
+
+
+class BenchmarkResult:
+    """Timing samples collected for a single benchmark.
+
+    Attributes:
+        name (str): A unique, stable identifier used in baselines
+        samples (list): Seconds taken by each measured operation
+        bytes_per_op (int): Payload bytes moved per operation, if relevant
+        cpu_samples (list): CPU seconds the measuring thread spent on each
+            operation, if recorded
+    """
+
+    def __init__(self, name: str, samples: List[float],
+                 bytes_per_op: int = None, cpu_samples: List[float] = None):
+        self.name = name
+        self.samples = samples
+        self.bytes_per_op = bytes_per_op
+        self.cpu_samples = cpu_samples
+
+    def summary(self) -> dict:
+        """Return the statistics stored in a baseline for this benchmark."""
+        ordered = sorted(self.samples)
+        median = statistics.median(ordered)
+        summary = {
+            'n': len(ordered),
+            'mean': statistics.mean(ordered),
+            'median': median,
+            'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'min': ordered[0],
+            'ops_per_sec': 1 / median if median > 0 else float('inf'),
+        }
+        if self.bytes_per_op is not None:
+            summary['bytes_per_op'] = self.bytes_per_op
+            summary['mb_per_sec'] = \
+                self.bytes_per_op / median / 1e6 if median > 0 else float('inf')
+        if self.cpu_samples:
+            summary['cpu_median'] = statistics.median(self.cpu_samples)
+        return summary
+
+
+class Regression:
+    """A benchmark whose median got slower than its baseline allows.
+
+    Attributes:
+        name (str): The benchmark name
+        baseline (float): The baseline median in seconds
+        current (float): The current median in seconds
+    """
+
+    def __init__(self, name: str, baseline: float, current: float):
+        self.name = name
+        self.baseline = baseline
+        self.current = current
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float('inf')
+
+
+def _measure(name: str, operation: Callable[[], None], iterations: int,
+             warmup: int = 3, bytes_per_op: int = None) -> BenchmarkResult:
+    for _ in range(warmup):
+        operation()
+    samples = []
+    cpu_samples = []
+    for _ in range(iterations):
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - start)
+        cpu_samples.append(time.thread_time() - cpu_start)
+    return BenchmarkResult(name, samples, bytes_per_op, cpu_samples)
+
+
+def bench_bridge_send(reply_sizes=DEFAULT_REPLY_SIZES,
+                      iterations: int = 200) -> List[BenchmarkResult]:
+    """Measure `PolycraftBridge.send` round trips for each reply size.
+
+    Sizes the bridge fails to receive intact are logged and left out of the
+    results rather than aborting the whole suite.
+    """
+    results = []
+    with FakePolycraftServer() as server:
+        host, port = server.address
+        for size in reply_sizes:
+            server.reply_size = size
+            # Large replies are slow enough that fewer samples suffice
+            count = max(10, iterations * 4096 // max(size, 4096))
+            # A failed receive leaves the stream out of sync, so each size
+            # gets its own connection
+            bridge = _connected_bridge(host, port)
+            try:
+                results.append(_measure(
+                    f'bridge_send_{size}b', lambda: bridge.send('SENSE_ALL'),
+                    count, bytes_per_op=len(server.reply('SENSE_ALL'))))
+            except ValueError:
+                log.warning('Bridge could not receive %s byte replies', size)
+            finally:
+                bridge.disconnect()
+    return results
+
+
+def bench_protocols(reply_size: int = 256 * 1024, iterations: int = 50
+                    ) -> List[BenchmarkResult]:
+    """Compare JSON and msgpack replies by latency, CPU and bytes on the wire.
+
+    The msgpack benchmark is skipped when msgpack is not installed.
+    """
+    protocols = [PROTOCOL_JSON]
+    if msgpack is not None:
+        protocols.append(PROTOCOL_MSGPACK)
+    results = []
+    with FakePolycraftServer(reply_size=reply_size) as server:
+        host, port = server.address
+        for protocol in protocols:
+            bridge = _connected_bridge(host, port, protocol)
+            try:
+                before = bridge.bytes_received
+                bridge.send('SENSE_ALL')
+                wire_bytes = bridge.bytes_received - before
+                results.append(_measure(
+                    f'protocol_{protocol}_{reply_size}b',
+                    lambda: bridge.send('SENSE_ALL'), iterations,
+                    bytes_per_op=wire_bytes))
+            finally:
+                bridge.disconnect()
+    return results
+
+
+def bench_env_step(iterations: int = 200) -> List[BenchmarkResult]:
+    """Measure `PolycraftEnv.step` next to a raw send of the same command."""
+    from polycraft_lab.envs.core import PolycraftEnv
+    with FakePolycraftServer() as server:
+        host, port = server.address
+        client = PolycraftClient.attach(host, port)
+        with PolycraftEnv('bench_mission.json', client=client) as env:
+            raw = _measure('env_raw_send', lambda: client.send('MOVE w'),
+                           iterations)
+            step = _measure('env_step', lambda: env.step('MOVE w'),
+                            iterations)
+    return [raw, step]
+
+
+def _placement_worker(limits: ResourceLimits, steps: int, reply_size: int,
+                      ready, go, done):
+    """Step a bridge to a fake game, both placed by `limits`."""
+    limits.apply()
+    with FakePolycraftServer(reply_size=reply_size) as server:
+        bridge = _connected_bridge(*server.address)
+        try:
+            bridge.send('SENSE_ALL')
+            ready.release()
+            go.wait()
+            for _ in range(steps):
+                bridge.send('SENSE_ALL')
+        finally:
+            bridge.disconnect()
+    done.release()
+
+
+def _acquire_all(semaphore, count: int):
+    for _ in range(count):
+        if not semaphore.acquire(timeout=_PLACEMENT_TIMEOUT):
+            raise RuntimeError('A placement benchmark process stopped '
+                               'responding')
+
+
+def bench_placement(policies=DEFAULT_PLACEMENT_POLICIES, instances: int = None,
+                    steps: int = 500, reply_size: int = 16 * 1024,
+                    repeats: int = 3) -> List[BenchmarkResult]:
+    """Measure the stepping throughput of many instances per placement.
+
+    Every instance is a process stepping its own fake game, placed like a
+    launched game would be. Samples are the seconds per step of all instances
+    together, from the moment they all start stepping until the last one is
+    done.
+
+    Args:
+        policies: The placement policies to compare
+        instances (int): How many instances step at once, one per CPU by
+            default
+    """
+    instances = instances or max(2, os.cpu_count() or 1)
+    context = multiprocessing.get_context()
+    results = []
+    for policy in policies:
+        placement = plan_placement(instances, policy)
+        samples = []
+        for _ in range(repeats):
+            ready = context.Semaphore(0)
+            done = context.Semaphore(0)
+            go = context.Event()
+            processes = [context.Process(
+                target=_placement_worker, daemon=True,
+                args=(limits, steps, reply_size, ready, go, done))
+                for limits in placement]
+            for process in processes:
+                process.start()
+            try:
+                _acquire_all(ready, instances)
+                start = time.perf_counter()
+                go.set()
+                _acquire_all(done, instances)
+                samples.append((time.perf_counter() - start) /
+                               (steps * instances))
+            finally:
+                for process in processes:
+                    process.join(_PLACEMENT_TIMEOUT)
+                    if process.is_alive():
+                        process.terminate()
+        results.append(BenchmarkResult(
+            f'placement_{policy}_{instances}x', samples))
+    return results
+
+
+def bench_import(repeats: int = 5) -> List[BenchmarkResult]:
+    """Measure `import polycraft_lab` in fresh interpreters."""
+    script = ('import time; start = time.perf_counter(); '
+              'import polycraft_lab; '
+              'print(time.perf_counter() - start)')
+    samples = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', script],
+                                stdout=subprocess.PIPE, check=True)
+        samples.append(float(output.stdout.decode().strip().splitlines()[-1]))
+    return [BenchmarkResult('import_polycraft_lab', samples)]
+
+
+def bench_config_load(iterations: int = 200) -> List[BenchmarkResult]:
+    """Measure loading lab and experiment configuration files."""
+    from polycraft_lab.ect.experiment_config import ExperimentConfig
+    from polycraft_lab.installation.config import CONFIG_FILE_NAME, \
+        CONFIG_TEMPLATE, PolycraftLabConfig
+    with tempfile.TemporaryDirectory() as directory:
+        lab_config_path = Path(directory) / CONFIG_FILE_NAME
+        lab_config_path.write_text(CONFIG_TEMPLATE)
+        return [
+            _measure('config_load_lab',
+                     lambda: PolycraftLabConfig.from_file(str(lab_config_path)),
+                     iterations),
+            _measure('config_load_experiment',
+                     lambda: ExperimentConfig.from_file(
+                         str(EXAMPLE_CONFIG_PATH)),
+                     iterations),
+        ]
+
+
+def bench_extraction(file_count: int = 200, file_size: int = 16 * 1024,
+                     iterations: int = 5) -> List[BenchmarkResult]:
+    """Measure extracting a synthetic Polycraft World bundle."""
+    from polycraft_lab.installation.download import _extract_polycraft
+    working_directory = os.getcwd()
+    Path(PAL_TEMP_PATH).mkdir(parents=True, exist_ok=True)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            bundle_path = Path(directory) / 'bundle.zip'
+            contents = os.urandom(file_size)
+            with ZipFile(bundle_path, 'w') as bundle:
+                # Like GitHub archives, the root directory is the first entry
+                bundle.writestr('polycraft-master/', '')
+                for i in range(file_count):
+                    bundle.writestr(f'polycraft-master/src/file_{i}.bin',
+                                    contents)
+            destination = str(Path(directory) / PAL_MOD_DIR_NAME)
+            return [_measure(
+                'extract_bundle',
+                lambda: _extract_polycraft(str(bundle_path), destination,
+                                           should_cleanup=False),
+                iterations, warmup=1,
+                bytes_per_op=file_count * file_size)]
+    finally:
+        os.chdir(working_directory)
+
+
+def _connected_bridge(host: str, port: int,
+                      protocol: str = PROTOCOL_JSON) -> PolycraftBridge:
+    bridge = PolycraftBridge(host, port, None, protocol=protocol)
+    bridge.start(startup_delay=0)
+    return bridge
+
+
+def run_benchmarks(quick: bool = False) -> Dict[str, dict]:
+    """Run the full benchmark suite.
+
+    Args:
+        quick (bool): Take fewer samples, e.g. for smoke tests
+
+    Returns:
+        A mapping of benchmark name to its summary statistics.
+    """
+    scale = 10 if quick else 1
+    results = []
+    results += bench_bridge_send(iterations=200 // scale)
+    results += bench_protocols(iterations=50 // scale)
+    results += bench_env_step(iterations=200 // scale)
+    results += bench_import(repeats=1 if quick else 5)
+    results += bench_config_load(iterations=200 // scale)
+    results += bench_extraction(file_count=200 // scale,
+                                iterations=2 if quick else 5)
+    results += bench_placement(steps=500 // scale,
+                               repeats=1 if quick else 3)
+    return {result.name: result.summary() for result in results}
+
+
+def _package_version() -> str:
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+        return version('polycraft-lab')
+    except (ImportError, PackageNotFoundError):
+        return 'unknown'
+
+
+def save_baseline(results: Dict[str, dict],
+                  path: Path = BENCHMARK_BASELINE_PATH):
+    """Write benchmark results to a JSON baseline file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    baseline = {
+        'version': _package_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': datetime.now().isoformat(),
+        'results': results,
+    }
+    with path.open('w') as file:
+        json.dump(baseline, file, indent=4)
+
+
+def load_baseline(path: Path = BENCHMARK_BASELINE_PATH) -> dict:
+    """Return a saved baseline, or None if there is none at `path`."""
+    path = Path(path)
+    if not path.is_file():
+        return None
+    with path.open() as file:
+        return json.load(file)
+
+
+def compare_to_baseline(results: Dict[str, dict], baseline: dict,
+                        tolerance: float = DEFAULT_TOLERANCE
+                        ) -> List[Regression]:
+    """Return every benchmark whose median regressed beyond `tolerance`.
+
+    Benchmarks that are missing from either side are ignored.
+    """
+    regressions = []
+    for name, summary in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        if summary['median'] > previous['median'] * (1 + tolerance):
+            regressions.append(
+                Regression(name, previous['median'], summary['median']))
+    return regressions
@@ -4,17 +4,46 @@ This can launch the game, manage a Polycraft Lab installation, as well as start
 reinforcement learning training experiments.
 """
 import logging
+import sys
+import time
 from pathlib import Path
+from typing import List, Optional
+
 import fire
 
+from polycraft_lab.bench.suite import BENCHMARK_BASELINE_PATH, \
+    DEFAULT_TOLERANCE, compare_to_baseline, load_baseline, run_benchmarks, \
+    save_baseline
 from polycraft_lab.cli.console_utils import _get_bool_input
+from polycraft_lab.cli.turtle import TurtleConsole
+from polycraft_lab.ect.generator import MissionTemplate, generate_missions
+from polycraft_lab.experiments.sweep import SweepConfig, SweepRunner
 from polycraft_lab.installation import PAL_DEFAULT_PATH
 from polycraft_lab.installation.game import ClientNotInitializedError
-from polycraft_lab.installation.comms import ClientDidNotStartError
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.installation.comms import ClientDidNotStartError, \
+    DEFAULT_HOST, DEFAULT_PORT, PROTOCOL_JSON
 from polycraft_lab.installation.client_tools import launch_polycraft
 from polycraft_lab.installation.config import CONFIG_FILE_NAME, \
     PolycraftLabConfig
-from polycraft_lab.installation.manager import PolycraftInstallation
+from polycraft_lab.installation.instances import InstanceRegistry
+from polycraft_lab.installation.integrity import InstallationCorruptedError
+from polycraft_lab.installation.logs import parse_time, search_logs
+from polycraft_lab.installation.manager import InstallationIncompleteError, \
+    PolycraftInstallation
+from polycraft_lab.installation.pipeline import \
+    InstallationCancelledError, ProgressPrinter
+from polycraft_lab.installation.placement import POLICY_NONE, \
+    plan_placement
+from polycraft_lab.installation.releases import prefetch_release
+from polycraft_lab.monitoring.profiler import Profiler, format_summary
+from polycraft_lab.monitoring.server import DEFAULT_METRICS_PORT, \
+    serve_metrics
+from polycraft_lab.remote.env import parse_address
+from polycraft_lab.remote.worker import DEFAULT_WORKER_HOST, \
+    DEFAULT_WORKER_PORT, PolycraftWorker, game_env_factory
+from polycraft_lab.monitoring.status import DEFAULT_REFRESH_INTERVAL, \
+    DEFAULT_STATUS_URL, watch_status
 
 POLYCRAFT_CONFIG_DIR = Path.home() / '.polycraft'
 
@@ -24,12 +53,17 @@ log = logging.getLogger('pal').getChild('cli')
 
 
 class CLIContext:
+    """Ends a command quietly when it is cancelled with Ctrl + C."""
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if isinstance(exc_type, KeyboardInterrupt):
-            print('')
+        if exc_type is not None and issubclass(
+                exc_type, (KeyboardInterrupt, InstallationCancelledError)):
+            print('\nCancelled.')
+            return True
+        return False
 
 
 class PolycraftLabCLI:
@@ -54,48 +88,73 @@ class PolycraftLabCLI:
 
         This is a guided flow.
         """
-        # with CLIContext(): # TODO: Handle Ctrl + C gracefully
         log.debug('Init command selected')
-        print('Welcome to Polycraft AI Lab.')
-
-        print(f'PAL configuration will be stored in '
-              f'{str(self.config.config.location)}')
-        # TODO: Save directory
-        game = PolycraftInstallation()
-        if game.is_installed:
-            # TODO: Replace with versioned clients
-            should_install = reinstall or _get_bool_input(
-                'Client is already installed. Would you like to reinstall the '
-                'Polycraft game client?')
-            if should_install:
-                print('Reinstalling Polycraft World...')
-                game.install(force_install=True)
-                print('Reinstall complete.')
+        should_launch_game = False
+        with CLIContext():
+            print('Welcome to Polycraft AI Lab.')
+
+            print(f'PAL configuration will be stored in '
+                  f'{str(self.config.config.location)}')
+            # TODO: Save directory
+            game = PolycraftInstallation()
+            # Fetched while waiting for the prompts below
+            release = prefetch_release()
+            progress = ProgressPrinter()
+            if game.is_installed:
+                # TODO: Replace with versioned clients
+                should_install = reinstall or _get_bool_input(
+                    'Client is already installed. Would you like to reinstall '
+                    'the Polycraft game client?')
+                if should_install:
+                    print('Reinstalling Polycraft World...')
+                    game.install(force_install=True, release=release,
+                                 on_progress=progress)
+                    print('Reinstall complete.')
+                else:
+                    print('Skipping reinstallation')
             else:
-                print('Skipping reinstallation')
-        else:
-            print('Game client is not installed. Installing now.\n')
-            game.install()
-        should_launch_game = _get_bool_input('Launch game?', default=True)
+                print('Game client is not installed. Installing now.\n')
+                game.install(release=release, on_progress=progress)
+            should_launch_game = _get_bool_input('Launch game?', default=True)
         if should_launch_game:
             self.launch()
 
     @staticmethod
-    def status():
-        """Return the status of the currently running experiment."""
+    def status(url: str = DEFAULT_STATUS_URL,
+               interval: float = DEFAULT_REFRESH_INTERVAL, once: bool = False):
+        """Show live metrics for the game instances of a running PAL process.
+
+        Metrics are served by pal launch and pal experiment launch.
+
+        Args:
+            url (str): The metrics endpoint of the PAL process to watch
+            interval (float): Seconds between refreshes
+            once (bool): Print the status a single time instead of refreshing
+        """
         log.debug('Status command selected')
-        print('Not yet implemented')
+        try:
+            watch_status(url, interval, once)
+        except KeyboardInterrupt:
+            print('')
+        except OSError as e:
+            print(f'Could not reach metrics at {url} ({e}). '
+                  f'Is a game running with pal launch?')
+            sys.exit(1)
 
-    def launch(self):
+    def launch(self, metrics_port: int = DEFAULT_METRICS_PORT):
         """Launch a Polycraft World instance.
 
         This also starts the socket connection in the background. Once this
         command is run, the process continues until it is killed with Ctrl + C.
+
+        Args:
+            metrics_port (int): Where to serve metrics for pal status
         """
         log.debug('Launch command selected')
         try:
             print('Starting Polycraft...')
-            launch_polycraft(verbose=self.verbose)
+            with serve_metrics(metrics_port):
+                launch_polycraft(verbose=self.verbose)
         except ClientNotInitializedError:
             print('The game has not been initialized.'
                   'Please run pal init to set up the game.')
@@ -107,16 +166,210 @@ class PolycraftLabCLI:
                   'containing information from your log files.')
         log.debug('Exiting CLI')
 
-    def turtle(self):
-        """Begin an interactive turtle."""
-        # TODO: Implement this.
+    @staticmethod
+    def worker(host: str = DEFAULT_WORKER_HOST,
+               port: int = DEFAULT_WORKER_PORT, games: str = None,
+               instances: int = 1, token: str = None,
+               metrics_port: int = DEFAULT_METRICS_PORT,
+               placement: str = POLICY_NONE, nice: int = None):
+        """Lend this machine's games to remote learners.
+
+        Learners connect with RemotePolycraftEnv or RemoteVectorEnv. The
+        worker is unencrypted, so only listen on other interfaces than
+        localhost inside a trusted network, and set a token.
+
+        Args:
+            host (str): The interface to listen on
+            port (int): The port to listen on
+            games (str): Comma-separated host:port of running games to lend.
+                Without it, the worker launches the default installation.
+            instances (int): How many games to launch when no games are
+                given. Each gets its own port from the lab config.
+            token (str): A shared secret learners must present
+            metrics_port (int): Where to serve metrics for pal status
+            placement (str): How launched games are placed on the CPUs:
+                spread, pack, node or none
+            nice (int): Niceness added to launched games
+        """
+        log.debug('Worker command selected')
+        if isinstance(games, str):
+            games = games.split(',')
+        addresses = [parse_address(game) for game in games or []]
+        limits = None
+        if not addresses:
+            limits = plan_placement(instances, placement, nice=nice)
+        worker = PolycraftWorker(host, port, len(addresses) or instances,
+                                 game_env_factory(addresses, limits), token)
+        print(f'Worker listening on {host}:{port} with {worker.capacity} '
+              f'game(s). Press Ctrl + C to stop.')
+        try:
+            with serve_metrics(metrics_port):
+                worker.serve_forever()
+        except KeyboardInterrupt:
+            print('')
+
+    @staticmethod
+    def verify(thorough: bool = False, repair: bool = False):
+        """Check the installed game files for missing or changed files.
+
+        Args:
+            thorough (bool): Hash every file instead of only checking sizes
+                and hashing files whose modification time changed
+            repair (bool): Extract broken files again from the cached release
+        """
+        log.debug('Verify command selected')
+        game = PolycraftInstallation()
+        try:
+            result = game.verify(thorough)
+        except InstallationIncompleteError:
+            print('The game is not installed completely. '
+                  'Run pal init to install it.')
+            sys.exit(1)
+        print(f'Checked {result.checked} files ({result.hashed} hashed) in '
+              f'{result.elapsed:.2f}s.')
+        if result.ok:
+            print('All files are intact.')
+            return
+        for path in result.missing:
+            print(f'missing  {path}')
+        for path in result.corrupted:
+            print(f'changed  {path}')
+        if not repair:
+            print('Run pal verify --repair to restore them.')
+            sys.exit(1)
+        try:
+            game.repair(result.broken)
+        except InstallationCorruptedError as e:
+            print(f'Could not repair the installation: {e}\n'
+                  f'Run pal init --reinstall to install it again.')
+            sys.exit(1)
+        print(f'Repaired {len(result.broken)} file(s).')
+
+    @staticmethod
+    def logs(instance: str = None, since: str = '1h', until: str = None,
+             event: str = None, level: str = None, grep: str = None,
+             limit: int = 100):
+        """Search the indexed output of game instances.
+
+        Args:
+            instance (str): Comma-separated instances to search, such as
+                game-9000. All instances by default.
+            since (str): The earliest time to show, as a duration before now
+                (30s, 10m, 2h, 1d), an ISO 8601 date or a Unix time
+            until (str): The latest time to show, in the same formats
+            event (str): Comma-separated event types, such as exception,crash
+            level (str): Comma-separated levels, such as WARN,ERROR
+            grep (str): Only show lines containing this text
+            limit (int): Show at most this many of the latest lines
+        """
+        log.debug('Logs command selected')
+        records = search_logs(
+            instances=_split(instance), limit=limit,
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            events=_split(event),
+            levels=[value.upper() for value in _split(level) or []],
+            contains=grep)
+        if not records:
+            print('No matching log lines.')
+            return
+        for record in records:
+            clock = time.strftime('%Y-%m-%d %H:%M:%S',
+                                  time.localtime(record['time']))
+            tag = f' [{record["event"]}]' if record['event'] else ''
+            print(f'{clock} {record["instance"]} {record["level"] or "-"}'
+                  f'{tag} {record["message"]}')
+
+    @staticmethod
+    def instances():
+        """List the game instances running on this machine."""
+        log.debug('Instances command selected')
+        records = InstanceRegistry().instances()
+        if not records:
+            print('No game instances are running.')
+            return
+        print(f'{"port":>6}{"pid":>9}{"owner":>9}  {"started":<20}'
+              f'installation')
+        for record in records:
+            started = time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(record['started_at']))
+            print(f'{record["port"]:>6}{record["pid"]:>9}'
+                  f'{record["owner_pid"]:>9}  {started:<20}'
+                  f'{record["installation"]}')
+
+    @staticmethod
+    def bench(save: bool = False, baseline: str = None,
+              tolerance: float = DEFAULT_TOLERANCE, quick: bool = False):
+        """Benchmark PAL against a local fake game server.
+
+        Results are compared to the saved baseline, and the command exits with
+        a non-zero status if any benchmark regressed.
+
+        Args:
+            save (bool): Store this run as the new baseline
+            baseline (str): The baseline file, stored in the PAL directory by
+                default
+            tolerance (float): How much slower (0.25 = 25%) a benchmark may get
+                before being flagged
+            quick (bool): Take fewer samples for a faster, noisier run
+        """
+        log.debug('Bench command selected')
+        baseline_path = Path(baseline) if baseline else BENCHMARK_BASELINE_PATH
+        print('Running benchmarks...')
+        results = run_benchmarks(quick=quick)
+        previous = load_baseline(baseline_path)
+        regressions = []
+        if previous is not None:
+            regressions = compare_to_baseline(results, previous, tolerance)
+        regressed = {regression.name: regression for regression in regressions}
+
+        print(f'{"benchmark":<28}{"median":>12}{"p95":>12}{"ops/s":>12}')
+        for name, summary in results.items():
+            line = (f'{name:<28}{summary["median"] * 1e3:>10.3f}ms'
+                    f'{summary["p95"] * 1e3:>10.3f}ms'
+                    f'{summary["ops_per_sec"]:>12.1f}')
+            if name in regressed:
+                line += f'  REGRESSION x{regressed[name].ratio:.2f}'
+            print(line)
+
+        if save:
+            save_baseline(results, baseline_path)
+            print(f'Saved baseline to {baseline_path}')
+        elif previous is None:
+            print(f'No baseline found at {baseline_path}. '
+                  f'Run pal bench --save to create one.')
+        else:
+            print(f'Compared against baseline from version '
+                  f'{previous["version"]} ({previous["created_at"]})')
+        if regressions and not save:
+            sys.exit(1)
+
+    @staticmethod
+    def turtle(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+               pretty: bool = True, protocol: str = PROTOCOL_JSON):
+        """Begin an interactive turtle on a running game.
+
+        Commands piped in on stdin are sent as a pipelined script instead,
+        for example: pal turtle < commands.txt
+
+        Args:
+            host (str): The address the game listens on
+            port (int): The port the game listens on
+            pretty (bool): Indent replies instead of printing them on one line
+            protocol (str): The reply encoding to use, 'json' or 'msgpack'
+        """
         log.debug('Turtle command selected')
-        print('Valid commands: [quit]')
-        last_input = input('>>> ')
-        while True:
-            log.debug(f'Given command: {last_input}')
-            if last_input.lower() is 'quit':
-                break
+        try:
+            client = PolycraftClient.attach(host, port, protocol=protocol)
+        except OSError as e:
+            print(f'Could not connect to a game at {host}:{port} ({e}). '
+                  f'Start one with pal launch.')
+            sys.exit(1)
+        try:
+            with TurtleConsole(client, pretty=pretty) as console:
+                console.run(sys.stdin)
+        finally:
+            client.stop()
         log.debug('Exiting CLI')
 
 
@@ -151,8 +404,67 @@ class RunExperimentGroup:
             # Run experiment in current directory
             pass
 
-    def launch(self, config_path):
-        print('Not yet implemented')
+    @staticmethod
+    def launch(config_path: str, restart: bool = False,
+               metrics_port: int = DEFAULT_METRICS_PORT, profile=False):
+        """Run a sweep of missions x seeds x agents.
+
+        Results are checkpointed after every trial, so running the same sweep
+        again continues where it stopped.
+
+        Args:
+            config_path (str): The sweep JSON file
+            restart (bool): Discard earlier results and run every trial again
+            metrics_port (int): Where to serve metrics for pal status
+            profile: Time the phases of every episode and sample their
+                stacks. Pass a directory to write the profile to, or no value
+                for a new directory in ~/polycraft-lab/profiles.
+        """
+        log.debug('Experiment launch command selected')
+        config = SweepConfig.from_file(config_path)
+        profiler = None
+        if profile:
+            profiler = Profiler(None if profile is True else profile)
+        runner = SweepRunner(config, profiler=profiler)
+        print(f'Running sweep {config.name} on {config.instance_count} '
+              f'instance(s), saving results to {runner.results_path}')
+        with serve_metrics(metrics_port):
+            if profiler is None:
+                progress = runner.run(resume=not restart)
+            else:
+                with profiler:
+                    progress = runner.run(resume=not restart)
+                print(format_summary(profiler.summary()))
+                print(f'Profile written to {profiler.directory}')
+        if progress.total_trials == 0:
+            print('Every trial of this sweep is already complete.')
+        elif progress.trials_failed:
+            print(f'{progress.trials_failed} trial(s) failed and will be '
+                  f'retried the next time this sweep is launched.')
+
+    @staticmethod
+    def generate(template_path: str, output: str = None, variants: int = None,
+                 workers: int = None):
+        """Generate concrete missions from a parameterized mission template.
+
+        Variants that were already generated are not written again. The
+        missions are indexed in manifest.json in the output directory, so
+        they can be made by name with make(name, manifest=...).
+
+        Args:
+            template_path (str): The mission template JSON file
+            output (str): Where to write missions, a directory named after
+                the template next to it by default
+            variants (int): How many variants to make, overriding the template
+            workers (int): Worker processes, one per CPU by default
+        """
+        log.debug('Experiment generate command selected')
+        template = MissionTemplate.from_file(template_path)
+        if output is None:
+            output = Path(template_path).parent / template.name
+        manifest = generate_missions(template, output, variants, workers)
+        print(f'{len(manifest.find(template.name))} mission(s) of '
+              f'{template.name} indexed in {manifest.path}')
 
     def test(self):
         """Test a task"""
@@ -163,6 +475,16 @@ class RunExperimentGroup:
         print('Not yet implemented')
 
 
+def _split(values) -> Optional[List[str]]:
+    """Turn a comma-separated option into a list, which fire may have
+    parsed into a tuple already."""
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = values.split(',')
+    return [str(value).strip() for value in values if str(value).strip()]
+
+
 def run_cli():
     """Trigger the Polycraft World command line interface."""
     fire.Fire(PolycraftLabCLI)
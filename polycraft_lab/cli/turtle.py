@@ -0,0 +1,235 @@
+"""An interactive console for sending commands to a running game.
+
+The console keeps one connection to the game open for the whole session, so
+missions can be debugged command by command without restarting anything.
+Typed commands are sent from a background thread while the prompt waits for
+the reply, which lets Ctrl + C stop waiting on a slow command without dropping
+the connection. Scripts piped in on stdin are sent in pipelined batches.
+"""
+import json
+import logging
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, TextIO
+
+from polycraft_lab.installation import PAL_DEFAULT_PATH
+from polycraft_lab.installation.client import PolycraftClient
+
+try:
+    import readline
+except ImportError:  # Not available on Windows
+    readline = None
+
+log = logging.getLogger('pal').getChild('cli').getChild('turtle')
+
+TURTLE_HISTORY_PATH = PAL_DEFAULT_PATH / 'turtle_history'
+TURTLE_HISTORY_LENGTH = 1000
+DEFAULT_SCRIPT_BATCH_SIZE = 64
+
+PROMPT = '>>> '
+QUIT_COMMANDS = frozenset(['quit', 'exit'])
+HELP_COMMAND = 'help'
+COMMENT_PREFIX = '#'
+
+HELP_TEXT = '''Type a game command, such as MOVE w, to send it to the game.
+The reply is printed with the round trip time of the command.
+
+  help         Show this message
+  quit, exit   Leave the console (Ctrl + D also works)
+
+Ctrl + C stops waiting for a reply. It is printed once it arrives.'''
+
+
+class TurtleConsole:
+    """A read-eval-print loop over a persistent game connection."""
+
+    def __init__(self, client: PolycraftClient, out: TextIO = sys.stdout,
+                 pretty: bool = True,
+                 batch_size: int = DEFAULT_SCRIPT_BATCH_SIZE):
+        """
+        Args:
+            client (PolycraftClient): A started client to send commands through
+            out: Where replies are written
+            pretty (bool): Indent replies instead of printing them on one line
+            batch_size (int): How many script commands are pipelined at once
+        """
+        self._client = client
+        self._out = out
+        self._indent = 2 if pretty else None
+        self._batch_size = batch_size
+        # One thread keeps replies in the order their commands were sent
+        self._sender = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix='pal-turtle')
+        self.commands_sent = 0
+
+    def close(self):
+        self._sender.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def send_async(self, command: str) -> Future:
+        """Send a command in the background.
+
+        Returns:
+            A future resolving to the reply and its round trip time in seconds
+        """
+        return self._sender.submit(self._timed_send, command)
+
+    def _timed_send(self, command: str):
+        started = time.perf_counter()
+        reply = self._client.send(command)
+        self.commands_sent += 1
+        return reply, time.perf_counter() - started
+
+    def run(self, lines: TextIO = sys.stdin) -> bool:
+        """Read commands until quit, end of input or the game exits.
+
+        Lines are read interactively if `lines` is a terminal, and as a
+        pipelined script otherwise.
+
+        Returns:
+            True if the user asked to quit
+        """
+        if lines.isatty():
+            return self.run_interactive()
+        return self.run_script(lines)
+
+    def run_interactive(self) -> bool:
+        """Prompt for commands one at a time, with history if available.
+
+        Returns:
+            True if the user asked to quit, False on end of input or if the
+            game exited
+        """
+        _load_history()
+        self._print('Connected. Type help for help or quit to exit.')
+        try:
+            while self._client.is_alive:
+                try:
+                    line = input(PROMPT).strip()
+                except EOFError:
+                    self._print('')
+                    return False
+                except KeyboardInterrupt:
+                    self._print('')
+                    continue
+                if not line or line.startswith(COMMENT_PREFIX):
+                    continue
+                if line.lower() in QUIT_COMMANDS:
+                    return True
+                if line.lower() == HELP_COMMAND:
+                    self._print(HELP_TEXT)
+                    continue
+                self._wait_for(line, self.send_async(line))
+            self._print('The game has exited.')
+            return False
+        finally:
+            _save_history()
+
+    def _wait_for(self, command: str, future: Future):
+        try:
+            reply, elapsed = future.result()
+        except KeyboardInterrupt:
+            self._print(f'Stopped waiting for {command}. The reply is shown '
+                        f'when it arrives.')
+            future.add_done_callback(
+                lambda done: self._print_result(command, done, late=True))
+            return
+        except (OSError, ValueError) as e:
+            self._print(f'{command} failed: {e}')
+            return
+        self._print_reply(reply, elapsed)
+
+    def _print_result(self, command: str, future: Future, late: bool = False):
+        if future.exception() is not None:
+            self._print(f'{command} failed: {future.exception()}')
+            return
+        reply, elapsed = future.result()
+        if late:
+            self._print(f'\nReply to {command}:')
+        self._print_reply(reply, elapsed)
+
+    def run_script(self, lines: Iterable[str]) -> bool:
+        """Send every command in `lines`, pipelining them in batches.
+
+        A batch is written to the socket in one go and its replies are read
+        back afterwards, so scripts run at the speed of the connection rather
+        than one round trip per command.
+
+        Returns:
+            True if the script contained quit
+        """
+        for batch, should_quit in _batches(lines, self._batch_size):
+            if batch:
+                started = time.perf_counter()
+                replies = self._client.send_many(batch)
+                elapsed = time.perf_counter() - started
+                self.commands_sent += len(batch)
+                for command, reply in zip(batch, replies):
+                    self._print(f'{PROMPT}{command}')
+                    self._print_reply(reply)
+                self._print(f'# {len(batch)} command(s) in '
+                            f'{elapsed * 1e3:.2f} ms '
+                            f'({elapsed * 1e3 / len(batch):.2f} ms each)')
+            if should_quit:
+                return True
+            if not self._client.is_alive:
+                self._print('The game has exited.')
+                break
+        return False
+
+    def _print_reply(self, reply, elapsed: float = None):
+        self._print(json.dumps(reply, indent=self._indent))
+        if elapsed is not None:
+            self._print(f'# {elapsed * 1e3:.2f} ms')
+
+    def _print(self, text: str):
+        self._out.write(text + '\n')
+        self._out.flush()
+
+
+def _batches(lines: Iterable[str], batch_size: int
+             ) -> Iterator[tuple]:
+    """Yield (commands, should_quit) batches of script lines.
+
+    Blank lines and comments are skipped, and a quit command ends the script
+    after the commands before it are sent.
+    """
+    batch: List[str] = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith(COMMENT_PREFIX):
+            continue
+        if line.lower() in QUIT_COMMANDS:
+            yield batch, True
+            return
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch, False
+            batch = []
+    yield batch, False
+
+
+def _load_history():
+    if readline is None:
+        return
+    readline.set_history_length(TURTLE_HISTORY_LENGTH)
+    try:
+        readline.read_history_file(str(TURTLE_HISTORY_PATH))
+    except OSError:
+        pass  # No history yet
+
+
+def _save_history():
+    if readline is None:
+        return
+    try:
+        TURTLE_HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        readline.write_history_file(str(TURTLE_HISTORY_PATH))
+    except OSError as e:
+        log.debug(f'Could not save turtle history: {e}')
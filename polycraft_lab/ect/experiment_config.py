@@ -3,33 +3,51 @@ import json
 from pathlib import Path
 from typing import Dict, List
 
+from polycraft_lab.ect.mission_cache import MissionCache, default_cache
+from polycraft_lab.installation.config import WriteBackConfig
+
 CONFIG_ACTION_SPACE = 'action_space'
 
 CONFIG_EXPERIMENT_SCENES = 'scenes'
 
+CONFIG_REWARD = 'reward'
+
 
-class ExperimentConfig:
-    """A wrapper for Polycraft Lab experiment configuration values."""
+class ExperimentConfig(WriteBackConfig):
+    """A wrapper for Polycraft Lab experiment configuration values.
 
-    def __init__(self, config_path: str):
+    Use `edit()` to change several values with a single write.
+    """
+
+    def __init__(self, config_path: str, cache: MissionCache = default_cache):
         """Initialize a new ExperimentConfig object.
 
+        The file is only parsed and validated if it changed since it was last
+        loaded through `cache`.
+
         Args:
             config_path (str): The path to the experiment configuration file JSON.
+            cache (MissionCache): Where parsed configs are kept, or None to
+                always read the file
         """
         self._config_path = Path(config_path)
-        config = self._load_config(config_path)
-        self._validate_config(config)
+        if cache is None:
+            config = self._load_config(config_path)
+            self._validate_config(config)
+        else:
+            config = cache.load(config_path, self._validate_config).config
         self.config = config
 
     @classmethod
-    def from_file(cls, config_path: str):
+    def from_file(cls, config_path: str, cache: MissionCache = default_cache):
         """Return a new ExperimentConfig.
 
         Args:
             config_path (str): The path to the experiment configuration file JSON.
+            cache (MissionCache): Where parsed configs are kept, or None to
+                always read the file
         """
-        return cls(config_path)
+        return cls(config_path, cache)
 
     @staticmethod
     def _load_config(config_path: str) -> dict:
@@ -56,13 +74,15 @@ class ExperimentConfig:
     def action_space(self, new_action_space: dict):
         if type(new_action_space) != dict:
             raise TypeError(f'{new_action_space} is not a dict.')
-        self.config[CONFIG_ACTION_SPACE] = new_action_space
-        with codecs.open(self._config_path, 'r+', encoding='utf-8') as config_file:
-            data = json.load(config_file)
-            data[CONFIG_ACTION_SPACE] = new_action_space
-            config_file.seek(0)
-            json.dump(data, config_file, indent=4)
-            config_file.truncate()
+        self._set(CONFIG_ACTION_SPACE, new_action_space)
+
+    @property
+    def reward(self) -> Dict:
+        """Return the reward and termination spec, empty if there is none.
+
+        See `polycraft_lab.envs.rewards` for the format.
+        """
+        return self.config.get(CONFIG_REWARD, {})
 
     @property
     def scenes(self) -> List[str]:
@@ -71,13 +91,7 @@ class ExperimentConfig:
     @scenes.setter
     def scenes(self, new_scenes: List[str]):
         # TODO: Consider if a setter is really needed for this
-        self.config[CONFIG_EXPERIMENT_SCENES] = new_scenes
-        with codecs.open(self._config_path, 'r+', encoding='utf-8') as config_file:
-            data = json.load(config_file)
-            data[CONFIG_ACTION_SPACE] = new_scenes
-            config_file.seek(0)
-            json.dump(data, config_file, indent=4)
-            config_file.truncate()
+        self._set(CONFIG_EXPERIMENT_SCENES, new_scenes)
 
 
 class InvalidExperimentConfigError(Exception):
@@ -0,0 +1,345 @@
+"""Generate many concrete missions from one parameterized template.
+
+A template is a JSON file with a mission containing `${name}` placeholders, a
+description of how to sample each parameter, and how many variants to make:
+
+    {
+        "name": "pogo_trees",
+        "seed": 0,
+        "variants": 1000,
+        "parameters": {
+            "tree_count": {"type": "int", "low": 1, "high": 10},
+            "biome": {"type": "choice", "values": ["forest", "taiga"]},
+            "spawn_x": {"type": "float", "low": -20, "high": 20},
+            "night": {"type": "bool", "p": 0.25}
+        },
+        "mission": {"trees": "${tree_count}", "title": "Trees in ${biome}"}
+    }
+
+A string that is exactly one placeholder is replaced by the sampled value with
+its type; placeholders inside longer strings are formatted into the text.
+
+Variant `i` always gets the same seed and parameters for a given template
+seed, so generation is reproducible. Each generated file is named after the
+hash of its contents, which is also its `mission_id` in the mission cache.
+Files that already exist are not written again, so regenerating a large set
+after a small template change only writes the variants that changed.
+
+Every generated mission is recorded in a `manifest.json` in the output
+directory, which `make()` uses to look missions up by name.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from polycraft_lab.ect.experiment_config import InvalidExperimentConfigError
+from polycraft_lab.ect.mission_cache import MISSION_ID_LENGTH
+from polycraft_lab.installation.config import atomic_write_json
+
+log = logging.getLogger('pal').getChild('ect').getChild('generator')
+
+MANIFEST_FILE_NAME = 'manifest.json'
+MANIFEST_FORMAT_VERSION = 1
+
+# Variants handed to a worker process at once
+DEFAULT_CHUNK_SIZE = 256
+
+VARIANT_KEY = 'pal_variant'
+
+PARAMETER_INT = 'int'
+PARAMETER_FLOAT = 'float'
+PARAMETER_CHOICE = 'choice'
+PARAMETER_BOOL = 'bool'
+
+_PLACEHOLDER = re.compile(r'\$\{(\w+)\}')
+
+
+class MissionTemplate:
+    """A mission with placeholders and how to sample their values."""
+
+    def __init__(self, template: dict):
+        """
+        Args:
+            template (dict): The parsed template, see the module docstring
+
+        Raises:
+            InvalidTemplateError: If the template is missing values or uses
+                placeholders it does not define
+        """
+        try:
+            self.name = template['name']
+            self.mission = template['mission']
+        except KeyError as e:
+            raise InvalidTemplateError(f'Template is missing {e}')
+        self.seed = template.get('seed', 0)
+        self.variants = template.get('variants', 1)
+        self.parameters: Dict[str, dict] = template.get('parameters', {})
+        for name, spec in self.parameters.items():
+            _check_parameter(name, spec)
+        undefined = _placeholders(self.mission) - set(self.parameters)
+        if undefined:
+            raise InvalidTemplateError(
+                f'Undefined parameters: {", ".join(sorted(undefined))}')
+
+    @classmethod
+    def from_file(cls, path: str) -> 'MissionTemplate':
+        with open(path, encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def variant_seed(self, index: int) -> int:
+        """Return the seed of variant `index`, stable across processes."""
+        return random.Random(f'{self.seed}:{index}').getrandbits(32)
+
+    def sample(self, index: int) -> dict:
+        """Return the parameter values of variant `index`."""
+        rng = random.Random(self.variant_seed(index))
+        # Sorted so adding a parameter does not reorder the draws of others
+        return {name: _sample(rng, self.parameters[name])
+                for name in sorted(self.parameters)}
+
+    def expand(self, index: int) -> dict:
+        """Return the concrete mission of variant `index`."""
+        parameters = self.sample(index)
+        mission = _substitute(self.mission, parameters)
+        mission[VARIANT_KEY] = {
+            'template': self.name,
+            'index': index,
+            'seed': self.variant_seed(index),
+            'parameters': parameters,
+        }
+        return mission
+
+    def variant_name(self, index: int) -> str:
+        return f'{self.name}-{index}'
+
+
+def generate_missions(template: MissionTemplate, output_directory: str,
+                      variants: int = None, workers: int = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      prune: bool = True) -> 'MissionManifest':
+    """Write every variant of a template and update the manifest.
+
+    Args:
+        template (MissionTemplate): The template to expand
+        output_directory (str): Where missions and the manifest are written
+        variants (int): How many variants to make, the template's count by
+            default
+        workers (int): Worker processes, one per CPU by default. With 1, or
+            when everything fits in one chunk, no pool is started.
+        chunk_size (int): Variants handed to a worker at once
+        prune (bool): Delete files of this template's earlier variants that
+            are no longer in the manifest
+
+    Returns:
+        The updated manifest
+    """
+    output = Path(output_directory)
+    output.mkdir(parents=True, exist_ok=True)
+    count = template.variants if variants is None else variants
+    chunks = [range(start, min(start + chunk_size, count))
+              for start in range(0, count, chunk_size)]
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [_generate_chunk(template, str(output), chunk)
+                   for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_generate_chunk,
+                                    [template] * len(chunks),
+                                    [str(output)] * len(chunks), chunks))
+
+    manifest = MissionManifest(output / MANIFEST_FILE_NAME)
+    previous_files = manifest.files_of(template.name)
+    entries = [entry for chunk_entries, _ in results
+               for entry in chunk_entries]
+    written = sum(chunk_written for _, chunk_written in results)
+    manifest.replace_template(template.name, entries)
+    manifest.save()
+
+    if prune:
+        for stale in previous_files - manifest.files_of(template.name):
+            try:
+                (output / stale).unlink()
+            except FileNotFoundError:
+                pass
+    log.info('Generated %d variants of %s, wrote %d new files', len(entries),
+             template.name, written)
+    return manifest
+
+
+def _generate_chunk(template: MissionTemplate, output_directory: str,
+                    indices: range):
+    """Write the variants in `indices`, skipping files that already exist.
+
+    Returns:
+        The manifest entries of the chunk and how many files were written
+    """
+    entries = []
+    written = 0
+    for index in indices:
+        mission = template.expand(index)
+        contents = json.dumps(mission, sort_keys=True, indent=2).encode('utf-8')
+        mission_id = hashlib.sha256(contents).hexdigest()[:MISSION_ID_LENGTH]
+        file_name = f'{template.name}-{mission_id}.json'
+        path = os.path.join(output_directory, file_name)
+        if not os.path.exists(path):
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as file:
+                file.write(contents)
+            os.replace(temp_path, path)
+            written += 1
+        entries.append({
+            'name': template.variant_name(index),
+            'template': template.name,
+            'index': index,
+            'seed': mission[VARIANT_KEY]['seed'],
+            'parameters': mission[VARIANT_KEY]['parameters'],
+            'file': file_name,
+            'mission_id': mission_id,
+        })
+    return entries, written
+
+
+class MissionManifest:
+    """The index of generated missions in a directory, keyed by name."""
+
+    def __init__(self, path: Path):
+        """Load the manifest at `path`, or start an empty one."""
+        self.path = Path(path)
+        self.missions: Dict[str, dict] = {}
+        try:
+            with self.path.open(encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        if data.get('version') == MANIFEST_FORMAT_VERSION:
+            self.missions = data['missions']
+
+    def __len__(self):
+        return len(self.missions)
+
+    def __contains__(self, name: str):
+        return name in self.missions
+
+    def mission_path(self, name: str) -> Path:
+        """Return the path of the generated mission called `name`.
+
+        Raises:
+            KeyError: If no mission has that name
+        """
+        return self.path.parent / self.missions[name]['file']
+
+    def find(self, template: str = None, **parameters) -> List[dict]:
+        """Return the entries matching a template and parameter values."""
+        return [entry for entry in self.missions.values()
+                if (template is None or entry['template'] == template) and
+                all(entry['parameters'].get(key) == value
+                    for key, value in parameters.items())]
+
+    def files_of(self, template: str) -> set:
+        return {entry['file'] for entry in self.missions.values()
+                if entry['template'] == template}
+
+    def replace_template(self, template: str, entries: List[dict]):
+        """Swap every entry of `template` for `entries`."""
+        self.missions = {name: entry for name, entry in self.missions.items()
+                         if entry['template'] != template}
+        self.missions.update((entry['name'], entry) for entry in entries)
+
+    def save(self):
+        atomic_write_json(self.path, {
+            'version': MANIFEST_FORMAT_VERSION,
+            'missions': self.missions,
+        })
+
+
+_manifests: Dict[str, tuple] = {}
+
+
+def load_manifest(path: str) -> MissionManifest:
+    """Return the manifest at `path`, only parsing it again if it changed.
+
+    A manifest of thousands of missions is read once per process, so looking
+    up a mission for every `make()` stays cheap.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _manifests.get(path)
+    if cached is None or cached[0] != version:
+        cached = (version, MissionManifest(Path(path)))
+        _manifests[path] = cached
+    return cached[1]
+
+
+def find_mission(name: str, manifest_path: str) -> Optional[Path]:
+    """Return the path of a generated mission, or None if it is not listed."""
+    manifest = load_manifest(manifest_path)
+    if name not in manifest:
+        return None
+    return manifest.mission_path(name)
+
+
+def _check_parameter(name: str, spec: dict):
+    kind = spec.get('type')
+    required = {
+        PARAMETER_INT: ('low', 'high'),
+        PARAMETER_FLOAT: ('low', 'high'),
+        PARAMETER_CHOICE: ('values',),
+        PARAMETER_BOOL: (),
+    }.get(kind)
+    if required is None:
+        raise InvalidTemplateError(
+            f'Parameter {name} has unknown type {kind}')
+    missing = [key for key in required if key not in spec]
+    if missing:
+        raise InvalidTemplateError(
+            f'Parameter {name} is missing {", ".join(missing)}')
+    if kind == PARAMETER_CHOICE and not spec['values']:
+        raise InvalidTemplateError(f'Parameter {name} has no values')
+
+
+def _sample(rng: random.Random, spec: dict):
+    kind = spec['type']
+    if kind == PARAMETER_INT:
+        return rng.randint(spec['low'], spec['high'])
+    if kind == PARAMETER_FLOAT:
+        return rng.uniform(spec['low'], spec['high'])
+    if kind == PARAMETER_CHOICE:
+        return rng.choices(spec['values'], weights=spec.get('weights'))[0]
+    return rng.random() < spec.get('p', 0.5)
+
+
+def _placeholders(value) -> set:
+    if isinstance(value, str):
+        return set(_PLACEHOLDER.findall(value))
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return set().union(*(_placeholders(item) for item in value))
+    return set()
+
+
+def _substitute(value, parameters: dict):
+    if isinstance(value, str):
+        whole = _PLACEHOLDER.fullmatch(value)
+        if whole:
+            return parameters[whole.group(1)]
+        return _PLACEHOLDER.sub(lambda match: str(parameters[match.group(1)]),
+                                value)
+    if isinstance(value, dict):
+        return {key: _substitute(item, parameters)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, parameters) for item in value]
+    return value
+
+
+class InvalidTemplateError(InvalidExperimentConfigError):
+    """Raised when a mission template is malformed."""
@@ -0,0 +1,179 @@
+"""A cache of parsed and validated experiment and mission files.
+
+Parsing and validating a JSON file happens once per version of the file. Each
+version is identified by its absolute path, modification time and size, and
+the parsed result is kept in memory and as a pickle in the PAL cache directory,
+so later processes skip the JSON parse as well.
+
+Every cached file also gets a `mission_id` derived from a hash of its contents,
+which the game can use to refer to a mission it has already loaded.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import types
+from pathlib import Path
+from typing import Callable, Dict
+
+from polycraft_lab.installation import PAL_DEFAULT_PATH
+
+log = logging.getLogger('pal').getChild('ect').getChild('cache')
+
+MISSION_CACHE_PATH = PAL_DEFAULT_PATH / 'cache' / 'missions'
+
+# Bump when the pickled layout changes so old cache files are ignored
+CACHE_FORMAT_VERSION = 2
+
+MISSION_ID_LENGTH = 16
+
+
+class CompiledMission:
+    """A parsed and validated version of a mission or experiment file.
+
+    Attributes:
+        path (str): The absolute path of the source file
+        mission_id (str): A short hash of the file contents
+        mtime_ns (int): The modification time of the parsed version
+        size (int): The size in bytes of the parsed version
+        validated (set): The names of the validators the contents passed
+    """
+
+    def __init__(self, path: str, mission_id: str, mtime_ns: int, size: int,
+                 payload: bytes):
+        self.path = path
+        self.mission_id = mission_id
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.validated = set()
+        self._payload = payload
+
+    @property
+    def config(self) -> dict:
+        """Return a fresh copy of the parsed file contents.
+
+        Callers may freely modify the result without affecting the cache.
+        """
+        return pickle.loads(self._payload)
+
+    def is_current(self, stat: os.stat_result) -> bool:
+        """Return True if this was compiled from the file version in `stat`."""
+        return self.mtime_ns == stat.st_mtime_ns and self.size == stat.st_size
+
+
+class MissionCache:
+    """Parses mission and experiment files once and reuses the result."""
+
+    def __init__(self, cache_directory: Path = MISSION_CACHE_PATH,
+                 persist: bool = True):
+        """Create a new cache.
+
+        Args:
+            cache_directory (Path): Where compiled files are pickled
+            persist (bool): If False, only keep compiled files in memory
+        """
+        self._cache_directory = Path(cache_directory)
+        self._persist = persist
+        self._memory: Dict[str, CompiledMission] = {}
+
+    def load(self, path: str,
+             validate: Callable[[dict], None] = None) -> CompiledMission:
+        """Return the compiled version of the file at `path`.
+
+        Args:
+            path (str): The location of a JSON mission or experiment file
+            validate: Called with the parsed contents unless this version of
+                the file already passed it, so files first loaded without a
+                validator are still checked. Any exception it raises
+                propagates, and the file is not recorded as valid.
+
+        Raises:
+            OSError if the file cannot be read, or ValueError if it is not
+            valid JSON.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        compiled = self._memory.get(path)
+        if compiled is None or not compiled.is_current(stat):
+            compiled = self._read_pickle(path)
+            if compiled is None or not compiled.is_current(stat):
+                compiled = self._compile(path)
+                self._write_pickle(compiled)
+            self._memory[path] = compiled
+        if validate is not None:
+            self._validate(compiled, validate)
+        return compiled
+
+    def mission_id(self, path: str) -> str:
+        """Return the content-based id of the mission file at `path`."""
+        return self.load(path).mission_id
+
+    def clear(self):
+        """Forget every compiled file, both in memory and on disk."""
+        self._memory.clear()
+        if self._cache_directory.is_dir():
+            for cache_file in self._cache_directory.glob('*.pickle'):
+                cache_file.unlink()
+
+    def _validate(self, compiled: CompiledMission,
+                  validate: Callable[[dict], None]):
+        """Run `validate` on the contents unless they already passed it.
+
+        Validators are told apart by their qualified name. Only module level
+        functions and static methods have a name of their own; lambdas,
+        nested functions and bound methods run on every load.
+        """
+        name = f'{validate.__module__}.{validate.__qualname__}'
+        if name in compiled.validated:
+            return
+        validate(compiled.config)
+        if isinstance(validate, types.FunctionType) and '<' not in name:
+            compiled.validated.add(name)
+            self._write_pickle(compiled)
+
+    @staticmethod
+    def _compile(path: str) -> CompiledMission:
+        log.debug('Compiling %s', path)
+        with open(path, 'rb') as file:
+            contents = file.read()
+            stat = os.fstat(file.fileno())
+        config = json.loads(contents)
+        mission_id = hashlib.sha256(contents).hexdigest()[:MISSION_ID_LENGTH]
+        return CompiledMission(path, mission_id, stat.st_mtime_ns,
+                               stat.st_size, pickle.dumps(config))
+
+    def _pickle_path(self, path: str) -> Path:
+        name = hashlib.sha1(path.encode()).hexdigest()
+        return self._cache_directory / f'{name}.pickle'
+
+    def _read_pickle(self, path: str) -> CompiledMission:
+        if not self._persist:
+            return None
+        try:
+            with self._pickle_path(path).open('rb') as file:
+                version, compiled = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if version != CACHE_FORMAT_VERSION or compiled.path != path:
+            return None
+        return compiled
+
+    def _write_pickle(self, compiled: CompiledMission):
+        if not self._persist:
+            return
+        try:
+            self._cache_directory.mkdir(parents=True, exist_ok=True)
+            # Write then rename so readers never see a partial pickle
+            descriptor, temp_path = tempfile.mkstemp(
+                dir=str(self._cache_directory), suffix='.tmp')
+            with os.fdopen(descriptor, 'wb') as file:
+                pickle.dump((CACHE_FORMAT_VERSION, compiled), file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, str(self._pickle_path(compiled.path)))
+        except OSError:
+            log.warning('Could not write mission cache for %s', compiled.path)
+
+
+default_cache = MissionCache()
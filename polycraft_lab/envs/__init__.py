@@ -6,9 +6,20 @@ Gym-like environment based on the config.
 
 The `setup_env` helper function should be used to create a new environment
 instead of instantiating a `PolycraftEnv` directly.
+
+`PolycraftVectorEnv` in `vector.py` steps many environments in parallel
+worker processes and hands their results back through shared memory.
+
+`wrappers.py` turns replies into arrays and stacks or normalizes them, for
+single and vector environments alike.
 """
 
 from polycraft_lab.envs.core import PolycraftEnv
 from polycraft_lab.envs.helpers import make
+from polycraft_lab.envs.vector import PolycraftVectorEnv
+from polycraft_lab.envs.wrappers import BlockGridEncoder, EncodeObservation, \
+    FrameStack, InventoryEncoder, NormalizeObservation
 
-__all__ = ['PolycraftEnv', 'make']
+__all__ = ['PolycraftEnv', 'PolycraftVectorEnv', 'make', 'BlockGridEncoder',
+           'EncodeObservation', 'FrameStack', 'InventoryEncoder',
+           'NormalizeObservation']
@@ -0,0 +1,91 @@
+"""Action repeat and macro-actions compiled from an experiment config.
+
+An experiment config may expand the actions an agent takes into sequences of
+game commands:
+
+    "action_repeat": 4,
+    "macros": {
+        "forward_5": {"command": "MOVE w", "repeat": 5},
+        "craft_pogo_stick": ["CRAFT 1 minecraft:stick minecraft:stick 0 ...",
+                             "SENSE_INVENTORY"]
+    },
+    "pipeline_actions": true
+
+Macros are looked up by name and run as given. Any other action is sent
+`action_repeat` times. Commands are sent one at a time, and a step stops at
+the first one that ends the episode. With `pipeline_actions`, all commands of
+one step are instead written to the socket back to back before any reply is
+read, so they all run in the game even after one ended the episode.
+"""
+from typing import Dict, Tuple
+
+from polycraft_lab.ect.experiment_config import InvalidExperimentConfigError
+
+SPEC_ACTION_REPEAT = 'action_repeat'
+SPEC_MACROS = 'macros'
+SPEC_PIPELINE = 'pipeline_actions'
+
+
+class ActionTable:
+    """Expands an agent's action into the game commands it stands for.
+
+    Attributes:
+        pipeline (bool): If True, all commands of a step are sent before their
+            replies are read. The episode can then not end part way through
+            the sequence, and replies after the one that ended it are ignored.
+    """
+
+    def __init__(self, macros: Dict[str, Tuple[str, ...]] = None,
+                 action_repeat: int = 1, pipeline: bool = False):
+        self._macros = macros or {}
+        self._action_repeat = action_repeat
+        self.pipeline = pipeline
+
+    @property
+    def macros(self) -> Dict[str, Tuple[str, ...]]:
+        return self._macros
+
+    def expand(self, action: str) -> Tuple[str, ...]:
+        """Return the commands to send for the given action."""
+        commands = self._macros.get(action)
+        if commands is not None:
+            return commands
+        return (action,) * self._action_repeat
+
+
+def _compile_macro(name: str, spec) -> Tuple[str, ...]:
+    if isinstance(spec, str):
+        return spec,
+    if isinstance(spec, list) and all(isinstance(c, str) for c in spec):
+        if not spec:
+            raise InvalidActionSpecError(f'Macro {name} has no commands')
+        return tuple(spec)
+    if isinstance(spec, dict) and isinstance(spec.get('command'), str):
+        repeat = int(spec.get('repeat', 1))
+        if repeat < 1:
+            raise InvalidActionSpecError(
+                f'The repeat count of macro {name} must be at least 1')
+        return (spec['command'],) * repeat
+    raise InvalidActionSpecError(f'Macro {name} must be a command, a list of '
+                                 f'commands or a command with a repeat count')
+
+
+def compile_action_spec(config: dict) -> ActionTable:
+    """Build an ActionTable from an experiment config.
+
+    Raises:
+        InvalidActionSpecError if a macro or the repeat count is malformed.
+    """
+    if not config:
+        return ActionTable()
+    action_repeat = int(config.get(SPEC_ACTION_REPEAT, 1))
+    if action_repeat < 1:
+        raise InvalidActionSpecError('action_repeat must be at least 1')
+    macros = {name: _compile_macro(name, spec)
+              for name, spec in config.get(SPEC_MACROS, {}).items()}
+    return ActionTable(macros, action_repeat,
+                       bool(config.get(SPEC_PIPELINE, False)))
+
+
+class InvalidActionSpecError(InvalidExperimentConfigError):
+    """Raised when the action repeat or macros of an experiment are invalid."""
@@ -1,18 +1,77 @@
+import itertools
 import logging
-from typing import Tuple
+import os
+import time
+from typing import Dict, Set, Tuple, Union
 
 import numpy as np
 
-from polycraft_lab import PAL_DEFAULT_PATH
+from polycraft_lab.installation import PAL_DEFAULT_PATH
+from polycraft_lab.ect.experiment_config import ExperimentConfig
+from polycraft_lab.ect.mission_cache import MissionCache, default_cache
+from polycraft_lab.envs.actions import compile_action_spec
+from polycraft_lab.envs.frames import DEFAULT_FRAME_SKIP, \
+    DEFAULT_RESOLUTION, FrameGrabber
+from polycraft_lab.envs.rewards import compile_reward_spec
 from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.installation.comms import CommandTimeoutError
+from polycraft_lab.monitoring.metrics import STEPS
+from polycraft_lab.monitoring.profiler import NULL_PROFILER, PHASE_RESET, \
+    PHASE_REWARD, PHASE_SEND, PHASE_STEP, Profiler
 
 log = logging.getLogger('pal').getChild('env').getChild('core')
 
+COMMAND_START = 'START'
+COMMAND_RESET = 'RESET'
+COMMAND_PRELOAD = 'PRELOAD'
+COMMAND_PIGGYBACK = 'PIGGYBACK'
+COMMAND_SAVE_STATE = 'SAVE_STATE'
+COMMAND_LOAD_STATE = 'LOAD_STATE'
+COMMAND_DROP_STATE = 'DROP_STATE'
+
+RESULT_FAIL = 'FAIL'
+
+# What a step that times out does
+TIMEOUT_RAISE = 'raise'
+TIMEOUT_DONE = 'done'
+
+# State ids are unique within a process, so envs sharing a game do not clash
+_state_ids = itertools.count()
+
+
+class StateHandle:
+    """A world state the game holds in memory, from `save_state`.
+
+    Attributes:
+        state_id (str): The id the game knows the state by
+        mission (str): The mission the state was saved in
+        released (bool): True once the game was told to forget the state
+        reward_state (tuple): The reward progress of the episode when saved
+    """
+
+    def __init__(self, state_id: str, mission: str, reward_state: tuple):
+        self.state_id = state_id
+        self.mission = mission
+        self.released = False
+        self.reward_state = reward_state
+
+    def __repr__(self):
+        return f'StateHandle({self.state_id!r}, {self.mission!r})'
+
 
 class PolycraftEnv:
     """A reinforcement learning environment for the Polycraft World mod."""
 
-    def __init__(self, mission_path: str):
+    def __init__(self, mission_path: str, client: PolycraftClient = None,
+                 preload_missions: bool = False,
+                 mission_cache: MissionCache = default_cache,
+                 experiment_config: ExperimentConfig = None,
+                 fast_reset: bool = False,
+                 render_resolution: Tuple[int, int] = DEFAULT_RESOLUTION,
+                 frame_skip: int = DEFAULT_FRAME_SKIP,
+                 step_timeout: float = None,
+                 on_timeout: str = TIMEOUT_RAISE,
+                 profiler: Union[Profiler, bool] = None):
         """Creates a new Polycraft environment.
 
         TODO:
@@ -33,10 +92,63 @@ class PolycraftEnv:
 
         Args:
             mission_path: The location of the configuration file.
+            client: An already constructed client to send commands through,
+                mainly useful for benchmarks and tests. A client for the
+                default installation is created when omitted.
+            preload_missions: If True, have the game parse each mission once
+                with `PRELOAD` and reset to it by id afterwards, instead of
+                re-reading the mission file on every reset.
+            mission_cache: Where mission ids are computed and cached.
+            experiment_config: The experiment whose reward spec scores each
+                step, and whose action repeat and macros expand each action.
+                Every step sends one command and has a reward of 0 when
+                omitted.
+            fast_reset: If True, save the world after the first reset of each
+                mission and restore it with `LOAD_STATE` on later resets,
+                instead of rebuilding the world from the mission. The game
+                keeps one saved state per mission in memory.
+            render_resolution: The width and height of `rgb_array` frames.
+            frame_skip: Have the game capture one frame every `frame_skip`
+                frames for `rgb_array` rendering.
+            step_timeout: Seconds a step may take, including every command
+                its action expands into. Steps wait forever when omitted.
+            on_timeout: 'raise' to raise StepTimeoutError when a step times
+                out, or 'done' to end the episode instead, returning the last
+                observation with `info['termination'] == 'timeout'`. Either
+                way the late replies are skipped by the next command.
+            profiler: A Profiler that times the reset, step, send and reward
+                phases of each episode and samples their stacks, or True to
+                profile into a new directory that is written when the
+                environment exits. Profiling is off when omitted.
         """
+        if on_timeout not in (TIMEOUT_RAISE, TIMEOUT_DONE):
+            raise ValueError(f'Unknown on_timeout {on_timeout}, expected '
+                             f'{TIMEOUT_RAISE} or {TIMEOUT_DONE}')
         self._mission = mission_path
-        installation_path = PAL_DEFAULT_PATH  # TODO: Fetch from config
-        self._client = PolycraftClient(installation_path)
+        self._preload_missions = preload_missions
+        self._mission_cache = mission_cache
+        self._preloaded: Set[str] = set()
+        self._fast_reset = fast_reset
+        self._initial_states: Dict[str, StateHandle] = {}
+        self._reward_function = compile_reward_spec(
+            experiment_config.reward if experiment_config else None)
+        self._actions = compile_action_spec(
+            experiment_config.config if experiment_config else None)
+        if client is None:
+            installation_path = PAL_DEFAULT_PATH  # TODO: Fetch from config
+            client = PolycraftClient(installation_path)
+        self._client = client
+        self._frames = FrameGrabber(client, render_resolution, frame_skip)
+        self._steps = STEPS.labels(instance=client.instance_name)
+        self._step_timeout = step_timeout
+        self._on_timeout = on_timeout
+        self._deadline: float = None
+        self._last_observation = None
+        self._owns_profiler = profiler is True
+        if profiler is True:
+            profiler = Profiler().start()
+        self._profiler = profiler or NULL_PROFILER
+        self._episode_steps = 0
 
     def __enter__(self):
         return self
@@ -44,40 +156,255 @@ class PolycraftEnv:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_val is not None:
             log.error('Error during exit', exc_tb)
+        self._frames.stop()
         self._client.stop()
+        self._end_episode()
+        if self._owns_profiler:
+            self._profiler.close()
+
+    @property
+    def is_alive(self) -> bool:
+        """Return True if the game can still receive commands."""
+        return self._client.is_alive
 
     def set_mission(self, mission_path: str):
         self._mission = mission_path
 
     def reset(self):
         """Reset the environment and get an initial observation"""
-        self._client.send('START')
-        self._client.send(f'RESET -d {self._mission}')
+        self._end_episode()
+        with self._profiler.phase(PHASE_RESET):
+            return self._reset()
+
+    def _reset(self):
+        initial_state = self._initial_states.get(self._mission)
+        if initial_state is not None:
+            try:
+                self._last_observation = self.load_state(initial_state)
+                return self._last_observation
+            except StateUnavailableError as e:
+                log.warning('Could not restore the initial state (%s), '
+                            'resetting from the mission', e)
+                del self._initial_states[self._mission]
+        observation = self._reset_from_mission()
+        if self._fast_reset:
+            try:
+                self._initial_states[self._mission] = self.save_state()
+            except StateUnavailableError as e:
+                log.warning('The game cannot save states (%s), fast resets '
+                            'are disabled', e)
+                self._fast_reset = False
+        self._last_observation = observation
+        return observation
+
+    def _end_episode(self):
+        self._profiler.end_episode(mission=self._mission,
+                                   steps=self._episode_steps)
+        self._episode_steps = 0
+
+    def _reset_from_mission(self):
+        self._client.send(COMMAND_START)
+        self._reward_function.reset()
+        if self._reward_function.piggyback:
+            # Have every action reply carry what the reward terms read
+            fields = self._reward_function.sensor_fields
+            if fields:
+                self._client.send(f'{COMMAND_PIGGYBACK} {" ".join(fields)}')
+        mission_id = self._preload(self._mission)
+        if mission_id is None:
+            return self._client.send(f'{COMMAND_RESET} -d {self._mission}')
+        return self._client.send(f'{COMMAND_RESET} -id {mission_id}')
+
+    def save_state(self) -> StateHandle:
+        """Have the game keep a copy of the current world in memory.
+
+        Search-based agents can save a state mid-episode and branch from it
+        with `load_state` as often as they like. The episode's reward progress
+        is saved along with the world.
+
+        Returns:
+            A handle to pass to `load_state` and `release_state`
+
+        Raises:
+            StateUnavailableError: If the game could not save the world
+        """
+        state_id = f's{next(_state_ids)}'
+        reply = self._client.send(f'{COMMAND_SAVE_STATE} {state_id}')
+        _check_state_reply(reply, COMMAND_SAVE_STATE)
+        return StateHandle(state_id, self._mission,
+                           self._reward_function.get_state())
+
+    def load_state(self, handle: StateHandle):
+        """Restore a saved world and continue the episode from there.
+
+        The saved state is kept, so it can be loaded again.
+
+        Returns:
+            The observation of the restored world
+
+        Raises:
+            StateUnavailableError: If the state was released or the game could
+                not restore it
+        """
+        if handle.released:
+            raise StateUnavailableError(f'{handle} was released')
+        reply = self._client.send(f'{COMMAND_LOAD_STATE} {handle.state_id}')
+        _check_state_reply(reply, COMMAND_LOAD_STATE)
+        self._mission = handle.mission
+        self._reward_function.set_state(handle.reward_state)
+        return reply
 
-    def step(self, action: str) -> Tuple[object, int, bool, dict]:
+    def release_state(self, handle: StateHandle):
+        """Let the game free the memory of a saved state."""
+        if handle.released:
+            return
+        self._client.send(f'{COMMAND_DROP_STATE} {handle.state_id}')
+        handle.released = True
+        if self._initial_states.get(handle.mission) is handle:
+            del self._initial_states[handle.mission]
+
+    def _preload(self, mission_path: str) -> str:
+        """Make sure the game has parsed the given mission.
+
+        Returns:
+            The id the game knows the mission by, or None if missions are not
+            preloaded and the game should read the file itself.
+        """
+        if not self._preload_missions:
+            return None
+        if not os.path.isfile(mission_path):
+            # The path may be relative to the game rather than to PAL
+            log.debug('Cannot preload %s, resetting from file', mission_path)
+            return None
+        mission_id = self._mission_cache.mission_id(mission_path)
+        if mission_id not in self._preloaded:
+            self._client.send(
+                f'{COMMAND_PRELOAD} -d {mission_path} -id {mission_id}')
+            self._preloaded.add(mission_id)
+        return mission_id
+
+    def step(self, action: str) -> Tuple[object, float, bool, dict]:
+        """Take an action, which may expand into several game commands.
+
+        Rewards are summed over the commands that ran, stopping at the first
+        one that ends the episode. The observation is the reply to that
+        command, or to the last one.
+        """
+        with self._profiler.phase(PHASE_STEP):
+            return self._step(action)
+
+    def _step(self, action: str) -> Tuple[object, float, bool, dict]:
         # TODO: Get client to send consistent data format
-        # observation = self._client.send('SENSE_ALL')
-        reward = 0
-        done = not self._client.is_alive
-        info = {}
-        # if action == 'break_block':
-        observation = self._client.send(action)
+        commands = self._actions.expand(action)
+        if self._step_timeout is not None:
+            self._deadline = time.monotonic() + self._step_timeout
+        try:
+            if len(commands) == 1:
+                observation, reward, done, info = \
+                    self._run_command(commands[0])
+                info['commands'] = 1
+            elif self._actions.pipeline:
+                observation, reward, done, info = \
+                    self._run_pipelined(commands)
+            else:
+                observation, reward, done, info = \
+                    self._run_sequential(commands)
+        except CommandTimeoutError as e:
+            if self._on_timeout == TIMEOUT_RAISE:
+                raise StepTimeoutError(action, self._step_timeout) from e
+            observation, reward, done = self._last_observation, 0.0, True
+            info = {'termination': 'timeout', 'degraded': True}
+        finally:
+            self._deadline = None
+        self._last_observation = observation
+        if not self._client.is_alive:
+            done = True
+            info['termination'] = 'client_exited'
+        self._steps.inc()
+        self._episode_steps += 1
 
         return observation, reward, done, info
 
+    def _remaining(self) -> dict:
+        """Return the timeout argument for a command sent during a step."""
+        if self._deadline is None:
+            return {}
+        return {'timeout': max(0.0, self._deadline - time.monotonic())}
+
+    def _run_command(self, command: str) -> Tuple[object, float, bool, dict]:
+        with self._profiler.phase(PHASE_SEND):
+            observation = self._client.send(command, **self._remaining())
+        with self._profiler.phase(PHASE_REWARD):
+            reward, done, info = self._reward_function(observation)
+        return observation, reward, done, info
+
+    def _run_sequential(self, commands) -> Tuple[object, float, bool, dict]:
+        total = 0.0
+        for count, command in enumerate(commands, start=1):
+            observation, reward, done, info = self._run_command(command)
+            total += reward
+            if done:
+                break
+        info['commands'] = count
+        return observation, total, done, info
+
+    def _run_pipelined(self, commands) -> Tuple[object, float, bool, dict]:
+        total = 0.0
+        with self._profiler.phase(PHASE_SEND):
+            observations = self._client.send_many(commands,
+                                                  **self._remaining())
+        for count, observation in enumerate(observations, start=1):
+            with self._profiler.phase(PHASE_REWARD):
+                reward, done, info = self._reward_function(observation)
+            total += reward
+            if done:
+                # Later commands already ran, but no longer count
+                break
+        info['commands'] = count
+        return observation, total, done, info
+
     def render(self, mode: str = 'human'):
         """Display training output for this environment.
 
+        In `rgb_array` mode, the game starts writing frames to shared memory
+        on the first call, and the latest frame is returned as a read-only
+        (height, width, 3) uint8 array. The array is a view of the shared
+        memory rather than a copy, so it changes as the game renders; copy it
+        to keep a frame.
+
         Args:
             mode (str): How this environment should output information
+
+        Raises:
+            FrameCaptureError: If the game cannot capture frames
         """
         # assert mode in self.metadata['render.modes']
+        if mode == 'rgb_array':
+            return self._frames.latest()
         if mode == 'human':
             pass
         elif mode == 'state_pixels':
             pass
-        elif mode == 'rgb_array':
-            pass
         else:  # mode == 'ansi'
             pass
         raise NotImplementedError()
+
+
+def _check_state_reply(reply, command: str):
+    if not isinstance(reply, dict) or reply.get('result') == RESULT_FAIL:
+        message = reply.get('message') if isinstance(reply, dict) else reply
+        raise StateUnavailableError(f'{command} failed: {message}')
+
+
+class StateUnavailableError(RuntimeError):
+    """Raised when the game cannot save or restore a world state."""
+
+
+class StepTimeoutError(TimeoutError):
+    """Raised when a step takes longer than the step timeout."""
+
+    def __init__(self, action: str, timeout: float):
+        super(StepTimeoutError, self).__init__(
+            f'Action {action!r} did not finish within {timeout} seconds')
+        self.action = action
+        self.timeout = timeout
@@ -0,0 +1,269 @@
+"""Frames captured by the game, shared through a memory-mapped file.
+
+Sending pixels through the command socket means encoding every frame as PNG
+or base64 JSON, which is far too slow for pixel-based agents. Instead, the
+environment creates a file in shared memory (`/dev/shm` where available) and
+asks the game to write its frames there with:
+
+    CAPTURE -path <file> -width <width> -height <height> -skip <frame_skip>
+
+The game renders at the requested resolution, writes every `frame_skip`-th
+frame and replies once capture has started. `CAPTURE_STOP` ends capture.
+
+The file starts with a 64 byte header, followed by the latest frame as
+`height * width * 3` RGB bytes, row by row from the top. The header holds a
+sequence number the writer increments before and after writing each frame,
+so it is odd while a frame is being written and twice the number of frames
+once it is done. Readers use it to wait for new frames and to detect frames
+they read while they were being written.
+
+The game has to run on the same host as the environment.
+"""
+import logging
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+log = logging.getLogger('pal').getChild('env').getChild('frames')
+
+COMMAND_CAPTURE = 'CAPTURE'
+COMMAND_CAPTURE_STOP = 'CAPTURE_STOP'
+
+RESULT_FAIL = 'FAIL'
+
+DEFAULT_RESOLUTION = (256, 256)  # width, height
+DEFAULT_FRAME_SKIP = 1
+DEFAULT_FRAME_TIMEOUT = 5.0
+
+FRAME_MAGIC = b'PALFRAME'
+FRAME_FORMAT_VERSION = 1
+FRAME_CHANNELS = 3
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('channels', '<u4'),
+    ('frame_skip', '<u4'),
+    ('reserved', '<u4'),
+    ('sequence', '<u8'),
+])
+
+_POLL_INTERVAL = 0.001
+# Retries of a snapshot before it waits for the writer between retries
+_SNAPSHOT_SPINS = 8
+
+
+def default_frame_directory() -> Path:
+    """Return where frame files are created, in memory when possible."""
+    shm = Path('/dev/shm')
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+class FrameBuffer:
+    """A memory-mapped file holding the latest frame and its header."""
+
+    def __init__(self, path: Path, resolution: Tuple[int, int] = None,
+                 frame_skip: int = DEFAULT_FRAME_SKIP):
+        """Create a frame file, or open an existing one.
+
+        Args:
+            path (Path): The frame file
+            resolution: The width and height of frames. An existing file is
+                opened when None.
+            frame_skip (int): Recorded in the header for the writer
+        """
+        self.path = Path(path)
+        self._owner = resolution is not None
+        if self._owner:
+            width, height = resolution
+            size = HEADER_SIZE + width * height * FRAME_CHANNELS
+            with open(self.path, 'wb') as file:
+                file.truncate(size)
+            self._memory = np.memmap(self.path, dtype=np.uint8, mode='r+',
+                                     shape=(size,))
+            self._header = self._memory[:HEADER_DTYPE.itemsize].view(
+                HEADER_DTYPE)
+            self._header['magic'] = FRAME_MAGIC
+            self._header['version'] = FRAME_FORMAT_VERSION
+            self._header['width'] = width
+            self._header['height'] = height
+            self._header['channels'] = FRAME_CHANNELS
+            self._header['frame_skip'] = frame_skip
+        else:
+            self._memory = np.memmap(self.path, dtype=np.uint8, mode='r+')
+            self._header = self._memory[:HEADER_DTYPE.itemsize].view(
+                HEADER_DTYPE)
+            if self._header['magic'][0] != FRAME_MAGIC:
+                raise FrameCaptureError(f'{self.path} is not a frame file')
+            width = int(self._header['width'][0])
+            height = int(self._header['height'][0])
+        self.resolution = (width, height)
+        self._pixels = self._memory[HEADER_SIZE:].reshape(
+            (height, width, FRAME_CHANNELS))
+        self._view = self._pixels.view()
+        self._view.flags.writeable = False
+
+    @property
+    def frame(self) -> np.ndarray:
+        """The latest frame, as a read-only (height, width, 3) view.
+
+        The view is not a copy, so it shows each new frame as the game writes
+        it. Use `snapshot` for a frame that is guaranteed to be complete.
+        """
+        return self._view
+
+    @property
+    def sequence(self) -> int:
+        return int(self._header['sequence'][0])
+
+    @property
+    def frame_count(self) -> int:
+        """How many frames have been written completely."""
+        return self.sequence // 2
+
+    def write(self, frame: np.ndarray):
+        """Write a frame the way the game does."""
+        self._header['sequence'] += 1
+        self._pixels[...] = frame
+        self._header['sequence'] += 1
+
+    def wait_for_frame(self, after: int = 0,
+                       timeout: float = DEFAULT_FRAME_TIMEOUT) -> int:
+        """Wait until more than `after` frames have been written.
+
+        Returns:
+            The number of frames written
+
+        Raises:
+            FrameTimeoutError: If no new frame arrived in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            count = self.frame_count
+            if count > after:
+                return count
+            if time.monotonic() > deadline:
+                raise FrameTimeoutError(
+                    f'No frame from the game after {timeout} seconds')
+            time.sleep(_POLL_INTERVAL)
+
+    def snapshot(self, out: np.ndarray = None,
+                 timeout: float = DEFAULT_FRAME_TIMEOUT) -> np.ndarray:
+        """Copy the latest complete frame, retrying if it changes meanwhile."""
+        if out is None:
+            out = np.empty_like(self._pixels)
+        deadline = time.monotonic() + timeout
+        attempts = 0
+        while True:
+            before = self.sequence
+            if before % 2 == 0:
+                np.copyto(out, self._pixels)
+                if self.sequence == before:
+                    return out
+            if time.monotonic() > deadline:
+                raise FrameTimeoutError(
+                    f'Frame kept changing for {timeout} seconds')
+            attempts += 1
+            if attempts > _SNAPSHOT_SPINS:
+                time.sleep(_POLL_INTERVAL)
+
+    def close(self):
+        """Drop the mapping, and delete the file if this buffer created it.
+
+        The memory is unmapped once no frame views are left.
+        """
+        self._view = self._pixels = self._header = self._memory = None
+        if self._owner:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class FrameGrabber:
+    """Asks a game to capture frames into a `FrameBuffer`."""
+
+    def __init__(self, client, resolution: Tuple[int, int] = DEFAULT_RESOLUTION,
+                 frame_skip: int = DEFAULT_FRAME_SKIP,
+                 directory: Path = None):
+        """
+        Args:
+            client: A started client of a game running on this host
+            resolution: The width and height frames are rendered at
+            frame_skip (int): Capture one frame every `frame_skip` frames
+            directory (Path): Where the frame file is created
+        """
+        if frame_skip < 1:
+            raise ValueError(f'frame_skip must be at least 1, not {frame_skip}')
+        self._client = client
+        self.resolution = tuple(resolution)
+        self.frame_skip = frame_skip
+        self._directory = Path(directory or default_frame_directory())
+        self.buffer: Optional[FrameBuffer] = None
+
+    @property
+    def is_capturing(self) -> bool:
+        return self.buffer is not None
+
+    def start(self):
+        """Create the frame file and start capture in the game.
+
+        Raises:
+            FrameCaptureError: If the game cannot capture frames
+        """
+        if self.is_capturing:
+            return
+        path = self._directory / f'pal-frames-{os.getpid()}-' \
+                                 f'{uuid.uuid4().hex[:8]}.bin'
+        buffer = FrameBuffer(path, self.resolution, self.frame_skip)
+        width, height = self.resolution
+        reply = self._client.send(
+            f'{COMMAND_CAPTURE} -path {path} -width {width} -height {height} '
+            f'-skip {self.frame_skip}')
+        if not isinstance(reply, dict) or reply.get('result') == RESULT_FAIL:
+            buffer.close()
+            message = reply.get('message') if isinstance(reply, dict) \
+                else reply
+            raise FrameCaptureError(f'The game cannot capture frames: '
+                                    f'{message}')
+        self.buffer = buffer
+        log.debug('Capturing %dx%d frames into %s', width, height, path)
+
+    def latest(self, timeout: float = DEFAULT_FRAME_TIMEOUT) -> np.ndarray:
+        """Return a zero-copy view of the latest frame.
+
+        Capture is started on first use, which waits for the first frame.
+        """
+        self.start()
+        if self.buffer.frame_count == 0:
+            self.buffer.wait_for_frame(timeout=timeout)
+        return self.buffer.frame
+
+    def stop(self):
+        """Stop capture and delete the frame file."""
+        if not self.is_capturing:
+            return
+        if self._client.is_alive:
+            try:
+                self._client.send(COMMAND_CAPTURE_STOP)
+            except OSError as e:
+                log.debug('Could not stop frame capture: %s', e)
+        self.buffer.close()
+        self.buffer = None
+
+
+class FrameCaptureError(RuntimeError):
+    """Raised when frames cannot be captured from the game."""
+
+
+class FrameTimeoutError(FrameCaptureError, TimeoutError):
+    """Raised when the game does not deliver a frame in time."""
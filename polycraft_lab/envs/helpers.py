@@ -1,21 +1,41 @@
 """Some helper functions for various Polycraft AI Lab tasks."""
 import logging
 
+from polycraft_lab.ect.generator import find_mission
 from polycraft_lab.envs import PolycraftEnv
+from polycraft_lab.envs.registry import MissionRegistry, default_registry
 
 log = logging.getLogger('pal').getChild('env')
 
-DEFAULT_MISSION_PATH = '../available_tests/pogo_nonov.json'
+DEFAULT_MISSION_NAME = 'pogo_stick-v0'
 
 
-def make(env_name: str = None, **kwargs):
-    """Create a new PolycraftEnv."""
+def make(env_name: str = DEFAULT_MISSION_NAME, manifest: str = None,
+         registry: MissionRegistry = None, **kwargs):
+    """Create a new PolycraftEnv.
+
+    Any keyword arguments besides `mission_path` are passed to the PolycraftEnv.
+
+    Args:
+        env_name (str): The name of the mission to make, such as
+            pogo_stick-v0, looked up in the mission registry
+        manifest (str): The manifest.json of a directory of generated missions
+            to look `env_name` up in before the registry
+        registry (MissionRegistry): Where to look missions up, the default
+            mission directories when omitted
+
+    Raises:
+        UnknownMissionError: If no mission is called `env_name`
+    """
+    generated_path = None
+    if manifest is not None and env_name is not None:
+        generated_path = find_mission(env_name, manifest)
     if 'mission_path' in kwargs:
-        mission_path = kwargs['mission_path']
-    elif env_name is 'pogo_stick':
-        # TODO: Don't hardcode this
-        mission_path = DEFAULT_MISSION_PATH
+        mission_path = kwargs.pop('mission_path')
+    elif generated_path is not None:
+        mission_path = str(generated_path)
     else:
-        mission_path = DEFAULT_MISSION_PATH
+        registry = registry or default_registry()
+        mission_path = str(registry.resolve(env_name or DEFAULT_MISSION_NAME))
 
-    return PolycraftEnv(mission_path=mission_path)
+    return PolycraftEnv(mission_path=mission_path, **kwargs)
@@ -0,0 +1,346 @@
+"""An index of the missions on disk, used by `make()` to find them by name.
+
+Mission directories are scanned once and the result is saved in the PAL cache
+directory, so later processes start from the saved index. Each mission is
+recorded with its path, content hash, a signature of its action space and its
+tags.
+
+Missions are named `<name>-v<version>`, from the `name` and `version` values
+in the mission file, or its file name and version 0 when they are missing.
+Missions written by the mission generator keep their generated name, such as
+`pogo_trees-17`. A name without a version resolves to the highest version.
+
+Looking a mission up is a dictionary access plus one `stat` of the mission
+file. Directories are only listed again when their modification time changed,
+and files are only read again when their modification time or size changed.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from polycraft_lab.ect.generator import MANIFEST_FILE_NAME, VARIANT_KEY
+from polycraft_lab.ect.mission_cache import MISSION_ID_LENGTH
+from polycraft_lab.installation import PAL_DEFAULT_PATH, PAL_MOD_DIR_NAME
+from polycraft_lab.installation.config import atomic_write_json
+
+log = logging.getLogger('pal').getChild('env').getChild('registry')
+
+MISSION_INDEX_DIRECTORY = PAL_DEFAULT_PATH / 'cache'
+INDEX_FORMAT_VERSION = 1
+
+# Extra mission directories, separated like PATH
+MISSION_PATH_VARIABLE = 'PAL_MISSION_PATH'
+
+DEFAULT_MISSION_DIRECTORIES = [
+    PAL_DEFAULT_PATH / PAL_MOD_DIR_NAME / 'available_tests',
+    PAL_DEFAULT_PATH / 'missions',
+]
+
+# Well known names for missions whose files are named differently
+MISSION_ALIASES = {
+    'pogo_stick': 'pogo_nonov',
+    'pogo_stick-v0': 'pogo_nonov-v0',
+}
+
+MISSION_NAME = 'name'
+MISSION_VERSION = 'version'
+MISSION_TAGS = 'tags'
+MISSION_ACTION_SPACE = 'action_space'
+
+ACTION_SIGNATURE_LENGTH = 12
+
+TAG_GENERATED = 'generated'
+
+
+class MissionRegistry:
+    """Finds missions by name across a list of directories."""
+
+    def __init__(self, directories: Iterable[Path] = None,
+                 index_path: Path = None):
+        """
+        Args:
+            directories: Where to look for missions, in order of priority when
+                two missions share a name. The defaults and any directories in
+                the PAL_MISSION_PATH environment variable are used when None.
+            index_path (Path): Where the index is saved, in the PAL cache
+                directory by default. Pass False to never save it.
+        """
+        if directories is None:
+            directories = list(DEFAULT_MISSION_DIRECTORIES)
+            extra = os.environ.get(MISSION_PATH_VARIABLE)
+            if extra:
+                directories.extend(path for path in extra.split(os.pathsep)
+                                   if path)
+        self.directories = [os.path.abspath(str(path))
+                            for path in directories]
+        if index_path is None:
+            key = hashlib.sha1('\n'.join(self.directories).encode())
+            index_path = (MISSION_INDEX_DIRECTORY /
+                          f'mission_index-{key.hexdigest()[:8]}.json')
+        self.index_path = index_path
+        self._directory_mtimes: Dict[str, int] = {}
+        self._files: Dict[str, dict] = {}
+        self._by_name: Dict[str, str] = {}
+        self._latest: Dict[str, str] = {}
+        self._scanned = False
+        self._load_index()
+
+    def resolve(self, name: str) -> Path:
+        """Return the path of the mission called `name`.
+
+        Raises:
+            UnknownMissionError: If no mission has that name
+        """
+        path = self._lookup(name)
+        if path is not None and self._is_current(path):
+            return Path(path)
+        # Missing or changed on disk, so bring the index up to date once
+        self.refresh()
+        path = self._lookup(name)
+        if path is None:
+            raise UnknownMissionError(name, self.directories)
+        return Path(path)
+
+    def entry(self, name: str) -> dict:
+        """Return what the index knows about the mission called `name`."""
+        path = str(self.resolve(name))
+        return dict(self._files[path], path=path)
+
+    def names(self) -> List[str]:
+        if not self._scanned:
+            self.refresh()
+        return sorted(self._by_name)
+
+    def find(self, tag: str = None, action_signature: str = None
+             ) -> List[str]:
+        """Return the names of missions with a tag and/or action signature."""
+        if not self._scanned:
+            self.refresh()
+        return sorted(
+            name for name, path in self._by_name.items()
+            if (tag is None or tag in self._files[path][MISSION_TAGS]) and
+            (action_signature is None or
+             self._files[path]['action_signature'] == action_signature))
+
+    def refresh(self):
+        """Bring the index up to date with the mission directories.
+
+        Directories whose modification time is unchanged are not listed
+        again, and files whose modification time and size are unchanged are
+        not read again.
+        """
+        seen_directories: Dict[str, int] = {}
+        seen_files: Dict[str, dict] = {}
+        changed = False
+        known_files: Dict[str, List[str]] = {}
+        for path in self._files:
+            known_files.setdefault(os.path.dirname(path), []).append(path)
+        known_subdirectories: Dict[str, List[str]] = {}
+        for directory in self._directory_mtimes:
+            known_subdirectories.setdefault(
+                os.path.dirname(directory), []).append(directory)
+
+        pending = list(reversed(self.directories))
+        while pending:
+            directory = pending.pop()
+            if directory in seen_directories:
+                continue
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            seen_directories[directory] = mtime_ns
+            if self._directory_mtimes.get(directory) == mtime_ns:
+                # Nothing was added or removed, but files may have changed
+                pending.extend(sorted(known_subdirectories.get(directory, []),
+                                      reverse=True))
+                for path in known_files.get(directory, []):
+                    entry = self._files[path]
+                    current = self._file_entry(path, entry)
+                    changed |= current is not entry
+                    if current is not None:
+                        seen_files[path] = current
+                continue
+            changed = True
+            subdirectories = []
+            with os.scandir(directory) as entries:
+                for item in entries:
+                    if item.is_dir():
+                        subdirectories.append(item.path)
+                    elif item.name.endswith('.json') and \
+                            item.name != MANIFEST_FILE_NAME:
+                        current = self._file_entry(
+                            item.path, self._files.get(item.path),
+                            item.stat())
+                        if current is not None:
+                            seen_files[item.path] = current
+            pending.extend(sorted(subdirectories, reverse=True))
+        changed |= seen_files.keys() != self._files.keys()
+        self._directory_mtimes = seen_directories
+        self._files = seen_files
+        self._build_names()
+        self._scanned = True
+        if changed:
+            self._save_index()
+
+    def _file_entry(self, path: str, entry: Optional[dict],
+                    stat: os.stat_result = None) -> Optional[dict]:
+        """Return the up to date index entry of a file.
+
+        The existing entry is returned as is when the file did not change.
+        None is returned when the file is gone or is not a mission.
+        """
+        try:
+            stat = stat or os.stat(path)
+        except FileNotFoundError:
+            return None
+        if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and \
+                entry['size'] == stat.st_size:
+            return entry
+        try:
+            with open(path, 'rb') as file:
+                contents = file.read()
+            mission = json.loads(contents)
+        except (OSError, ValueError) as e:
+            log.debug('Skipping %s: %s', path, e)
+            return None
+        if not isinstance(mission, dict):
+            return None
+        try:
+            return _describe(path, mission, contents, stat)
+        except (TypeError, ValueError, KeyError) as e:
+            log.debug('Skipping %s: malformed mission: %r', path, e)
+            return None
+
+    def _is_current(self, path: str) -> bool:
+        entry = self._files[path]
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return entry['mtime_ns'] == stat.st_mtime_ns and \
+            entry['size'] == stat.st_size
+
+    def _lookup(self, name: str) -> Optional[str]:
+        name = MISSION_ALIASES.get(name, name)
+        path = self._by_name.get(name)
+        if path is None:
+            latest = self._latest.get(name)
+            if latest is not None:
+                path = self._by_name[latest]
+        return path
+
+    def _build_names(self):
+        by_name: Dict[str, str] = {}
+        latest: Dict[str, tuple] = {}
+        priority = {root: index for index, root in enumerate(self.directories)}
+        for path in sorted(self._files, key=lambda path: (
+                min((index for root, index in priority.items()
+                     if path.startswith(root + os.sep)),
+                    default=len(priority)), path)):
+            entry = self._files[path]
+            name = entry['name']
+            if name in by_name:
+                log.warning('Mission %s in %s is shadowed by %s', name, path,
+                            by_name[name])
+                continue
+            by_name[name] = path
+            base, version = entry['base_name'], entry['version']
+            if version is not None and (
+                    base not in latest or latest[base][0] < version):
+                latest[base] = (version, name)
+        self._by_name = by_name
+        self._latest = {base: name for base, (_, name) in latest.items()}
+
+    def _load_index(self):
+        if not self.index_path:
+            return
+        try:
+            with open(self.index_path, encoding='utf-8') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return
+        if index.get('version') != INDEX_FORMAT_VERSION or \
+                index.get('directories_searched') != self.directories:
+            return
+        self._directory_mtimes = index['directories']
+        self._files = index['files']
+        self._build_names()
+        self._scanned = True
+
+    def _save_index(self):
+        if not self.index_path:
+            return
+        try:
+            Path(self.index_path).parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_json(Path(self.index_path), {
+                'version': INDEX_FORMAT_VERSION,
+                'directories_searched': self.directories,
+                'directories': self._directory_mtimes,
+                'files': self._files,
+            })
+        except OSError as e:
+            log.warning('Could not save the mission index: %s', e)
+
+
+def action_signature(mission: dict) -> Optional[str]:
+    """Return a short hash of a mission's action space, if it has one.
+
+    Missions with the same signature accept the same actions, so an agent
+    trained on one can be evaluated on the others.
+    """
+    action_space = mission.get(MISSION_ACTION_SPACE)
+    if action_space is None:
+        return None
+    canonical = json.dumps(action_space, sort_keys=True,
+                           separators=(',', ':'))
+    return hashlib.sha256(
+        canonical.encode('utf-8')).hexdigest()[:ACTION_SIGNATURE_LENGTH]
+
+
+def _describe(path: str, mission: dict, contents: bytes,
+              stat: os.stat_result) -> dict:
+    tags = list(mission.get(MISSION_TAGS, []))
+    variant = mission.get(VARIANT_KEY)
+    if variant is not None:
+        base_name = variant['template']
+        name = f'{base_name}-{variant["index"]}'
+        version = None
+        tags += [TAG_GENERATED, f'template:{base_name}']
+    else:
+        base_name = mission.get(MISSION_NAME) or Path(path).stem
+        version = int(mission.get(MISSION_VERSION, 0))
+        name = f'{base_name}-v{version}'
+    return {
+        'name': name,
+        'base_name': base_name,
+        'version': version,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': hashlib.sha256(contents).hexdigest()[:MISSION_ID_LENGTH],
+        'action_signature': action_signature(mission),
+        'tags': tags,
+    }
+
+
+_default_registry: Optional[MissionRegistry] = None
+
+
+def default_registry() -> MissionRegistry:
+    """Return the registry of the default mission directories."""
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = MissionRegistry()
+    return _default_registry
+
+
+class UnknownMissionError(KeyError):
+    """Raised when no mission in the registry has the requested name."""
+
+    def __init__(self, name: str, directories: List[str]):
+        super(UnknownMissionError, self).__init__(
+            f'No mission named {name} in {", ".join(directories)}')
+        self.name = name
@@ -0,0 +1,247 @@
+"""Reward and termination functions compiled from an experiment config.
+
+The `reward` section of an experiment config lists reward terms and limits:
+
+    "reward": {
+        "terms": [
+            {"type": "inventory", "item": "polycraft:wooden_pogo_stick",
+             "count": 1, "reward": 1000, "done": true},
+            {"type": "position", "target": [10, 4, 10], "radius": 1.5,
+             "reward": 10},
+            {"type": "step", "reward": -1}
+        ],
+        "max_steps": 500,
+        "piggyback": true
+    }
+
+Terms are evaluated against the reply each action already returns, so no extra
+sensor commands are sent. With `piggyback`, the env asks the game to attach the
+sensor fields the terms need to every action reply.
+"""
+import math
+from typing import Dict, List, Sequence, Set, Tuple
+
+from polycraft_lab.ect.experiment_config import InvalidExperimentConfigError
+
+SPEC_TERMS = 'terms'
+SPEC_MAX_STEPS = 'max_steps'
+SPEC_PIGGYBACK = 'piggyback'
+
+FIELD_INVENTORY = 'inventory'
+FIELD_PLAYER = 'player'
+
+
+def _inventory_counts(reply: dict) -> Dict[str, int]:
+    """Return item counts from an inventory reply, keyed by item name.
+
+    The game lists slots either as a dict of slot number to item, or as a list.
+    """
+    inventory = reply.get(FIELD_INVENTORY)
+    if isinstance(inventory, dict):
+        slots = inventory.values()
+    elif isinstance(inventory, list):
+        slots = inventory
+    else:
+        return None
+    counts = {}
+    for slot in slots:
+        if isinstance(slot, dict) and 'item' in slot:
+            counts[slot['item']] = counts.get(slot['item'], 0) + \
+                slot.get('count', 1)
+    return counts
+
+
+def _player_position(reply: dict) -> Sequence[float]:
+    player = reply.get(FIELD_PLAYER)
+    if isinstance(player, dict):
+        return player.get('pos')
+    return None
+
+
+class RewardTerm:
+    """One source of reward, evaluated once per step.
+
+    Attributes:
+        reward (float): The reward given when the term triggers
+        done (bool): If True, the episode ends when the term triggers
+        fields (set): The reply fields this term reads
+    """
+
+    fields: Set[str] = set()
+
+    def __init__(self, spec: dict):
+        self.reward = float(spec.get('reward', 0))
+        self.done = bool(spec.get('done', False))
+
+    def reset(self):
+        """Forget any progress from the previous episode."""
+
+    def get_state(self):
+        """Return the progress of this term, for restoring it later."""
+        return None
+
+    def set_state(self, state):
+        """Restore progress returned by `get_state`."""
+
+    def triggered(self, reply: dict) -> bool:
+        raise NotImplementedError
+
+
+class StepTerm(RewardTerm):
+    """Gives its reward on every step, e.g. a time penalty."""
+
+    def triggered(self, reply: dict) -> bool:
+        return True
+
+
+class _GoalTerm(RewardTerm):
+    """Gives its reward once per episode, the first time the goal is met."""
+
+    def __init__(self, spec: dict):
+        super(_GoalTerm, self).__init__(spec)
+        self._achieved = False
+
+    def reset(self):
+        self._achieved = False
+
+    def get_state(self):
+        return self._achieved
+
+    def set_state(self, state):
+        self._achieved = state
+
+    def triggered(self, reply: dict) -> bool:
+        if self._achieved or not self._goal_met(reply):
+            return False
+        self._achieved = True
+        return True
+
+    def _goal_met(self, reply: dict) -> bool:
+        raise NotImplementedError
+
+
+class InventoryTerm(_GoalTerm):
+    """Triggers once the inventory holds `count` of `item`."""
+
+    fields = {FIELD_INVENTORY}
+
+    def __init__(self, spec: dict):
+        super(InventoryTerm, self).__init__(spec)
+        if 'item' not in spec:
+            raise InvalidRewardSpecError('Inventory terms require an item')
+        self._item = spec['item']
+        self._count = int(spec.get('count', 1))
+
+    def _goal_met(self, reply: dict) -> bool:
+        counts = _inventory_counts(reply)
+        return counts is not None and counts.get(self._item, 0) >= self._count
+
+
+class PositionTerm(_GoalTerm):
+    """Triggers once the player is within `radius` blocks of `target`."""
+
+    fields = {FIELD_PLAYER}
+
+    def __init__(self, spec: dict):
+        super(PositionTerm, self).__init__(spec)
+        target = spec.get('target')
+        if not isinstance(target, list) or len(target) != 3:
+            raise InvalidRewardSpecError(
+                'Position terms require a target of [x, y, z]')
+        self._target = [float(value) for value in target]
+        self._radius_squared = float(spec.get('radius', 1)) ** 2
+
+    def _goal_met(self, reply: dict) -> bool:
+        position = _player_position(reply)
+        if position is None:
+            return False
+        distance_squared = sum((a - b) ** 2
+                               for a, b in zip(position, self._target))
+        return distance_squared <= self._radius_squared
+
+
+TERM_TYPES = {
+    'step': StepTerm,
+    'inventory': InventoryTerm,
+    'position': PositionTerm,
+}
+
+
+class RewardFunction:
+    """Computes the reward and done signal of each step from its reply."""
+
+    def __init__(self, terms: List[RewardTerm], max_steps: int = None,
+                 piggyback: bool = False):
+        self._terms = terms
+        self._max_steps = max_steps if max_steps is not None else math.inf
+        self.piggyback = piggyback
+        self.steps = 0
+
+    @property
+    def sensor_fields(self) -> List[str]:
+        """Return the reply fields the terms read, in a stable order."""
+        return sorted(set().union(*(term.fields for term in self._terms)))
+
+    def reset(self):
+        """Start a new episode."""
+        self.steps = 0
+        for term in self._terms:
+            term.reset()
+
+    def get_state(self) -> tuple:
+        """Return the step count and term progress of the current episode."""
+        return self.steps, [term.get_state() for term in self._terms]
+
+    def set_state(self, state: tuple):
+        """Continue an episode from a state returned by `get_state`."""
+        self.steps, term_states = state
+        for term, term_state in zip(self._terms, term_states):
+            term.set_state(term_state)
+
+    def __call__(self, reply) -> Tuple[float, bool, dict]:
+        """Evaluate one step.
+
+        Returns:
+            The reward, whether the episode is done, and an info dict naming
+            the reason it ended, if it did.
+        """
+        self.steps += 1
+        reward = 0.0
+        done = False
+        info = {}
+        if isinstance(reply, dict):
+            for term in self._terms:
+                if term.triggered(reply):
+                    reward += term.reward
+                    if term.done:
+                        done = True
+                        info['termination'] = 'goal'
+        if not done and self.steps >= self._max_steps:
+            done = True
+            info['termination'] = 'max_steps'
+        return reward, done, info
+
+
+def compile_reward_spec(spec: dict) -> RewardFunction:
+    """Build a RewardFunction from the `reward` section of an experiment.
+
+    Raises:
+        InvalidRewardSpecError if the spec contains unknown or malformed terms.
+    """
+    if not spec:
+        return RewardFunction([])
+    terms = []
+    for term_spec in spec.get(SPEC_TERMS, []):
+        term_type = TERM_TYPES.get(term_spec.get('type'))
+        if term_type is None:
+            raise InvalidRewardSpecError(
+                f'Unknown reward term type {term_spec.get("type")}')
+        terms.append(term_type(term_spec))
+    max_steps = spec.get(SPEC_MAX_STEPS)
+    return RewardFunction(terms,
+                          int(max_steps) if max_steps is not None else None,
+                          bool(spec.get(SPEC_PIGGYBACK, False)))
+
+
+class InvalidRewardSpecError(InvalidExperimentConfigError):
+    """Raised when the reward section of an experiment config is invalid."""
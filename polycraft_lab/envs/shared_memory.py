@@ -0,0 +1,103 @@
+"""A shared-memory ring buffer for passing step results between processes.
+
+Environment workers write observations, rewards and dones for their env index
+straight into a fixed-layout shared memory block, and the learner reads them
+back as NumPy views of the same memory. Nothing is pickled on the way.
+
+The block holds `capacity` slots. Each batched step writes to the next slot, so
+the arrays returned for one step stay valid until `capacity - 1` more steps
+have been taken.
+"""
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+DEFAULT_CAPACITY = 2
+
+REWARD_DTYPE = np.float32
+
+
+class SharedStepBuffer:
+    """Fixed-layout slots of (observations, rewards, dones) in shared memory.
+
+    Attributes:
+        observations (np.ndarray): Shape (capacity, num_envs, *observation_shape)
+        rewards (np.ndarray): Shape (capacity, num_envs)
+        dones (np.ndarray): Shape (capacity, num_envs)
+    """
+
+    def __init__(self, num_envs: int, observation_shape: Tuple[int, ...],
+                 observation_dtype=np.float32,
+                 capacity: int = DEFAULT_CAPACITY, name: str = None):
+        """Create a new buffer, or attach to an existing one by name.
+
+        Args:
+            num_envs (int): How many environments write to each slot
+            observation_shape (tuple): The shape of a single observation
+            observation_dtype: The NumPy dtype of observations
+            capacity (int): How many steps the ring holds
+            name (str): The shared memory block to attach to. A new block is
+                created when omitted.
+        """
+        self.num_envs = num_envs
+        self.observation_shape = tuple(observation_shape)
+        self.observation_dtype = np.dtype(observation_dtype)
+        self.capacity = capacity
+
+        observations_size = int(np.prod((capacity, num_envs)
+                                        + self.observation_shape)
+                                ) * self.observation_dtype.itemsize
+        rewards_size = capacity * num_envs * np.dtype(REWARD_DTYPE).itemsize
+        dones_size = capacity * num_envs
+        self._owner = name is None
+        self._memory = shared_memory.SharedMemory(
+            name=name, create=self._owner,
+            size=max(1, observations_size + rewards_size + dones_size))
+
+        buffer = self._memory.buf
+        self.observations = np.ndarray(
+            (capacity, num_envs) + self.observation_shape,
+            dtype=self.observation_dtype, buffer=buffer)
+        self.rewards = np.ndarray((capacity, num_envs), dtype=REWARD_DTYPE,
+                                  buffer=buffer, offset=observations_size)
+        self.dones = np.ndarray((capacity, num_envs), dtype=np.bool_,
+                                buffer=buffer,
+                                offset=observations_size + rewards_size)
+
+    @classmethod
+    def attach(cls, spec: tuple):
+        """Attach to a buffer created in another process from its `spec`."""
+        name, num_envs, observation_shape, observation_dtype, capacity = spec
+        return cls(num_envs, observation_shape, observation_dtype, capacity,
+                   name=name)
+
+    @property
+    def spec(self) -> tuple:
+        """Return a small, picklable description to `attach` with."""
+        return (self._memory.name, self.num_envs, self.observation_shape,
+                self.observation_dtype.str, self.capacity)
+
+    def write(self, slot: int, env_index: int, observation, reward: float,
+              done: bool):
+        """Copy one environment's step result into the given slot."""
+        self.observations[slot, env_index] = observation
+        self.rewards[slot, env_index] = reward
+        self.dones[slot, env_index] = done
+
+    def read(self, slot: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return zero-copy views of every environment's result in a slot."""
+        return self.observations[slot], self.rewards[slot], self.dones[slot]
+
+    def close(self):
+        """Detach from the block, and free it if this buffer created it."""
+        # Views must be dropped before the memory can be unmapped
+        del self.observations, self.rewards, self.dones
+        try:
+            self._memory.close()
+        except BufferError:
+            # Views handed out by `read` are still alive. The block is unmapped
+            # once they are garbage collected.
+            pass
+        if self._owner:
+            self._memory.unlink()
@@ -0,0 +1,283 @@
+"""Run several Polycraft environments in parallel worker processes.
+
+Each worker owns one `PolycraftEnv`. Actions go to the workers over pipes, and
+step results come back through a `SharedStepBuffer`, so observations are never
+pickled between the workers and the learner.
+
+Observations from the game are JSON dicts, so every worker needs an
+`observation_encoder` that turns a reply into a fixed-shape array.
+
+With a `step_timeout`, a worker that does not answer in time is left out of
+the batch: its result is replaced by a done signal, and it gets no new
+commands until its late answer has arrived, so one stuck game does not hold up
+the others. A worker that is still busy when the environments are reset is
+not reset; it stays out of every batch until a later reset reaches it.
+
+With a `placement`, each worker is pinned to its own CPUs before it creates
+its environment, so the game it launches inherits them.
+"""
+import logging
+import multiprocessing
+import time
+import traceback
+from multiprocessing.connection import wait
+from typing import Callable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.envs.shared_memory import DEFAULT_CAPACITY, \
+    SharedStepBuffer
+from polycraft_lab.installation.placement import ResourceLimits, \
+    plan_placement
+
+log = logging.getLogger('pal').getChild('env').getChild('vector')
+
+_COMMAND_RESET = 'reset'
+_COMMAND_STEP = 'step'
+_COMMAND_CLOSE = 'close'
+
+_STATUS_OK = 'ok'
+_STATUS_ERROR = 'error'
+
+TERMINATION_TIMEOUT = 'timeout'
+
+
+def _worker(env_index: int, env_fn: Callable[[], PolycraftEnv],
+            encoder: Callable[[object], np.ndarray], buffer_spec: tuple,
+            pipe, limits: ResourceLimits = None):
+    """Step a single environment on behalf of a PolycraftVectorEnv."""
+    buffer = SharedStepBuffer.attach(buffer_spec)
+    env = None
+    try:
+        if limits is not None:
+            limits.apply()
+        env = env_fn()
+        while True:
+            command, slot, action = pipe.recv()
+            if command == _COMMAND_CLOSE:
+                break
+            try:
+                if command == _COMMAND_RESET:
+                    observation, reward, done, info = env.reset(), 0, False, {}
+                else:
+                    observation, reward, done, info = env.step(action)
+                buffer.write(slot, env_index, encoder(observation), reward,
+                             done)
+                pipe.send((_STATUS_OK, info))
+            except Exception:
+                pipe.send((_STATUS_ERROR, traceback.format_exc()))
+    except Exception:
+        pipe.send((_STATUS_ERROR, traceback.format_exc()))
+    finally:
+        if env is not None:
+            env.__exit__(None, None, None)
+        buffer.close()
+        pipe.close()
+
+
+class PolycraftVectorEnv:
+    """A batch of PolycraftEnvs stepped together in worker processes.
+
+    `reset` and `step` return views into shared memory. They stay valid until
+    `capacity - 1` further calls, so copy them if they are needed longer. The
+    observation of an environment that timed out may still change when its
+    late result arrives.
+    """
+
+    def __init__(self, env_fns: Sequence[Callable[[], PolycraftEnv]],
+                 observation_encoder: Callable[[object], np.ndarray],
+                 observation_shape: Tuple[int, ...],
+                 observation_dtype=np.float32,
+                 capacity: int = DEFAULT_CAPACITY, context: str = None,
+                 placement: Union[str, Sequence[ResourceLimits]] = None,
+                 step_timeout: float = None):
+        """Start one worker process per environment.
+
+        Args:
+            env_fns: Functions that each create one environment. They must be
+                picklable unless the 'fork' start method is used.
+            observation_encoder: Turns a reply from the game into an array of
+                `observation_shape`. Runs in the workers.
+            observation_shape (tuple): The shape of one encoded observation
+            observation_dtype: The NumPy dtype of encoded observations
+            capacity (int): How many steps of results are kept in the ring
+            context (str): The multiprocessing start method to use
+            placement: A placement policy such as 'spread', or the limits of
+                each worker from `plan_placement`. Workers are not placed by
+                default.
+            step_timeout (float): Seconds to wait for the workers in each
+                call. Environments that take longer are reported as done,
+                with a reward of 0 and `info['termination'] == 'timeout'`.
+                Calls wait for every worker when omitted.
+        """
+        self.num_envs = len(env_fns)
+        if isinstance(placement, str):
+            placement = plan_placement(self.num_envs, placement)
+        self.placement = list(placement) if placement is not None \
+            else [None] * self.num_envs
+        self._buffer = SharedStepBuffer(self.num_envs, observation_shape,
+                                        observation_dtype, capacity)
+        self._cursor = 0
+        self._closed = False
+        self.step_timeout = step_timeout
+        # Workers still busy with a call that timed out
+        self._busy = [False] * self.num_envs
+        # Workers a reset skipped, which must not step until they are reset
+        self._needs_reset = [False] * self.num_envs
+        mp_context = multiprocessing.get_context(context)
+        self._pipes = []
+        self._processes = []
+        for env_index, env_fn in enumerate(env_fns):
+            parent_pipe, child_pipe = mp_context.Pipe()
+            process = mp_context.Process(
+                target=_worker, daemon=True,
+                args=(env_index, env_fn, observation_encoder,
+                      self._buffer.spec, child_pipe,
+                      self.placement[env_index]),
+                name=f'polycraft-env-{env_index}')
+            process.start()
+            child_pipe.close()
+            self._pipes.append(parent_pipe)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def reset(self) -> np.ndarray:
+        """Reset every environment and return their initial observations.
+
+        Environments still busy with a call that timed out, or that time out
+        while resetting, are not reset and their rows hold stale
+        observations. They are listed in `degraded`, and every step reports
+        them as done by timeout until a later reset reaches them.
+        """
+        slot = self._next_slot()
+        self._broadcast(_COMMAND_RESET, slot, [None] * self.num_envs)
+        self._needs_reset = list(self._busy)
+        return self._buffer.read(slot)[0]
+
+    @property
+    def degraded(self) -> List[int]:
+        """The environments left out of every batch until they recover.
+
+        These are busy with a call that timed out, or were skipped by the
+        last reset.
+        """
+        return [index for index in range(self.num_envs)
+                if self._busy[index] or self._needs_reset[index]]
+
+    def step(self, actions: Sequence[str]
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[dict]]:
+        """Take one action in each environment.
+
+        Returns:
+            Views of the observations, rewards and dones of every
+            environment, and a list of their info dicts.
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError(f'Expected {self.num_envs} actions, '
+                             f'got {len(actions)}')
+        slot = self._next_slot()
+        infos = self._broadcast(_COMMAND_STEP, slot, actions)
+        observations, rewards, dones = self._buffer.read(slot)
+        timed_out = [index for index, info in enumerate(infos)
+                     if info.get('termination') == TERMINATION_TIMEOUT]
+        if timed_out:
+            # Copies, so late results do not overwrite the substitutes
+            rewards, dones = rewards.copy(), dones.copy()
+            rewards[timed_out] = 0
+            dones[timed_out] = True
+        return observations, rewards, dones, infos
+
+    def close(self):
+        """Stop every worker and free the shared memory."""
+        if self._closed:
+            return
+        self._closed = True
+        for pipe in self._pipes:
+            try:
+                pipe.send((_COMMAND_CLOSE, None, None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for pipe in self._pipes:
+            pipe.close()
+        self._buffer.close()
+
+    def _next_slot(self) -> int:
+        slot = self._cursor % self._buffer.capacity
+        self._cursor += 1
+        return slot
+
+    def _broadcast(self, command: str, slot: int, actions: Sequence
+                   ) -> List[dict]:
+        self._collect_late_replies()
+        # Send everything first so the workers run concurrently
+        waiting = {}
+        skipped = list(self._busy) if command == _COMMAND_RESET else \
+            [busy or needs_reset for busy, needs_reset
+             in zip(self._busy, self._needs_reset)]
+        for env_index, (pipe, action) in enumerate(zip(self._pipes, actions)):
+            if not skipped[env_index]:
+                pipe.send((command, slot, action))
+                waiting[pipe] = env_index
+        deadline = None if self.step_timeout is None \
+            else time.monotonic() + self.step_timeout
+        infos = [None] * self.num_envs
+        error = None
+        # Always collect every reply so the pipes stay in sync after an error
+        while waiting:
+            timeout = None if deadline is None \
+                else max(0.0, deadline - time.monotonic())
+            ready = wait(list(waiting), timeout)
+            if not ready:
+                break
+            for pipe in ready:
+                env_index = waiting.pop(pipe)
+                status, payload = self._receive(pipe)
+                if status == _STATUS_ERROR:
+                    error = error or VectorEnvWorkerError(env_index, payload)
+                    payload = None
+                infos[env_index] = payload
+        for env_index in waiting.values():
+            log.warning('Environment %s did not answer within %s seconds',
+                        env_index, self.step_timeout)
+            self._busy[env_index] = True
+            skipped[env_index] = True
+        for env_index, skip in enumerate(skipped):
+            if skip:
+                infos[env_index] = {'termination': TERMINATION_TIMEOUT,
+                                    'degraded': True}
+        if error is not None:
+            raise error
+        return infos
+
+    def _collect_late_replies(self):
+        """Free the workers whose late answer has arrived meanwhile."""
+        for env_index, pipe in enumerate(self._pipes):
+            if self._busy[env_index] and pipe.poll():
+                self._receive(pipe)
+                self._busy[env_index] = False
+
+    @staticmethod
+    def _receive(pipe) -> tuple:
+        try:
+            return pipe.recv()
+        except EOFError:
+            return _STATUS_ERROR, 'Worker exited'
+
+
+class VectorEnvWorkerError(RuntimeError):
+    """Raised when an environment worker fails or exits unexpectedly."""
+
+    def __init__(self, env_index: int, details: str):
+        super(VectorEnvWorkerError, self).__init__(
+            f'Environment {env_index} failed:\n{details}')
+        self.env_index = env_index
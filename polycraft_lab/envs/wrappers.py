@@ -0,0 +1,386 @@
+"""Observation preprocessing as composable environment wrappers.
+
+Encoders turn the JSON replies of the game into fixed-shape arrays:
+
+- `BlockGridEncoder` crops the blocks around the player into a grid of block
+  ids, or a one-hot grid.
+- `InventoryEncoder` counts the items of a fixed vocabulary in the inventory.
+
+Wrappers process arrays step by step:
+
+- `EncodeObservation` applies encoders to every reply.
+- `FrameStack` keeps the last few observations.
+- `NormalizeObservation` standardizes observations with running statistics.
+
+Every piece works on batches. Wrappers around a vector env (anything with a
+`num_envs` attribute) handle one row per environment, and wrappers around a
+single env treat it as a batch of one. Results are written into arrays that
+are allocated once, so the arrays returned by `reset` and `step` are reused
+by the next call; copy them if they are needed for longer.
+
+Example:
+    env = FrameStack(EncodeObservation(
+        make('pogo_stick-v0'), BlockGridEncoder(BLOCKS, radius=4)), 4)
+"""
+from typing import Dict, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from polycraft_lab.envs.rewards import _inventory_counts, _player_position
+
+FIELD_BLOCKS = 'blocks'
+
+BLOCK_AIR = 0
+BLOCK_UNKNOWN = 1
+
+
+class BlockGridEncoder:
+    """Crops the blocks around the player into a cube of block ids.
+
+    Ids 0 and 1 stand for air (or anything not reported) and for blocks that
+    are not in the vocabulary, so `vocabulary[i]` gets id `i + 2`.
+    """
+
+    def __init__(self, vocabulary: Sequence[str], radius: int = 4,
+                 one_hot: bool = False):
+        """
+        Args:
+            vocabulary: The block names to tell apart, e.g. 'minecraft:log'
+            radius (int): How many blocks to keep on each side of the player
+            one_hot (bool): Encode each cell as a one-hot vector along a
+                leading channel axis instead of as an id
+        """
+        self.ids: Dict[str, int] = {name: index + 2
+                                    for index, name in enumerate(vocabulary)}
+        self.num_ids = len(vocabulary) + 2
+        self.radius = radius
+        self.one_hot = one_hot
+        side = 2 * radius + 1
+        self._grid_shape = (side, side, side)
+        self._grids = np.zeros((1,) + self._grid_shape, dtype=np.int64)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """The shape of one encoded observation."""
+        if self.one_hot:
+            return (self.num_ids,) + self._grid_shape
+        return self._grid_shape
+
+    @property
+    def dtype(self):
+        return np.float32 if self.one_hot else np.int64
+
+    def __call__(self, reply: dict) -> np.ndarray:
+        """Encode a single reply, e.g. in a PolycraftVectorEnv worker."""
+        return self.encode_batch([reply])[0]
+
+    def encode_batch(self, replies: Sequence[dict],
+                     out: np.ndarray = None) -> np.ndarray:
+        """Encode one reply per row of `out`.
+
+        Blocks of all replies are gathered into flat arrays first, so the
+        grid is filled with a single scatter however many blocks there are.
+        """
+        batch = len(replies)
+        if out is None:
+            out = np.empty((batch,) + self.shape, dtype=self.dtype)
+        if self._grids.shape[0] != batch:
+            self._grids = np.zeros((batch,) + self._grid_shape,
+                                   dtype=np.int64)
+        grids = self._grids
+        grids.fill(BLOCK_AIR)
+
+        rows, positions, ids = [], [], []
+        for row, reply in enumerate(replies):
+            blocks = reply.get(FIELD_BLOCKS) if isinstance(reply, dict) \
+                else None
+            if not blocks:
+                continue
+            origin = _player_position(reply) or (0, 0, 0)
+            for block in blocks:
+                rows.append(row)
+                positions.append([p - o for p, o in zip(block['pos'], origin)])
+                ids.append(self.ids.get(block.get('name'), BLOCK_UNKNOWN))
+
+        if rows:
+            offsets = np.floor(np.asarray(positions, dtype=np.float64))
+            offsets = offsets.astype(np.int64) + self.radius
+            inside = np.all((offsets >= 0) & (offsets <= 2 * self.radius),
+                            axis=1)
+            rows = np.asarray(rows)[inside]
+            offsets = offsets[inside]
+            grids[rows, offsets[:, 0], offsets[:, 1], offsets[:, 2]] = \
+                np.asarray(ids)[inside]
+
+        if self.one_hot:
+            out.fill(0)
+            np.put_along_axis(out, grids[:, np.newaxis], 1, axis=1)
+        else:
+            out[...] = grids
+        return out
+
+
+class InventoryEncoder:
+    """Counts the items of a fixed vocabulary in the player's inventory."""
+
+    def __init__(self, items: Sequence[str]):
+        """
+        Args:
+            items: The item names to count, e.g. 'minecraft:planks'. Other
+                items are ignored.
+        """
+        self.items = list(items)
+        self._columns = {item: column for column, item in enumerate(items)}
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (len(self.items),)
+
+    @property
+    def dtype(self):
+        return np.float32
+
+    def __call__(self, reply: dict) -> np.ndarray:
+        return self.encode_batch([reply])[0]
+
+    def encode_batch(self, replies: Sequence[dict],
+                     out: np.ndarray = None) -> np.ndarray:
+        if out is None:
+            out = np.empty((len(replies),) + self.shape, dtype=self.dtype)
+        out.fill(0)
+        rows, columns, counts = [], [], []
+        for row, reply in enumerate(replies):
+            inventory = _inventory_counts(reply) \
+                if isinstance(reply, dict) else None
+            if not inventory:
+                continue
+            for item, count in inventory.items():
+                column = self._columns.get(item)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+                    counts.append(count)
+        if rows:
+            np.add.at(out, (rows, columns), counts)
+        return out
+
+
+class ObservationWrapper:
+    """Base class of wrappers that only change observations.
+
+    Other attributes are looked up on the wrapped environment.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.num_envs = getattr(env, 'num_envs', None)
+
+    @property
+    def is_batched(self) -> bool:
+        return self.num_envs is not None
+
+    @property
+    def batch_size(self) -> int:
+        return self.num_envs if self.is_batched else 1
+
+    def __getattr__(self, name):
+        return getattr(self.env, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.env.__exit__(exc_type, exc_val, exc_tb)
+
+    def reset(self):
+        return self._unbatch(self.reset_batch(self._batch(self.env.reset())))
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        observation = self._unbatch(self.step_batch(self._batch(observation)))
+        return observation, reward, done, info
+
+    def reset_batch(self, observations):
+        """Process the first observations of every environment."""
+        return self.step_batch(observations)
+
+    def step_batch(self, observations):
+        """Process the latest observations of every environment."""
+        raise NotImplementedError
+
+    def _batch(self, observation):
+        if self.is_batched:
+            return observation
+        if isinstance(observation, np.ndarray):
+            return observation[np.newaxis]
+        if isinstance(observation, dict) and observation and all(
+                isinstance(value, np.ndarray)
+                for value in observation.values()):
+            return {key: value[np.newaxis]
+                    for key, value in observation.items()}
+        return [observation]
+
+    def _unbatch(self, observations):
+        if self.is_batched:
+            return observations
+        if isinstance(observations, dict):
+            return {key: value[0] for key, value in observations.items()}
+        return observations[0]
+
+
+Encoder = Union[BlockGridEncoder, InventoryEncoder]
+
+
+class EncodeObservation(ObservationWrapper):
+    """Turns replies into an array, or a dict of arrays, with encoders."""
+
+    def __init__(self, env, encoders: Union[Encoder, Mapping[str, Encoder]]):
+        """
+        Args:
+            env: The environment whose replies to encode
+            encoders: One encoder, or a dict of encoders whose outputs are
+                returned under the same keys
+        """
+        super(EncodeObservation, self).__init__(env)
+        self._encoders = encoders
+        if isinstance(encoders, Mapping):
+            self._out = {key: np.empty((self.batch_size,) + encoder.shape,
+                                       dtype=encoder.dtype)
+                         for key, encoder in encoders.items()}
+        else:
+            self._out = np.empty((self.batch_size,) + encoders.shape,
+                                 dtype=encoders.dtype)
+
+    def step_batch(self, replies):
+        if isinstance(self._encoders, Mapping):
+            for key, encoder in self._encoders.items():
+                encoder.encode_batch(replies, self._out[key])
+            return self._out
+        return self._encoders.encode_batch(replies, self._out)
+
+
+class _ArrayWrapper(ObservationWrapper):
+    """A wrapper processing an array observation, or one key of a dict."""
+
+    def __init__(self, env, key: str = None):
+        super(_ArrayWrapper, self).__init__(env)
+        self.key = key
+
+    def reset_batch(self, observations):
+        return self._replace(observations, self.reset_array(
+            self._select(observations)))
+
+    def step_batch(self, observations):
+        return self._replace(observations, self.step_array(
+            self._select(observations)))
+
+    def reset_array(self, array: np.ndarray) -> np.ndarray:
+        return self.step_array(array)
+
+    def step_array(self, array: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _select(self, observations) -> np.ndarray:
+        array = observations if self.key is None else observations[self.key]
+        return np.asarray(array)
+
+    def _replace(self, observations, array: np.ndarray):
+        if self.key is None:
+            return array
+        replaced = dict(observations)
+        replaced[self.key] = array
+        return replaced
+
+
+class FrameStack(_ArrayWrapper):
+    """Stacks the last `num_frames` observations along a new axis 1.
+
+    Frames are kept in a ring buffer of twice the stack size, where every
+    frame is written twice, so the latest frames are always one contiguous
+    slice and reading the stack never copies. On reset, the stack is filled
+    with the first observation.
+    """
+
+    def __init__(self, env, num_frames: int, key: str = None):
+        super(FrameStack, self).__init__(env, key)
+        self.num_frames = num_frames
+        self._frames: Optional[np.ndarray] = None
+        self._position = 0
+
+    def reset_array(self, array: np.ndarray) -> np.ndarray:
+        if self._frames is None or self._frames.shape[2:] != array.shape[1:]:
+            self._frames = np.empty(
+                (array.shape[0], 2 * self.num_frames) + array.shape[1:],
+                dtype=array.dtype)
+        self._frames[:] = array[:, np.newaxis]
+        self._position = 0
+        return self._frames[:, 1:self.num_frames + 1]
+
+    def step_array(self, array: np.ndarray) -> np.ndarray:
+        if self._frames is None:
+            return self.reset_array(array)
+        self._position = (self._position + 1) % self.num_frames
+        self._frames[:, self._position] = array
+        self._frames[:, self._position + self.num_frames] = array
+        start = self._position + 1
+        return self._frames[:, start:start + self.num_frames]
+
+
+class RunningMeanStd:
+    """The mean and variance of a stream of batches, per element.
+
+    Batches are merged with the parallel algorithm of Chan et al., which
+    stays accurate over long runs without storing past observations.
+    """
+
+    def __init__(self, shape: Tuple[int, ...] = (), epsilon: float = 1e-4):
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.var = np.ones(shape, dtype=np.float64)
+        self.count = epsilon
+
+    def update(self, batch: np.ndarray):
+        batch_mean = batch.mean(axis=0)
+        batch_var = batch.var(axis=0)
+        batch_count = batch.shape[0]
+        delta = batch_mean - self.mean
+        total = self.count + batch_count
+        self.mean += delta * (batch_count / total)
+        m2 = self.var * self.count + batch_var * batch_count + \
+            np.square(delta) * (self.count * batch_count / total)
+        self.var = m2 / total
+        self.count = total
+
+
+class NormalizeObservation(_ArrayWrapper):
+    """Standardizes observations with their running mean and variance."""
+
+    def __init__(self, env, key: str = None, clip: float = 5.0,
+                 epsilon: float = 1e-8, update: bool = True):
+        """
+        Args:
+            env: The environment to wrap
+            key (str): The entry to normalize when observations are dicts
+            clip (float): Normalized values are clipped to [-clip, clip]
+            epsilon (float): Added to the variance to avoid dividing by 0
+            update (bool): Keep updating the statistics, set to False to
+                evaluate with frozen statistics
+        """
+        super(NormalizeObservation, self).__init__(env, key)
+        self.clip = clip
+        self.epsilon = epsilon
+        self.update = update
+        self.statistics: Optional[RunningMeanStd] = None
+        self._out: Optional[np.ndarray] = None
+
+    def step_array(self, array: np.ndarray) -> np.ndarray:
+        if self.statistics is None:
+            self.statistics = RunningMeanStd(array.shape[1:])
+        if self._out is None or self._out.shape != array.shape:
+            self._out = np.empty(array.shape, dtype=np.float32)
+        if self.update:
+            self.statistics.update(array)
+        out = self._out
+        np.subtract(array, self.statistics.mean, out=out, casting='unsafe')
+        out /= np.sqrt(self.statistics.var + self.epsilon).astype(np.float32)
+        np.clip(out, -self.clip, self.clip, out=out)
+        return out
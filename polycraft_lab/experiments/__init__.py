@@ -0,0 +1,11 @@
+"""Run Polycraft AI Lab experiments at scale.
+
+`SweepRunner` in `sweep.py` runs every combination of missions, seeds and
+agents from a sweep file over a pool of game instances, and can be started
+from the command line with `pal experiment launch <sweep file>`.
+"""
+
+from polycraft_lab.experiments.sweep import SweepConfig, SweepRunner, \
+    run_sweep
+
+__all__ = ['SweepConfig', 'SweepRunner', 'run_sweep']
@@ -0,0 +1,50 @@
+"""Agents that can be referenced from an experiment sweep config.
+
+Sweep configs name agents by import path, e.g.
+`"my_package.agents:PlanningAgent"`. The named object is called as
+`factory(seed=seed, actions=actions)` once per trial and must return an object
+with an `act(observation) -> str` method. An optional `reset()` method is
+called before every episode.
+"""
+import importlib
+import random
+from typing import Callable, Sequence
+
+
+class RandomAgent:
+    """Takes a uniformly random action from the sweep's action list."""
+
+    def __init__(self, seed: int, actions: Sequence[str]):
+        if not actions:
+            raise ValueError('RandomAgent needs at least one action')
+        self._actions = list(actions)
+        self._random = random.Random(seed)
+
+    def reset(self):
+        pass
+
+    def act(self, observation) -> str:
+        return self._random.choice(self._actions)
+
+
+BUILTIN_AGENTS = {
+    'random': RandomAgent,
+}
+
+
+def load_agent_factory(path: str) -> Callable:
+    """Return the agent factory named by a built-in name or `module:attr`.
+
+    Raises:
+        ValueError if the path does not name an importable object.
+    """
+    if path in BUILTIN_AGENTS:
+        return BUILTIN_AGENTS[path]
+    module_name, _, attribute = path.partition(':')
+    if not attribute:
+        raise ValueError(f'Agent {path} must look like "module:attribute"')
+    module = importlib.import_module(module_name)
+    try:
+        return getattr(module, attribute)
+    except AttributeError:
+        raise ValueError(f'{module_name} has no agent {attribute}')
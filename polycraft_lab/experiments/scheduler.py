@@ -0,0 +1,59 @@
+"""A work-stealing task queue for spreading trials over game instances.
+
+Each worker has its own deque of tasks and takes from the front of it. A worker
+that runs out steals from the back of the longest deque of another worker, so
+tasks that were queued together (such as trials of the same mission) tend to
+stay on the same game instance while no instance ever sits idle.
+"""
+import threading
+from collections import deque
+from typing import Deque, Generic, Iterable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class WorkStealingQueue(Generic[T]):
+    """Per-worker deques of tasks with stealing when a worker runs dry."""
+
+    def __init__(self, worker_count: int):
+        if worker_count < 1:
+            raise ValueError('At least one worker is required')
+        self._queues: List[Deque[T]] = [deque() for _ in range(worker_count)]
+        self._lock = threading.Lock()
+        self.steals = 0
+
+    @property
+    def worker_count(self) -> int:
+        return len(self._queues)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(queue) for queue in self._queues)
+
+    def put(self, worker: int, task: T):
+        """Queue a task for the given worker."""
+        with self._lock:
+            self._queues[worker].append(task)
+
+    def distribute(self, groups: Iterable[List[T]]):
+        """Queue groups of related tasks, keeping each group on one worker.
+
+        Groups are handed out largest first to the least loaded worker.
+        """
+        with self._lock:
+            for group in sorted(groups, key=len, reverse=True):
+                queue = min(self._queues, key=len)
+                queue.extend(group)
+
+    def get(self, worker: int) -> Optional[T]:
+        """Return the next task for a worker, or None if all queues are empty.
+        """
+        with self._lock:
+            own = self._queues[worker]
+            if own:
+                return own.popleft()
+            victim = max(self._queues, key=len)
+            if not victim:
+                return None
+            self.steals += 1
+            return victim.pop()
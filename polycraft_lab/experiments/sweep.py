@@ -0,0 +1,353 @@
+"""Run sweeps of missions x seeds x agents over a pool of game instances.
+
+A sweep is described by a JSON file:
+
+    {
+        "name": "nightly",
+        "missions": ["missions/pogo_nonov.json", "missions/pogo_novel.json"],
+        "seeds": [0, 1, 2],
+        "agents": {"random": "random",
+                   "planner": "my_package.agents:PlanningAgent"},
+        "actions": ["MOVE w", "TURN 90", "BREAK_BLOCK"],
+        "experiment": "pogo_stick_config.json",
+        "episodes": 1,
+        "max_steps": 1000,
+        "instances": 4,
+        "placement": {"policy": "spread", "nice": 5}
+    }
+
+Relative paths are resolved against the sweep file. `instances` is either a
+number of games to launch, or a list of `{"host": ..., "port": ...}` addresses
+of games that are already running. Launched games are placed on the CPUs of
+the host as described by the optional `placement` (see
+`polycraft_lab.installation.placement.placement_from_config`).
+
+Every finished trial is appended to `results.jsonl` in the output directory, so
+an interrupted sweep picks up where it stopped when launched again.
+"""
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Set, TextIO
+
+from polycraft_lab.ect.experiment_config import ExperimentConfig
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.experiments.agents import load_agent_factory
+from polycraft_lab.experiments.scheduler import WorkStealingQueue
+from polycraft_lab.installation import PAL_DEFAULT_PATH, PAL_MOD_DIR_NAME
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.installation.placement import placement_from_config
+from polycraft_lab.monitoring.profiler import NULL_PROFILER, PHASE_AGENT, \
+    Profiler
+
+log = logging.getLogger('pal').getChild('experiments')
+
+RESULTS_FILE_NAME = 'results.jsonl'
+
+DEFAULT_REPORT_INTERVAL = 2  # seconds
+
+DEFAULT_MAX_STEPS = 1000
+
+
+class Trial:
+    """One agent playing one mission with one seed.
+
+    Attributes:
+        trial_id (str): A stable id used to resume interrupted sweeps
+    """
+
+    def __init__(self, agent_name: str, agent_path: str, mission: str,
+                 seed: int):
+        self.agent_name = agent_name
+        self.agent_path = agent_path
+        self.mission = mission
+        self.seed = seed
+        self.trial_id = f'{agent_name}/{mission}/{seed}'
+
+
+class SweepConfig:
+    """A wrapper for the values of a sweep file."""
+
+    def __init__(self, config: dict, base_directory: Path):
+        def resolve(path: str) -> str:
+            return str((base_directory / path).resolve())
+
+        self.name = config.get('name', 'sweep')
+        self.missions = [resolve(mission) for mission in config['missions']]
+        self.seeds = config.get('seeds', [0])
+        self.agents: Dict[str, str] = config['agents']
+        self.actions = config.get('actions', [])
+        self.experiment_path = resolve(config['experiment']) \
+            if 'experiment' in config else None
+        self.episodes = int(config.get('episodes', 1))
+        self.max_steps = int(config.get('max_steps', DEFAULT_MAX_STEPS))
+        self.instances = config.get('instances', 1)
+        self.placement = config.get('placement')
+        self.output_directory = Path(resolve(
+            config.get('output', f'{self.name}_results')))
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path) as file:
+            return cls(json.load(file), Path(path).absolute().parent)
+
+    @property
+    def instance_count(self) -> int:
+        if isinstance(self.instances, list):
+            return len(self.instances)
+        return int(self.instances)
+
+    def trials(self) -> List[Trial]:
+        """Return every trial of the sweep in a stable order."""
+        return [Trial(agent_name, self.agents[agent_name], mission, seed)
+                for agent_name, mission, seed in itertools.product(
+                    self.agents, self.missions, self.seeds)]
+
+
+class SweepProgress:
+    """Thread-safe counters for reporting sweep throughput."""
+
+    def __init__(self, total_trials: int):
+        self.total_trials = total_trials
+        self.trials_done = 0
+        self.trials_failed = 0
+        self.steps = 0
+        self.episodes = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, steps: int = 0, episodes: int = 0, trials: int = 0,
+            failed: int = 0):
+        with self._lock:
+            self.steps += steps
+            self.episodes += episodes
+            self.trials_done += trials
+            self.trials_failed += failed
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        line = (f'{self.trials_done}/{self.total_trials} trials | '
+                f'{self.steps / elapsed:.1f} steps/s | '
+                f'{self.episodes / elapsed:.2f} episodes/s')
+        if self.trials_failed:
+            line += f' | {self.trials_failed} failed'
+        return line
+
+
+def _discard_partial_line(results_path: Path):
+    """Cut off a trailing line left unfinished by an interrupted write."""
+    if not results_path.is_file():
+        return
+    with results_path.open('rb+') as file:
+        data = file.read()
+        if data and not data.endswith(b'\n'):
+            file.truncate(data.rfind(b'\n') + 1)
+
+
+def load_completed(results_path: Path) -> Set[str]:
+    """Return the ids of trials already checkpointed in a results file."""
+    completed = set()
+    if not results_path.is_file():
+        return completed
+    with results_path.open() as file:
+        for line in file:
+            try:
+                completed.add(json.loads(line)['trial_id'])
+            except (ValueError, KeyError):
+                # A line cut short by an interruption is simply rerun
+                continue
+    return completed
+
+
+class SweepRunner:
+    """Runs the trials of a sweep on a pool of environments."""
+
+    def __init__(self, config: SweepConfig,
+                 env_factory: Callable[[int], PolycraftEnv] = None,
+                 report_interval: float = DEFAULT_REPORT_INTERVAL,
+                 out: TextIO = sys.stdout, profiler: Profiler = None):
+        """
+        Args:
+            config (SweepConfig): The sweep to run
+            env_factory: Creates the environment for the worker with the given
+                index. By default each worker launches or attaches to one of
+                the sweep's instances.
+            report_interval (float): Seconds between throughput updates, or 0
+                to not report
+            out: Where throughput updates are written
+            profiler (Profiler): Times the phases of every episode, including
+                the agent choosing actions. The caller starts and closes it.
+        """
+        self._config = config
+        self._experiment = None
+        if config.experiment_path is not None:
+            self._experiment = ExperimentConfig.from_file(
+                config.experiment_path)
+        self._env_factory = env_factory or self._default_env_factory
+        self._placement = None
+        if env_factory is None and not isinstance(config.instances, list):
+            self._placement = placement_from_config(config.placement,
+                                                    config.instance_count)
+        self._report_interval = report_interval
+        self._out = out
+        self._profiler = profiler or NULL_PROFILER
+        self._results_path = config.output_directory / RESULTS_FILE_NAME
+        self._write_lock = threading.Lock()
+        self._finished = threading.Event()
+        self.progress: SweepProgress = None
+
+    @property
+    def results_path(self) -> Path:
+        return self._results_path
+
+    def run(self, resume: bool = True) -> SweepProgress:
+        """Run every trial that has no checkpointed result yet.
+
+        Args:
+            resume (bool): If False, earlier results are discarded first
+        """
+        self._config.output_directory.mkdir(parents=True, exist_ok=True)
+        if not resume and self._results_path.exists():
+            self._results_path.unlink()
+        _discard_partial_line(self._results_path)
+        completed = load_completed(self._results_path)
+        pending = [trial for trial in self._config.trials()
+                   if trial.trial_id not in completed]
+        log.info('%s trials to run, %s already complete', len(pending),
+                 len(completed))
+        self.progress = SweepProgress(len(pending))
+        if not pending:
+            return self.progress
+
+        worker_count = min(self._config.instance_count, len(pending))
+        queue = WorkStealingQueue(worker_count)
+        by_mission: Dict[str, List[Trial]] = {}
+        for trial in pending:
+            by_mission.setdefault(trial.mission, []).append(trial)
+        queue.distribute(by_mission.values())
+
+        workers = [threading.Thread(target=self._work, args=(index, queue),
+                                    name=f'sweep-worker-{index}')
+                   for index in range(worker_count)]
+        reporter = threading.Thread(target=self._report, daemon=True)
+        self._finished.clear()
+        for worker in workers:
+            worker.start()
+        if self._report_interval:
+            reporter.start()
+        for worker in workers:
+            worker.join()
+        unrun = len(queue)
+        if unrun:
+            # Every worker stopped, having failed to start or lost its game
+            log.error('%s trials were not run because no worker was left',
+                      unrun)
+            self.progress.add(failed=unrun)
+        self._finished.set()
+        if self._report_interval:
+            reporter.join()
+            print(f'\r{self.progress.line()}', file=self._out)
+        log.info('Sweep finished with %s steals', queue.steals)
+        return self.progress
+
+    def _default_env_factory(self, index: int) -> PolycraftEnv:
+        instances = self._config.instances
+        if isinstance(instances, list):
+            client = PolycraftClient.attach(instances[index]['host'],
+                                            instances[index]['port'])
+        else:
+            client = PolycraftClient(str(PAL_DEFAULT_PATH / PAL_MOD_DIR_NAME),
+                                     limits=self._placement[index])
+            client.start()
+        return PolycraftEnv(self._config.missions[0], client=client,
+                            preload_missions=True,
+                            experiment_config=self._experiment,
+                            profiler=self._profiler)
+
+    def _work(self, index: int, queue: WorkStealingQueue):
+        try:
+            env = self._env_factory(index)
+        except Exception:
+            log.exception('Worker %s could not start its environment', index)
+            return
+        with env:
+            while True:
+                trial = queue.get(index)
+                if trial is None:
+                    return
+                try:
+                    result = self._run_trial(env, trial)
+                except Exception:
+                    log.exception('Trial %s failed', trial.trial_id)
+                    if not env.is_alive:
+                        # Another worker retries it, or it counts as failed
+                        # once no worker is left
+                        log.error('Worker %s lost its game, stopping', index)
+                        queue.put(index, trial)
+                        return
+                    self.progress.add(failed=1)
+                    continue
+                self._checkpoint(result)
+                self.progress.add(trials=1)
+
+    def _run_trial(self, env: PolycraftEnv, trial: Trial) -> dict:
+        factory = load_agent_factory(trial.agent_path)
+        agent = factory(seed=trial.seed, actions=self._config.actions)
+        env.set_mission(trial.mission)
+        started = time.time()
+        episodes = []
+        for _ in range(self._config.episodes):
+            episode_started = time.monotonic()
+            if hasattr(agent, 'reset'):
+                agent.reset()
+            observation = env.reset()
+            total_reward = 0.0
+            steps = 0
+            done = False
+            info = {}
+            while not done and steps < self._config.max_steps:
+                with self._profiler.phase(PHASE_AGENT):
+                    action = agent.act(observation)
+                observation, reward, done, info = env.step(action)
+                total_reward += reward
+                steps += 1
+            self._profiler.end_episode(trial_id=trial.trial_id,
+                                       mission=trial.mission, steps=steps)
+            self.progress.add(steps=steps, episodes=1)
+            episodes.append({
+                'steps': steps,
+                'reward': total_reward,
+                'termination': info.get('termination',
+                                        'done' if done else 'max_steps'),
+                'seconds': time.monotonic() - episode_started,
+            })
+        return {
+            'trial_id': trial.trial_id,
+            'agent': trial.agent_name,
+            'mission': trial.mission,
+            'seed': trial.seed,
+            'started_at': started,
+            'episodes': episodes,
+        }
+
+    def _checkpoint(self, result: dict):
+        line = json.dumps(result) + '\n'
+        with self._write_lock, self._results_path.open('a') as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _report(self):
+        while not self._finished.wait(self._report_interval):
+            print(f'\r{self.progress.line()}', end='', file=self._out,
+                  flush=True)
+
+
+def run_sweep(config_path: str, resume: bool = True) -> SweepProgress:
+    """Run the sweep described by the file at `config_path`."""
+    return SweepRunner(SweepConfig.from_file(config_path)).run(resume)
@@ -8,11 +8,21 @@ mod, and PolycraftServerBridge, which is responsible for sending commands to the
 currently running game.
 """
 import logging
-from typing import Callable
+from typing import Callable, List, Optional, Sequence
 
+from polycraft_lab.installation import PAL_DEFAULT_PATH
 from polycraft_lab.installation.comms import ClientDidNotStartError, \
-    DEFAULT_HOST, DEFAULT_PORT, PolycraftBridge
+    DEFAULT_HOST, DEFAULT_PORT, PROTOCOL_JSON, PolycraftBridge
+from polycraft_lab.installation.config import CONFIG_FILE_NAME, \
+    ConfigLoadingError, DEFAULT_INSTANCE_PORT_RANGE, PolycraftLabConfig
+from polycraft_lab.installation.dispatch import DEFAULT_QUEUE_SIZE, \
+    POLICY_DROP_OLDEST, Subscription
 from polycraft_lab.installation.game import PolycraftGame
+from polycraft_lab.installation.instances import PortAllocator
+from polycraft_lab.installation.placement import ResourceLimits
+from polycraft_lab.installation.streaming import DEFAULT_MAX_BUFFER, \
+    StreamingReply
+from polycraft_lab.monitoring.metrics import JVM_RSS, RESTARTS
 
 log = logging.getLogger('pal').getChild('client').getChild('core')
 
@@ -20,14 +30,66 @@ log = logging.getLogger('pal').getChild('client').getChild('core')
 class PolycraftClient:
     """A module that manages a running Polycraft World client."""
 
-    def __init__(self, installation_path: str,
-                 message_callback: Callable[[str], None] = None):
+    def __init__(self, installation_path: str = None,
+                 message_callback: Callable[[str], None] = None,
+                 host: str = None, port: int = None,
+                 protocol: str = PROTOCOL_JSON,
+                 port_allocator: PortAllocator = None,
+                 limits: ResourceLimits = None):
+        """Create a new client.
+
+        Args:
+            installation_path (str): The Polycraft World mod installation to
+                run. If None, the client attaches to a game that is already
+                listening on host:port and does not manage its process.
+            message_callback: A function that receives the text of every
+                reply on a worker thread (see `subscribe`)
+            host (str): The address the game listens on, from the lab config
+                by default
+            port (int): The port the game listens on. A game started by this
+                client gets a free port from the lab config's instance port
+                range by default; an attached client uses the lab config's
+                server port.
+            protocol (str): The reply encoding to negotiate, 'json' or
+                'msgpack'
+            port_allocator (PortAllocator): Where a game started by this
+                client reserves its port
+            limits (ResourceLimits): The CPUs, priority and memory cap of a
+                game started by this client
+        """
         self.is_running = False
-        # TODO: Fetch values from config
-        # config = PolycraftLabConfig.from_installation(installation_path)
-        self.game = PolycraftGame(installation_path)
-        self.bridge = PolycraftBridge(DEFAULT_HOST, DEFAULT_PORT,
-                                      message_callback)
+        lab_config = None
+        if host is None or port is None:
+            lab_config = _load_lab_config()
+        if host is None:
+            host = lab_config.lab_server_host if lab_config else DEFAULT_HOST
+        self.game = None
+        self._reservation = None
+        if installation_path is not None:
+            self.game = PolycraftGame(installation_path, limits=limits)
+            if port_allocator is None:
+                port_range = lab_config.instance_port_range if lab_config \
+                    else DEFAULT_INSTANCE_PORT_RANGE
+                port_allocator = PortAllocator(port_range, host)
+            if port is None:
+                self._reservation = port_allocator.allocate()
+            else:
+                self._reservation = port_allocator.reserve(port)
+            port = self.game.port = self._reservation.port
+        elif port is None:
+            port = lab_config.lab_server_port if lab_config else DEFAULT_PORT
+        self.bridge = PolycraftBridge(host, port, message_callback,
+                                      protocol=protocol)
+        self._times_started = 0
+
+    @classmethod
+    def attach(cls, host: str = None, port: int = None,
+               message_callback: Callable[[str], None] = None,
+               protocol: str = PROTOCOL_JSON):
+        """Return a client connected to a game that is already running."""
+        client = cls(None, message_callback, host, port, protocol)
+        client.start()
+        return client
 
     def __enter__(self):
         self.start()
@@ -39,23 +101,94 @@ class PolycraftClient:
     @property
     def is_alive(self):
         """Return True if the game client can receive commands."""
+        if self.game is None:
+            return self.bridge.is_connected
         return self.game.is_alive
 
     def start(self):
         """Try starting the game client and message channel."""
+        if self.game is None:
+            log.debug('Attaching to running game')
+            self.bridge.start(startup_delay=0)
+            self.is_running = True
+            return
         log.debug('Starting game')
-        with self.game:
-            log.debug('Starting communication bridge')
-            try:
-                self.bridge.start()
-            except ClientDidNotStartError:
-                raise
-        self.bridge.disconnect()
+        self._reservation.acquire()
+        if self._times_started:
+            RESTARTS.labels(instance=self.instance_name).inc()
+        self._times_started += 1
+        self.game.start()
+        self._reservation.register(self.game.pid,
+                                   self.game.installation_directory)
+        JVM_RSS.labels(instance=self.instance_name).set_function(
+            self._memory_usage)
+        log.debug('Starting communication bridge')
+        try:
+            self.bridge.start()
+        except ClientDidNotStartError:
+            self.game.stop()
+            self._reservation.release()
+            raise
+        self.is_running = True
 
     def stop(self):
         """Stop the currently running game of Minecraft."""
+        if self.is_running:
+            self.bridge.disconnect()
+        if self.game is not None:
+            self.game.stop()
+            self._reservation.release()
         self.is_running = False
 
-    def send(self, message: str):
-        """Send a message to the server."""
-        return self.bridge.send(message)
+    @property
+    def instance_name(self) -> str:
+        """The host:port label this client's metrics are recorded under."""
+        return self.bridge.instance_name
+
+    def _memory_usage(self) -> float:
+        usage = self.game.memory_usage()
+        return float('nan') if usage is None else usage
+
+    @property
+    def is_degraded(self) -> bool:
+        """True if a command timed out and its reply has not arrived yet."""
+        return self.bridge.is_degraded
+
+    def send(self, message: str, timeout: float = None):
+        """Send a message to the server.
+
+        Raises:
+            CommandTimeoutError: If there is no reply within `timeout` seconds
+        """
+        return self.bridge.send(message, timeout)
+
+    def send_many(self, messages: Sequence[str],
+                  timeout: float = None) -> List[object]:
+        """Send several messages back to back and return every reply."""
+        return self.bridge.send_many(messages, timeout)
+
+    def subscribe(self, callback: Callable[[object], None], name: str = None,
+                  max_size: int = DEFAULT_QUEUE_SIZE,
+                  policy: str = POLICY_DROP_OLDEST) -> Subscription:
+        """Call `callback` with every decoded reply, on a worker thread.
+
+        Subscribers never delay commands. When one falls `max_size` replies
+        behind, `policy` decides which replies it misses; see
+        `polycraft_lab.installation.dispatch`.
+        """
+        return self.bridge.dispatcher.subscribe(callback, name, max_size,
+                                                policy)
+
+    def stream(self, message: str, fields: Sequence[str],
+               max_buffer: int = DEFAULT_MAX_BUFFER) -> StreamingReply:
+        """Send a message and stream the given array fields of its reply."""
+        return self.bridge.stream(message, fields, max_buffer)
+
+
+def _load_lab_config() -> Optional[PolycraftLabConfig]:
+    """Return the lab config, or None if it was never created."""
+    try:
+        return PolycraftLabConfig(str(PAL_DEFAULT_PATH / CONFIG_FILE_NAME),
+                                  create_file=False)
+    except ConfigLoadingError:
+        return None
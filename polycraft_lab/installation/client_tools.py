@@ -1,5 +1,9 @@
 import logging
+import sys
+import time
+from typing import TextIO
 
+from polycraft_lab.cli.turtle import TurtleConsole
 from polycraft_lab.installation import PAL_DEFAULT_PATH, PAL_MOD_DIR_NAME
 from polycraft_lab.installation.client import PolycraftClient
 from polycraft_lab.installation.game import ClientNotInitializedError
@@ -7,10 +11,17 @@ from polycraft_lab.installation.comms import ClientDidNotStartError
 
 log = logging.getLogger('pal').getChild('client')
 
+GAME_POLL_INTERVAL = 1  # seconds
+
 
 def launch_polycraft(directory: str = PAL_DEFAULT_PATH / PAL_MOD_DIR_NAME,
-                     verbose: bool = False):
-    """Launch the default Polycraft World installation."""
+                     verbose: bool = False, commands: TextIO = sys.stdin):
+    """Launch the default Polycraft World installation.
+
+    Once the game is connected, commands are read from `commands` and sent to
+    it, interactively if it is a terminal. The game is stopped when quit is
+    entered. At the end of input, the game keeps running until it is closed.
+    """
     if verbose:
         log.setLevel(logging.DEBUG)
 
@@ -20,14 +31,16 @@ def launch_polycraft(directory: str = PAL_DEFAULT_PATH / PAL_MOD_DIR_NAME,
         # TODO: Check that game is installed
         client = PolycraftClient(directory)
         client.start()
-        while client.is_alive:
-            # TODO: Insert wait and then listen to commands from STDiIN
-            # TODO; Send commends from STDIN to client
-            pass
     except ClientNotInitializedError as e:
         log.error(f'Game client not found at {directory}')
         raise e
     except ClientDidNotStartError as e:
         log.error('Game did not start in time.', e)
         raise e
-    client.stop()
+    try:
+        with TurtleConsole(client) as console:
+            should_quit = console.run(commands)
+        while not should_quit and client.is_alive:
+            time.sleep(GAME_POLL_INTERVAL)
+    finally:
+        client.stop()
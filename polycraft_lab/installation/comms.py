@@ -1,14 +1,40 @@
 import json
 import logging
 import socket
+import struct
 import time
-from typing import Callable
+from contextlib import contextmanager
+from typing import Callable, List, Sequence
+
+from polycraft_lab.installation.dispatch import DEFAULT_CLOSE_TIMEOUT, \
+    ReplyDispatcher
+from polycraft_lab.installation.streaming import DEFAULT_MAX_BUFFER, \
+    StreamingReply, ValueScanner
+from polycraft_lab.monitoring.metrics import COMMAND_LATENCY, \
+    COMMAND_TIMEOUTS, INSTANCE_DEGRADED, INSTANCE_UP, RECONNECTS
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 log = logging.getLogger('pal').getChild('client').getChild('comms')
 
 DEFAULT_PORT = 9000
 DEFAULT_HOST = '127.0.0.1'
-DEFAULT_BUFF_SIZE = 4096  # 4 KiB
+DEFAULT_BUFF_SIZE = 64 * 1024  # 64 KiB
+DEFAULT_STARTUP_DELAY = 30  # seconds
+
+PROTOCOL_JSON = 'json'
+PROTOCOL_MSGPACK = 'msgpack'
+COMMAND_PROTOCOL = 'PROTOCOL'
+
+# msgpack replies are framed with a big-endian payload length
+_LENGTH_PREFIX = struct.Struct('>I')
+
+_JSON_WHITESPACE = frozenset(b' \t\r\n')
+_JSON_CLOSING_BYTES = frozenset(b'}]')
+_json_decoder = json.JSONDecoder()
 
 
 class PolycraftBridge:
@@ -16,21 +42,50 @@ class PolycraftBridge:
 
     def __init__(self, host: str, port: int,
                  message_callback: Callable[[str], None],
-                 buffer_size: int = DEFAULT_BUFF_SIZE):
+                 buffer_size: int = DEFAULT_BUFF_SIZE,
+                 protocol: str = PROTOCOL_JSON):
         """
 
         Args:
-            host:
-            port:
-            message_callback: A function that receives results from commands
-            buffer_size:
+            host: The address the game listens on
+            port: The port the game listens on
+            message_callback: A function that receives the text of every
+                reply. It is called on a worker thread of `dispatcher`, not
+                while the command is sent; use `dispatcher.subscribe` to
+                receive decoded replies or to choose a queue policy.
+            buffer_size: The most bytes read from the socket at once
+            protocol: The reply encoding to ask the game for when connecting,
+                either 'json' or 'msgpack'. JSON is used if the game or this
+                Python environment does not support the requested encoding.
         """
         self._host = host
         self._port = port
-        self._callback = message_callback
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._buffer_size = buffer_size
         self._should_disconnect = False
+        self._requested_protocol = protocol
+        self._receive_buffer = bytearray()
+        self._chunk = memoryview(bytearray(buffer_size))
+        self._stream: StreamingReply = None
+        # Replies to commands that timed out, still to be skipped
+        self._unread = 0
+        self._deadline: float = None
+        self._has_socket_timeout = False
+        self.is_connected = False
+        self.is_degraded = False
+        self.protocol = PROTOCOL_JSON
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.instance_name = f'{host}:{port}'
+        self._latency = COMMAND_LATENCY.labels(instance=self.instance_name)
+        self._up = INSTANCE_UP.labels(instance=self.instance_name)
+        self._degraded = INSTANCE_DEGRADED.labels(instance=self.instance_name)
+        self._timeouts = COMMAND_TIMEOUTS.labels(instance=self.instance_name)
+        self.dispatcher = ReplyDispatcher(self.instance_name)
+        if message_callback is not None:
+            self.dispatcher.subscribe(
+                lambda reply: message_callback(json.dumps(reply)),
+                name='message_callback')
 
     def __enter__(self):
         self.start()
@@ -39,9 +94,30 @@ class PolycraftBridge:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.disconnect()
 
-    def start(self):
-        time.sleep(30)  # TODO: Maybe not delay this?
+    def start(self, startup_delay: float = DEFAULT_STARTUP_DELAY):
+        """Connect to the game after waiting for it to boot.
+
+        Args:
+            startup_delay (float): Seconds to wait before the first connection
+                attempt. Pass 0 when the server is known to be listening.
+        """
+        time.sleep(startup_delay)  # TODO: Maybe not delay this?
         self._attempt_connection()
+        self._negotiate_protocol()
+
+    def _negotiate_protocol(self):
+        """Ask the game to switch to the requested reply encoding."""
+        if self._requested_protocol == PROTOCOL_JSON:
+            return
+        if self._requested_protocol != PROTOCOL_MSGPACK:
+            raise ValueError(f'Unknown protocol {self._requested_protocol}')
+        if msgpack is None:
+            log.warning('msgpack is not installed, using JSON replies')
+            return
+        reply = self.send(f'{COMMAND_PROTOCOL} {PROTOCOL_MSGPACK}')
+        if isinstance(reply, dict) and reply.get('protocol') == PROTOCOL_MSGPACK:
+            self.protocol = PROTOCOL_MSGPACK
+        log.info('Using %s replies', self.protocol)
 
     def _attempt_connection(self, max_attempts: int = 4):
         """Start the Polycraft Lab to Polycraft World communication bridge.
@@ -54,11 +130,14 @@ class PolycraftBridge:
         for attempt in range(max_attempts):
             try:
                 self._socket.connect((self._host, self._port))
+                self.is_connected = True
+                self._up.set(1)
                 # TODO: Pipe output to a stream
                 print('Game client connected.')
                 log.debug('Game client connected.')
                 return
             except ConnectionRefusedError:
+                RECONNECTS.labels(instance=self.instance_name).inc()
                 log.debug(f'Attempt {attempt} to start server failed')
                 log.debug(f'Waiting {backoff} seconds before trying again')
                 time.sleep(backoff)
@@ -67,28 +146,289 @@ class PolycraftBridge:
 
     def disconnect(self):
         log.info('Shutting down communication with game')
+        self.is_connected = False
+        self._up.set(0)
         self._socket.close()
         log.debug('Socket closed')
+        if not self.dispatcher.flush(DEFAULT_CLOSE_TIMEOUT):
+            log.warning('Subscribers did not handle every reply in time')
+        self.dispatcher.close(DEFAULT_CLOSE_TIMEOUT)
+
+    def send(self, command: str, timeout: float = None):
+        """Send commands to Minecraft.
+
+        Args:
+            command (str): The command to send
+            timeout (float): Seconds to wait for the reply, forever by default
+
+        Raises:
+            CommandTimeoutError: If the reply did not arrive in time. The
+                bridge is then degraded, and the late reply is skipped by the
+                next command.
+        """
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Sending command {command}')
+        self._finish_stream()
+        started = time.perf_counter()
+        self._write(command)
+        self._unread += 1
+        with self._time_limit(command, timeout):
+            self._skip_stale_replies(1)
+            reply = self._read_reply()
+        self._latency.observe(time.perf_counter() - started)
+        return reply
+
+    def send_many(self, commands: Sequence[str],
+                  timeout: float = None) -> List[object]:
+        """Send several commands back to back and return their replies.
+
+        All commands are written before any reply is read, so the game never
+        waits on a Python round trip between them. The whole batch is recorded
+        as a single round trip in the latency metrics.
+
+        Args:
+            commands: The commands to send
+            timeout (float): Seconds to wait for every reply, forever by
+                default
+
+        Raises:
+            CommandTimeoutError: If the replies did not all arrive in time
+        """
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Sending {len(commands)} pipelined commands')
+        self._finish_stream()
+        started = time.perf_counter()
+        self._write('\n'.join(commands))
+        self._unread += len(commands)
+        with self._time_limit(commands[0] if commands else '', timeout):
+            self._skip_stale_replies(len(commands))
+            replies = [self._read_reply() for _ in commands]
+        self._latency.observe(time.perf_counter() - started)
+        return replies
+
+    def resync(self, timeout: float = None) -> bool:
+        """Skip the late replies of commands that timed out.
+
+        This happens anyway before the next command reads its reply, so it is
+        only needed to find out whether a degraded game has recovered.
+
+        Returns:
+            True if the bridge is no longer degraded
+        """
+        self._finish_stream()
+        try:
+            with self._time_limit('resync', timeout):
+                self._skip_stale_replies(0)
+        except CommandTimeoutError:
+            return False
+        return True
+
+    def stream(self, command: str, fields: Sequence[str],
+               max_buffer: int = DEFAULT_MAX_BUFFER) -> StreamingReply:
+        """Send a command and stream the given array fields of its reply.
 
-    def send(self, command: str):
-        """Send commands to Minecraft."""
+        The elements of the arrays are decoded one at a time as the reply is
+        received (see `StreamingReply`), so a large reply never has to be held
+        in memory at once. Subscribers do not see streamed replies.
+        Sending another command first reads the rest of the reply, or skips
+        it if decoding failed partway. Streamed replies have no time limit.
 
-        log.debug(f'Sending command {command}')
-        self._socket.send(str.encode(command + '\n'))
+        msgpack replies are not framed per value, so they are still received
+        whole and only handed out element by element.
 
-        data = b''
+        Args:
+            command (str): The command to send
+            fields: The top-level keys whose arrays are streamed
+            max_buffer (int): The most bytes a single value may take
+        """
+        self._finish_stream()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Streaming command {command}')
+        started = time.perf_counter()
+        self._write(command)
+        self._unread += 1
+        self._skip_stale_replies(1)
+        if self.protocol == PROTOCOL_MSGPACK:
+            reply = StreamingReply.from_value(
+                self._read_reply(publish=False), fields)
+            self._latency.observe(time.perf_counter() - started)
+            return reply
+        self._stream = StreamingReply(
+            self._receive_buffer, self._fill, fields, max_buffer,
+            on_finish=lambda: self._latency.observe(
+                time.perf_counter() - started))
+        return self._stream
+
+    def _finish_stream(self):
+        """Read or skip the rest of a streamed reply, keeping replies in step.
+
+        A streamed reply counts as unread until all of it was read.
+        """
+        stream, self._stream = self._stream, None
+        if stream is None:
+            return
+        try:
+            if not stream.is_finished:
+                stream.finish()
+        except ValueError as e:
+            log.warning('%s: skipped the rest of a streamed reply (%s)',
+                        self.instance_name, e)
+        finally:
+            if stream.is_finished:
+                self._unread = max(0, self._unread - 1)
+
+    @contextmanager
+    def _time_limit(self, command: str, timeout: float = None):
+        """Make socket reads in this block fail once `timeout` runs out."""
+        if timeout is None:
+            yield
+            return
+        self._deadline = time.monotonic() + timeout
+        try:
+            yield
+        except socket.timeout:
+            self.is_degraded = True
+            self._degraded.set(1)
+            self._timeouts.inc()
+            log.warning('%s: no reply to %s within %.3g seconds',
+                        self.instance_name, command, timeout)
+            raise CommandTimeoutError(command, timeout) from None
+        finally:
+            self._deadline = None
+            if self._has_socket_timeout:
+                self._socket.settimeout(None)
+                self._has_socket_timeout = False
+
+    def _skip_stale_replies(self, expected: int):
+        """Read replies until only `expected` are left unread."""
+        while self._unread > expected:
+            self._read_reply(publish=False)
+            log.debug('Skipped a late reply')
+        if self.is_degraded:
+            self.is_degraded = False
+            self._degraded.set(0)
+            log.info('%s caught up after timing out', self.instance_name)
+
+    def _apply_deadline(self):
+        if self._deadline is None:
+            return
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout()
+        self._socket.settimeout(remaining)
+        self._has_socket_timeout = True
+
+    def _write(self, command: str):
+        data = (command + '\n').encode()
+        self._socket.sendall(data)
+        self.bytes_sent += len(data)
+
+    def _read_reply(self, publish: bool = True):
+        self._finish_stream()
+        if self.protocol == PROTOCOL_MSGPACK:
+            reply = self._read_msgpack()
+        else:
+            reply = self._read_json()
+        self._unread = max(0, self._unread - 1)
+        if publish and self.dispatcher.has_subscribers:
+            self.dispatcher.publish(reply)
+        return reply
+
+    def _read_msgpack(self):
+        header = self._take(_LENGTH_PREFIX.size)
+        try:
+            payload = self._take(_LENGTH_PREFIX.unpack(header)[0])
+        except socket.timeout:
+            # Keep the stream in sync for the next attempt
+            self._receive_buffer[:0] = header
+            raise
+        return msgpack.unpackb(payload, raw=False)
+
+    def _lost_connection(self):
+        self.is_connected = False
+        self._up.set(0)
+        raise GameDisconnectedError()
+
+    def _fill(self):
+        """Append the next chunk from the socket to the receive buffer."""
+        self._apply_deadline()
+        received = self._socket.recv_into(self._chunk)
+        if received == 0:
+            self._lost_connection()
+        self.bytes_received += received
+        self._receive_buffer += self._chunk[:received]
+
+    def _read_json(self):
+        """Return the value of the next JSON reply.
+
+        JSON replies are not length-prefixed, so the buffer is first parsed
+        once it ends in something that can close a JSON value, which finds
+        replies that arrive in one chunk. If that closing byte turns out to be
+        inside an unfinished reply, a `ValueScanner` tracks where the reply
+        ends from then on, so a large reply is not parsed again after every
+        chunk. Anything after the first complete value is kept for the next
+        reply.
+        """
+        buffer = self._receive_buffer
+        scanner = None
         while True:
-            part = self._socket.recv(self._buffer_size)
-            data += part
-            time.sleep(0.001)
-            if len(part) < self._buffer_size:
-                # either 0 or end of data
-                break
-        log.debug('Received data:\n' + str(data))
-        data_dict = json.loads(data)
-        if self._callback is not None:
-            self._callback(str(data))
-        return data_dict
+            if scanner is None and _ends_json_value(buffer):
+                text = buffer.decode('utf-8')
+                start = json.decoder.WHITESPACE.match(text, 0).end()
+                try:
+                    reply, end = _json_decoder.raw_decode(text, start)
+                except json.JSONDecodeError:
+                    # The closing byte was inside an unfinished reply
+                    scanner = ValueScanner(start)
+                else:
+                    remainder = text[end:]
+                    buffer.clear()
+                    if remainder.strip():
+                        buffer += remainder.encode('utf-8')
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug(f'Received {end - start} characters')
+                    return reply
+            elif scanner is not None:
+                end = scanner.scan(buffer)
+                if end is not None:
+                    reply = json.loads(buffer[:end])
+                    del buffer[:end]
+                    if not buffer.strip():
+                        buffer.clear()
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug(f'Received {end} bytes')
+                    return reply
+            self._fill()
+
+    def _take(self, size: int) -> bytearray:
+        """Return exactly `size` bytes, receiving straight into the result."""
+        data = bytearray(size)
+        view = memoryview(data)
+        filled = min(size, len(self._receive_buffer))
+        view[:filled] = self._receive_buffer[:filled]
+        del self._receive_buffer[:filled]
+        while filled < size:
+            try:
+                self._apply_deadline()
+                received = self._socket.recv_into(view[filled:])
+            except socket.timeout:
+                # Put what did arrive back, so it is read again next time
+                view.release()
+                self._receive_buffer[:0] = data[:filled]
+                raise
+            if received == 0:
+                self._lost_connection()
+            self.bytes_received += received
+            filled += received
+        view.release()
+        return data
+
+
+def _ends_json_value(buffer: bytearray) -> bool:
+    index = len(buffer) - 1
+    while index >= 0 and buffer[index] in _JSON_WHITESPACE:
+        index -= 1
+    return index >= 0 and buffer[index] in _JSON_CLOSING_BYTES
 
 
 class ClientDidNotStartError(ConnectionRefusedError):
@@ -98,3 +438,17 @@ class ClientDidNotStartError(ConnectionRefusedError):
 
     def __init__(self, **kwargs):
         super(ClientDidNotStartError, self).__init__(kwargs)
+
+
+class CommandTimeoutError(TimeoutError):
+    """Raised when the game does not reply to a command in time."""
+
+    def __init__(self, command: str, timeout: float):
+        super(CommandTimeoutError, self).__init__(
+            f'No reply to {command!r} within {timeout:.3g} seconds')
+        self.command = command
+        self.timeout = timeout
+
+
+class GameDisconnectedError(ConnectionError):
+    """Raised when the game closes the connection while a reply is expected."""
@@ -1,15 +1,24 @@
 """Classes for managing the Polycraft Lab installation configuration."""
 import codecs
+import copy
 import json
 import os
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, List
 
 from polycraft_lab.installation import PAL_DEFAULT_PATH
+from polycraft_lab.installation.filelock import FileLock
 
 CONFIG_LAB_SERVER_PORT = 'lab.server.port'
 
 CONFIG_LAB_SERVER_HOST = 'lab.server.host'
 
+CONFIG_LAB_INSTANCE_PORT_RANGE = 'lab.instances.port_range'
+
+DEFAULT_INSTANCE_PORT_RANGE = [9000, 9099]
+
 CONFIG_FILE_NAME = 'lab_config.json'
 
 
@@ -29,6 +38,9 @@ CONFIG_TEMPLATE = '''{
     "server": {
       "host": "127.0.0.1",
       "port": 9000
+    },
+    "instances": {
+      "port_range": [9000, 9099]
     }
   }
 }
@@ -49,7 +61,107 @@ def _init_lab_config(installation_path: Path = PAL_DEFAULT_PATH):
         # TODO: Actually initialize config
 
 
-class PolycraftLabConfig:
+def atomic_write_json(path: Path, data: dict):
+    """Replace the JSON file at `path` without ever exposing a partial file.
+
+    The data is written to a temporary file in the same directory, which is
+    then renamed over the original.
+    """
+    path = Path(path)
+    descriptor, temp_path = tempfile.mkstemp(dir=str(path.parent),
+                                             prefix=f'.{path.name}.',
+                                             suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, str(path))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _set_nested(data: dict, key: str, value):
+    """Set a dotted key like 'lab.server.port' in a nested dict."""
+    *parents, last = key.split('.')
+    for parent in parents:
+        data = data.setdefault(parent, {})
+    data[last] = value
+
+
+class WriteBackConfig:
+    """A config backed by a JSON file, cached in memory and written atomically.
+
+    Values are read from memory. Every change made through `_set` is written to
+    the file straight away, unless it is made inside an `edit()` block, in which
+    case all changes are written together when the block exits. Writes hold a
+    lock on `<file>.lock` and merge into the latest file contents, so processes
+    changing different values of the same file do not overwrite each other.
+
+    Subclasses must set `config` and `_config_path`.
+    """
+
+    config: dict
+    _config_path: Path
+    _pending: Dict[str, object] = None
+
+    @contextmanager
+    def edit(self):
+        """Batch changes into a single atomic write.
+
+        Example:
+            with config.edit() as c:
+                c.lab_server_host = '0.0.0.0'
+                c.lab_server_port = 9001
+
+        If the block raises, nothing is written and the in-memory values are
+        restored.
+        """
+        if self._pending is not None:
+            # Nested edits are part of the outer batch
+            yield self
+            return
+        snapshot = copy.deepcopy(self.config)
+        self._pending = {}
+        try:
+            yield self
+        except BaseException:
+            self.config = snapshot
+            raise
+        finally:
+            changes, self._pending = self._pending, None
+        if changes:
+            self._write(changes)
+
+    @property
+    def lock_path(self) -> Path:
+        return self._config_path.with_name(self._config_path.name + '.lock')
+
+    def _set(self, key: str, value):
+        """Change a dotted config key and write it through to the file."""
+        _set_nested(self.config, key, value)
+        if self._pending is None:
+            self._write({key: value})
+        else:
+            self._pending[key] = value
+
+    def _write(self, changes: Dict[str, object]):
+        with FileLock(self.lock_path):
+            try:
+                with codecs.open(str(self._config_path), 'r',
+                                 encoding='utf-8') as config_file:
+                    data = json.load(config_file)
+            except (OSError, ValueError):
+                # Nothing usable on disk, so the cached copy is authoritative
+                data = copy.deepcopy(self.config)
+            for key, value in changes.items():
+                _set_nested(data, key, value)
+            atomic_write_json(self._config_path, data)
+        self.config = data
+
+
+class PolycraftLabConfig(WriteBackConfig):
     """A wrapper for various Polycraft Lab installation configuration values."""
 
     def __init__(self, config_path: str, create_file=True):
@@ -102,14 +214,7 @@ class PolycraftLabConfig:
     @lab_server_port.setter
     def lab_server_port(self, new_port: int):
         """Set the new Polycraft Lab socket port."""
-        self.config[CONFIG_LAB_SERVER_PORT] = new_port
-        with codecs.open(self._config_path, 'r+',
-                         encoding='utf-8') as config_file:
-            data = json.load(config_file)
-            data['lab']['server']['port'] = new_port
-            config_file.seek(0)
-            json.dump(data, config_file, indent=4)
-            config_file.truncate()
+        self._set(CONFIG_LAB_SERVER_PORT, new_port)
 
     @property
     def lab_server_host(self) -> str:
@@ -121,15 +226,24 @@ class PolycraftLabConfig:
 
     @lab_server_host.setter
     def lab_server_host(self, new_host):
-        """Set the new Polycraft Lab socket port.
+        """Set the new Polycraft Lab socket host.
+
+        Example: '127.0.0.1'
+        """
+        self._set(CONFIG_LAB_SERVER_HOST, new_host)
+
+    @property
+    def instance_port_range(self) -> List[int]:
+        """Return the lowest and highest port game instances may use.
 
-        Example: 9000
+        Example: [9000, 9099]
         """
-        self.config[CONFIG_LAB_SERVER_PORT] = new_host
-        with codecs.open(self._config_path, 'r+',
-                         encoding='utf-8') as config_file:
-            data = json.load(config_file)
-            data['lab']['server']['host'] = new_host
-            config_file.seek(0)
-            json.dump(data, config_file, indent=4)
-            config_file.truncate()
+        instances = self.config['lab'].get('instances', {})
+        return instances.get('port_range', DEFAULT_INSTANCE_PORT_RANGE)
+
+    @instance_port_range.setter
+    def instance_port_range(self, new_range: List[int]):
+        low, high = new_range
+        if not 0 < low <= high < 65536:
+            raise ValueError(f'Invalid port range {low}-{high}')
+        self._set(CONFIG_LAB_INSTANCE_PORT_RANGE, [low, high])
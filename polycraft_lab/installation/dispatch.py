@@ -0,0 +1,249 @@
+"""Hand replies to observers without slowing down the agent loop.
+
+Loggers, recorders and UIs subscribe to the replies of a bridge through its
+`ReplyDispatcher`. Publishing a reply only appends it to the bounded queue of
+each subscription; a worker thread per subscription calls the subscriber, so a
+slow subscriber only falls behind itself, never the step that produced the
+reply or the other subscribers.
+
+What happens when a queue is full is the policy of its subscription:
+
+- `drop_oldest` (default) discards the oldest waiting reply, for observers
+  that only care about recent state, like a UI.
+- `drop_newest` discards the new reply, keeping a contiguous prefix.
+- `block` makes the publisher wait for room, for recorders that must not
+  miss replies, up to `block_timeout` seconds before dropping the reply.
+
+The lag between publishing and delivering each reply, the queue length and the
+number of dropped replies are recorded per subscriber in the metrics registry.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Tuple
+
+from polycraft_lab.monitoring.metrics import SUBSCRIBER_BACKLOG, \
+    SUBSCRIBER_DROPPED, SUBSCRIBER_LAG
+
+log = logging.getLogger('pal').getChild('client').getChild('dispatch')
+
+POLICY_DROP_OLDEST = 'drop_oldest'
+POLICY_DROP_NEWEST = 'drop_newest'
+POLICY_BLOCK = 'block'
+POLICIES = (POLICY_DROP_OLDEST, POLICY_DROP_NEWEST, POLICY_BLOCK)
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_BLOCK_TIMEOUT = 5  # seconds
+DEFAULT_CLOSE_TIMEOUT = 5  # seconds
+
+
+class Subscription:
+    """A subscriber, its queue of replies and the thread that drains it."""
+
+    def __init__(self, callback: Callable[[object], None], name: str,
+                 instance: str, max_size: int = DEFAULT_QUEUE_SIZE,
+                 policy: str = POLICY_DROP_OLDEST,
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT):
+        """
+        Args:
+            callback: Called with each reply on the worker thread
+            name (str): Labels the metrics of the subscriber
+            instance (str): The game instance the replies come from
+            max_size (int): The most replies waiting at once
+            policy (str): What to do with a reply when the queue is full
+            block_timeout (float): How long the `block` policy waits for
+                room, or None to wait as long as it takes
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown policy {policy}, expected one of '
+                             f'{", ".join(POLICIES)}')
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.name = name
+        self.instance = instance
+        self.policy = policy
+        self.max_size = max_size
+        self.block_timeout = block_timeout
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._callback = callback
+        self._queue: Deque[Tuple[float, object]] = deque()
+        self._condition = threading.Condition()
+        self._is_delivering = False
+        self._is_closed = False
+        self._thread: threading.Thread = None
+        self._lag = SUBSCRIBER_LAG.labels(instance=instance, subscriber=name)
+        self._dropped = SUBSCRIBER_DROPPED.labels(instance=instance,
+                                                  subscriber=name)
+        SUBSCRIBER_BACKLOG.labels(instance=instance, subscriber=name) \
+            .set_function(lambda: len(self._queue))
+
+    @property
+    def backlog(self) -> int:
+        """The number of replies waiting to be delivered."""
+        return len(self._queue)
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest waiting reply has been waiting."""
+        try:
+            published, _ = self._queue[0]
+        except IndexError:
+            return 0.0
+        return time.perf_counter() - published
+
+    def put(self, reply, published: float = None):
+        """Queue a reply, applying the policy if the queue is full."""
+        published = time.perf_counter() if published is None else published
+        with self._condition:
+            if self._is_closed:
+                return
+            if len(self._queue) >= self.max_size:
+                if self.policy == POLICY_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._drop()
+                elif self.policy == POLICY_DROP_NEWEST or \
+                        not self._condition.wait_for(self._has_room,
+                                                     self.block_timeout):
+                    self._drop()
+                    return
+                if self._is_closed:
+                    return
+            self._queue.append((published, reply))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True,
+                    name=f'pal-subscriber-{self.name}')
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued reply was delivered.
+
+        Returns:
+            False if the timeout ran out first
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._queue and not self._is_delivering, timeout)
+
+    def close(self, timeout: float = DEFAULT_CLOSE_TIMEOUT):
+        """Deliver the replies already queued, then stop the worker."""
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                log.warning('Subscriber %s did not finish within %s seconds',
+                            self.name, timeout)
+        SUBSCRIBER_BACKLOG.remove(instance=self.instance, subscriber=self.name)
+
+    def _has_room(self) -> bool:
+        return len(self._queue) < self.max_size or self._is_closed
+
+    def _drop(self):
+        self.dropped += 1
+        self._dropped.inc()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._is_delivering = False
+                self._condition.notify_all()
+                self._condition.wait_for(
+                    lambda: self._queue or self._is_closed)
+                if not self._queue:
+                    return
+                published, reply = self._queue.popleft()
+                self._is_delivering = True
+                self._condition.notify_all()
+            self._lag.observe(time.perf_counter() - published)
+            try:
+                self._callback(reply)
+            except Exception:
+                self.errors += 1
+                log.exception('Subscriber %s failed to handle a reply',
+                              self.name)
+            self.delivered += 1
+
+
+class ReplyDispatcher:
+    """Fans the replies of one bridge out to its subscriptions."""
+
+    def __init__(self, instance: str):
+        """
+        Args:
+            instance (str): The game instance the replies come from, used to
+                label metrics
+        """
+        self.instance = instance
+        # Replaced rather than changed, so publishing needs no lock
+        self._subscriptions: Tuple[Subscription, ...] = ()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscriptions)
+
+    @property
+    def subscriptions(self) -> Tuple[Subscription, ...]:
+        return self._subscriptions
+
+    def subscribe(self, callback: Callable[[object], None], name: str = None,
+                  max_size: int = DEFAULT_QUEUE_SIZE,
+                  policy: str = POLICY_DROP_OLDEST,
+                  block_timeout: float = DEFAULT_BLOCK_TIMEOUT
+                  ) -> Subscription:
+        """Call `callback` with every reply, on its own worker thread.
+
+        See `Subscription` for the arguments.
+        """
+        if name is None:
+            name = f'subscriber-{next(self._ids)}'
+        with self._lock:
+            # Before creating the subscription, which takes over the metrics
+            # of its name
+            if any(other.name == name for other in self._subscriptions):
+                raise ValueError(f'A subscriber named {name} already exists')
+            subscription = Subscription(callback, name, self.instance,
+                                        max_size, policy, block_timeout)
+            self._subscriptions += (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription,
+                    timeout: float = DEFAULT_CLOSE_TIMEOUT):
+        """Stop delivering replies to a subscriber once its queue is empty."""
+        with self._lock:
+            self._subscriptions = tuple(
+                other for other in self._subscriptions
+                if other is not subscription)
+        subscription.close(timeout)
+
+    def publish(self, reply):
+        """Queue a reply for every subscriber."""
+        published = time.perf_counter()
+        for subscription in self._subscriptions:
+            subscription.put(reply, published)
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every subscriber has handled the published replies."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for subscription in self._subscriptions:
+            remaining = None if deadline is None else \
+                max(0.0, deadline - time.monotonic())
+            if not subscription.flush(remaining):
+                return False
+        return True
+
+    def close(self, timeout: float = DEFAULT_CLOSE_TIMEOUT):
+        """Deliver queued replies and stop every subscriber."""
+        with self._lock:
+            subscriptions, self._subscriptions = self._subscriptions, ()
+        for subscription in subscriptions:
+            subscription.close(timeout)
@@ -9,7 +9,8 @@ import urllib
 from pathlib import Path
 from urllib import request
 from urllib.error import URLError
-from zipfile import ZipFile
+from typing import Callable, List
+from zipfile import ZipFile, ZipInfo
 
 from tqdm import tqdm
 
@@ -20,6 +21,8 @@ REPO_URL = 'https://github.com/StephenGss/polycraft/archive/master.zip'
 
 MOD_ZIP_NAME = 'polycraft-world-bundle.zip'
 
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
 log = logging.getLogger('pal').getChild('installer')
 
 
@@ -115,6 +118,101 @@ def _extract_polycraft(bundle_path: str, dest_dir: str,
         shutil.rmtree(PAL_TEMP_PATH)
 
 
+def download_file(url: str, output_path: Path,
+                  on_progress: Callable[[int, int], None] = None):
+    """Download `url` in chunks, reporting progress after each one.
+
+    The file is written next to `output_path` and moved into place once it is
+    complete, so an interrupted download never leaves a partial file behind.
+
+    Args:
+        url (str): What to download
+        output_path (Path): Where the file is saved
+        on_progress: Called with the bytes downloaded so far and the total
+            size, or None if the server did not send it. Exceptions it raises
+            stop the download.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_name(output_path.name + '.part')
+    try:
+        with request.urlopen(url) as response, temp_path.open('wb') as file:
+            total = response.headers.get('Content-Length')
+            total = int(total) if total else None
+            downloaded = 0
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+                downloaded += len(chunk)
+                if on_progress is not None:
+                    on_progress(downloaded, total)
+        os.replace(temp_path, output_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def extract_bundle(bundle_path: Path, destination: Path,
+                   select: Callable[[str], bool] = None,
+                   on_progress: Callable[[int, int], None] = None):
+    """Extract a GitHub release zip without its top-level directory.
+
+    Args:
+        bundle_path (Path): The zip file
+        destination (Path): Where its contents are extracted
+        select: Only extract the paths, relative to the top-level directory,
+            for which this returns True
+        on_progress: Called with the number of entries handled so far and
+            the total
+    """
+    destination = Path(destination).resolve()
+    with ZipFile(bundle_path, 'r') as bundle:
+        members = bundle.infolist()
+        prefix = _bundle_prefix(members)
+        for index, member in enumerate(members, start=1):
+            relative = _strip_prefix(member.filename, prefix)
+            if relative and (select is None or select(relative)):
+                target = (destination / relative).resolve()
+                if destination not in target.parents:
+                    raise PolycraftDownloadError(
+                        f'{member.filename} is outside the bundle')
+                if member.is_dir():
+                    target.mkdir(parents=True, exist_ok=True)
+                else:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    with bundle.open(member) as source, \
+                            target.open('wb') as file:
+                        shutil.copyfileobj(source, file)
+                    mode = member.external_attr >> 16
+                    if mode:
+                        os.chmod(target, mode & 0o777)
+            if on_progress is not None:
+                on_progress(index, len(members))
+
+
+def list_bundle(bundle_path: Path) -> List[str]:
+    """Return the files in a GitHub release zip, relative to its top-level
+    directory like `extract_bundle` extracts them."""
+    with ZipFile(bundle_path, 'r') as bundle:
+        members = bundle.infolist()
+    prefix = _bundle_prefix(members)
+    return [_strip_prefix(member.filename, prefix) for member in members
+            if not member.is_dir()]
+
+
+def _bundle_prefix(members: List[ZipInfo]) -> str:
+    # Downloading from GitHub should only have one subdirectory
+    if members and members[0].is_dir():
+        return members[0].filename
+    return ''
+
+
+def _strip_prefix(name: str, prefix: str) -> str:
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
 class PolycraftDownloadError(Exception):
     """Raised when the Polycraft World mod cannot be downloaded.
 
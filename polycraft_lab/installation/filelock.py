@@ -0,0 +1,105 @@
+"""Cross-process locks for files shared between Polycraft Lab processes.
+
+Locks are advisory: every process touching the protected file has to take the
+lock through `FileLock` for it to have any effect.
+"""
+import os
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_LOCK_TIMEOUT = 10  # seconds
+
+_POLL_INTERVAL = 0.01  # seconds
+
+
+class FileLock:
+    """An exclusive lock held on a lock file for the duration of a `with`."""
+
+    def __init__(self, path: str, timeout: float = DEFAULT_LOCK_TIMEOUT):
+        """Create a new lock. It is not acquired until `acquire` is called.
+
+        Args:
+            path (str): The lock file, which is created if it does not exist
+            timeout (float): Seconds to wait for the lock, 0 to only try once,
+                or None to wait forever
+        """
+        self._path = Path(path)
+        self._timeout = timeout
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def is_locked(self) -> bool:
+        return self._file is not None
+
+    def acquire(self):
+        """Block until the lock is held.
+
+        Raises:
+            LockTimeoutError if the lock could not be acquired in time.
+        """
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(str(self._path), 'a+')
+        deadline = None
+        if self._timeout is not None:
+            deadline = time.monotonic() + self._timeout
+        while True:
+            try:
+                _lock(lock_file)
+                self._file = lock_file
+                return
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    lock_file.close()
+                    raise LockTimeoutError(self._path)
+                time.sleep(_POLL_INTERVAL)
+
+    def release(self):
+        """Release the lock if it is held."""
+        if self._file is None:
+            return
+        try:
+            _unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class LockTimeoutError(TimeoutError):
+    """Raised when a file lock could not be acquired in time."""
+
+    def __init__(self, path: Path):
+        super(LockTimeoutError, self).__init__(f'Timed out waiting for {path}')
+        self.path = path
@@ -1,10 +1,22 @@
 import logging
+import os
 import platform
 from pathlib import Path
-from subprocess import PIPE, Popen
+from subprocess import PIPE, STDOUT, Popen
+from typing import List, Optional
+
+from polycraft_lab.installation.instances import PORT_ENVIRONMENT_VARIABLE, \
+    PORT_GRADLE_PROPERTY
+from polycraft_lab.installation.integrity import IntegrityManifest
+from polycraft_lab.installation.logs import LOGS_PATH, LogIngester, LogStore
+from polycraft_lab.installation.placement import ResourceLimits
+from polycraft_lab.monitoring.process import process_tree_rss
 
 log = logging.getLogger('pal').getChild('env').getChild('game')
 
+# How long a restart waits for the output of the previous run to be read
+LOG_DRAIN_TIMEOUT = 5  # seconds
+
 
 class PolycraftGame:
     """A wrapper for a Polycraft game installation.
@@ -13,20 +25,82 @@ class PolycraftGame:
     and maintain a handle on the process.
     """
 
-    def __init__(self, installation_directory: str):
+    def __init__(self, installation_directory: str, port: int = None,
+                 log_directory: Path = LOGS_PATH,
+                 limits: ResourceLimits = None):
+        """
+        Args:
+            installation_directory (str): The Polycraft World mod installation
+            port (int): The port the mod should listen on, passed as the
+                palPort Gradle property and the PAL_PORT environment variable.
+                The mod's default is used when None.
+            log_directory (Path): Where the output of the game is indexed,
+                in a directory per instance named after its port
+            limits (ResourceLimits): The CPUs, priority and memory cap the
+                game is started with, from `plan_placement`
+        """
         self._installation_directory = installation_directory
+        self.port = port
+        self._log_directory = Path(log_directory)
+        self.limits = limits
+        self._logs: Optional[LogIngester] = None
+        # Shared by every run, so restarts never write one segment twice
+        self._log_store: Optional[LogStore] = None
         # noinspection PyTypeChecker
         self._process: Popen = None
         self.check_installed()
 
     def check_installed(self):
-        # TODO: Find more robust way of doing this
+        """Quickly verify the installation before the game is started.
+
+        Installations without an integrity manifest, such as checkouts of the
+        mod, are only checked for gradlew.
+
+        Raises:
+            ClientNotInitializedError: If files are missing or changed
+        """
         if not (Path(self._installation_directory) / 'gradlew').exists():
             raise ClientNotInitializedError
+        manifest = IntegrityManifest.load(self._installation_directory)
+        if manifest is not None:
+            result = manifest.verify()
+            if not result.ok:
+                raise ClientNotInitializedError(
+                    f'{len(result.broken)} installed file(s) are missing or '
+                    f'changed, such as {result.broken[0]}')
 
     @property
     def is_alive(self):
-        return self._process.poll() is None
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def installation_directory(self) -> str:
+        return self._installation_directory
+
+    @property
+    def log_name(self) -> str:
+        """The name of this instance in the logs directory."""
+        return 'game' if self.port is None else f'game-{self.port}'
+
+    def recent_output(self) -> List[str]:
+        """Return the last lines the game printed."""
+        return [] if self._logs is None else list(self._logs.tail)
+
+    @property
+    def pid(self) -> Optional[int]:
+        """The process ID of the running game, or None if not started."""
+        return None if self._process is None else self._process.pid
+
+    def memory_usage(self) -> Optional[int]:
+        """Return the resident memory of the game and its JVM in bytes.
+
+        Returns:
+            0 if the game is not running, or None if memory usage cannot be
+            read on this platform.
+        """
+        if not self.is_alive:
+            return 0
+        return process_tree_rss(self._process.pid)
 
     def start(self):
         """Attempt to start the game.
@@ -44,17 +118,61 @@ class PolycraftGame:
         cwd = Path(self._installation_directory)
         executable_base = str(cwd / gradlew_name)
         log.info('Starting Minecraft... This may also take a bit.')
+        arguments = [executable_base, 'runClient']
+        environment = None
+        if self.port is not None:
+            arguments.append(f'-P{PORT_GRADLE_PROPERTY}={self.port}')
+            environment = dict(os.environ)
+            environment[PORT_ENVIRONMENT_VARIABLE] = str(self.port)
+
+        prefix = None
+        if self.limits is not None and not self.limits.is_empty:
+            prefix = self.limits.command_prefix()
+            if prefix is None:
+                log.debug('Limiting the game after it starts, as taskset, '
+                          'nice or prlimit is missing')
+            else:
+                arguments = prefix + arguments
 
         # This should be the last thing
         self._process = Popen(
-            [executable_base, 'runClient'],
+            arguments,
             stdout=PIPE,
+            stderr=STDOUT,
             # shell=True,
             # close_fds=False,
             cwd=cwd,
+            env=environment,
         )
+        if self.limits is not None and not self.limits.is_empty and \
+                prefix is None:
+            try:
+                self.limits.apply_to_tree(self._process.pid)
+            except OSError as e:
+                log.warning('Could not apply %s to the game: %s',
+                            self.limits, e)
+        # Reading the output keeps the pipe from filling up and blocking
+        self._drain_logs()
+        if self._log_store is None or \
+                self._log_store.instance != self.log_name:
+            self._log_store = LogStore(self._log_directory / self.log_name)
+        self._logs = LogIngester(self._process.stdout,
+                                 self._log_store).start()
         log.debug('Polycraft client started')
 
+    def _drain_logs(self):
+        """Let the ingester of the previous run read the rest of its output.
+
+        It may outlive the timeout if a leftover JVM holds the pipe open. It
+        then keeps writing through the same store, which serializes the two.
+        """
+        if self._logs is None:
+            return
+        self._logs.join(LOG_DRAIN_TIMEOUT)
+        if self._logs.is_running:
+            log.warning('Output of the previous run of %s is still being '
+                        'read', self.log_name)
+
     def stop(self):
         if self._process is None or not self.is_alive:
             return
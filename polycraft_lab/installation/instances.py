@@ -0,0 +1,212 @@
+"""Port allocation and a registry of the game instances running on this host.
+
+Every game instance listens on its own port from the configured range. A port
+is reserved by holding an exclusive lock on `port-<port>.lock` in the
+instances directory, which the operating system releases when the holding
+process exits, even if it crashes. Before a port is handed out it is also
+checked by binding to it, so ports used by unrelated programs are skipped.
+
+Allocators never wait for each other: a port whose lock is taken is skipped,
+so many environments can start on one host at the same time.
+
+While an instance runs, a JSON record of its pid, port and installation sits
+next to its lock file, so every PAL process on the host can list it.
+"""
+import json
+import logging
+import os
+import socket
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from polycraft_lab.installation import PAL_DEFAULT_PATH
+from polycraft_lab.installation.config import atomic_write_json
+from polycraft_lab.installation.filelock import FileLock, LockTimeoutError
+
+log = logging.getLogger('pal').getChild('client').getChild('instances')
+
+INSTANCES_PATH = PAL_DEFAULT_PATH / 'instances'
+DEFAULT_PORT_RANGE = (9000, 9099)  # inclusive
+
+# How the allocated port is passed to the mod when the game is launched
+PORT_ENVIRONMENT_VARIABLE = 'PAL_PORT'
+PORT_GRADLE_PROPERTY = 'palPort'
+
+
+class PortReservation:
+    """A port held for one game instance until it is released.
+
+    Attributes:
+        host (str): The interface the port was checked on
+        port (int): The reserved port
+    """
+
+    def __init__(self, host: str, port: int, lock: FileLock,
+                 directory: Path):
+        self.host = host
+        self.port = port
+        self._lock = lock
+        self._record_path = directory / f'instance-{port}.json'
+
+    @property
+    def is_held(self) -> bool:
+        return self._lock.is_locked
+
+    def acquire(self):
+        """Take the port again after it was released.
+
+        Raises:
+            PortUnavailableError: If another process took the port meanwhile
+        """
+        if self.is_held:
+            return
+        try:
+            self._lock.acquire()
+        except LockTimeoutError:
+            raise PortUnavailableError(f'Port {self.port} is already in use')
+
+    def register(self, pid: int, installation: str):
+        """Record the instance running on this port for other processes."""
+        atomic_write_json(self._record_path, {
+            'host': self.host,
+            'port': self.port,
+            'pid': pid,
+            'owner_pid': os.getpid(),
+            'installation': str(installation),
+            'started_at': time.time(),
+        })
+
+    def release(self):
+        """Forget the instance record and free the port."""
+        if not self.is_held:
+            return
+        try:
+            self._record_path.unlink()
+        except FileNotFoundError:
+            pass
+        self._lock.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class PortAllocator:
+    """Hands out free ports from a range, safely across processes."""
+
+    def __init__(self, port_range: Sequence[int] = DEFAULT_PORT_RANGE,
+                 host: str = '127.0.0.1', directory: Path = INSTANCES_PATH):
+        """
+        Args:
+            port_range: The lowest and highest port to use, inclusive
+            host (str): The interface games listen on
+            directory (Path): Where lock files and instance records are kept
+        """
+        low, high = port_range
+        if not 0 < low <= high < 65536:
+            raise ValueError(f'Invalid port range {low}-{high}')
+        self.port_range: Tuple[int, int] = (low, high)
+        self.host = host
+        self.directory = Path(directory)
+
+    def allocate(self) -> PortReservation:
+        """Reserve the lowest free port in the range.
+
+        Raises:
+            PortUnavailableError: If every port in the range is taken
+        """
+        low, high = self.port_range
+        for port in range(low, high + 1):
+            reservation = self._try_reserve(port)
+            if reservation is not None:
+                log.debug('Allocated port %s', port)
+                return reservation
+        raise PortUnavailableError(
+            f'No free port between {low} and {high}')
+
+    def reserve(self, port: int) -> PortReservation:
+        """Reserve a specific port, which may be outside the range.
+
+        Raises:
+            PortUnavailableError: If the port is already in use
+        """
+        reservation = self._try_reserve(port)
+        if reservation is None:
+            raise PortUnavailableError(f'Port {port} is already in use')
+        return reservation
+
+    def _try_reserve(self, port: int) -> Optional[PortReservation]:
+        lock = FileLock(str(self.directory / f'port-{port}.lock'), timeout=0)
+        try:
+            lock.acquire()
+        except LockTimeoutError:
+            return None  # Reserved by another PAL process
+        if not _is_bindable(self.host, port):
+            lock.release()  # Taken by something outside PAL
+            return None
+        return PortReservation(self.host, port, lock, self.directory)
+
+
+class InstanceRegistry:
+    """Lists the game instances PAL processes are running on this host."""
+
+    def __init__(self, directory: Path = INSTANCES_PATH):
+        self.directory = Path(directory)
+
+    def instances(self) -> List[dict]:
+        """Return the record of every running instance, ordered by port.
+
+        Records left behind by processes that exited without releasing their
+        port are removed.
+        """
+        running = []
+        for record_path in sorted(self.directory.glob('instance-*.json')):
+            try:
+                with record_path.open(encoding='utf-8') as file:
+                    record = json.load(file)
+            except (OSError, ValueError):
+                continue
+            if self._is_reserved(record['port']):
+                running.append(record)
+            else:
+                log.debug('Removing stale instance record %s', record_path)
+                try:
+                    record_path.unlink()
+                except FileNotFoundError:
+                    pass
+        return sorted(running, key=lambda record: record['port'])
+
+    def find(self, port: int) -> Optional[dict]:
+        for record in self.instances():
+            if record['port'] == port:
+                return record
+        return None
+
+    def _is_reserved(self, port: int) -> bool:
+        lock = FileLock(str(self.directory / f'port-{port}.lock'), timeout=0)
+        try:
+            lock.acquire()
+        except LockTimeoutError:
+            return True
+        lock.release()
+        return False
+
+
+def _is_bindable(host: str, port: int) -> bool:
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        # Match how servers bind, so ports in TIME_WAIT still count as free
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        probe.bind((host, port))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class PortUnavailableError(OSError):
+    """Raised when no port can be reserved for a game instance."""
@@ -0,0 +1,242 @@
+"""A manifest of the installed mod files, to detect and repair broken installs.
+
+Once the mod is extracted, the size, modification time and SHA-256 hash of
+every file from the release bundle is recorded in `.pal_manifest.json` in the
+mod directory. The bundle itself is kept in the installation's cache.
+
+An installation can then be verified in two ways:
+
+- Quick verification stats every file. Files that are missing or changed size
+  are broken. Files whose modification time changed are hashed, and their new
+  time is recorded if the contents are intact, so the next check is a stat
+  again.
+- Thorough verification hashes every file, on a pool of threads.
+
+Broken files are repaired by extracting just those files from the cached
+bundle, instead of installing everything again.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from polycraft_lab.installation.config import atomic_write_json
+from polycraft_lab.installation.download import extract_bundle
+
+log = logging.getLogger('pal').getChild('installer').getChild('integrity')
+
+INTEGRITY_MANIFEST_NAME = '.pal_manifest.json'
+INTEGRITY_FORMAT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1 << 20
+# Hashing releases the GIL, so threads hash files in parallel
+DEFAULT_HASH_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+def file_digest(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VerificationResult:
+    """What a verification found.
+
+    Attributes:
+        missing (list): Files that no longer exist
+        corrupted (list): Files whose size or contents changed
+        checked (int): How many files were checked
+        hashed (int): How many of them had to be hashed
+        elapsed (float): How long the verification took in seconds
+    """
+
+    def __init__(self, missing: List[str], corrupted: List[str], checked: int,
+                 hashed: int, elapsed: float):
+        self.missing = missing
+        self.corrupted = corrupted
+        self.checked = checked
+        self.hashed = hashed
+        self.elapsed = elapsed
+
+    @property
+    def broken(self) -> List[str]:
+        return sorted(self.missing + self.corrupted)
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing and not self.corrupted
+
+    def __repr__(self):
+        return (f'VerificationResult(missing={len(self.missing)}, '
+                f'corrupted={len(self.corrupted)}, checked={self.checked})')
+
+
+class IntegrityManifest:
+    """The recorded state of every file extracted from the release bundle."""
+
+    def __init__(self, root: Path, files: Dict[str, dict] = None,
+                 bundle: str = None, release: str = None):
+        """
+        Args:
+            root (Path): The mod directory the files are relative to
+            files: The size, mtime_ns and sha256 of each file, by its
+                relative POSIX path
+            bundle (str): The cached release bundle, to repair files from
+            release (str): The installed release version
+        """
+        self.root = Path(root)
+        self.files: Dict[str, dict] = files or {}
+        self.bundle = bundle
+        self.release = release
+
+    @property
+    def path(self) -> Path:
+        return self.root / INTEGRITY_MANIFEST_NAME
+
+    @classmethod
+    def load(cls, root: Path) -> Optional['IntegrityManifest']:
+        """Return the manifest of the mod at `root`, or None if it has none."""
+        try:
+            with (Path(root) / INTEGRITY_MANIFEST_NAME).open(
+                    encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != INTEGRITY_FORMAT_VERSION:
+            return None
+        return cls(root, data['files'], data.get('bundle'),
+                   data.get('release'))
+
+    @classmethod
+    def record(cls, root: Path, paths: Iterable[str], bundle: str = None,
+               release: str = None,
+               workers: int = DEFAULT_HASH_WORKERS) -> 'IntegrityManifest':
+        """Hash the files at `paths` and return their manifest, unsaved."""
+        manifest = cls(root, bundle=bundle, release=release)
+        manifest.update(paths, workers)
+        return manifest
+
+    def save(self):
+        atomic_write_json(self.path, {
+            'version': INTEGRITY_FORMAT_VERSION,
+            'release': self.release,
+            'bundle': self.bundle,
+            'files': self.files,
+        })
+
+    def update(self, paths: Iterable[str],
+               workers: int = DEFAULT_HASH_WORKERS):
+        """Record the current state of the files at `paths`."""
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, record in zip(paths, pool.map(self._describe, paths)):
+                self.files[path] = record
+
+    def verify(self, thorough: bool = False,
+               workers: int = DEFAULT_HASH_WORKERS) -> VerificationResult:
+        """Check every file against the manifest.
+
+        Args:
+            thorough (bool): Hash every file, instead of only those whose
+                modification time changed
+            workers (int): How many threads hash files
+        """
+        started = time.perf_counter()
+        missing, corrupted, to_hash = [], [], []
+        for path, record in self.files.items():
+            try:
+                stat = os.stat(self.root / path)
+            except FileNotFoundError:
+                missing.append(path)
+                continue
+            if stat.st_size != record['size']:
+                corrupted.append(path)
+            elif thorough or stat.st_mtime_ns != record['mtime_ns']:
+                to_hash.append((path, stat.st_mtime_ns))
+
+        refreshed = False
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = pool.map(self._digest_or_none,
+                               [path for path, _ in to_hash])
+            for (path, mtime_ns), digest in zip(to_hash, digests):
+                record = self.files[path]
+                if digest is None:
+                    missing.append(path)
+                elif digest != record['sha256']:
+                    corrupted.append(path)
+                elif mtime_ns != record['mtime_ns']:
+                    # Touched but intact, so a stat is enough next time
+                    record['mtime_ns'] = mtime_ns
+                    refreshed = True
+        if refreshed:
+            try:
+                self.save()
+            except OSError as e:
+                log.debug('Could not update the integrity manifest: %s', e)
+
+        result = VerificationResult(sorted(missing), sorted(corrupted),
+                                    len(self.files), len(to_hash),
+                                    time.perf_counter() - started)
+        log.debug('Verified %s in %.3fs', result, result.elapsed)
+        return result
+
+    def repair(self, paths: Iterable[str],
+               workers: int = DEFAULT_HASH_WORKERS):
+        """Extract the files at `paths` from the cached bundle again.
+
+        Raises:
+            InstallationCorruptedError: If the bundle is gone, or the files it
+                holds do not match the manifest either
+        """
+        paths = set(paths)
+        if not paths:
+            return
+        if not self.bundle or not Path(self.bundle).exists():
+            raise InstallationCorruptedError(
+                'The release bundle to repair from is not cached', paths)
+        log.info('Repairing %d file(s) from %s', len(paths), self.bundle)
+        expected = {path: self.files[path]['sha256'] for path in paths}
+        extract_bundle(Path(self.bundle), self.root, paths.__contains__)
+        self.update(paths, workers)
+        still_broken = sorted(path for path in paths
+                              if self.files[path]['sha256'] != expected[path])
+        if still_broken:
+            for path in still_broken:
+                self.files[path]['sha256'] = expected[path]
+            raise InstallationCorruptedError(
+                'The cached release bundle does not match the manifest',
+                still_broken)
+        self.save()
+
+    def _describe(self, path: str) -> dict:
+        full_path = self.root / path
+        stat = os.stat(full_path)
+        return {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_digest(full_path),
+        }
+
+    def _digest_or_none(self, path: str) -> Optional[str]:
+        try:
+            return file_digest(self.root / path)
+        except FileNotFoundError:
+            return None
+
+
+class InstallationCorruptedError(Exception):
+    """Raised when installed files are broken and cannot be repaired."""
+
+    def __init__(self, message: str, paths: Iterable[str]):
+        paths = sorted(paths)
+        super(InstallationCorruptedError, self).__init__(
+            f'{message}: {", ".join(paths[:10])}'
+            f'{" and more" if len(paths) > 10 else ""}')
+        self.paths = paths
@@ -0,0 +1,379 @@
+"""Ingest the output of game instances into a searchable on-disk log index.
+
+The game writes its log to stdout. A `LogIngester` reads it on a background
+thread, so the pipe never fills up and blocks the game, and parses each line
+into a compact record with its time, level, thread, source and message. Lines
+that match known mod events, such as exceptions, crash reports or missions
+being loaded, are tagged with the event type.
+
+Records are appended to `current.jsonl` in a directory per instance. Once the
+file grows past `SEGMENT_MAX_BYTES`, or the game exits, it is compressed into
+a gzip segment and summarized in `index.json`: the time range of the segment
+and how many records of each level and event it holds. Searches read the index
+first and only open segments that can contain matches, so looking for the
+exceptions of the last hour does not decompress days of logs. The oldest
+segments are deleted once an instance has more than `MAX_SEGMENTS`.
+"""
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+from polycraft_lab.installation import PAL_DEFAULT_PATH
+from polycraft_lab.installation.config import atomic_write_json
+
+log = logging.getLogger('pal').getChild('client').getChild('logs')
+
+LOGS_PATH = PAL_DEFAULT_PATH / 'logs'
+
+INDEX_FILE_NAME = 'index.json'
+CURRENT_SEGMENT_NAME = 'current.jsonl'
+INDEX_FORMAT_VERSION = 1
+
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+MAX_SEGMENTS = 32
+TAIL_LINES = 200
+
+EVENT_EXCEPTION = 'exception'
+EVENT_CRASH = 'crash'
+EVENT_MISSION = 'mission'
+EVENT_CONNECTION = 'connection'
+EVENT_BUILD_FAILED = 'build_failed'
+EVENT_PAL = 'pal'
+
+# The first pattern a message matches decides its event type
+EVENT_PATTERNS = [
+    (EVENT_CRASH, re.compile(r'---- Minecraft Crash Report ----|'
+                             r'crash report has been saved')),
+    (EVENT_EXCEPTION, re.compile(r'^(Caused by: )?[\w.$]+(Exception|Error)'
+                                 r'(: |$)|^\s+at [\w.$]+\(')),
+    (EVENT_BUILD_FAILED, re.compile(r'^BUILD FAILED|^FAILURE: ')),
+    (EVENT_MISSION, re.compile(r'\b(RESET|PRELOAD|LOAD_STATE)\b|'
+                               r'[Ll]oading mission')),
+    (EVENT_CONNECTION, re.compile(r'[Cc]lient (connected|disconnected)|'
+                                  r'[Ll]istening on port')),
+    (EVENT_PAL, re.compile(r'^\[PAL\]')),
+]
+
+# [12:34:56] [Client thread/INFO] [FML]: message
+_LINE = re.compile(r'^\[(?P<clock>\d\d:\d\d:\d\d)\] '
+                   r'\[(?P<thread>[^\]/]*)/(?P<level>[A-Z]+)\]'
+                   r'(?: \[(?P<source>[^\]]*)\])?: (?P<message>.*)$')
+
+# Short keys keep segments small
+_KEYS = {'t': 'time', 'l': 'level', 'th': 'thread', 's': 'source',
+         'e': 'event', 'm': 'message'}
+
+
+def parse_line(line: str, previous_level: str = None) -> dict:
+    """Parse one line of game output into a compact record.
+
+    Lines that are not in the Minecraft log format, such as stack traces, keep
+    the level of the line before them.
+    """
+    record = {'t': round(time.time(), 3)}
+    match = _LINE.match(line)
+    if match:
+        record['l'] = match.group('level')
+        record['th'] = match.group('thread')
+        if match.group('source'):
+            record['s'] = match.group('source')
+        message = match.group('message')
+    else:
+        if previous_level:
+            record['l'] = previous_level
+        message = line
+    for event, pattern in EVENT_PATTERNS:
+        if pattern.search(message):
+            record['e'] = event
+            break
+    record['m'] = message
+    return record
+
+
+class LogStore:
+    """The rotated, compressed log segments of one game instance."""
+
+    def __init__(self, directory: Path, max_bytes: int = SEGMENT_MAX_BYTES,
+                 max_segments: int = MAX_SEGMENTS):
+        """
+        Args:
+            directory (Path): Where the segments and index of the instance are
+            max_bytes (int): Size at which the current segment is compressed
+            max_segments (int): How many compressed segments are kept
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self._file = None
+        self._summary: Optional[dict] = None
+        self._lock = threading.Lock()
+
+    @property
+    def instance(self) -> str:
+        return self.directory.name
+
+    def append(self, record: dict):
+        """Add a record from `parse_line` to the current segment."""
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            _summarize(self._summary, record)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """Compress the current segment."""
+        with self._lock:
+            if self._file is not None:
+                self._rotate()
+
+    def segments(self) -> List[dict]:
+        """Return the summaries of the compressed segments, oldest first."""
+        try:
+            with (self.directory / INDEX_FILE_NAME).open(
+                    encoding='utf-8') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return []
+        if index.get('version') != INDEX_FORMAT_VERSION:
+            return []
+        return index['segments']
+
+    def query(self, since: float = None, until: float = None,
+              events: Iterable[str] = None, levels: Iterable[str] = None,
+              contains: str = None) -> Iterator[dict]:
+        """Yield the records matching every given filter, oldest first.
+
+        Args:
+            since (float): Only records at or after this Unix time
+            until (float): Only records at or before this Unix time
+            events: Only records tagged with one of these event types
+            levels: Only records with one of these levels
+            contains (str): Only records whose message contains this text
+        """
+        events = set(events) if events else None
+        levels = set(levels) if levels else None
+        paths = [self.directory / segment['file']
+                 for segment in self.segments()
+                 if _may_match(segment, since, until, events, levels)]
+        paths.append(self.directory / CURRENT_SEGMENT_NAME)
+        for path in paths:
+            for record in _read_segment(path):
+                t = record['t']
+                if (since is not None and t < since) or \
+                        (until is not None and t > until):
+                    continue
+                if events is not None and record.get('e') not in events:
+                    continue
+                if levels is not None and record.get('l') not in levels:
+                    continue
+                if contains is not None and contains not in record['m']:
+                    continue
+                yield _expand(record, self.instance)
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        current = self.directory / CURRENT_SEGMENT_NAME
+        if current.exists():
+            # Left behind by a process that did not exit cleanly
+            self._summary = _new_summary()
+            for record in _read_segment(current):
+                _summarize(self._summary, record)
+            self._file = current.open('a', encoding='utf-8')
+            self._rotate()
+        self._summary = _new_summary()
+        self._file = current.open('a', encoding='utf-8')
+
+    def _rotate(self):
+        """Compress the current segment and add it to the index."""
+        self._file.close()
+        self._file = None
+        current = self.directory / CURRENT_SEGMENT_NAME
+        summary = self._summary
+        if summary['records'] == 0:
+            current.unlink()
+            return
+        segments = self.segments()
+        serial = segments[-1]['serial'] + 1 if segments else 0
+        name = f'segment-{serial:06d}-{int(summary["start"])}.jsonl.gz'
+        with current.open('rb') as source, \
+                gzip.open(self.directory / name, 'wb') as target:
+            target.writelines(source)
+        current.unlink()
+        summary['file'] = name
+        summary['serial'] = serial
+        segments.append(summary)
+        for stale in segments[:-self.max_segments]:
+            try:
+                (self.directory / stale['file']).unlink()
+            except FileNotFoundError:
+                pass
+        atomic_write_json(self.directory / INDEX_FILE_NAME, {
+            'version': INDEX_FORMAT_VERSION,
+            'segments': segments[-self.max_segments:],
+        })
+
+
+class LogIngester:
+    """Reads the output of a game on a background thread into a LogStore."""
+
+    def __init__(self, stream: BinaryIO, store: LogStore,
+                 tail_lines: int = TAIL_LINES):
+        """
+        Args:
+            stream: The stdout of the game, read until it closes
+            store (LogStore): Where records are written
+            tail_lines (int): How many recent lines to keep in memory
+        """
+        self.store = store
+        self.tail = deque(maxlen=tail_lines)
+        self.lines_read = 0
+        self._stream = stream
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f'pal-logs-{store.instance}')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def join(self, timeout: float = None):
+        self._thread.join(timeout)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        level = None
+        try:
+            for raw_line in iter(self._stream.readline, b''):
+                line = raw_line.decode('utf-8', errors='replace').rstrip()
+                if not line:
+                    continue
+                self.lines_read += 1
+                self.tail.append(line)
+                record = parse_line(line, level)
+                level = record.get('l', level)
+                self.store.append(record)
+                if record.get('e') in (EVENT_EXCEPTION, EVENT_CRASH):
+                    self.store.flush()
+        except (OSError, ValueError) as e:
+            log.debug('Stopped reading game output: %s', e)
+        finally:
+            self.store.close()
+
+
+def instance_stores(directory: Path = LOGS_PATH) -> List[LogStore]:
+    """Return the log store of every instance that has logs."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    return [LogStore(path) for path in sorted(directory.iterdir())
+            if path.is_dir()]
+
+
+def search_logs(directory: Path = LOGS_PATH, instances: Iterable[str] = None,
+                limit: int = None, **filters) -> List[dict]:
+    """Return matching records across instances, sorted by time.
+
+    Args:
+        directory (Path): The logs directory
+        instances: The instances to search, all of them by default
+        limit (int): Only return the latest `limit` records
+        **filters: Passed to `LogStore.query`
+    """
+    instances = set(instances) if instances else None
+    records = []
+    for store in instance_stores(directory):
+        if instances is None or store.instance in instances:
+            records.extend(store.query(**filters))
+    records.sort(key=lambda record: record['time'])
+    if limit is not None:
+        records = records[-limit:] if limit > 0 else []
+    return records
+
+
+def parse_time(value, now: float = None) -> float:
+    """Turn a time given on the command line into a Unix time.
+
+    Accepts Unix times, ISO 8601 dates and durations before now such as 30s,
+    10m, 2h or 1d.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    now = time.time() if now is None else now
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd])', str(value).strip())
+    if match:
+        return now - float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def _new_summary() -> dict:
+    return {'start': None, 'end': None, 'records': 0, 'levels': {},
+            'events': {}}
+
+
+def _summarize(summary: dict, record: dict):
+    t = record['t']
+    if summary['start'] is None:
+        summary['start'] = t
+    summary['end'] = t
+    summary['records'] += 1
+    level = record.get('l')
+    if level:
+        summary['levels'][level] = summary['levels'].get(level, 0) + 1
+    event = record.get('e')
+    if event:
+        summary['events'][event] = summary['events'].get(event, 0) + 1
+
+
+def _may_match(segment: dict, since: Optional[float], until: Optional[float],
+               events: Optional[set], levels: Optional[set]) -> bool:
+    if since is not None and segment['end'] < since:
+        return False
+    if until is not None and segment['start'] > until:
+        return False
+    if events is not None and not events & segment['events'].keys():
+        return False
+    if levels is not None and not levels & segment['levels'].keys():
+        return False
+    return True
+
+
+def _read_segment(path: Path) -> Iterator[dict]:
+    opener = gzip.open if path.suffix == '.gz' else open
+    try:
+        with opener(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+    except FileNotFoundError:
+        return
+
+
+def _expand(record: dict, instance: str) -> Dict[str, object]:
+    expanded = {name: record.get(key) for key, name in _KEYS.items()}
+    expanded['instance'] = instance
+    return expanded
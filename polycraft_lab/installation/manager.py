@@ -2,18 +2,49 @@
 import logging
 import os
 import platform
+import re
 import shutil
 import stat
 import subprocess
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from pathlib import Path
+from typing import Callable, Iterable
+from urllib.error import URLError
 
 from polycraft_lab.installation import PAL_DEFAULT_PATH, PAL_LAB_DIR_NAME, \
-    PAL_MOD_DIR_NAME
-from polycraft_lab.installation.download import download_and_extract_polycraft
-from polycraft_lab.installation.releases import UnknownVersionError, get_release
+    PAL_MOD_DIR_NAME, PAL_TEMP_PATH
+from polycraft_lab.installation.download import MOD_ZIP_NAME, \
+    PolycraftDownloadError, download_file, extract_bundle, list_bundle
+from polycraft_lab.installation.integrity import IntegrityManifest, \
+    InstallationCorruptedError, VerificationResult
+from polycraft_lab.installation.pipeline import InstallPipeline, \
+    InstallStage, StageContext, StageEvent
+from polycraft_lab.installation.releases import PolycraftWorldRelease, \
+    UnknownVersionError, prefetch_release
 
 log = logging.getLogger('pal').getChild('installer')
 
+# Files Gradle needs to set up the workspace, which are extracted first so
+# setupDecompWorkspace can run while the rest of the mod is extracted
+BUILD_FILE_NAMES = frozenset(['gradlew', 'gradlew.bat', 'build.gradle',
+                              'settings.gradle', 'gradle.properties'])
+BUILD_FILE_DIRECTORY = 'gradle/'
+ACCESS_TRANSFORMER_SUFFIX = '_at.cfg'
+
+STAGE_RELEASE = 'release'
+STAGE_DOWNLOAD = 'download'
+STAGE_EXTRACT_BUILD_FILES = 'extract_build_files'
+STAGE_EXTRACT = 'extract'
+STAGE_SETUP = 'setup'
+STAGE_BUILD = 'build'
+STAGE_MANIFEST = 'manifest'
+
+# Where release bundles are kept to repair installations, in the installation
+BUNDLE_CACHE_DIR_NAME = 'bundles'
+
+# Seconds between checks for cancellation while waiting for the release
+_RELEASE_POLL_INTERVAL = 0.2
+
 
 class PolycraftInstallation:
     """A module that manages the Polycraft Lab installation."""
@@ -27,14 +58,15 @@ class PolycraftInstallation:
 
     @property
     def is_installed(self):
-        """Currently checks if the game has been built."""
-        # TODO: Perform a more thorough check of installation, maybe also with a hash
-        # TODO: Find a way to automate ensuring Polycraft is installed
+        """Check the mod was extracted completely and its files are intact.
+
+        The integrity manifest is only written once every file is extracted
+        and the mod was built, so an interrupted or failed installation never
+        counts as installed.
+        """
         # TODO: Differentiate between if client is installed vs installed and built
-        return (Path(
-            self._installation_directory) / PAL_MOD_DIR_NAME
-                # / 'build'
-                ).exists()
+        manifest = IntegrityManifest.load(self.client_location)
+        return manifest is not None and manifest.verify().ok
 
     @property
     def location(self):
@@ -50,26 +82,33 @@ class PolycraftInstallation:
         """
         return str(Path(self._installation_directory) / PAL_MOD_DIR_NAME)
 
-    def install(self, force_install: bool = False, version: str = 'newest'):
+    def install(self, force_install: bool = False, version: str = 'newest',
+                release: Future = None,
+                on_progress: Callable[[StageEvent], None] = None):
         """Installs and builds a development version of Minecraft.
 
+        Installation runs as a pipeline of stages, see `install_pipeline`.
+
         Args:
             force_install (bool): Will overwrite the existing Polycraft World
                 installation when True, False by default.
             version (str): The version of Polycraft World to install.
+            release (Future): The release to install, already being fetched
+                with `prefetch_release`. Fetched when the install starts if
+                omitted.
+            on_progress: Called with the progress of every stage
 
         Raises:
             UnknownVersionError when the given version does not exist.
+            InstallationCancelledError if the installation was cancelled, for
+                example with Ctrl + C.
         """
         # TODO: Allow specific version of mod to be chosen
         if not self.is_installed or force_install:
             if force_install:
                 log.info('Forcing re-installation of Polycraft World')
             try:
-                log.debug('Now downloading Polycraft')
-                self._download_polycraft(version)
-                log.debug('Launching setup...')
-                self._run_setup()
+                self.install_pipeline(version, release, on_progress).run()
             except UnknownVersionError:
                 log.exception(
                     'Attempted to install unknown version of Polycraft: %s',
@@ -89,36 +128,171 @@ class PolycraftInstallation:
                 'so not installing mod.')
             return
 
+    def install_pipeline(self, version: str = 'newest', release: Future = None,
+                         on_progress: Callable[[StageEvent], None] = None,
+                         download_directory: str = PAL_TEMP_PATH
+                         ) -> InstallPipeline:
+        """Return the stages that install Polycraft World, ready to run.
+
+        The Gradle build files are extracted before the rest of the mod, so
+        setupDecompWorkspace, which downloads Minecraft and the Gradle
+        dependencies, runs while the remaining sources are extracted. The
+        build starts once both are done.
+
+        Args:
+            version (str): The version of Polycraft World to install
+            release (Future): The release, if it is already being fetched
+            on_progress: Called with the progress of every stage
+            download_directory (str): Where the mod is downloaded to
+        """
+        bundle_path = Path(download_directory) / MOD_ZIP_NAME
+
+        def fetch_release(context: StageContext) -> PolycraftWorldRelease:
+            future = release if release is not None \
+                else prefetch_release(version)
+            while True:
+                context.check_cancelled()
+                try:
+                    return future.result(timeout=_RELEASE_POLL_INTERVAL)
+                except FutureTimeoutError:
+                    continue
+                except UnknownVersionError:
+                    raise
+                except Exception as e:
+                    raise InstallationDownloadError(e)
+
+        def download(context: StageContext):
+            url = context.results[STAGE_RELEASE].download_url
+            log.debug('Downloading %s to %s', url, bundle_path)
+
+            def report(downloaded: int, total: int):
+                context.report(total and downloaded / total,
+                               f'{downloaded / 1e6:.1f} MB')
+            try:
+                download_file(url, bundle_path, report)
+            except (URLError, OSError) as e:
+                raise InstallationDownloadError(e)
+
+        def extract_build_files(context: StageContext):
+            # Extracting over an old installation could leave stale files
+            shutil.rmtree(self.client_location, ignore_errors=True)
+            self._extract(context, bundle_path, _is_build_file)
+            self._make_gradle_executable()
+
+        def extract(context: StageContext):
+            self._extract(context, bundle_path,
+                          lambda path: not _is_build_file(path))
+
+        def record_manifest(context: StageContext):
+            # Keep the bundle to repair files from later on
+            release_version = context.results[STAGE_RELEASE].version
+            cache = Path(self._installation_directory) / BUNDLE_CACHE_DIR_NAME
+            cache.mkdir(parents=True, exist_ok=True)
+            cached_bundle = cache / _bundle_name(release_version)
+            for old_bundle in cache.glob('*.zip'):
+                old_bundle.unlink()
+            shutil.move(str(bundle_path), str(cached_bundle))
+            context.report(message='Hashing installed files')
+            IntegrityManifest.record(self.client_location,
+                                     list_bundle(cached_bundle),
+                                     str(cached_bundle),
+                                     release_version).save()
+
+        def setup(context: StageContext):
+            log.info(f'Setting up workspace in {self.client_location}...')
+            self._run_gradle(context, 'setupDecompWorkspace',
+                             '--refresh-dependencies')
+
+        def build(context: StageContext):
+            log.info('Starting Minecraft build...')
+            self._run_gradle(context, 'build')
+
+        return InstallPipeline([
+            InstallStage(STAGE_RELEASE, fetch_release),
+            InstallStage(STAGE_DOWNLOAD, download, requires=[STAGE_RELEASE]),
+            InstallStage(STAGE_EXTRACT_BUILD_FILES, extract_build_files,
+                         requires=[STAGE_DOWNLOAD]),
+            InstallStage(STAGE_EXTRACT, extract,
+                         requires=[STAGE_EXTRACT_BUILD_FILES]),
+            InstallStage(STAGE_SETUP, setup,
+                         requires=[STAGE_EXTRACT_BUILD_FILES]),
+            InstallStage(STAGE_BUILD, build,
+                         requires=[STAGE_SETUP, STAGE_EXTRACT]),
+            # Last, so a failed build is not taken for an installation
+            InstallStage(STAGE_MANIFEST, record_manifest,
+                         requires=[STAGE_BUILD]),
+        ], on_progress)
+
     def ensure_polycraft_installed(self):
         """Ensures a Polycraft World installation will exist after calling, or fail.
 
-        If Polycraft World is installed, it will be downloaded and then
-        installed. Otherwise, this is a no-op.
+        If Polycraft World is not installed, it will be downloaded and then
+        installed. Broken files of an existing installation are extracted
+        again from the cached release, and everything is only reinstalled if
+        that is not possible. Otherwise, this is a no-op.
 
         This should be preferred to manually checking if the client is installed
         and calling then calling the installer.
         """
-        # TODO: Attempt re-installation
-        if not self.is_installed:  # Just in case pip install didn't work
-            self.install()
+        manifest = IntegrityManifest.load(self.client_location)
+        if manifest is None:  # Just in case pip install didn't work
+            self.install(force_install=True)
+            return
+        result = manifest.verify()
+        if result.ok:
+            return
+        log.warning('%d installed file(s) are missing or changed',
+                    len(result.broken))
+        try:
+            manifest.repair(result.broken)
+        except (InstallationCorruptedError, OSError,
+                PolycraftDownloadError) as e:
+            log.warning('Could not repair the installation (%s), '
+                        'reinstalling', e)
+            self.install(force_install=True)
+
+    def verify(self, thorough: bool = False) -> VerificationResult:
+        """Check the installed files against the integrity manifest.
+
+        Args:
+            thorough (bool): Hash every file, instead of only checking sizes
+                and hashing files whose modification time changed
+
+        Raises:
+            InstallationIncompleteError: If the installation has no manifest
+        """
+        manifest = IntegrityManifest.load(self.client_location)
+        if manifest is None:
+            raise InstallationIncompleteError(
+                f'No integrity manifest in {self.client_location}')
+        return manifest.verify(thorough)
+
+    def repair(self, paths: Iterable[str]):
+        """Extract the given installed files again from the cached release.
+
+        Raises:
+            InstallationIncompleteError: If the installation has no manifest
+            InstallationCorruptedError: If the files cannot be repaired
+        """
+        manifest = IntegrityManifest.load(self.client_location)
+        if manifest is None:
+            raise InstallationIncompleteError(
+                f'No integrity manifest in {self.client_location}')
+        manifest.repair(paths)
 
     def uninstall(self):
         """Removes the entire Polycraft Lab installation."""
         shutil.rmtree(self._installation_directory, onerror=log.error)
 
-    def _download_polycraft(self, version: str):
-        """Downloads and extracts specified version of Polycraft World."""
+    def _extract(self, context: StageContext, bundle_path: Path, select):
         try:
-            # TODO: Handle retries
-            release = get_release(version)
-            download_and_extract_polycraft(self.client_location,
-                                           bundle_location=release.download_url)
-        except Exception:
-            raise InstallationDownloadError()
-
-    def _run_setup(self):
-        os.chdir(Path(self._installation_directory) / PAL_MOD_DIR_NAME)
+            extract_bundle(bundle_path, Path(self.client_location), select,
+                           lambda done, total: context.report(done / total))
+        except (OSError, PolycraftDownloadError) as e:
+            raise InstallationDownloadError(e)
 
+    @property
+    def _gradle_executable(self) -> str:
         system = platform.system()
         if system == 'Windows':
             gradlew_name = 'gradlew.bat'
@@ -126,21 +300,35 @@ class PolycraftInstallation:
             gradlew_name = 'gradlew'
         else:
             raise RuntimeError('OS not supported for Polycraft Lab: %s', system)
-        executable = str(Path(self.client_location) / gradlew_name)
-        if system == 'Linux':
-            # Ensure gradlew is executable
-            st = os.stat(str(executable))
-            os.chmod(str(executable), st.st_mode | stat.S_IEXEC)
+        return str(Path(self.client_location) / gradlew_name)
+
+    def _make_gradle_executable(self):
+        if platform.system() == 'Linux':
+            executable = self._gradle_executable
+            st = os.stat(executable)
+            os.chmod(executable, st.st_mode | stat.S_IEXEC)
+
+    def _run_gradle(self, context: StageContext, *tasks: str):
         # TODO: Ensure java executable exists
         try:
-            log.info(f'Setting up workspace in {self.client_location}...')
-            subprocess.run(
-                f'{executable} setupDecompWorkspace --refresh-dependencies'.split())
-            log.info('Starting Minecraft build...')
-            log.info('This may take a while.')
-            subprocess.run(f'{executable} build'.split())
-        except Exception:
-            raise InstallationBuildError()
+            context.run([self._gradle_executable, *tasks],
+                        cwd=self.client_location)
+        except (OSError, subprocess.CalledProcessError) as e:
+            output = getattr(e, 'output', None)
+            raise InstallationBuildError(
+                f'{" ".join(tasks)} failed: {e}' +
+                (f'\n{output}' if output else ''))
+
+
+def _bundle_name(release_version: str) -> str:
+    safe_version = re.sub(r'[^\w.-]', '_', str(release_version))
+    return f'polycraft-{safe_version}.zip'
+
+
+def _is_build_file(path: str) -> bool:
+    return path in BUILD_FILE_NAMES or \
+        path.startswith(BUILD_FILE_DIRECTORY) or \
+        path.endswith(ACCESS_TRANSFORMER_SUFFIX)
 
 
 class InstallationDownloadError(Exception):
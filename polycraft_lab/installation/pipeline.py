@@ -0,0 +1,318 @@
+"""Run installation steps as stages on background threads.
+
+Each stage names the stages it needs, and starts as soon as all of them are
+done, so independent work overlaps. While stages run, progress events are
+streamed to a callback. The pipeline can be cancelled from any thread, or with
+Ctrl + C while `run` waits: running stages stop at their next progress report,
+and their subprocesses are terminated.
+
+Example:
+    pipeline = InstallPipeline([
+        InstallStage('download', download),
+        InstallStage('extract', extract, requires=['download']),
+    ], on_progress=ProgressPrinter())
+    pipeline.run()
+"""
+import logging
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, TextIO
+
+log = logging.getLogger('pal').getChild('installer').getChild('pipeline')
+
+STATUS_STARTED = 'started'
+STATUS_PROGRESS = 'progress'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+# Seconds between checks for Ctrl + C while waiting for stages
+_WAIT_INTERVAL = 0.2
+# Seconds a cancelled subprocess gets to exit before it is killed
+_TERMINATE_TIMEOUT = 5
+# Output lines of a failed subprocess included in its error
+_OUTPUT_TAIL_LINES = 20
+
+
+class StageEvent:
+    """A change in the state of a stage.
+
+    Attributes:
+        stage (str): The name of the stage
+        status (str): One of the STATUS_ constants
+        elapsed (float): Seconds since the stage started
+        fraction (float): How much of the stage is done, if known
+        message (str): What the stage is doing, or why it failed
+    """
+
+    def __init__(self, stage: str, status: str, elapsed: float = 0.0,
+                 fraction: float = None, message: str = None):
+        self.stage = stage
+        self.status = status
+        self.elapsed = elapsed
+        self.fraction = fraction
+        self.message = message
+
+    def __repr__(self):
+        return f'StageEvent({self.stage!r}, {self.status!r})'
+
+
+class InstallStage:
+    """A step of an installation.
+
+    The function is called with a `StageContext` and may return a result,
+    which later stages can read from `context.results`.
+    """
+
+    def __init__(self, name: str, function: Callable[['StageContext'], object],
+                 requires: Iterable[str] = ()):
+        self.name = name
+        self.function = function
+        self.requires = list(requires)
+
+
+class StageContext:
+    """What a running stage uses to report progress and check cancellation."""
+
+    def __init__(self, pipeline: 'InstallPipeline', stage: InstallStage):
+        self._pipeline = pipeline
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    @property
+    def results(self) -> Dict[str, object]:
+        """The results of the stages that are done."""
+        return self._pipeline.results
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def check_cancelled(self):
+        """Raise InstallationCancelledError if the pipeline was cancelled."""
+        if self._pipeline.is_cancelled:
+            raise InstallationCancelledError(
+                f'{self._stage.name} was cancelled')
+
+    def report(self, fraction: float = None, message: str = None):
+        """Stream the progress of the stage, stopping it if cancelled."""
+        self.check_cancelled()
+        self._pipeline._emit(StageEvent(self._stage.name, STATUS_PROGRESS,
+                                        self.elapsed, fraction, message))
+
+    def run(self, command: List[str], cwd: str = None):
+        """Run a command, reporting each line it prints.
+
+        Raises:
+            InstallationCancelledError: If the pipeline was cancelled
+            subprocess.CalledProcessError: If the command failed, with the
+                last lines it printed as its output
+        """
+        self.check_cancelled()
+        log.debug('Running %s', ' '.join(command))
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL,
+                                   universal_newlines=True)
+        tail = deque(maxlen=_OUTPUT_TAIL_LINES)
+        with self._pipeline._track(process):
+            for line in process.stdout:
+                line = line.rstrip()
+                if not line:
+                    continue
+                tail.append(line)
+                log.debug('%s: %s', self._stage.name, line)
+                if not self._pipeline.is_cancelled:
+                    self.report(message=line)
+            process.wait()
+        self.check_cancelled()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command,
+                                                output='\n'.join(tail))
+
+
+class InstallPipeline:
+    """Runs stages concurrently, in the order their requirements allow."""
+
+    def __init__(self, stages: Iterable[InstallStage],
+                 on_progress: Callable[[StageEvent], None] = None):
+        """
+        Args:
+            stages: The stages to run. Every required stage must be listed.
+            on_progress: Called with every StageEvent, from any thread but
+                never concurrently
+        """
+        self.stages = list(stages)
+        names = {stage.name for stage in self.stages}
+        for stage in self.stages:
+            missing = set(stage.requires) - names
+            if missing:
+                raise ValueError(f'{stage.name} requires unknown stages '
+                                 f'{", ".join(sorted(missing))}')
+        self.results: Dict[str, object] = {}
+        self.timings: Dict[str, float] = {}
+        self._on_progress = on_progress
+        self._cancelled = threading.Event()
+        self._emit_lock = threading.Lock()
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Stop every running stage and skip the ones not started yet."""
+        if self._cancelled.is_set():
+            return
+        log.debug('Cancelling installation')
+        self._cancelled.set()
+        with self._processes_lock:
+            for process in self._processes:
+                process.terminate()
+
+    def run(self) -> Dict[str, object]:
+        """Run every stage and wait for them to finish.
+
+        Returns:
+            The result of each stage, by name
+
+        Raises:
+            InstallationCancelledError: If the pipeline was cancelled, which
+                Ctrl + C does while this waits
+            Exception: The error of the first stage that failed, after the
+                other stages were cancelled
+        """
+        pending = list(self.stages)
+        running = {}
+        error: Optional[BaseException] = None
+        with ThreadPoolExecutor(max_workers=max(1, len(pending)),
+                                thread_name_prefix='pal-install') as pool:
+            try:
+                while pending or running:
+                    if not self.is_cancelled:
+                        for stage in [stage for stage in pending if all(
+                                name in self.results
+                                for name in stage.requires)]:
+                            pending.remove(stage)
+                            running[pool.submit(self._run_stage, stage)] = \
+                                stage
+                    if not running:
+                        break  # Cancelled before the remaining stages started
+                    done, _ = wait(running, timeout=_WAIT_INTERVAL,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del running[future]
+                        stage_error = future.exception()
+                        if stage_error is not None and (
+                                error is None or isinstance(
+                                    error, InstallationCancelledError)):
+                            error = stage_error
+                        if stage_error is not None:
+                            self.cancel()
+            except KeyboardInterrupt:
+                self.cancel()
+                wait(running)
+                raise InstallationCancelledError('Installation was cancelled')
+        if error is not None:
+            raise error
+        if self.is_cancelled:
+            raise InstallationCancelledError('Installation was cancelled')
+        return self.results
+
+    def _run_stage(self, stage: InstallStage):
+        context = StageContext(self, stage)
+        self._emit(StageEvent(stage.name, STATUS_STARTED))
+        try:
+            result = stage.function(context)
+        except InstallationCancelledError:
+            self._emit(StageEvent(stage.name, STATUS_CANCELLED,
+                                  context.elapsed))
+            raise
+        except Exception as e:
+            self._emit(StageEvent(stage.name, STATUS_FAILED, context.elapsed,
+                                  message=str(e)))
+            raise
+        self.timings[stage.name] = context.elapsed
+        self.results[stage.name] = result
+        self._emit(StageEvent(stage.name, STATUS_DONE, context.elapsed, 1.0))
+        return result
+
+    def _emit(self, event: StageEvent):
+        if self._on_progress is None:
+            return
+        with self._emit_lock:
+            self._on_progress(event)
+
+    def _track(self, process: subprocess.Popen):
+        return _TrackedProcess(self, process)
+
+
+class _TrackedProcess:
+    """Keeps a subprocess known to the pipeline while it runs."""
+
+    def __init__(self, pipeline: InstallPipeline, process: subprocess.Popen):
+        self._pipeline = pipeline
+        self._process = process
+
+    def __enter__(self):
+        with self._pipeline._processes_lock:
+            self._pipeline._processes.add(self._process)
+        if self._pipeline.is_cancelled:
+            self._process.terminate()
+        return self._process
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._pipeline._processes_lock:
+            self._pipeline._processes.discard(self._process)
+        if self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(_TERMINATE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+
+
+class ProgressPrinter:
+    """Prints stage events as lines, at most one progress line per interval."""
+
+    def __init__(self, out: TextIO = sys.stdout, interval: float = 2.0):
+        """
+        Args:
+            out: Where lines are written
+            interval (float): Minimum seconds between progress lines of a
+                stage
+        """
+        self._out = out
+        self._interval = interval
+        self._last_printed: Dict[str, float] = {}
+
+    def __call__(self, event: StageEvent):
+        if event.status == STATUS_STARTED:
+            self._print(f'[{event.stage}] started')
+        elif event.status == STATUS_PROGRESS:
+            now = time.monotonic()
+            if now - self._last_printed.get(event.stage, 0) < self._interval:
+                return
+            self._last_printed[event.stage] = now
+            progress = '' if event.fraction is None \
+                else f'{event.fraction:4.0%} '
+            self._print(f'[{event.stage}] {progress}{event.message or ""}')
+        elif event.status == STATUS_DONE:
+            self._print(f'[{event.stage}] done in {event.elapsed:.1f}s')
+        elif event.status == STATUS_FAILED:
+            self._print(f'[{event.stage}] failed after {event.elapsed:.1f}s: '
+                        f'{event.message}')
+
+    def _print(self, line: str):
+        self._out.write(line + '\n')
+        self._out.flush()
+
+
+class InstallationCancelledError(Exception):
+    """Raised when an installation is cancelled before it finished."""
@@ -0,0 +1,317 @@
+"""Place game instances on CPUs and NUMA nodes, and limit their resources.
+
+Without placement, every JVM on a host may run on every core, so with many
+instances they keep migrating between cores and evicting each other's caches.
+`plan_placement` gives each instance its own set of CPUs under one of these
+policies:
+
+- `spread` deals instances out over the NUMA nodes in turn, and each gets
+  `cpus_per_instance` CPUs of its node that no other instance uses, until
+  the node runs out.
+- `pack` fills the CPUs of one node before using the next, which keeps few
+  instances close together on a shared cache.
+- `node` binds each instance to every CPU of a node, dealt out in turn, and
+  leaves the balancing within the node to the operating system.
+
+The resulting `ResourceLimits` are applied before the game runs a single
+instruction: `command_prefix` returns a `taskset -c`, `nice -n` and
+`prlimit --data` prefix for its command, and each of those sets its limit and
+execs the rest, so the game keeps its pid. Gradle and the JVM it forks inherit
+all three. They are not applied through `Popen(preexec_fn=...)`, which is
+unsafe while other threads run, and PAL always has some. Where one of the
+tools is missing, `apply_to_tree(pid)` limits the started game and every
+process it forked so far instead, with `os.sched_setaffinity`,
+`os.setpriority` and `resource.prlimit`. Unlike a cgroup the memory cap
+applies to each process on its own, not to the instance as a whole. Affinity
+and the memory cap of another process are only supported on Linux; elsewhere
+they are skipped with a warning.
+"""
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from polycraft_lab.monitoring.process import process_tree
+
+log = logging.getLogger('pal').getChild('client').getChild('placement')
+
+POLICY_NONE = 'none'
+POLICY_SPREAD = 'spread'
+POLICY_PACK = 'pack'
+POLICY_NODE = 'node'
+POLICIES = (POLICY_NONE, POLICY_SPREAD, POLICY_PACK, POLICY_NODE)
+
+NUMA_NODES_PATH = Path('/sys/devices/system/node')
+
+# Each sets one limit and execs the rest of its command line
+_TASKSET = 'taskset'
+_NICE = 'nice'
+_PRLIMIT = 'prlimit'
+
+_NODE_DIRECTORY = re.compile(r'node(\d+)')
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """Parse a Linux CPU list such as '0-3,8,10-11'."""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def supports_affinity() -> bool:
+    return hasattr(os, 'sched_setaffinity')
+
+
+class CpuTopology:
+    """The CPUs this process may use, grouped by NUMA node.
+
+    Attributes:
+        nodes (list): The CPU ids of each node, in order
+    """
+
+    def __init__(self, nodes: Sequence[Sequence[int]]):
+        self.nodes = [list(cpus) for cpus in nodes if cpus]
+        if not self.nodes:
+            raise ValueError('A topology needs at least one CPU')
+
+    @classmethod
+    def detect(cls, nodes_path: Path = NUMA_NODES_PATH) -> 'CpuTopology':
+        """Read the NUMA nodes from sysfs, limited to the CPUs available.
+
+        Hosts without NUMA information are treated as a single node.
+        """
+        if supports_affinity():
+            available = os.sched_getaffinity(0)
+        else:
+            available = set(range(os.cpu_count() or 1))
+        nodes = []
+        try:
+            directories = sorted(
+                (int(match.group(1)), path)
+                for path in Path(nodes_path).iterdir()
+                for match in [_NODE_DIRECTORY.fullmatch(path.name)] if match)
+            for _, path in directories:
+                cpus = parse_cpu_list((path / 'cpulist').read_text())
+                nodes.append([cpu for cpu in cpus if cpu in available])
+        except OSError:
+            nodes = []
+        if not any(nodes):
+            nodes = [sorted(available)]
+        return cls(nodes)
+
+    @property
+    def cpus(self) -> List[int]:
+        return [cpu for cpus in self.nodes for cpu in cpus]
+
+    def node_of(self, cpu: int) -> Optional[int]:
+        for index, cpus in enumerate(self.nodes):
+            if cpu in cpus:
+                return index
+        return None
+
+
+class ResourceLimits:
+    """The CPUs, priority and memory cap of one game instance.
+
+    Attributes:
+        cpus (list): The CPUs the instance may run on, or None for any
+        nice (int): How much to lower the priority, or None to keep it
+        memory_bytes (int): The most data memory each process may allocate,
+            or None for no limit
+        node (int): The NUMA node of the CPUs, for reporting
+    """
+
+    def __init__(self, cpus: Sequence[int] = None, nice: int = None,
+                 memory_bytes: int = None, node: int = None):
+        self.cpus = None if cpus is None else sorted(set(cpus))
+        self.nice = nice
+        self.memory_bytes = memory_bytes
+        self.node = node
+
+    def __repr__(self):
+        return (f'ResourceLimits(cpus={self.cpus}, nice={self.nice}, '
+                f'memory_bytes={self.memory_bytes}, node={self.node})')
+
+    @property
+    def is_empty(self) -> bool:
+        return self.cpus is None and self.nice is None and \
+            self.memory_bytes is None
+
+    def apply(self, pid: int = 0):
+        """Apply the limits to a process, this one by default.
+
+        Processes it starts afterwards inherit them. Limits this platform
+        does not support are skipped with a warning.
+
+        Raises:
+            OSError: If a limit could not be applied, such as CPUs the process
+                may not use
+        """
+        if self.cpus is not None:
+            if supports_affinity():
+                os.sched_setaffinity(pid, self.cpus)
+            else:
+                log.warning('CPU affinity is not supported on this platform')
+        if self.nice is not None:
+            if not hasattr(os, 'setpriority'):
+                log.warning('Niceness is not supported on this platform')
+            elif pid == 0:
+                os.nice(self.nice)
+            else:
+                os.setpriority(os.PRIO_PROCESS, pid,
+                               os.getpriority(os.PRIO_PROCESS, pid) +
+                               self.nice)
+        if self.memory_bytes is not None:
+            if resource is None or \
+                    (pid != 0 and not hasattr(resource, 'prlimit')):
+                log.warning('Memory limits are not supported on this '
+                            'platform')
+            elif pid == 0:
+                _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+                resource.setrlimit(resource.RLIMIT_DATA,
+                                   (self._memory_limit(hard), hard))
+            else:
+                _, hard = resource.prlimit(pid, resource.RLIMIT_DATA)
+                resource.prlimit(pid, resource.RLIMIT_DATA,
+                                 (self._memory_limit(hard), hard))
+
+    def command_prefix(self) -> Optional[List[str]]:
+        """Return the arguments that start a command under the limits.
+
+        Returns:
+            The prefix of the command, or None if a tool it needs is not
+            installed
+        """
+        commands = []
+        if self.cpus is not None:
+            commands.append([_TASKSET, '-c', ','.join(map(str, self.cpus))])
+        if self.nice is not None:
+            commands.append([_NICE, '-n', str(self.nice)])
+        if self.memory_bytes is not None:
+            if resource is None:
+                return None
+            # The command inherits the hard limit of this process
+            _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+            commands.append([_PRLIMIT,
+                             f'--data={self._memory_limit(hard)}:'])
+        prefix = []
+        for tool, *arguments in commands:
+            path = shutil.which(tool)
+            if path is None:
+                return None
+            prefix += [path] + arguments
+        return prefix
+
+    def apply_to_tree(self, pid: int):
+        """Apply the limits to a started process and its descendants.
+
+        The process is limited first, so what it forks afterwards inherits
+        the limits, then the processes it forked before are limited too.
+
+        Raises:
+            OSError: If the limits could not be applied to the process
+        """
+        self.apply(pid)
+        children = process_tree(pid)[1:]
+        if not children:
+            return
+        # Children forked since the process was limited already have its
+        # priority, so they are given that rather than lowered again
+        limits = ResourceLimits(self.cpus, None, self.memory_bytes)
+        priority = None
+        if self.nice is not None and hasattr(os, 'getpriority'):
+            priority = os.getpriority(os.PRIO_PROCESS, pid)
+        for child in children:
+            try:
+                limits.apply(child)
+                if priority is not None and \
+                        os.getpriority(os.PRIO_PROCESS, child) < priority:
+                    os.setpriority(os.PRIO_PROCESS, child, priority)
+            except ProcessLookupError:  # It exited
+                pass
+
+    def _memory_limit(self, hard: int) -> int:
+        if hard == resource.RLIM_INFINITY:
+            return self.memory_bytes
+        return min(self.memory_bytes, hard)
+
+
+def plan_placement(count: int, policy: str = POLICY_SPREAD,
+                   cpus_per_instance: int = None, nice: int = None,
+                   memory_bytes: int = None,
+                   topology: CpuTopology = None) -> List[ResourceLimits]:
+    """Return the limits of `count` instances placed with `policy`.
+
+    Args:
+        count (int): How many instances to place
+        policy (str): 'spread', 'pack', 'node' or 'none'
+        cpus_per_instance (int): CPUs for each instance under 'spread' and
+            'pack'. By default the CPUs are divided evenly, with at least one
+            per instance. CPUs are shared once every CPU is in use.
+        nice (int): Niceness added to every instance
+        memory_bytes (int): Memory cap of every instance
+        topology (CpuTopology): The CPUs to place on, detected by default
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown placement policy {policy}, expected one '
+                         f'of {", ".join(POLICIES)}')
+    if policy == POLICY_NONE:
+        return [ResourceLimits(None, nice, memory_bytes)
+                for _ in range(count)]
+    topology = topology or CpuTopology.detect()
+    nodes = topology.nodes
+    if policy == POLICY_NODE:
+        return [ResourceLimits(nodes[index % len(nodes)], nice, memory_bytes,
+                               index % len(nodes))
+                for index in range(count)]
+    cpus = topology.cpus
+    if cpus_per_instance is None:
+        cpus_per_instance = max(1, len(cpus) // max(count, 1))
+    if policy == POLICY_PACK:
+        groups = [[cpus[(index * cpus_per_instance + offset) % len(cpus)]
+                   for offset in range(cpus_per_instance)]
+                  for index in range(count)]
+        return [ResourceLimits(group, nice, memory_bytes,
+                               topology.node_of(group[0]))
+                for group in groups]
+    # Spread: deal instances out over the nodes, each taking the next free
+    # CPUs of its node, and start again from the first CPU once one fills up
+    cursors = [0] * len(nodes)
+    placements = []
+    for index in range(count):
+        node = index % len(nodes)
+        node_cpus = nodes[node]
+        group = [node_cpus[(cursors[node] + offset) % len(node_cpus)]
+                 for offset in range(min(cpus_per_instance, len(node_cpus)))]
+        cursors[node] += len(group)
+        placements.append(ResourceLimits(group, nice, memory_bytes, node))
+    return placements
+
+
+def placement_from_config(config: Optional[dict], count: int
+                          ) -> List[ResourceLimits]:
+    """Plan placement from a JSON object such as a sweep's "placement".
+
+    For example `{"policy": "spread", "cpus_per_instance": 2, "nice": 5,
+    "memory_mb": 4096}`. Without a config, instances are not placed.
+    """
+    config = dict(config or {})
+    memory_mb = config.pop('memory_mb', None)
+    placements = plan_placement(
+        count, config.pop('policy', POLICY_NONE),
+        config.pop('cpus_per_instance', None), config.pop('nice', None),
+        None if memory_mb is None else int(memory_mb) * 1024 * 1024)
+    if config:
+        raise ValueError(f'Unknown placement options: {", ".join(config)}')
+    return placements
@@ -5,6 +5,7 @@ release data.
 """
 
 import json
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import List
 
@@ -40,7 +41,7 @@ def get_release(version: str) -> PolycraftWorldRelease:
     Raises:
         UnknownVersionError if the given version does not exist.
     """
-    if version is 'newest':
+    if version == 'newest':
         releases = get_release_list()
         return releases[0]  # First release is newest
     response = requests.get(f'{RELEASES_ENDPOINT}/{version}')
@@ -55,6 +56,22 @@ def get_release(version: str) -> PolycraftWorldRelease:
     )
 
 
+def prefetch_release(version: str = 'newest') -> Future:
+    """Start fetching release info in the background.
+
+    Useful to hide the request behind a prompt, before the installation needs
+    the release.
+
+    Returns:
+        A future resolving to the PolycraftWorldRelease of `version`
+    """
+    executor = ThreadPoolExecutor(max_workers=1,
+                                  thread_name_prefix='pal-releases')
+    future = executor.submit(get_release, version)
+    executor.shutdown(wait=False)
+    return future
+
+
 def get_release_list(released_after: str = None) -> List[PolycraftWorldRelease]:
     """
     Args:
@@ -0,0 +1,314 @@
+"""Decode large JSON replies as they arrive, in bounded memory.
+
+A full area scan can be tens of megabytes of JSON. Decoding it in one go
+holds the raw bytes, the decoded text and the resulting objects at once, in
+every environment. A `StreamingReply` instead decodes the reply one value at
+a time while it is received, and hands the elements of chosen top-level
+arrays to the caller one by one:
+
+    with client.stream('SENSE_ALL', fields=['blocks']) as reply:
+        for field, block in reply:
+            ...
+        inventory = reply.fields['inventory']
+
+Only the value being decoded is kept in the receive buffer, which is capped at
+`max_buffer` bytes. Nothing more is read from the socket until the caller asks
+for the next element, so a slow consumer makes the game wait instead of
+growing the buffer.
+
+`ValueScanner` finds where a JSON value ends by jumping between structural
+characters with regular expressions, and resumes where it stopped when more
+bytes arrive, so each byte is scanned once.
+"""
+import json
+import re
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+DEFAULT_MAX_BUFFER = 4 * 1024 * 1024  # 4 MiB
+
+# Consumed bytes are only cut from the buffer once there are this many, so
+# small values do not each shift the whole buffer
+_COMPACT_THRESHOLD = 64 * 1024
+
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+_OPENING = frozenset(b'[{')
+
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+_STRING_END = re.compile(rb'["\\]')
+_PRIMITIVE_END = re.compile(rb'[\s,\]}]')
+_NOT_WHITESPACE = re.compile(rb'[^ \t\r\n]')
+
+
+class ValueScanner:
+    """Finds the end of a JSON array, object or string across chunks."""
+
+    def __init__(self, start: int, depth: int = 0):
+        """
+        Args:
+            start (int): Where the value starts in the buffer
+            depth (int): How many arrays and objects are already open, to find
+                the end of the value that contains them instead
+        """
+        self.position = start
+        self._depth = depth
+        self._in_string = False
+
+    def shift(self, offset: int):
+        """Account for `offset` bytes cut from the front of the buffer."""
+        self.position -= offset
+
+    def scan(self, buffer: bytearray) -> Optional[int]:
+        """Return the index after the value, or None if it is incomplete."""
+        position = self.position
+        while True:
+            if self._in_string:
+                match = _STRING_END.search(buffer, position)
+                if match is None:
+                    self.position = len(buffer)
+                    return None
+                if buffer[match.start()] == _BACKSLASH:
+                    if match.end() >= len(buffer):
+                        self.position = match.start()  # Escape is cut off
+                        return None
+                    position = match.end() + 1
+                    continue
+                self._in_string = False
+                position = match.end()
+                if self._depth == 0:
+                    return position
+                continue
+            match = _STRUCTURAL.search(buffer, position)
+            if match is None:
+                self.position = len(buffer)
+                return None
+            character = buffer[match.start()]
+            position = match.end()
+            if character == _QUOTE:
+                self._in_string = True
+            elif character in _OPENING:
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return position
+
+
+class StreamingReply:
+    """A JSON object reply whose chosen array fields are decoded lazily.
+
+    Iterating yields `(field, element)` for each element of the streamed
+    arrays, in the order they were sent. Every other top-level value is
+    decoded into `fields` as it is reached, so values sent after an array are
+    only available once iteration has passed it. `finish` reads the rest of
+    the reply, discarding streamed elements nobody iterated over. If decoding
+    fails partway, `finish` skips the rest of the reply unparsed, so the
+    connection stays in step with the game.
+    """
+
+    def __init__(self, buffer: bytearray, fill: Callable[[], None],
+                 fields: Sequence[str], max_buffer: int = DEFAULT_MAX_BUFFER,
+                 on_finish: Callable[[], None] = None):
+        """
+        Args:
+            buffer (bytearray): The receive buffer, starting at the reply.
+                Bytes after the reply are left in it.
+            fill: Appends the next chunk from the connection to the buffer
+            fields: The top-level keys whose arrays are streamed
+            max_buffer (int): The most bytes a single value may take
+            on_finish: Called once the whole reply was read
+        """
+        self.fields: Dict[str, object] = {}
+        self.is_finished = False
+        self._buffer = buffer
+        self._fill = fill
+        self._streamed = frozenset(fields)
+        self._max_buffer = max_buffer
+        self._on_finish = on_finish
+        self._position = 0
+        # How many arrays and objects are open, and where the value being
+        # decoded starts, to skip the rest of the reply after an error
+        self._depth = 0
+        self._value_start: Optional[int] = None
+        self._failed = False
+        self._elements = self._parse()
+
+    @classmethod
+    def from_value(cls, reply: dict, fields: Sequence[str]
+                   ) -> 'StreamingReply':
+        """Wrap a reply that was already decoded, such as a msgpack one."""
+        streaming = cls(bytearray(), lambda: None, fields)
+        streaming.fields = {key: value for key, value in reply.items()
+                            if key not in streaming._streamed or
+                            not isinstance(value, list)}
+        streaming._elements = iter([
+            (key, element) for key, value in reply.items()
+            if key not in streaming.fields for element in value])
+        streaming.is_finished = True
+        return streaming
+
+    def __iter__(self) -> Iterator[Tuple[str, object]]:
+        return self._elements
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+    def elements(self, field: str) -> Iterator[object]:
+        """Yield the elements of one streamed field.
+
+        Elements of other streamed fields sent before it are skipped.
+        """
+        for key, element in self._elements:
+            if key == field:
+                yield element
+
+    def finish(self) -> Dict[str, object]:
+        """Read the rest of the reply and return its non-streamed fields.
+
+        Raises:
+            ValueError: If the rest of the reply could not be decoded. It was
+                skipped all the same.
+        """
+        try:
+            for _ in self._elements:
+                pass
+        finally:
+            if self._failed and not self.is_finished:
+                self._skip_rest()
+        return self.fields
+
+    def _parse(self) -> Iterator[Tuple[str, object]]:
+        try:
+            self._expect(b'{')
+            self._depth = 1
+            if self._peek() == ord('}'):
+                self._position += 1
+            else:
+                while True:
+                    key = self._decode_value()
+                    if not isinstance(key, str):
+                        raise ValueError('Expected a key in the reply')
+                    self._expect(b':')
+                    if key in self._streamed and self._peek() == ord('['):
+                        self._position += 1
+                        self._depth = 2
+                        yield from self._parse_array(key)
+                        self._depth = 1
+                    else:
+                        self.fields[key] = self._decode_value()
+                    if self._expect(b',}') == ord('}'):
+                        break
+        except Exception:
+            self._failed = True
+            raise
+        self._depth = 0
+        self._compact(force=True)
+        self.is_finished = True
+        if self._on_finish is not None:
+            self._on_finish()
+
+    def _skip_rest(self):
+        """Discard the rest of the reply without decoding it.
+
+        Scanning resumes at the value that failed to decode, or after the
+        last token taken, with the arrays and objects around it still open.
+        Consumed bytes are cut from the buffer as it goes, so memory stays
+        bounded however large the rest is.
+        """
+        start = self._position if self._value_start is None \
+            else self._value_start
+        self._position = start
+        if self._depth == 0 and self._peek() not in _OPENING and \
+                self._peek() != _QUOTE:
+            # The reply is a bare number or literal
+            self._decode_value()
+        else:
+            scanner = ValueScanner(self._position, self._depth)
+            while True:
+                end = scanner.scan(self._buffer)
+                if end is not None:
+                    break
+                scanner.shift(self._compact(keep_from=scanner.position,
+                                            force=True))
+                self._fill()
+            self._position = end
+        self._depth = 0
+        self._value_start = None
+        self._compact(force=True)
+        self.is_finished = True
+
+    def _parse_array(self, key: str) -> Iterator[Tuple[str, object]]:
+        if self._peek() == ord(']'):
+            self._position += 1
+            return
+        while True:
+            yield key, self._decode_value()
+            if self._expect(b',]') == ord(']'):
+                return
+
+    def _peek(self) -> int:
+        """Return the next byte that is not whitespace, without taking it."""
+        while True:
+            match = _NOT_WHITESPACE.search(self._buffer, self._position)
+            if match is not None:
+                self._position = match.start()
+                return self._buffer[self._position]
+            self._position = len(self._buffer)
+            self._compact()
+            self._receive()
+
+    def _expect(self, allowed: bytes) -> int:
+        character = self._peek()
+        if character not in allowed:
+            raise ValueError(f'Expected one of {allowed.decode()} in the '
+                             f'reply, found {chr(character)!r}')
+        self._position += 1
+        return character
+
+    def _decode_value(self):
+        character = self._peek()
+        start = self._value_start = self._position
+        scanner = ValueScanner(start) if character == _QUOTE or \
+            character in _OPENING else None
+        while True:
+            if scanner is not None:
+                end = scanner.scan(self._buffer)
+            else:
+                match = _PRIMITIVE_END.search(self._buffer, start)
+                end = None if match is None else match.start()
+            if end is not None:
+                value = json.loads(self._buffer[start:end])
+                self._position = end
+                self._value_start = None
+                self._compact()
+                return value
+            offset = self._compact(keep_from=start)
+            start -= offset
+            self._value_start = start
+            if scanner is not None:
+                scanner.shift(offset)
+            self._receive()
+
+    def _receive(self):
+        if len(self._buffer) - self._position >= self._max_buffer:
+            raise ReplyTooLargeError(
+                f'A value in the reply is larger than {self._max_buffer} '
+                f'bytes')
+        self._fill()
+
+    def _compact(self, keep_from: int = None, force: bool = False) -> int:
+        """Cut consumed bytes from the buffer, returning how many."""
+        keep_from = self._position if keep_from is None else keep_from
+        if keep_from == 0 or (not force and keep_from < _COMPACT_THRESHOLD
+                              and keep_from < len(self._buffer)):
+            return 0
+        del self._buffer[:keep_from]
+        self._position -= keep_from
+        return keep_from
+
+
+class ReplyTooLargeError(ValueError):
+    """Raised when one value of a streamed reply exceeds the buffer cap."""
@@ -0,0 +1,15 @@
+"""Metrics for running Polycraft AI Lab (PAL) game instances.
+
+The bridge, client and environment record into the shared `REGISTRY`. A
+`MetricsServer` serves it locally in the Prometheus text format, and
+`pal status` draws it as a table that refreshes in place. A `Profiler` splits
+the time of each episode into phases and samples their stacks.
+"""
+
+from polycraft_lab.monitoring.metrics import MetricsRegistry, REGISTRY
+from polycraft_lab.monitoring.profiler import Profiler
+from polycraft_lab.monitoring.server import MetricsServer
+from polycraft_lab.monitoring.status import StatusView, watch_status
+
+__all__ = ['MetricsRegistry', 'REGISTRY', 'MetricsServer', 'Profiler',
+           'StatusView', 'watch_status']
@@ -0,0 +1,317 @@
+"""A small, thread-safe metrics registry with Prometheus text output.
+
+Metrics are cheap enough to update on every step: a counter increment or a
+histogram observation is a lock and an addition. Values that are expensive to
+read, like the memory of a game process, are gauges backed by a function that
+only runs when the metrics are collected.
+
+The metrics PAL records about its game instances are defined at the bottom of
+this module and labelled with the instance they belong to.
+"""
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Seconds, from 100 microseconds to 30 seconds
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1, 2.5, 5, 10, 30,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    """A named metric with one child per combination of label values."""
+
+    type_name = ''
+
+    def __init__(self, name: str, description: str,
+                 label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._children: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """Return the child metric for the given label values."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, **labels):
+        """Stop reporting the child with the given label values."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._children.pop(key, None)
+
+    def children(self) -> List[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.label_names, key)), child)
+                for key, child in items]
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _CounterValue:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class _GaugeValue:
+    def __init__(self):
+        self._value = 0.0
+        self._function: Callable[[], float] = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Compute the value with `function` whenever it is collected."""
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return math.nan
+        return self._value
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self._upper_bounds = list(buckets)
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[float], List[int], float]:
+        """Return the bucket bounds, their cumulative counts, and the sum."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return self._upper_bounds + [math.inf], cumulative, total
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket."""
+        bounds, cumulative, _ = self.snapshot()
+        count = cumulative[-1]
+        if count == 0:
+            return math.nan
+        rank = q * count
+        index = bisect.bisect_left(cumulative, rank)
+        lower = bounds[index - 1] if index > 0 else 0.0
+        upper = bounds[index]
+        if math.isinf(upper):
+            return lower
+        previous = cumulative[index - 1] if index > 0 else 0
+        in_bucket = cumulative[index] - previous
+        fraction = (rank - previous) / in_bucket if in_bucket else 1
+        return lower + (upper - lower) * fraction
+
+
+class Counter(_Metric):
+    """A value that only goes up, such as steps taken."""
+
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as memory use."""
+
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+
+class Histogram(_Metric):
+    """Observations counted into buckets, such as command latencies."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str,
+                 label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description, label_names)
+        self._buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self._buckets)
+
+
+class MetricsRegistry:
+    """A collection of metrics that can be exported together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str,
+                label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str,
+              label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(self, name: str, description: str,
+                  label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS
+                  ) -> Histogram:
+        return self.register(Histogram(name, description, label_names,
+                                       buckets))
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def to_prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for labels, child in metric.children():
+                if isinstance(child, _HistogramValue):
+                    bounds, cumulative, total = child.snapshot()
+                    for bound, count in zip(bounds, cumulative):
+                        bucket_labels = dict(labels, le=_format_value(bound))
+                        lines.append(f'{metric.name}_bucket'
+                                     f'{_format_labels(bucket_labels)} '
+                                     f'{count}')
+                    lines.append(f'{metric.name}_sum{_format_labels(labels)} '
+                                 f'{_format_value(total)}')
+                    lines.append(f'{metric.name}_count'
+                                 f'{_format_labels(labels)} {cumulative[-1]}')
+                else:
+                    lines.append(f'{metric.name}{_format_labels(labels)} '
+                                 f'{_format_value(child.get())}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> dict:
+        """Return a JSON-friendly snapshot, with histogram percentiles."""
+        snapshot = {}
+        for metric in self.metrics():
+            samples = []
+            for labels, child in metric.children():
+                if isinstance(child, _HistogramValue):
+                    _, cumulative, total = child.snapshot()
+                    value = {
+                        'count': cumulative[-1],
+                        'sum': total,
+                        'p50': _json_number(child.quantile(0.5)),
+                        'p90': _json_number(child.quantile(0.9)),
+                        'p99': _json_number(child.quantile(0.99)),
+                    }
+                else:
+                    value = _json_number(child.get())
+                samples.append({'labels': labels, 'value': value})
+            snapshot[metric.name] = {'type': metric.type_name,
+                                     'samples': samples}
+        return snapshot
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _json_number(value: float):
+    return None if math.isnan(value) or math.isinf(value) else value
+
+
+REGISTRY = MetricsRegistry()
+
+INSTANCE_UP = REGISTRY.gauge(
+    'pal_instance_up', 'Whether the bridge to a game instance is connected',
+    ['instance'])
+STEPS = REGISTRY.counter(
+    'pal_steps_total', 'Environment steps taken', ['instance'])
+COMMAND_LATENCY = REGISTRY.histogram(
+    'pal_command_latency_seconds', 'Round trip time of commands to the game',
+    ['instance'])
+INSTANCE_DEGRADED = REGISTRY.gauge(
+    'pal_instance_degraded',
+    'Whether a game instance timed out and has not caught up yet',
+    ['instance'])
+COMMAND_TIMEOUTS = REGISTRY.counter(
+    'pal_command_timeouts_total', 'Commands the game did not answer in time',
+    ['instance'])
+RECONNECTS = REGISTRY.counter(
+    'pal_reconnects_total', 'Failed attempts to connect to a game',
+    ['instance'])
+RESTARTS = REGISTRY.counter(
+    'pal_restarts_total', 'Times a game instance was started again',
+    ['instance'])
+JVM_RSS = REGISTRY.gauge(
+    'pal_jvm_rss_bytes', 'Resident memory of a game and its child processes',
+    ['instance'])
+SUBSCRIBER_LAG = REGISTRY.histogram(
+    'pal_subscriber_lag_seconds',
+    'Time from receiving a reply to handing it to a subscriber',
+    ['instance', 'subscriber'])
+SUBSCRIBER_BACKLOG = REGISTRY.gauge(
+    'pal_subscriber_backlog', 'Replies waiting to be handed to a subscriber',
+    ['instance', 'subscriber'])
+SUBSCRIBER_DROPPED = REGISTRY.counter(
+    'pal_subscriber_dropped_total',
+    'Replies a subscriber missed because its queue was full',
+    ['instance', 'subscriber'])
@@ -0,0 +1,96 @@
+"""Read resource usage of game processes.
+
+The game is started through Gradle, so the JVM that actually runs Minecraft is
+a child of the process PAL holds a handle on. Usage is summed over the whole
+process tree. On Linux this reads /proc directly; elsewhere psutil is used if
+it is installed.
+"""
+import os
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_PROC = Path('/proc')
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Return the resident memory in bytes of a process and its descendants.
+
+    Args:
+        pid (int): The root process
+
+    Returns:
+        The total resident set size, or None if it cannot be read on this
+        platform.
+    """
+    if _PROC.is_dir():
+        return sum(_proc_rss(child) for child in _proc_tree(pid))
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+    return None
+
+
+def process_tree(pid: int) -> List[int]:
+    """Return the ids of a process and its descendants, parents first.
+
+    Where the tree cannot be read on this platform, only `pid` is returned.
+    """
+    if _PROC.is_dir():
+        return _proc_tree(pid)
+    if psutil is not None:
+        try:
+            children = psutil.Process(pid).children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        return [pid] + [child.pid for child in children]
+    return [pid]
+
+
+def _proc_tree(pid: int) -> List[int]:
+    pids = [pid]
+    index = 0
+    while index < len(pids):
+        pids.extend(_proc_children(pids[index]))
+        index += 1
+    return pids
+
+
+def _proc_children(pid: int) -> List[int]:
+    children = []
+    try:
+        tasks = os.listdir(_PROC / str(pid) / 'task')
+    except OSError:
+        return children
+    for task in tasks:
+        try:
+            text = (_PROC / str(pid) / 'task' / task / 'children').read_text()
+        except OSError:
+            continue
+        children.extend(int(child) for child in text.split())
+    return children
+
+
+def _proc_rss(pid: int) -> int:
+    try:
+        with open(_PROC / str(pid) / 'status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024  # Reported in kB
+    except (OSError, ValueError):
+        pass
+    return 0
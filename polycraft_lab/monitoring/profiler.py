@@ -0,0 +1,335 @@
+"""Opt-in profiling of where the time of an episode goes.
+
+A `Profiler` answers two questions when throughput drops:
+
+- Which phase of an episode is slow, and is it computing or waiting? Code
+  wraps its phases in `profiler.phase(name)`. Each phase records its wall
+  time and the CPU time of its thread, so `wait = wall - cpu` is the time
+  spent blocked, mostly on the game. Phases nest, so the send of a step is
+  recorded as `step/send`. Totals are kept per episode and overall.
+- Which Python code is slow? A background thread samples the stacks of the
+  profiled threads every `sample_interval` seconds and counts them as
+  collapsed stacks, the input format of flamegraph.pl, speedscope and
+  inferno. Each stack starts with the phase it was sampled in, and ends in
+  `[waiting]` if its thread used less than half a CPU since the last sample.
+
+Both are cheap enough to leave on in production: a phase reads two clocks when
+it starts and ends, and sampling at 100 Hz costs a fraction of a percent. For
+native frames, attach py-spy to the process instead; it writes the same
+collapsed format.
+
+Results are written to a directory: `episodes.jsonl` gets one line per
+finished episode, and `close` writes `phases.json` and `stacks.collapsed`.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from polycraft_lab.installation import PAL_DEFAULT_PATH
+from polycraft_lab.installation.config import atomic_write_json
+
+log = logging.getLogger('pal').getChild('monitoring').getChild('profiler')
+
+PROFILES_PATH = PAL_DEFAULT_PATH / 'profiles'
+
+PHASES_FILE_NAME = 'phases.json'
+EPISODES_FILE_NAME = 'episodes.jsonl'
+STACKS_FILE_NAME = 'stacks.collapsed'
+
+DEFAULT_SAMPLE_INTERVAL = 0.01  # seconds
+
+PHASE_RESET = 'reset'
+PHASE_STEP = 'step'
+PHASE_SEND = 'send'
+PHASE_REWARD = 'reward'
+PHASE_AGENT = 'agent'
+
+WAITING_FRAME = '[waiting]'
+IDLE_PHASE = '[idle]'
+
+# Threads that used less than this share of a CPU between samples are waiting
+_WAITING_CPU_SHARE = 0.5
+
+
+def default_profile_directory() -> Path:
+    """Return a new directory under ~/polycraft-lab/profiles."""
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    return PROFILES_PATH / f'{stamp}-{os.getpid()}'
+
+
+class _PhaseTotals:
+    __slots__ = ('count', 'wall', 'cpu')
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def add(self, other: '_PhaseTotals'):
+        self.count += other.count
+        self.wall += other.wall
+        self.cpu += other.cpu
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'wall': self.wall, 'cpu': self.cpu,
+                'wait': max(0.0, self.wall - self.cpu)}
+
+
+class _ThreadState:
+    """The open phases and current episode of one profiled thread."""
+
+    def __init__(self):
+        self.phases: List[str] = []
+        self.episode: Dict[str, _PhaseTotals] = {}
+        try:
+            self.clock_id = time.pthread_getcpuclockid(threading.get_ident())
+        except (AttributeError, OSError):
+            self.clock_id = None
+        self.last_cpu: Optional[float] = None
+        self.last_sampled: Optional[float] = None
+
+    def cpu_time(self) -> Optional[float]:
+        """Return the CPU time of the thread, from any thread."""
+        if self.clock_id is None:
+            return None
+        try:
+            return time.clock_gettime(self.clock_id)
+        except OSError:  # The thread exited
+            return None
+
+
+class _Phase:
+    """Times one phase on the thread that entered it."""
+
+    __slots__ = ('_profiler', '_name', '_state', '_path', '_wall', '_cpu')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        state = self._state = self._profiler._thread_state()
+        parent = state.phases[-1] if state.phases else None
+        self._path = self._name if parent is None \
+            else f'{parent}/{self._name}'
+        state.phases.append(self._path)
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        self._state.phases.pop()
+        totals = self._state.episode.get(self._path)
+        if totals is None:
+            totals = self._state.episode[self._path] = _PhaseTotals()
+        totals.count += 1
+        totals.wall += wall
+        totals.cpu += cpu
+
+
+class Profiler:
+    """Times the phases of episodes and samples the stacks of their threads."""
+
+    def __init__(self, directory: Path = None,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL):
+        """
+        Args:
+            directory (Path): Where results are written, a new directory in
+                ~/polycraft-lab/profiles by default
+            sample_interval (float): Seconds between stack samples, or 0 to
+                only time phases
+        """
+        self.directory = Path(directory) if directory is not None \
+            else default_profile_directory()
+        self.sample_interval = sample_interval
+        self.episodes = 0
+        self.samples = 0
+        self._totals: Dict[str, _PhaseTotals] = {}
+        self._stacks: Counter = Counter()
+        self._threads: Dict[int, _ThreadState] = {}
+        self._local = threading.local()
+        self._labels: Dict[object, str] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler: threading.Thread = None
+        self._episodes_file = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self) -> 'Profiler':
+        """Start sampling stacks, if a sample interval is set."""
+        if self._sampler is None and self.sample_interval > 0:
+            self._stopped.clear()
+            self._sampler = threading.Thread(target=self._sample, daemon=True,
+                                             name='pal-profiler')
+            self._sampler.start()
+        return self
+
+    def phase(self, name: str) -> _Phase:
+        """Return a context manager that times a phase on this thread."""
+        return _Phase(self, name)
+
+    def end_episode(self, **details) -> Optional[dict]:
+        """Close the episode of this thread and record its phase totals.
+
+        Does nothing if no phase ran since the last episode ended.
+
+        Args:
+            **details: Extra values written along with the totals
+
+        Returns:
+            The record written to episodes.jsonl, or None
+        """
+        state = self._thread_state()
+        if not state.episode:
+            return None
+        episode, state.episode = state.episode, {}
+        record = dict(details)
+        record['thread'] = threading.current_thread().name
+        record['phases'] = {name: totals.to_dict()
+                            for name, totals in sorted(episode.items())}
+        with self._lock:
+            for name, totals in episode.items():
+                self._totals.setdefault(name, _PhaseTotals()).add(totals)
+            self.episodes += 1
+            record['episode'] = self.episodes
+            line = json.dumps(record) + '\n'
+            if self._episodes_file is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._episodes_file = (
+                    self.directory / EPISODES_FILE_NAME).open('a')
+            self._episodes_file.write(line)
+            self._episodes_file.flush()
+        return record
+
+    def summary(self) -> Dict[str, dict]:
+        """Return the totals of every phase over the finished episodes."""
+        with self._lock:
+            return {name: totals.to_dict()
+                    for name, totals in sorted(self._totals.items())}
+
+    def collapsed_stacks(self) -> List[str]:
+        """Return the sampled stacks as 'root;...;leaf count' lines."""
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return [f'{stack} {count}' for stack, count in stacks]
+
+    def save(self):
+        """Write the phase summary and the collapsed stacks."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(self.directory / PHASES_FILE_NAME, {
+            'episodes': self.episodes,
+            'samples': self.samples,
+            'sample_interval': self.sample_interval,
+            'phases': self.summary(),
+        })
+        if self.samples:
+            (self.directory / STACKS_FILE_NAME).write_text(
+                '\n'.join(self.collapsed_stacks()) + '\n')
+
+    def close(self):
+        """Stop sampling, end the episode of this thread and save results."""
+        if self._sampler is not None:
+            self._stopped.set()
+            self._sampler.join()
+            self._sampler = None
+        self.end_episode()
+        self.save()
+        with self._lock:
+            if self._episodes_file is not None:
+                self._episodes_file.close()
+                self._episodes_file = None
+        log.info('Profile written to %s', self.directory)
+
+    def _thread_state(self) -> _ThreadState:
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            state = self._local.state = _ThreadState()
+            with self._lock:
+                self._threads[threading.get_ident()] = state
+        return state
+
+    def _sample(self):
+        while not self._stopped.wait(self.sample_interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            with self._lock:
+                threads = list(self._threads.items())
+            sampled = []
+            for thread_id, state in threads:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                phases = state.phases
+                phase = phases[-1] if phases else IDLE_PHASE
+                stack = [phase]
+                stack.extend(self._stack_labels(frame))
+                cpu = state.cpu_time()
+                if cpu is not None and state.last_cpu is not None and \
+                        cpu - state.last_cpu < _WAITING_CPU_SHARE * (
+                        now - state.last_sampled):
+                    stack.append(WAITING_FRAME)
+                state.last_cpu, state.last_sampled = cpu, now
+                sampled.append(';'.join(stack))
+            del frames
+            with self._lock:
+                self._stacks.update(sampled)
+                self.samples += len(sampled)
+
+    def _stack_labels(self, frame) -> List[str]:
+        """Return the labels of a frame and its callers, outermost first."""
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                name = os.path.basename(code.co_filename)
+                label = self._labels[code] = \
+                    f'{code.co_name} ({name})'.replace(';', ':')
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return labels
+
+
+class NullProfiler:
+    """Stands in for a Profiler when profiling is off, at almost no cost."""
+
+    _PHASE = nullcontext()
+
+    def phase(self, name: str):
+        return self._PHASE
+
+    def end_episode(self, **details):
+        return None
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def format_summary(summary: Dict[str, dict]) -> str:
+    """Return a table of phase totals, with the share spent waiting."""
+    lines = [f'{"phase":<24}{"count":>10}{"wall s":>12}{"cpu s":>12}'
+             f'{"waiting":>10}']
+    for name, totals in summary.items():
+        waiting = totals['wait'] / totals['wall'] if totals['wall'] else 0
+        lines.append(f'{name:<24}{totals["count"]:>10}{totals["wall"]:>12.3f}'
+                     f'{totals["cpu"]:>12.3f}{waiting:>10.0%}')
+    return '\n'.join(lines)
@@ -0,0 +1,137 @@
+"""A local HTTP endpoint that serves the metrics registry.
+
+`/metrics` returns the Prometheus text format, so the endpoint can be scraped
+directly. `/status.json` returns the same values as JSON, with histogram
+percentiles already computed, which is what `pal status` reads.
+"""
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional, Tuple
+
+from polycraft_lab.monitoring.metrics import MetricsRegistry, REGISTRY
+
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_METRICS_PORT = 9464
+
+PATH_METRICS = '/metrics'
+PATH_STATUS = '/status.json'
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+log = logging.getLogger('pal').getChild('monitoring')
+
+
+class MetricsServer:
+    """Serve a metrics registry over HTTP from a background thread.
+
+    Metrics are only formatted when a request arrives, so an idle server
+    costs nothing beyond its thread.
+    """
+
+    def __init__(self, host: str = DEFAULT_METRICS_HOST,
+                 port: int = DEFAULT_METRICS_PORT,
+                 registry: MetricsRegistry = REGISTRY):
+        """
+        Args:
+            host (str): The interface to listen on, only localhost by default
+            port (int): The port to listen on, or 0 for any free port
+            registry (MetricsRegistry): The metrics to serve
+        """
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        """The host and port the server is listening on."""
+        if self._server is None:
+            return self.host, self.port
+        return self._server.server_address[:2]
+
+    @property
+    def url(self) -> str:
+        host, port = self.address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == PATH_METRICS:
+                    body = registry.to_prometheus().encode('utf-8')
+                    content_type = PROMETHEUS_CONTENT_TYPE
+                elif path == PATH_STATUS:
+                    body = json.dumps(registry.to_dict()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('Metrics request: ' + format, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='pal-metrics', daemon=True)
+        self._thread.start()
+        log.debug('Serving metrics at %s', self.url)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+@contextmanager
+def serve_metrics(port: Optional[int] = DEFAULT_METRICS_PORT,
+                  host: str = DEFAULT_METRICS_HOST
+                  ) -> Iterator[Optional[MetricsServer]]:
+    """Serve the default registry for the duration of a `with` block.
+
+    Metrics are optional, so a port that is already taken, for example by
+    another PAL process, only logs a warning.
+
+    Args:
+        port (int): The port to serve on, or None to not serve metrics
+
+    Yields:
+        The running server, or None if metrics are not being served
+    """
+    if port is None:
+        yield None
+        return
+    server = MetricsServer(host, port)
+    try:
+        server.start()
+    except OSError as e:
+        log.warning('Could not serve metrics on port %s: %s', port, e)
+        yield None
+        return
+    try:
+        yield server
+    finally:
+        server.stop()
@@ -0,0 +1,132 @@
+"""The `pal status` terminal view.
+
+The view polls the JSON snapshot of a `MetricsServer` and draws one row per
+game instance. Steps per second are computed from the change in the step
+counter between two polls, so the server itself never tracks rates.
+"""
+import json
+import sys
+import time
+import urllib.request
+from typing import Dict, Optional, TextIO
+
+from polycraft_lab.monitoring.server import DEFAULT_METRICS_HOST, \
+    DEFAULT_METRICS_PORT, PATH_STATUS
+
+DEFAULT_STATUS_URL = f'http://{DEFAULT_METRICS_HOST}:{DEFAULT_METRICS_PORT}'
+DEFAULT_REFRESH_INTERVAL = 1.0  # seconds
+
+# Move the cursor home and clear the screen
+_CLEAR_SCREEN = '\x1b[H\x1b[2J'
+
+_MEGABYTE = 1024 * 1024
+
+
+def fetch_status(url: str = DEFAULT_STATUS_URL, timeout: float = 2) -> dict:
+    """Return the metrics snapshot served at `url`.
+
+    Raises:
+        OSError: If the endpoint cannot be reached
+    """
+    with urllib.request.urlopen(url.rstrip('/') + PATH_STATUS,
+                                timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+class StatusView:
+    """Turns successive metric snapshots into a per-instance table."""
+
+    def __init__(self):
+        self._last_steps: Dict[str, float] = {}
+        self._last_time: Optional[float] = None
+
+    def instances(self, snapshot: dict, now: float = None) -> Dict[str, dict]:
+        """Return the values shown for each instance, keyed by its name."""
+        now = time.monotonic() if now is None else now
+        elapsed = None if self._last_time is None else now - self._last_time
+        rows: Dict[str, dict] = {}
+
+        def row(labels):
+            return rows.setdefault(labels.get('instance', '?'), {
+                'up': None, 'steps': 0, 'steps_per_sec': None,
+                'p50': None, 'p99': None, 'reconnects': 0, 'restarts': 0,
+                'rss': None,
+            })
+
+        for name, key in [('pal_instance_up', 'up'),
+                          ('pal_steps_total', 'steps'),
+                          ('pal_reconnects_total', 'reconnects'),
+                          ('pal_restarts_total', 'restarts'),
+                          ('pal_jvm_rss_bytes', 'rss')]:
+            for sample in snapshot.get(name, {}).get('samples', []):
+                row(sample['labels'])[key] = sample['value']
+        latency = snapshot.get('pal_command_latency_seconds', {})
+        for sample in latency.get('samples', []):
+            values = row(sample['labels'])
+            values['p50'] = sample['value']['p50']
+            values['p99'] = sample['value']['p99']
+
+        for instance, values in rows.items():
+            previous = self._last_steps.get(instance)
+            if elapsed and previous is not None:
+                values['steps_per_sec'] = (values['steps'] - previous) / elapsed
+            self._last_steps[instance] = values['steps']
+        self._last_time = now
+        return rows
+
+    def render(self, snapshot: dict, now: float = None) -> str:
+        """Return the status table for a snapshot."""
+        rows = self.instances(snapshot, now)
+        lines = [f'{"instance":<22}{"up":>4}{"steps":>10}{"steps/s":>10}'
+                 f'{"p50 ms":>9}{"p99 ms":>9}{"reconn":>8}{"restart":>9}'
+                 f'{"rss MB":>9}']
+        for instance, values in sorted(rows.items()):
+            up = {None: '-', 0: 'no', 1: 'yes'}.get(values['up'], '?')
+            lines.append(
+                f'{instance:<22}{up:>4}{int(values["steps"]):>10}'
+                f'{_format(values["steps_per_sec"], 1):>10}'
+                f'{_format(values["p50"], 2, 1e3):>9}'
+                f'{_format(values["p99"], 2, 1e3):>9}'
+                f'{int(values["reconnects"]):>8}{int(values["restarts"]):>9}'
+                f'{_format(values["rss"], 0, 1 / _MEGABYTE):>9}')
+        if not rows:
+            lines.append('No game instances are reporting metrics.')
+        alive = sum(1 for values in rows.values() if values['up'] == 1)
+        lines.append(f'{alive} of {len(rows)} instance(s) connected')
+        return '\n'.join(lines)
+
+
+def _format(value: Optional[float], digits: int, scale: float = 1) -> str:
+    if value is None:
+        return '-'
+    return f'{value * scale:.{digits}f}'
+
+
+def watch_status(url: str = DEFAULT_STATUS_URL,
+                 interval: float = DEFAULT_REFRESH_INTERVAL,
+                 once: bool = False, out: TextIO = sys.stdout):
+    """Draw the status table until interrupted, refreshing it in place.
+
+    Args:
+        url (str): The metrics endpoint to poll
+        interval (float): Seconds between refreshes
+        once (bool): Print the table a single time and return
+        out: Where to draw the table. The screen is only redrawn in place
+            when this is a terminal.
+
+    Raises:
+        OSError: If the endpoint cannot be reached
+    """
+    view = StatusView()
+    in_place = out.isatty() and not once
+    while True:
+        table = view.render(fetch_status(url))
+        if in_place:
+            out.write(_CLEAR_SCREEN)
+            table += f'\n\n{url}, refreshing every {interval:g}s. ' \
+                     f'Press Ctrl + C to exit.'
+        out.write(table + '\n')
+        out.flush()
+        if once:
+            return
+        time.sleep(interval)
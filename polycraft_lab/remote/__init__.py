@@ -0,0 +1,11 @@
+"""Run Polycraft environments on other machines.
+
+`pal worker` starts a `PolycraftWorker` daemon that lends the game instances
+of its machine to remote learners, which use them through
+`RemotePolycraftEnv` and `RemoteVectorEnv`.
+"""
+
+from polycraft_lab.remote.env import RemotePolycraftEnv, RemoteVectorEnv
+from polycraft_lab.remote.worker import PolycraftWorker
+
+__all__ = ['PolycraftWorker', 'RemotePolycraftEnv', 'RemoteVectorEnv']
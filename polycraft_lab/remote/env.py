@@ -0,0 +1,204 @@
+"""Learner-side environments that run on remote `pal worker` daemons.
+
+`RemoteVectorEnv` spreads environments over several workers. Each step sends
+one request to every worker before reading any reply, so a step costs a single
+network round trip no matter how many workers or environments take part.
+"""
+import logging
+import socket
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+from polycraft_lab.remote.protocol import OP_CLOSE, OP_HELLO, OP_OPEN, \
+    OP_RESET, OP_STEP, RemoteError, receive_message, send_message
+
+log = logging.getLogger('pal').getChild('remote').getChild('env')
+
+DEFAULT_CONNECT_TIMEOUT = 10  # seconds
+
+Address = Union[Tuple[str, int], str]
+
+
+def parse_address(address: Address) -> Tuple[str, int]:
+    """Return (host, port) from a pair or a 'host:port' string."""
+    if isinstance(address, str):
+        host, _, port = address.rpartition(':')
+        return host, int(port)
+    host, port = address
+    return host, int(port)
+
+
+class WorkerConnection:
+    """A connection to one worker daemon."""
+
+    def __init__(self, address: Address, token: str = None,
+                 timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        """Connect and introduce ourselves to the worker.
+
+        Args:
+            address: The worker's (host, port) or 'host:port'
+            token (str): The worker's shared token, if it requires one
+            timeout (float): Seconds to wait for the connection
+        """
+        self.address = parse_address(address)
+        self._socket = socket.create_connection(self.address, timeout=timeout)
+        self._socket.settimeout(None)  # Steps may legitimately take a while
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.envs: List[int] = []
+        try:
+            hello = self.request({'op': OP_HELLO, 'token': token})
+        except BaseException:
+            self._socket.close()
+            raise
+        self.worker_name = hello['worker']
+        self.capacity = hello['capacity']
+
+    def send(self, message: dict):
+        send_message(self._socket, message)
+
+    def receive(self) -> dict:
+        """Read the reply to the oldest outstanding request.
+
+        Raises:
+            RemoteError: If the worker could not carry out the request
+        """
+        reply = receive_message(self._socket)
+        if not reply.get('ok'):
+            raise RemoteError(f'Worker {self.address[0]}:{self.address[1]}: '
+                              f'{reply.get("error")}')
+        return reply
+
+    def request(self, message: dict) -> dict:
+        self.send(message)
+        return self.receive()
+
+    def open(self, count: int, mission: str, options: dict = None):
+        reply = self.request({'op': OP_OPEN, 'count': count,
+                              'mission': mission, 'options': options or {}})
+        self.envs = reply['envs']
+
+    def close(self):
+        try:
+            self.request({'op': OP_CLOSE})
+        except (OSError, RemoteError):
+            pass  # The worker closes our environments when we disconnect
+        finally:
+            self._socket.close()
+
+
+class RemoteVectorEnv:
+    """Environments spread over one or more remote workers.
+
+    Environments are numbered worker by worker, in the order the workers are
+    given.
+    """
+
+    def __init__(self, workers: Sequence[Address], mission: str,
+                 envs_per_worker: int = 1, options: dict = None,
+                 token: str = None):
+        """
+        Args:
+            workers: The address of every worker to use
+            mission (str): The mission to run, as a path on the workers
+            envs_per_worker (int): How many environments to open on each
+            options (dict): Passed to the workers' environment factories, e.g.
+                {"fast_reset": true}
+            token (str): The workers' shared token, if they require one
+        """
+        self._connections: List[WorkerConnection] = []
+        try:
+            for address in workers:
+                connection = WorkerConnection(address, token)
+                self._connections.append(connection)
+                connection.open(envs_per_worker, mission, options)
+        except BaseException:
+            self.close()
+            raise
+        self.num_envs = sum(len(connection.envs)
+                            for connection in self._connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def reset(self) -> list:
+        """Reset every environment and return their initial observations."""
+        replies = self._round_trip([
+            {'op': OP_RESET, 'envs': connection.envs}
+            for connection in self._connections])
+        return [observation for reply in replies
+                for observation in reply['observations']]
+
+    def step(self, actions: Sequence) -> Tuple[list, np.ndarray,
+                                               np.ndarray, List[dict]]:
+        """Step every environment with its action.
+
+        Returns:
+            Lists of observations and infos, and arrays of rewards and dones
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError(f'Expected {self.num_envs} actions, '
+                             f'got {len(actions)}')
+        requests = []
+        start = 0
+        for connection in self._connections:
+            end = start + len(connection.envs)
+            requests.append({'op': OP_STEP, 'envs': connection.envs,
+                             'actions': list(actions[start:end])})
+            start = end
+        results = [result for reply in self._round_trip(requests)
+                   for result in reply['results']]
+        observations = [result[0] for result in results]
+        rewards = np.array([result[1] for result in results],
+                           dtype=np.float32)
+        dones = np.array([result[2] for result in results], dtype=np.bool_)
+        infos = [result[3] for result in results]
+        return observations, rewards, dones, infos
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+    def _round_trip(self, requests: List[dict]) -> List[dict]:
+        """Send a request to every worker, then collect every reply."""
+        for connection, request in zip(self._connections, requests):
+            connection.send(request)
+        replies = []
+        error = None
+        for connection in self._connections:
+            # Read every reply, even after an error, to keep connections usable
+            try:
+                replies.append(connection.receive())
+            except RemoteError as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return replies
+
+
+class RemotePolycraftEnv:
+    """A single environment on a remote worker, used like a PolycraftEnv."""
+
+    def __init__(self, worker: Address, mission: str, options: dict = None,
+                 token: str = None):
+        self._envs = RemoteVectorEnv([worker], mission, 1, options, token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def reset(self):
+        return self._envs.reset()[0]
+
+    def step(self, action) -> Tuple[object, float, bool, dict]:
+        observations, rewards, dones, infos = self._envs.step([action])
+        return observations[0], float(rewards[0]), bool(dones[0]), infos[0]
+
+    def close(self):
+        self._envs.close()
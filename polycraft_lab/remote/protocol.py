@@ -0,0 +1,84 @@
+"""The message format between `pal worker` daemons and remote learners.
+
+Every message is a JSON object framed by its length as a 4-byte big-endian
+integer, so either side can read a whole message without scanning for a
+delimiter. Requests carry an `op` naming what to do and replies carry `ok`,
+plus an `error` when it is False.
+
+    hello  {"token"}                     -> {"worker", "capacity", "version"}
+    open   {"count", "mission", "options"} -> {"envs": [env ids]}
+    reset  {"envs"}                      -> {"observations"}
+    step   {"envs", "actions"}           -> {"results": [[obs, reward, done,
+                                                          info], ...]}
+    close  {}                            -> {}
+
+`reset` and `step` act on every listed environment in one round trip.
+"""
+import json
+import socket
+import struct
+
+PROTOCOL_VERSION = 1
+
+OP_HELLO = 'hello'
+OP_OPEN = 'open'
+OP_RESET = 'reset'
+OP_STEP = 'step'
+OP_CLOSE = 'close'
+
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024  # 256 MiB
+
+_HEADER = struct.Struct('>I')
+
+
+def encode_message(message: dict) -> bytes:
+    """Return a message framed for sending."""
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return _HEADER.pack(len(payload)) + payload
+
+
+def send_message(connection: socket.socket, message: dict):
+    connection.sendall(encode_message(message))
+
+
+def receive_message(connection: socket.socket) -> dict:
+    """Read the next message from a connection.
+
+    Raises:
+        ConnectionClosedError: If the other side closed the connection
+        ProtocolError: If the message is too large or is not a JSON object
+    """
+    size, = _HEADER.unpack(_receive_exactly(connection, _HEADER.size))
+    if size > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f'Message of {size} bytes is too large')
+    try:
+        message = json.loads(_receive_exactly(connection, size))
+    except ValueError as e:
+        raise ProtocolError(f'Malformed message: {e}')
+    if not isinstance(message, dict):
+        raise ProtocolError('Messages must be JSON objects')
+    return message
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytearray:
+    data = bytearray(size)
+    view = memoryview(data)
+    filled = 0
+    while filled < size:
+        received = connection.recv_into(view[filled:])
+        if received == 0:
+            raise ConnectionClosedError()
+        filled += received
+    return data
+
+
+class ConnectionClosedError(ConnectionError):
+    """Raised when the other side closes the connection mid-conversation."""
+
+
+class ProtocolError(ValueError):
+    """Raised when a message does not follow the worker protocol."""
+
+
+class RemoteError(RuntimeError):
+    """Raised on the learner when a worker could not carry out a request."""
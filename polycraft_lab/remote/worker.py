@@ -0,0 +1,285 @@
+"""The `pal worker` daemon, which lends local game instances to remote learners.
+
+A worker owns a fixed pool of game slots. Each learner connection opens some
+of them as environments, and gives them back when it closes. Step and reset
+requests name several environments at once; the worker runs them in parallel,
+one thread per environment, and answers with a single reply.
+
+There is no encryption, and the only access control is an optional shared
+token, so workers listen on localhost unless told otherwise.
+"""
+import hmac
+import logging
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from polycraft_lab.ect.experiment_config import ExperimentConfig
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.installation import PAL_DEFAULT_PATH, PAL_MOD_DIR_NAME
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.installation.placement import ResourceLimits
+from polycraft_lab.remote.protocol import ConnectionClosedError, OP_CLOSE, \
+    OP_HELLO, OP_OPEN, OP_RESET, OP_STEP, PROTOCOL_VERSION, ProtocolError, \
+    receive_message, send_message
+
+log = logging.getLogger('pal').getChild('remote').getChild('worker')
+
+DEFAULT_WORKER_HOST = '127.0.0.1'
+DEFAULT_WORKER_PORT = 9100
+
+OPTION_EXPERIMENT = 'experiment'
+
+_SHUTDOWN_POLL_INTERVAL = 0.1  # seconds
+
+# Builds the environment for a game slot from a mission and the learner's
+# options, e.g. {"fast_reset": true, "experiment": "experiment.json"}
+EnvFactory = Callable[[int, str, dict], PolycraftEnv]
+
+
+def game_env_factory(games: Sequence[Tuple[str, int]] = None,
+                     placement: Sequence[ResourceLimits] = None
+                     ) -> EnvFactory:
+    """Return a factory for environments on real games.
+
+    Args:
+        games: The (host, port) of each game slot, for games that are already
+            running. When omitted, each slot launches the default
+            installation on a port of its own.
+        placement: The limits of the game launched for each slot, from
+            `plan_placement`
+    """
+    def factory(slot: int, mission: str, options: dict) -> PolycraftEnv:
+        options = dict(options)
+        experiment = options.pop(OPTION_EXPERIMENT, None)
+        if experiment is not None:
+            options['experiment_config'] = ExperimentConfig(experiment)
+        if games:
+            client = PolycraftClient.attach(*games[slot])
+        else:
+            client = PolycraftClient(
+                str(PAL_DEFAULT_PATH / PAL_MOD_DIR_NAME),
+                limits=placement[slot] if placement else None)
+            client.start()
+        return PolycraftEnv(mission, client=client, **options)
+    return factory
+
+
+class PolycraftWorker:
+    """Serves environments on local game instances to remote learners."""
+
+    def __init__(self, host: str = DEFAULT_WORKER_HOST,
+                 port: int = DEFAULT_WORKER_PORT, capacity: int = 1,
+                 env_factory: EnvFactory = None, token: str = None,
+                 name: str = None):
+        """
+        Args:
+            host (str): The interface to listen on
+            port (int): The port to listen on, or 0 for any free port
+            capacity (int): How many environments can be open at once
+            env_factory: Builds the environment for a slot, launching the
+                default installation by default
+            token (str): If set, learners must present it to connect
+            name (str): How the worker identifies itself, its hostname by
+                default
+        """
+        self.host = host
+        self.port = port
+        self.capacity = capacity
+        self.name = name or socket.gethostname()
+        self._env_factory = env_factory or game_env_factory()
+        self._token = token
+        self._free_slots = list(range(capacity))
+        self._slots_lock = threading.Lock()
+        self._server: Optional[socketserver.ThreadingTCPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        if self._server is None:
+            return self.host, self.port
+        return self._server.server_address[:2]
+
+    def start(self):
+        """Listen for learners in a background thread."""
+        self._bind()
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(_SHUTDOWN_POLL_INTERVAL,),
+                                        name='pal-worker', daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """Listen for learners until interrupted."""
+        self._bind()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _bind(self):
+        worker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP,
+                                        socket.TCP_NODELAY, 1)
+                _Session(worker, self.request).run()
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((self.host, self.port),
+                                                       Handler)
+        self._server.daemon_threads = True
+        log.info('Worker %s listening on %s:%s with %s slot(s)', self.name,
+                 *self.address, self.capacity)
+
+    def _take_slots(self, count: int) -> List[int]:
+        with self._slots_lock:
+            if count > len(self._free_slots):
+                raise WorkerBusyError(
+                    f'{count} environment(s) requested, '
+                    f'{len(self._free_slots)} of {self.capacity} free')
+            taken = self._free_slots[:count]
+            del self._free_slots[:count]
+            return taken
+
+    def _return_slots(self, slots: List[int]):
+        with self._slots_lock:
+            self._free_slots.extend(slots)
+            self._free_slots.sort()
+
+
+class _Session:
+    """One learner connection and the environments it opened."""
+
+    def __init__(self, worker: PolycraftWorker, connection: socket.socket):
+        self._worker = worker
+        self._connection = connection
+        self._envs: Dict[int, PolycraftEnv] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._greeted = worker._token is None
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    request = receive_message(self._connection)
+                except (ConnectionClosedError, OSError):
+                    return
+                op = request.get('op')
+                try:
+                    reply = self._dispatch(op, request)
+                except ProtocolError:
+                    raise
+                except Exception as e:
+                    log.exception('Request %s failed', op)
+                    reply = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+                send_message(self._connection, reply)
+                if op == OP_CLOSE:
+                    return
+        except (ProtocolError, OSError) as e:
+            log.warning('Dropping learner connection: %s', e)
+        finally:
+            self._close_envs()
+
+    def _dispatch(self, op: str, request: dict) -> dict:
+        if op == OP_HELLO:
+            return self._hello(request)
+        if not self._greeted:
+            raise PermissionError('Send hello with the worker token first')
+        if op == OP_OPEN:
+            return self._open(request)
+        if op == OP_RESET:
+            envs = self._envs_for(request)
+            return {'ok': True,
+                    'observations': self._map(lambda env: env.reset(), envs)}
+        if op == OP_STEP:
+            envs = self._envs_for(request)
+            actions = request['actions']
+            if len(actions) != len(envs):
+                raise ValueError(f'{len(actions)} actions for {len(envs)} '
+                                 f'environments')
+            results = self._map(lambda pair: list(pair[0].step(pair[1])),
+                                list(zip(envs, actions)))
+            return {'ok': True, 'results': results}
+        if op == OP_CLOSE:
+            self._close_envs()
+            return {'ok': True}
+        raise ProtocolError(f'Unknown op {op}')
+
+    def _hello(self, request: dict) -> dict:
+        token = self._worker._token
+        if token is not None and not hmac.compare_digest(
+                str(request.get('token', '')), token):
+            raise PermissionError('Invalid worker token')
+        self._greeted = True
+        return {'ok': True, 'worker': self._worker.name,
+                'capacity': self._worker.capacity,
+                'version': PROTOCOL_VERSION}
+
+    def _open(self, request: dict) -> dict:
+        count = int(request.get('count', 1))
+        slots = self._worker._take_slots(count)
+        opened = []
+        try:
+            for slot in slots:
+                self._envs[slot] = self._worker._env_factory(
+                    slot, request['mission'], request.get('options', {}))
+                opened.append(slot)
+        except BaseException:
+            for slot in opened:
+                self._envs.pop(slot).__exit__(None, None, None)
+            self._worker._return_slots(slots)
+            raise
+        if self._pool is not None:
+            self._pool.shutdown()
+        self._pool = ThreadPoolExecutor(max_workers=len(self._envs),
+                                        thread_name_prefix='pal-worker-env')
+        return {'ok': True, 'envs': slots}
+
+    def _envs_for(self, request: dict) -> List[PolycraftEnv]:
+        try:
+            return [self._envs[env_id] for env_id in request['envs']]
+        except KeyError as e:
+            raise ValueError(f'Environment {e} is not open on this connection')
+
+    def _map(self, function, items: list) -> list:
+        if len(items) == 1 or self._pool is None:
+            return [function(item) for item in items]
+        return list(self._pool.map(function, items))
+
+    def _close_envs(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        slots = list(self._envs)
+        for env in self._envs.values():
+            try:
+                env.__exit__(None, None, None)
+            except Exception:
+                log.exception('Could not close an environment')
+        self._envs.clear()
+        if slots:
+            self._worker._return_slots(slots)
+
+
+class WorkerBusyError(RuntimeError):
+    """Raised when a learner asks for more environments than are free."""
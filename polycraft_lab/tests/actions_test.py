@@ -0,0 +1,86 @@
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.envs.actions import InvalidActionSpecError, \
+    compile_action_spec
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+class ExperimentStub:
+    """The parts of ExperimentConfig that PolycraftEnv reads."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.reward = config.get('reward', {})
+
+
+CONFIG = {
+    'action_repeat': 2,
+    'macros': {
+        'forward_3': {'command': 'MOVE w', 'repeat': 3},
+        'craft': ['CRAFT stick', 'CRAFT pogo_stick', 'SENSE_INVENTORY'],
+    },
+    'reward': {'terms': [{'type': 'step', 'reward': -1}], 'max_steps': 4},
+}
+
+
+class ActionTableTestCase(unittest.TestCase):
+    """Verify actions expand into the right commands."""
+
+    def test_expand(self):
+        table = compile_action_spec(CONFIG)
+        self.assertEqual(table.expand('forward_3'), ('MOVE w',) * 3)
+        self.assertEqual(len(table.expand('craft')), 3)
+        self.assertEqual(table.expand('TURN 90'), ('TURN 90',) * 2)
+        # Macros stop at done unless the experiment opts into pipelining
+        self.assertFalse(table.pipeline)
+
+    def test_invalid_macro(self):
+        with self.assertRaises(InvalidActionSpecError):
+            compile_action_spec({'macros': {'bad': {'repeat': 2}}})
+
+    def test_empty_macro(self):
+        with self.assertRaises(InvalidActionSpecError):
+            compile_action_spec({'macros': {'noop': []}})
+
+    def test_macro_repeat_below_one(self):
+        for repeat in (0, -1):
+            with self.assertRaises(InvalidActionSpecError):
+                compile_action_spec({'macros': {'noop': {'command': 'MOVE w',
+                                                         'repeat': repeat}}})
+
+
+class MacroStepTestCase(unittest.TestCase):
+    """Verify macro steps accumulate reward and stop when done."""
+
+    def _env(self, client, pipeline: bool) -> PolycraftEnv:
+        config = dict(CONFIG, pipeline_actions=pipeline)
+        return PolycraftEnv('mission.json', client=client,
+                            experiment_config=ExperimentStub(config))
+
+    def test_sequential_stops_at_done(self):
+        client = RecordingClient()
+        env = self._env(client, pipeline=False)
+        env.reset()
+        self.assertEqual(env.step('forward_3')[1], -3)
+        _, reward, done, info = env.step('craft')
+        self.assertEqual((reward, done, info['commands']), (-1, True, 1))
+        self.assertEqual(client.commands[-1], 'CRAFT stick')
+
+    def test_pipelined_over_socket(self):
+        with FakePolycraftServer(handler=lambda c: {'echo': c}) as server:
+            with self._env(PolycraftClient.attach(*server.address),
+                           pipeline=True) as env:
+                observation, reward, done, info = env.step('craft')
+                self.assertEqual(observation, {'echo': 'SENSE_INVENTORY'})
+                self.assertEqual((reward, done, info['commands']),
+                                 (-3, False, 3))
+                # The stream stays in sync after a pipelined step
+                self.assertEqual(env.step('forward_3')[0],
+                                 {'echo': 'MOVE w'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.bench.suite import BenchmarkResult, compare_to_baseline
+from polycraft_lab.installation.comms import PolycraftBridge
+
+
+class FakeServerTestCase(unittest.TestCase):
+    """Verify the fake server answers the bridge like the game would."""
+
+    def test_bridge_round_trip(self):
+        with FakePolycraftServer(reply_size=1024) as server:
+            bridge = PolycraftBridge(*server.address, None)
+            bridge.start(startup_delay=0)
+            try:
+                reply = bridge.send('SENSE_ALL')
+            finally:
+                bridge.disconnect()
+        self.assertEqual(reply['result'], 'SUCCESS')
+        self.assertEqual(server.commands_received, 1)
+
+    def test_custom_handler(self):
+        with FakePolycraftServer(handler=lambda c: {'echo': c}) as server:
+            bridge = PolycraftBridge(*server.address, None)
+            bridge.start(startup_delay=0)
+            try:
+                self.assertEqual(bridge.send('MOVE w'), {'echo': 'MOVE w'})
+            finally:
+                bridge.disconnect()
+
+
+class BaselineTestCase(unittest.TestCase):
+    """Verify regressions are flagged against a baseline."""
+
+    BASELINE = {'results': {
+        'fast': {'median': 1.0},
+        'slow': {'median': 1.0},
+    }}
+
+    def test_compare_to_baseline(self):
+        results = {
+            'fast': BenchmarkResult('fast', [1.1, 1.1, 1.1]).summary(),
+            'slow': BenchmarkResult('slow', [2.0, 2.0, 2.0]).summary(),
+            'new': BenchmarkResult('new', [5.0]).summary(),
+        }
+        regressions = compare_to_baseline(results, self.BASELINE,
+                                          tolerance=0.25)
+        self.assertEqual([regression.name for regression in regressions],
+                         ['slow'])
+        self.assertAlmostEqual(regressions[0].ratio, 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
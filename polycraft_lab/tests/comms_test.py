@@ -0,0 +1,49 @@
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.installation.comms import PROTOCOL_JSON, \
+    PROTOCOL_MSGPACK, PolycraftBridge, msgpack
+
+
+class ProtocolTestCase(unittest.TestCase):
+    """Verify reply framing and protocol negotiation on the bridge."""
+
+    def _bridge(self, server: FakePolycraftServer,
+                protocol: str = PROTOCOL_JSON) -> PolycraftBridge:
+        bridge = PolycraftBridge(*server.address, None, protocol=protocol)
+        bridge.start(startup_delay=0)
+        self.addCleanup(bridge.disconnect)
+        return bridge
+
+    def test_large_json_reply(self):
+        with FakePolycraftServer(reply_size=2 * 1024 * 1024) as server:
+            bridge = self._bridge(server)
+            for _ in range(3):
+                reply = bridge.send('SENSE_ALL')
+                self.assertEqual(reply['result'], 'SUCCESS')
+
+    def test_replies_split_from_one_buffer(self):
+        with FakePolycraftServer(handler=lambda c: {'echo': c}) as server:
+            bridge = self._bridge(server)
+            bridge._write('A')
+            bridge._write('B')
+            self.assertEqual(bridge._read_reply(), {'echo': 'A'})
+            self.assertEqual(bridge._read_reply(), {'echo': 'B'})
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_negotiated(self):
+        with FakePolycraftServer(reply_size=64 * 1024) as server:
+            bridge = self._bridge(server, PROTOCOL_MSGPACK)
+            self.assertEqual(bridge.protocol, PROTOCOL_MSGPACK)
+            reply = bridge.send('SENSE_ALL')
+            self.assertEqual(reply['blocks'][1]['pos'], [1, 64, -1])
+
+    def test_msgpack_falls_back_to_json(self):
+        with FakePolycraftServer(protocols=(PROTOCOL_JSON,)) as server:
+            bridge = self._bridge(server, PROTOCOL_MSGPACK)
+            self.assertEqual(bridge.protocol, PROTOCOL_JSON)
+            self.assertEqual(bridge.send('SENSE_ALL')['result'], 'SUCCESS')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import tempfile
+import unittest
+from multiprocessing import Process
+from pathlib import Path
+from unittest import mock
+
+from polycraft_lab.ect.experiment_config import ExperimentConfig
+from polycraft_lab.installation import config as config_module
+from polycraft_lab.installation.config import CONFIG_FILE_NAME, \
+    CONFIG_TEMPLATE, PolycraftLabConfig
+
+
+def _set_port(config_path: str, port: int):
+    PolycraftLabConfig.from_file(config_path).lab_server_port = port
+
+
+def _set_host(config_path: str, host: str):
+    PolycraftLabConfig.from_file(config_path).lab_server_host = host
+
+
+class ConfigEditTestCase(unittest.TestCase):
+    """Verify batched and concurrent config writes."""
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.config_path = Path(self._directory.name) / CONFIG_FILE_NAME
+        self.config_path.write_text(CONFIG_TEMPLATE)
+        self.config = PolycraftLabConfig.from_file(str(self.config_path))
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _read(self) -> dict:
+        return json.loads(self.config_path.read_text())
+
+    def test_single_set_writes_through(self):
+        self.config.lab_server_port = 9001
+        self.assertEqual(self._read()['lab']['server']['port'], 9001)
+
+    def test_edit_writes_once(self):
+        with mock.patch.object(config_module, 'atomic_write_json',
+                               wraps=config_module.atomic_write_json) as write:
+            with self.config.edit() as config:
+                config.lab_server_port = 9001
+                config.lab_server_host = '0.0.0.0'
+                self.assertEqual(self._read()['lab']['server']['port'], 9000)
+            self.assertEqual(write.call_count, 1)
+        self.assertEqual(self._read()['lab']['server'],
+                         {'host': '0.0.0.0', 'port': 9001})
+
+    def test_failed_edit_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self.config.edit() as config:
+                config.lab_server_port = 9001
+                raise RuntimeError
+        self.assertEqual(self.config.lab_server_port, 9000)
+        self.assertEqual(self._read()['lab']['server']['port'], 9000)
+
+    def test_concurrent_writers_merge(self):
+        writers = [
+            Process(target=_set_port, args=(str(self.config_path), 9005)),
+            Process(target=_set_host, args=(str(self.config_path), '10.0.0.1')),
+        ]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        self.assertEqual(self._read()['lab']['server'],
+                         {'host': '10.0.0.1', 'port': 9005})
+
+    def test_experiment_config_edit(self):
+        experiment_path = Path(self._directory.name) / 'experiment.json'
+        experiment_path.write_text(json.dumps({'action_space': {'a': {}}}))
+        experiment = ExperimentConfig(str(experiment_path), cache=None)
+        with experiment.edit() as config:
+            config.action_space = {'b': {}}
+            config.scenes = ['scene.json']
+        self.assertEqual(json.loads(experiment_path.read_text()),
+                         {'action_space': {'b': {}}, 'scenes': ['scene.json']})
+
+
+if __name__ == '__main__':
+    unittest.main()
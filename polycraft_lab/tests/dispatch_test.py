@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.installation.comms import PolycraftBridge
+from polycraft_lab.installation.dispatch import POLICY_BLOCK, \
+    POLICY_DROP_NEWEST, POLICY_DROP_OLDEST, ReplyDispatcher
+from polycraft_lab.monitoring.metrics import REGISTRY
+
+
+class ReplyDispatcherTestCase(unittest.TestCase):
+    """Verify replies reach subscribers without waiting on them."""
+
+    def setUp(self):
+        self.dispatcher = ReplyDispatcher('dispatch-test')
+        self.addCleanup(self.dispatcher.close)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _blocked_subscriber(self, received: list, **options):
+        """Subscribe a callback that waits until `release` is set."""
+
+        def callback(reply):
+            self.release.wait(5)
+            received.append(reply)
+
+        subscription = self.dispatcher.subscribe(callback, **options)
+        self.dispatcher.publish(-1)
+        # Wait until the worker holds the first reply, leaving the queue empty
+        while subscription.backlog:
+            time.sleep(0.001)
+        return subscription
+
+    def test_every_subscriber_gets_every_reply(self):
+        first, second = [], []
+        self.dispatcher.subscribe(first.append)
+        self.dispatcher.subscribe(second.append)
+        for index in range(100):
+            self.dispatcher.publish(index)
+        self.assertTrue(self.dispatcher.flush(5))
+        self.assertEqual(first, list(range(100)))
+        self.assertEqual(second, list(range(100)))
+
+    def test_slow_subscriber_does_not_block_publish(self):
+        received = []
+        subscription = self._blocked_subscriber(received, max_size=3)
+        started = time.perf_counter()
+        for index in range(10):
+            self.dispatcher.publish(index)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(subscription.dropped, 7)
+        self.assertGreater(subscription.lag, 0)
+        self.release.set()
+        self.assertTrue(subscription.flush(5))
+        self.assertEqual(received, [-1, 7, 8, 9])
+
+    def test_drop_newest(self):
+        received = []
+        subscription = self._blocked_subscriber(
+            received, max_size=2, policy=POLICY_DROP_NEWEST)
+        for index in range(5):
+            self.dispatcher.publish(index)
+        self.release.set()
+        subscription.flush(5)
+        self.assertEqual(received, [-1, 0, 1])
+        self.assertEqual(subscription.dropped, 3)
+
+    def test_block_waits_for_room(self):
+        received = []
+        subscription = self._blocked_subscriber(
+            received, max_size=1, policy=POLICY_BLOCK, block_timeout=5)
+        self.dispatcher.publish(0)
+        timer = threading.Timer(0.05, self.release.set)
+        timer.start()
+        self.dispatcher.publish(1)  # Waits until the subscriber catches up
+        timer.join()
+        subscription.flush(5)
+        self.assertEqual(received, [-1, 0, 1])
+        self.assertEqual(subscription.dropped, 0)
+
+    def test_block_times_out(self):
+        subscription = self._blocked_subscriber(
+            [], max_size=1, policy=POLICY_BLOCK, block_timeout=0.01)
+        self.dispatcher.publish(0)
+        self.dispatcher.publish(1)
+        self.assertEqual(subscription.dropped, 1)
+
+    def test_failing_subscriber_keeps_receiving(self):
+        received = []
+
+        def callback(reply):
+            if reply == 0:
+                raise RuntimeError('boom')
+            received.append(reply)
+
+        subscription = self.dispatcher.subscribe(callback, name='flaky')
+        self.dispatcher.publish(0)
+        self.dispatcher.publish(1)
+        subscription.flush(5)
+        self.assertEqual((received, subscription.errors), ([1], 1))
+
+    def test_metrics(self):
+        self.dispatcher.subscribe(lambda reply: None, name='metered',
+                                  policy=POLICY_DROP_OLDEST)
+        self.dispatcher.publish({})
+        self.dispatcher.flush(5)
+        lag = REGISTRY.to_dict()['pal_subscriber_lag_seconds']['samples']
+        self.assertIn({'instance': 'dispatch-test', 'subscriber': 'metered'},
+                      [sample['labels'] for sample in lag])
+
+    def test_duplicate_name_keeps_metrics(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.dispatcher.subscribe(lambda reply: release.wait(5),
+                                  name='recorder')
+        with self.assertRaises(ValueError):
+            self.dispatcher.subscribe(lambda reply: None, name='recorder')
+        for index in range(3):
+            self.dispatcher.publish(index)
+        backlog = REGISTRY.to_dict()['pal_subscriber_backlog']['samples']
+        [sample] = [sample for sample in backlog if sample['labels'] == {
+            'instance': 'dispatch-test', 'subscriber': 'recorder'}]
+        self.assertGreater(sample['value'], 0)
+
+    def test_unsubscribe(self):
+        received = []
+        subscription = self.dispatcher.subscribe(received.append)
+        self.dispatcher.publish(0)
+        self.dispatcher.unsubscribe(subscription)
+        self.dispatcher.publish(1)
+        self.assertEqual(received, [0])
+        self.assertFalse(self.dispatcher.has_subscribers)
+
+
+class BridgeSubscriberTestCase(unittest.TestCase):
+    """Verify the message callback of a bridge runs off the command path."""
+
+    def test_message_callback_receives_text(self):
+        texts = []
+        with FakePolycraftServer(handler=lambda c: {'echo': c}) as server:
+            bridge = PolycraftBridge(*server.address, texts.append)
+            bridge.start(startup_delay=0)
+            bridge.send_many(['A', 'B'])
+            bridge.disconnect()
+        self.assertEqual([json.loads(text) for text in texts],
+                         [{'echo': 'A'}, {'echo': 'B'}])
+
+    def test_disconnect_closes_subscribers(self):
+        with FakePolycraftServer(handler=lambda c: {'echo': c}) as server:
+            bridge = PolycraftBridge(*server.address, lambda text: None)
+            bridge.start(startup_delay=0)
+            bridge.send('A')
+            [subscription] = bridge.dispatcher.subscriptions
+            bridge.disconnect()
+        self.assertEqual(bridge.dispatcher.subscriptions, ())
+        self.assertFalse(subscription._thread.is_alive())
+        backlog = REGISTRY.to_dict()['pal_subscriber_backlog']['samples']
+        self.assertNotIn(bridge.instance_name,
+                         [sample['labels']['instance'] for sample in backlog])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from polycraft_lab.envs import frames as frames_module
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.envs.frames import FrameBuffer, FrameCaptureError, \
+    FrameTimeoutError
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+class _CapturingGame:
+    """Replies like a game that writes one frame when capture starts."""
+
+    def __init__(self):
+        self.buffer = None
+
+    def __call__(self, command: str) -> dict:
+        if command.startswith('CAPTURE -path'):
+            self.buffer = FrameBuffer(command.split()[2])
+            width, height = self.buffer.resolution
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+            frame[0, 0] = (255, 0, 0)
+            self.buffer.write(frame)
+        return {'result': 'SUCCESS'}
+
+
+class FrameBufferTestCase(unittest.TestCase):
+    """Verify frames written by one side are visible to the other."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'frames.bin'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_frames_are_shared(self):
+        reader = FrameBuffer(self.path, (4, 2))
+        writer = FrameBuffer(self.path)
+        self.assertEqual(writer.resolution, (4, 2))
+        frame = reader.frame
+        writer.write(np.full((2, 4, 3), 7, dtype=np.uint8))
+        self.assertEqual(reader.wait_for_frame(), 1)
+        self.assertEqual(frame.shape, (2, 4, 3))
+        self.assertTrue((frame == 7).all())
+        self.assertFalse(frame.flags.writeable)
+        copy = reader.snapshot()
+        writer.write(np.zeros((2, 4, 3), dtype=np.uint8))
+        self.assertTrue((copy == 7).all())
+        self.assertTrue((frame == 0).all())
+        reader.close()
+        self.assertFalse(self.path.exists())
+
+    def test_wait_times_out(self):
+        buffer = FrameBuffer(self.path, (1, 1))
+        with self.assertRaises(FrameTimeoutError):
+            buffer.wait_for_frame(timeout=0.01)
+        buffer.close()
+
+    def test_snapshot_waits_for_writer(self):
+        buffer = FrameBuffer(self.path, (1, 1))
+        buffer._header['sequence'] += 1  # A write that never finishes
+        with mock.patch.object(frames_module.time, 'sleep',
+                               wraps=frames_module.time.sleep) as sleep:
+            with self.assertRaises(FrameTimeoutError):
+                buffer.snapshot(timeout=0.05)
+        self.assertTrue(sleep.called)
+        buffer.close()
+
+
+class RenderTestCase(unittest.TestCase):
+    """Verify rgb_array rendering through PolycraftEnv."""
+
+    def test_render_rgb_array(self):
+        game = _CapturingGame()
+        client = RecordingClient(game)
+        env = PolycraftEnv('mission.json', client=client,
+                           render_resolution=(8, 6), frame_skip=4)
+        frame = env.render('rgb_array')
+        self.assertEqual(frame.shape, (6, 8, 3))
+        self.assertEqual(frame.dtype, np.uint8)
+        self.assertEqual(tuple(frame[0, 0]), (255, 0, 0))
+        self.assertIs(env.render('rgb_array').base, frame.base)
+        self.assertEqual(len(client.commands), 1)
+        self.assertTrue(client.commands[0].endswith(
+            '-width 8 -height 6 -skip 4'))
+        with env:
+            pass
+        self.assertEqual(client.commands[-1], 'CAPTURE_STOP')
+        self.assertFalse(game.buffer.path.exists())
+
+    def test_render_without_game_support(self):
+        client = RecordingClient(lambda command: {'result': 'FAIL',
+                                                  'message': 'Unknown'})
+        env = PolycraftEnv('mission.json', client=client)
+        with self.assertRaises(FrameCaptureError):
+            env.render('rgb_array')
+
+
+if __name__ == '__main__':
+    unittest.main()
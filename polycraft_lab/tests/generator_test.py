@@ -0,0 +1,96 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.ect.generator import InvalidTemplateError, \
+    MANIFEST_FILE_NAME, MissionTemplate, find_mission, generate_missions
+from polycraft_lab.ect.mission_cache import MissionCache
+
+TEMPLATE = {
+    'name': 'trees',
+    'seed': 3,
+    'variants': 20,
+    'parameters': {
+        'count': {'type': 'int', 'low': 1, 'high': 5},
+        'biome': {'type': 'choice', 'values': ['forest', 'taiga']},
+    },
+    'mission': {'trees': '${count}', 'title': 'Trees in ${biome}'},
+}
+
+
+class MissionTemplateTest(unittest.TestCase):
+
+    def test_expand_substitutes_typed_values(self):
+        template = MissionTemplate(TEMPLATE)
+        mission = template.expand(0)
+        self.assertIsInstance(mission['trees'], int)
+        self.assertIn(mission['title'], ['Trees in forest', 'Trees in taiga'])
+        self.assertEqual(mission['pal_variant']['index'], 0)
+
+    def test_variants_are_reproducible(self):
+        first = MissionTemplate(TEMPLATE)
+        second = MissionTemplate(dict(TEMPLATE))
+        self.assertEqual([first.sample(i) for i in range(20)],
+                         [second.sample(i) for i in range(20)])
+        self.assertNotEqual(first.variant_seed(0), first.variant_seed(1))
+
+    def test_undefined_placeholder(self):
+        with self.assertRaises(InvalidTemplateError):
+            MissionTemplate(dict(TEMPLATE, mission={'a': '${missing}'}))
+
+    def test_unknown_parameter_type(self):
+        with self.assertRaises(InvalidTemplateError):
+            MissionTemplate(dict(TEMPLATE, parameters={'a': {'type': 'x'}}))
+
+
+class GenerateMissionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_manifest_indexes_every_variant(self):
+        template = MissionTemplate(TEMPLATE)
+        manifest = generate_missions(template, self.output, workers=1)
+        self.assertEqual(len(manifest), 20)
+        path = find_mission('trees-7', str(self.output / MANIFEST_FILE_NAME))
+        with path.open() as file:
+            self.assertEqual(json.load(file), template.expand(7))
+
+    def test_file_name_matches_mission_id(self):
+        manifest = generate_missions(MissionTemplate(TEMPLATE), self.output,
+                                     workers=1)
+        entry = manifest.missions['trees-0']
+        cache = MissionCache(persist=False)
+        self.assertEqual(cache.mission_id(str(manifest.mission_path('trees-0'))),
+                         entry['mission_id'])
+
+    def test_existing_variants_are_not_rewritten(self):
+        template = MissionTemplate(TEMPLATE)
+        generate_missions(template, self.output, workers=1)
+        before = {path.name: path.stat().st_mtime_ns
+                  for path in self.output.glob('trees-*.json')}
+        generate_missions(template, self.output, workers=1)
+        after = {path.name: path.stat().st_mtime_ns
+                 for path in self.output.glob('trees-*.json')}
+        self.assertEqual(before, after)
+
+    def test_fewer_variants_prunes_files(self):
+        template = MissionTemplate(TEMPLATE)
+        generate_missions(template, self.output, workers=1)
+        manifest = generate_missions(template, self.output, variants=5,
+                                     workers=1)
+        self.assertEqual(len(manifest), 5)
+        self.assertEqual(len(list(self.output.glob('trees-*.json'))), 5)
+
+    def test_process_pool_matches_inline(self):
+        template = MissionTemplate(TEMPLATE)
+        inline = generate_missions(template, self.output / 'inline',
+                                   workers=1)
+        pooled = generate_missions(template, self.output / 'pooled',
+                                   workers=2, chunk_size=4)
+        self.assertEqual(inline.missions, pooled.missions)
@@ -0,0 +1,83 @@
+import socket
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.installation.instances import InstanceRegistry, \
+    PortAllocator, PortUnavailableError
+
+
+def _free_port_range(size: int):
+    """Return a range of ports that were free a moment ago."""
+    for low in range(47000, 48000, size):
+        probes = []
+        try:
+            for port in range(low, low + size):
+                probe = socket.socket()
+                probes.append(probe)
+                probe.bind(('127.0.0.1', port))
+        except OSError:
+            continue
+        finally:
+            for probe in probes:
+                probe.close()
+        return low, low + size - 1
+    raise unittest.SkipTest('No free port range')
+
+
+class PortAllocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        self.port_range = _free_port_range(3)
+        self.allocator = PortAllocator(self.port_range, directory=self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_concurrent_reservations_get_different_ports(self):
+        low, high = self.port_range
+        reservations = [self.allocator.allocate() for _ in range(3)]
+        self.assertEqual([reservation.port for reservation in reservations],
+                         [low, low + 1, high])
+        with self.assertRaises(PortUnavailableError):
+            self.allocator.allocate()
+        reservations[1].release()
+        self.assertEqual(self.allocator.allocate().port, low + 1)
+
+    def test_ports_in_use_outside_pal_are_skipped(self):
+        low, _ = self.port_range
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', low))
+            server.listen()
+            self.assertEqual(self.allocator.allocate().port, low + 1)
+
+    def test_reserve_specific_port(self):
+        low, _ = self.port_range
+        reservation = self.allocator.reserve(low)
+        with self.assertRaises(PortUnavailableError):
+            self.allocator.reserve(low)
+        reservation.release()
+        reservation.acquire()
+        self.assertTrue(reservation.is_held)
+
+    def test_registry_lists_running_instances(self):
+        registry = InstanceRegistry(self.path)
+        first = self.allocator.allocate()
+        second = self.allocator.allocate()
+        first.register(pid=100, installation='/games/a')
+        second.register(pid=200, installation='/games/b')
+        self.assertEqual([record['pid'] for record in registry.instances()],
+                         [100, 200])
+        second.release()
+        self.assertEqual([record['pid'] for record in registry.instances()],
+                         [100])
+
+    def test_stale_records_are_removed(self):
+        reservation = self.allocator.allocate()
+        reservation.register(pid=100, installation='/games/a')
+        # Simulate a crashed owner: the lock is gone but the record is left
+        reservation._lock.release()
+        self.assertEqual(InstanceRegistry(self.path).instances(), [])
+        self.assertEqual(list(self.path.glob('instance-*.json')), [])
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from zipfile import ZipFile
+
+from polycraft_lab.installation.integrity import IntegrityManifest, \
+    InstallationCorruptedError
+
+FILES = {
+    'gradlew': b'#!/bin/sh\n',
+    'src/main/java/Mod.java': b'class Mod {}',
+    'src/main/resources/mcmod.info': b'{}',
+}
+
+
+class IntegrityManifestTestCase(unittest.TestCase):
+    """Verify broken files are found and repaired from the bundle."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name) / 'mod'
+        self.bundle = Path(self.directory.name) / 'bundle.zip'
+        with ZipFile(self.bundle, 'w') as bundle:
+            bundle.writestr('polycraft-master/', '')
+            for path, contents in FILES.items():
+                bundle.writestr(f'polycraft-master/{path}', contents)
+                (self.root / path).parent.mkdir(parents=True, exist_ok=True)
+                (self.root / path).write_bytes(contents)
+        IntegrityManifest.record(self.root, FILES, str(self.bundle),
+                                 '1.0').save()
+        self.manifest = IntegrityManifest.load(self.root)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_intact(self):
+        result = self.manifest.verify()
+        self.assertTrue(result.ok)
+        self.assertEqual(result.checked, 3)
+        self.assertEqual(result.hashed, 0)
+        self.assertEqual(self.manifest.verify(thorough=True).hashed, 3)
+
+    def test_quick_finds_missing_and_resized(self):
+        (self.root / 'gradlew').unlink()
+        (self.root / 'src/main/java/Mod.java').write_bytes(b'class')
+        result = self.manifest.verify()
+        self.assertEqual(result.missing, ['gradlew'])
+        self.assertEqual(result.corrupted, ['src/main/java/Mod.java'])
+
+    def test_touched_file_is_hashed_once(self):
+        path = self.root / 'src/main/resources/mcmod.info'
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.manifest.verify().hashed, 1)
+        reloaded = IntegrityManifest.load(self.root)
+        result = reloaded.verify()
+        self.assertTrue(result.ok)
+        self.assertEqual(result.hashed, 0)
+
+    def test_thorough_finds_same_size_change(self):
+        path = self.root / 'src/main/resources/mcmod.info'
+        stat = path.stat()
+        path.write_bytes(b'[]')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertTrue(self.manifest.verify().ok)
+        self.assertEqual(self.manifest.verify(thorough=True).corrupted,
+                         ['src/main/resources/mcmod.info'])
+
+    def test_repair(self):
+        (self.root / 'gradlew').unlink()
+        (self.root / 'src/main/java/Mod.java').write_bytes(b'broken')
+        self.manifest.repair(self.manifest.verify().broken)
+        self.assertTrue(IntegrityManifest.load(self.root).verify(
+            thorough=True).ok)
+        self.assertEqual((self.root / 'gradlew').read_bytes(),
+                         FILES['gradlew'])
+
+    def test_repair_without_bundle(self):
+        self.bundle.unlink()
+        with self.assertRaises(InstallationCorruptedError):
+            self.manifest.repair(['gradlew'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import io
+import platform
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.installation.game import PolycraftGame
+from polycraft_lab.installation.logs import CURRENT_SEGMENT_NAME, \
+    EVENT_EXCEPTION, EVENT_MISSION, LogIngester, LogStore, parse_line, \
+    parse_time, search_logs
+
+OUTPUT = b'''[10:00:00] [Client thread/INFO] [FML]: Loading mission pogo.json
+[10:00:01] [Server thread/ERROR]: Error handling command
+java.lang.NullPointerException: boom
+\tat net.polycraft.Commands.run(Commands.java:10)
+[10:00:02] [Client thread/INFO]: Done
+'''
+
+
+class ParseLineTestCase(unittest.TestCase):
+    """Verify game output is split into fields and tagged with events."""
+
+    def test_log_line(self):
+        record = parse_line('[10:00:00] [Client thread/WARN] [FML]: Slow')
+        self.assertEqual((record['l'], record['th'], record['s'],
+                          record['m']), ('WARN', 'Client thread', 'FML', 'Slow'))
+        self.assertNotIn('e', record)
+
+    def test_continuation_keeps_level(self):
+        record = parse_line('java.lang.IllegalStateException', 'ERROR')
+        self.assertEqual(record['l'], 'ERROR')
+        self.assertEqual(record['e'], EVENT_EXCEPTION)
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time('10m', now=1000), 400)
+        self.assertEqual(parse_time('1500'), 1500)
+        self.assertEqual(parse_time(12), 12)
+
+
+class LogStoreTestCase(unittest.TestCase):
+    """Verify output is ingested, rotated and searched."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _ingest(self, output: bytes = OUTPUT, **store_options) -> LogStore:
+        store = LogStore(self.root / 'game-9000', **store_options)
+        ingester = LogIngester(io.BytesIO(output), store).start()
+        ingester.join(5)
+        self.assertFalse(ingester.is_running)
+        return store
+
+    def test_ingest_and_query(self):
+        store = self._ingest()
+        self.assertFalse((store.directory / CURRENT_SEGMENT_NAME).exists())
+        [segment] = store.segments()
+        self.assertEqual(segment['records'], 5)
+        self.assertEqual(segment['events'], {EVENT_MISSION: 1,
+                                             EVENT_EXCEPTION: 2})
+        exceptions = list(store.query(events=[EVENT_EXCEPTION]))
+        self.assertEqual([record['message'] for record in exceptions], [
+            'java.lang.NullPointerException: boom',
+            '\tat net.polycraft.Commands.run(Commands.java:10)'])
+        self.assertEqual(exceptions[0]['level'], 'ERROR')
+        self.assertEqual(exceptions[0]['instance'], 'game-9000')
+        self.assertEqual(len(list(store.query(contains='Done'))), 1)
+        self.assertEqual(list(store.query(since=segment['end'] + 1)), [])
+
+    def test_rotation_keeps_latest_segments(self):
+        lines = b''.join(b'[10:00:00] [main/INFO]: line %d\n' % index
+                         for index in range(100))
+        store = self._ingest(lines, max_bytes=500, max_segments=3)
+        segments = store.segments()
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(len(list(store.directory.glob('*.gz'))), 3)
+        messages = [record['message'] for record in store.query()]
+        self.assertEqual(messages[-1], 'line 99')
+        self.assertEqual(len(messages),
+                         sum(segment['records'] for segment in segments))
+
+    def test_recovers_segment_of_crashed_process(self):
+        store = LogStore(self.root / 'game-9000')
+        store.append(parse_line('[10:00:00] [main/INFO]: before crash'))
+        store.flush()
+        # A new process finds the uncompressed segment and rotates it first
+        recovered = LogStore(self.root / 'game-9000')
+        recovered.append(parse_line('[10:00:00] [main/INFO]: after'))
+        recovered.close()
+        self.assertEqual(len(recovered.segments()), 2)
+        self.assertEqual([record['message'] for record in search_logs(
+            self.root)], ['before crash', 'after'])
+
+    def test_search_across_instances(self):
+        self._ingest()
+        other = LogStore(self.root / 'game-9001')
+        other.append(parse_line('[10:00:00] [main/ERROR]: other failed'))
+        other.close()
+        records = search_logs(self.root, levels=['ERROR'], limit=2)
+        self.assertEqual([record['instance'] for record in records],
+                         ['game-9000', 'game-9001'])
+        self.assertEqual(len(search_logs(self.root, instances=['game-9001'])),
+                         1)
+
+
+
+@unittest.skipUnless(platform.system() == 'Linux', 'Runs a shell script')
+class GameRestartTestCase(unittest.TestCase):
+    """Verify restarting a game keeps indexing its output in one store."""
+
+    def test_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            root = Path(directory)
+            gradlew = root / 'mod' / 'gradlew'
+            gradlew.parent.mkdir()
+            gradlew.write_text('#!/bin/sh\nfor i in 1 2 3; do '
+                               'echo "[10:00:00] [main/INFO]: line $i"; '
+                               'sleep 0.05; done\n')
+            gradlew.chmod(0o755)
+            game = PolycraftGame(str(gradlew.parent), port=9000,
+                                 log_directory=root / 'logs')
+            for _ in range(3):
+                game.start()
+            game._logs.join(5)
+            segments = LogStore(root / 'logs' / 'game-9000').segments()
+            self.assertEqual(sum(segment['records'] for segment in segments),
+                             9)
+            serials = [segment['serial'] for segment in segments]
+            self.assertEqual(len(set(serials)), len(serials))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.ect.experiment_config import ExperimentConfig, \
+    InvalidActionSpaceError
+from polycraft_lab.ect.mission_cache import MissionCache
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+class MissionCacheTestCase(unittest.TestCase):
+    """Verify missions are compiled once per version of the file."""
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self._directory.name)
+        self.cache = MissionCache(self.directory / 'cache')
+        self.mission_path = self.directory / 'mission.json'
+        self._write({'action_space': {'forward': {}}})
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _write(self, config: dict):
+        self.mission_path.write_text(json.dumps(config))
+
+    def test_cached_until_modified(self):
+        first = self.cache.load(str(self.mission_path))
+        self.assertIs(self.cache.load(str(self.mission_path)), first)
+
+        self._write({'action_space': {'forward': {}, 'jump': {}}})
+        stat = os.stat(self.mission_path)
+        os.utime(self.mission_path,
+                 ns=(stat.st_atime_ns, first.mtime_ns + 1_000_000))
+        second = self.cache.load(str(self.mission_path))
+        self.assertNotEqual(first.mission_id, second.mission_id)
+        self.assertIn('jump', second.config['action_space'])
+
+    def test_persisted_between_caches(self):
+        first = self.cache.load(str(self.mission_path))
+        other = MissionCache(self.directory / 'cache')
+        self.assertEqual(other.mission_id(str(self.mission_path)),
+                         first.mission_id)
+
+    def test_config_copies_are_independent(self):
+        compiled = self.cache.load(str(self.mission_path))
+        compiled.config['action_space'].clear()
+        self.assertTrue(compiled.config['action_space'])
+
+    def test_invalid_config_not_cached(self):
+        self._write({'action_space': {}})
+        with self.assertRaises(InvalidActionSpaceError):
+            ExperimentConfig(str(self.mission_path), self.cache)
+        with self.assertRaises(InvalidActionSpaceError):
+            ExperimentConfig(str(self.mission_path), self.cache)
+
+    def test_validated_after_loading_without_validator(self):
+        self._write({'action_space': {}})
+        self.cache.mission_id(str(self.mission_path))
+        with self.assertRaises(InvalidActionSpaceError):
+            ExperimentConfig(str(self.mission_path), self.cache)
+        other = MissionCache(self.directory / 'cache')
+        with self.assertRaises(InvalidActionSpaceError):
+            ExperimentConfig(str(self.mission_path), other)
+
+    def test_validated_once(self):
+        calls = []
+        ExperimentConfig(str(self.mission_path), self.cache)
+        compiled = self.cache.load(str(self.mission_path), calls.append)
+        compiled = self.cache.load(str(self.mission_path), calls.append)
+        # Bound methods are not told apart, so they run every time
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(compiled.validated), 1)
+        other = MissionCache(self.directory / 'cache')
+        self.assertEqual(
+            other.load(str(self.mission_path)).validated, compiled.validated)
+
+    def test_env_preloads_each_mission_once(self):
+        client = RecordingClient()
+        env = PolycraftEnv(str(self.mission_path), client=client,
+                           preload_missions=True, mission_cache=self.cache)
+        env.reset()
+        env.reset()
+        mission_id = self.cache.mission_id(str(self.mission_path))
+        self.assertEqual(client.commands, [
+            'START',
+            f'PRELOAD -d {self.mission_path} -id {mission_id}',
+            f'RESET -id {mission_id}',
+            'START',
+            f'RESET -id {mission_id}',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import json
+import math
+import unittest
+import urllib.request
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.monitoring.metrics import MetricsRegistry, STEPS
+from polycraft_lab.monitoring.server import MetricsServer
+from polycraft_lab.monitoring.status import StatusView, watch_status
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_prometheus_text(self):
+        steps = self.registry.counter('steps_total', 'Steps', ['instance'])
+        steps.labels(instance='a').inc()
+        steps.labels(instance='a').inc(2)
+        text = self.registry.to_prometheus()
+        self.assertIn('# TYPE steps_total counter', text)
+        self.assertIn('steps_total{instance="a"} 3.0', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram('latency', 'Latency',
+                                          buckets=[1, 2, 3])
+        for value in [0.5, 1.5, 1.5, 2.5, 10]:
+            latency.labels().observe(value)
+        text = self.registry.to_prometheus()
+        self.assertIn('latency_bucket{le="1.0"} 1', text)
+        self.assertIn('latency_bucket{le="2.0"} 3', text)
+        self.assertIn('latency_bucket{le="+Inf"} 5', text)
+        self.assertIn('latency_count 5', text)
+
+    def test_histogram_quantile_interpolates(self):
+        latency = self.registry.histogram('latency', 'Latency',
+                                          buckets=[1, 2])
+        child = latency.labels()
+        self.assertTrue(math.isnan(child.quantile(0.5)))
+        for _ in range(10):
+            child.observe(1.5)
+        self.assertAlmostEqual(child.quantile(0.5), 1.5)
+
+    def test_gauge_function_runs_on_collect(self):
+        calls = []
+        gauge = self.registry.gauge('rss', 'Memory')
+        gauge.labels().set_function(lambda: calls.append(1) or 42)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.registry.to_dict()['rss']['samples'][0]['value'],
+                         42)
+
+
+class MetricsServerTest(unittest.TestCase):
+
+    def test_bridge_metrics_are_served(self):
+        with FakePolycraftServer() as game, MetricsServer(port=0) as server:
+            client = PolycraftClient.attach(*game.address)
+            try:
+                client.send('MOVE w')
+            finally:
+                client.stop()
+            with urllib.request.urlopen(server.url + '/metrics') as response:
+                text = response.read().decode('utf-8')
+            with urllib.request.urlopen(server.url + '/status.json') as reply:
+                snapshot = json.loads(reply.read().decode('utf-8'))
+        instance = client.instance_name
+        self.assertIn(f'pal_command_latency_seconds_count{{instance='
+                      f'"{instance}"}}', text)
+        samples = snapshot['pal_instance_up']['samples']
+        self.assertIn({'labels': {'instance': instance}, 'value': 0},
+                      samples)
+
+    def test_status_view_computes_step_rate(self):
+        registry = MetricsRegistry()
+        steps = registry.counter(STEPS.name, STEPS.description,
+                                 STEPS.label_names).labels(instance='game')
+        view = StatusView()
+        steps.inc(10)
+        view.instances(registry.to_dict(), now=0)
+        steps.inc(50)
+        rows = view.instances(registry.to_dict(), now=2)
+        self.assertEqual(rows['game']['steps_per_sec'], 25)
+
+    def test_watch_once(self):
+        out = io.StringIO()
+        with MetricsServer(port=0, registry=MetricsRegistry()) as server:
+            watch_status(server.url, once=True, out=out)
+        self.assertIn('No game instances are reporting metrics.',
+                      out.getvalue())
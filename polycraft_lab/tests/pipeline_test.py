@@ -0,0 +1,164 @@
+import platform
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from pathlib import Path
+from zipfile import ZipFile, ZipInfo
+
+from polycraft_lab.installation import PAL_MOD_DIR_NAME
+from polycraft_lab.installation.download import MOD_ZIP_NAME, extract_bundle
+from polycraft_lab.installation.manager import InstallationBuildError, \
+    PolycraftInstallation
+from polycraft_lab.installation.pipeline import STATUS_DONE, \
+    STATUS_STARTED, InstallPipeline, InstallStage, \
+    InstallationCancelledError
+from polycraft_lab.installation.releases import PolycraftWorldRelease
+
+GRADLEW = '#!/bin/sh\necho "running $1" >> "$(dirname "$0")/gradle.log"\n'
+
+
+def _write_bundle(path: Path, gradlew: str = GRADLEW):
+    with ZipFile(path, 'w') as bundle:
+        bundle.writestr('polycraft-master/', '')
+        script = ZipInfo('polycraft-master/gradlew')
+        script.external_attr = 0o755 << 16
+        bundle.writestr(script, gradlew)
+        bundle.writestr('polycraft-master/build.gradle', 'apply plugin')
+        bundle.writestr('polycraft-master/src/main/java/Mod.java', 'class Mod')
+
+
+class InstallPipelineTestCase(unittest.TestCase):
+    """Verify stages run concurrently, in dependency order."""
+
+    def test_independent_stages_overlap(self):
+        both_running = threading.Barrier(2, timeout=5)
+        events = []
+
+        def wait_for_other(context):
+            both_running.wait()
+            return context.results['first'] + 1
+
+        pipeline = InstallPipeline([
+            InstallStage('first', lambda context: 1),
+            InstallStage('a', wait_for_other, requires=['first']),
+            InstallStage('b', wait_for_other, requires=['first']),
+            InstallStage('last', lambda context: context.results['a'],
+                         requires=['a', 'b']),
+        ], on_progress=events.append)
+        results = pipeline.run()
+        self.assertEqual(results['last'], 2)
+        self.assertEqual(set(pipeline.timings), {'first', 'a', 'b', 'last'})
+        statuses = [(event.stage, event.status) for event in events]
+        self.assertLess(statuses.index(('first', STATUS_DONE)),
+                        statuses.index(('a', STATUS_STARTED)))
+        self.assertEqual(statuses[-1], ('last', STATUS_DONE))
+
+    def test_failure_cancels_other_stages(self):
+        def fail(context):
+            raise ValueError('broken')
+
+        def run_until_cancelled(context):
+            while True:
+                context.report()
+                time.sleep(0.01)
+
+        ran = []
+        pipeline = InstallPipeline([
+            InstallStage('slow', run_until_cancelled),
+            InstallStage('fail', fail),
+            InstallStage('after', ran.append, requires=['fail']),
+        ])
+        with self.assertRaises(ValueError):
+            pipeline.run()
+        self.assertTrue(pipeline.is_cancelled)
+        self.assertEqual(ran, [])
+
+    def test_cancel_terminates_subprocess(self):
+        def sleep(context):
+            context.run([sys.executable, '-c',
+                         'import time; print("start", flush=True); '
+                         'time.sleep(60)'])
+
+        pipeline = InstallPipeline(
+            [InstallStage('sleep', sleep)],
+            on_progress=lambda event: event.message == 'start' and
+            pipeline.cancel())
+        started = time.monotonic()
+        with self.assertRaises(InstallationCancelledError):
+            pipeline.run()
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_unknown_requirement(self):
+        with self.assertRaises(ValueError):
+            InstallPipeline([InstallStage('a', print, requires=['b'])])
+
+
+@unittest.skipUnless(platform.system() == 'Linux', 'Runs a shell script')
+class PolycraftInstallPipelineTestCase(unittest.TestCase):
+    """Verify the installation stages with a local bundle."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.installation = PolycraftInstallation(str(self.root / 'lab'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _release(self, gradlew: str = GRADLEW) -> Future:
+        bundle = self.root / 'bundle.zip'
+        _write_bundle(bundle, gradlew)
+        release = Future()
+        release.set_result(PolycraftWorldRelease('1.0', bundle.as_uri(), ''))
+        return release
+
+    def test_extract_bundle(self):
+        bundle = self.root / 'bundle.zip'
+        _write_bundle(bundle)
+        extract_bundle(bundle, self.root / 'out',
+                       select=lambda path: path.startswith('src'))
+        self.assertEqual(
+            [path.relative_to(self.root / 'out').as_posix() for path in
+             (self.root / 'out').rglob('*') if path.is_file()],
+            ['src/main/java/Mod.java'])
+
+    def test_install(self):
+        self.installation.install_pipeline(
+            release=self._release(),
+            download_directory=str(self.root / 'download')).run()
+        mod = self.root / 'lab' / PAL_MOD_DIR_NAME
+        self.assertTrue((mod / 'src' / 'main' / 'java' / 'Mod.java').exists())
+        self.assertEqual((mod / 'gradle.log').read_text().split('\n')[:2],
+                         ['running setupDecompWorkspace', 'running build'])
+        self.assertFalse((self.root / 'download' / MOD_ZIP_NAME).exists())
+        self.assertTrue(self.installation.is_installed)
+        (mod / 'src' / 'main' / 'java' / 'Mod.java').unlink()
+        self.assertFalse(self.installation.is_installed)
+        self.installation.ensure_polycraft_installed()
+        self.assertTrue(self.installation.verify(thorough=True).ok)
+
+    def test_build_failure(self):
+        pipeline = self.installation.install_pipeline(
+            release=self._release('#!/bin/sh\necho "no java"\nexit 1\n'),
+            download_directory=str(self.root / 'download'))
+        with self.assertRaises(InstallationBuildError) as context:
+            pipeline.run()
+        self.assertIn('no java', str(context.exception))
+        self.assertFalse(self.installation.is_installed)
+
+    def test_failed_build_is_not_installed(self):
+        # The workspace is set up, but the build itself fails
+        gradlew = GRADLEW + '[ "$1" = build ] && exit 1\nexit 0\n'
+        pipeline = self.installation.install_pipeline(
+            release=self._release(gradlew),
+            download_directory=str(self.root / 'download'))
+        with self.assertRaises(InstallationBuildError):
+            pipeline.run()
+        self.assertFalse(self.installation.is_installed)
+
+
+if __name__ == '__main__':
+    unittest.main()
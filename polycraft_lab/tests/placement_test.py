@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.installation.placement import CpuTopology, \
+    POLICY_NODE, POLICY_NONE, POLICY_PACK, POLICY_SPREAD, ResourceLimits, \
+    parse_cpu_list, placement_from_config, plan_placement, supports_affinity
+
+# Two NUMA nodes of four CPUs, numbered like hyperthreaded Linux hosts
+TOPOLOGY = CpuTopology([[0, 1, 2, 3], [4, 5, 6, 7]])
+
+
+class PlanPlacementTestCase(unittest.TestCase):
+    """Verify instances are placed on CPUs by each policy."""
+
+    def _cpus(self, policy: str, count: int, **kwargs):
+        return [limits.cpus for limits in plan_placement(
+            count, policy, topology=TOPOLOGY, **kwargs)]
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(parse_cpu_list('0-2,8,10-11\n'), [0, 1, 2, 8, 10, 11])
+
+    def test_spread_alternates_nodes(self):
+        self.assertEqual(self._cpus(POLICY_SPREAD, 4),
+                         [[0, 1], [4, 5], [2, 3], [6, 7]])
+        placements = plan_placement(2, POLICY_SPREAD, topology=TOPOLOGY)
+        self.assertEqual([limits.node for limits in placements], [0, 1])
+
+    def test_pack_fills_first_node(self):
+        self.assertEqual(self._cpus(POLICY_PACK, 2, cpus_per_instance=2),
+                         [[0, 1], [2, 3]])
+
+    def test_overcommitted_instances_share_cpus(self):
+        cpus = self._cpus(POLICY_SPREAD, 10)
+        self.assertEqual(len(cpus), 10)
+        self.assertTrue(all(len(group) == 1 for group in cpus))
+        self.assertEqual(sorted(set(sum(cpus, []))), TOPOLOGY.cpus)
+
+    def test_node_and_none(self):
+        self.assertEqual(self._cpus(POLICY_NODE, 3),
+                         [TOPOLOGY.nodes[0], TOPOLOGY.nodes[1],
+                          TOPOLOGY.nodes[0]])
+        self.assertEqual(self._cpus(POLICY_NONE, 2), [None, None])
+
+    def test_from_config(self):
+        [limits] = placement_from_config(
+            {'policy': POLICY_NONE, 'nice': 5, 'memory_mb': 2}, 1)
+        self.assertEqual((limits.nice, limits.memory_bytes), (5, 2 * 2 ** 20))
+        with self.assertRaises(ValueError):
+            placement_from_config({'policy': 'random'}, 1)
+        with self.assertRaises(ValueError):
+            placement_from_config({'cpus': [0]}, 1)
+
+    def test_detect_from_sysfs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for node, cpus in [(0, '0'), (1, '99-100')]:
+                path = Path(directory) / f'node{node}'
+                path.mkdir()
+                (path / 'cpulist').write_text(cpus)
+            (Path(directory) / 'possible').write_text('0-1')
+            topology = CpuTopology.detect(directory)
+        # CPUs this process may not use are left out
+        self.assertEqual(topology.nodes[0], [0])
+        self.assertNotIn(99, topology.cpus)
+
+
+@unittest.skipUnless(supports_affinity(), 'CPU affinity is not supported')
+class ResourceLimitsTestCase(unittest.TestCase):
+    """Verify limits are applied to a started process."""
+
+    def test_apply_to_started_process(self):
+        cpu = min(os.sched_getaffinity(0))
+        limits = ResourceLimits([cpu], nice=3, memory_bytes=2 ** 40)
+        # The child reports its limits once told to, after they are applied
+        process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import os, resource, sys; sys.stdin.readline(); '
+             'print(sorted(os.sched_getaffinity(0)), os.nice(0), '
+             'resource.getrlimit(resource.RLIMIT_DATA)[0])'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        limits.apply(process.pid)
+        output = process.communicate(b'\n', timeout=30)[0].decode()
+        self.assertEqual(output.split(),
+                         [f'[{cpu}]', str(os.nice(0) + 3), str(2 ** 40)])
+
+    def test_command_prefix(self):
+        cpu = min(os.sched_getaffinity(0))
+        limits = ResourceLimits([cpu], nice=3, memory_bytes=2 ** 40)
+        prefix = limits.command_prefix()
+        if prefix is None:
+            self.skipTest('taskset, nice or prlimit is not installed')
+        output = subprocess.check_output(prefix + [
+            sys.executable, '-c',
+            'import os, resource; print(sorted(os.sched_getaffinity(0)), '
+            'os.nice(0), resource.getrlimit(resource.RLIMIT_DATA)[0])'],
+            timeout=30).decode()
+        self.assertEqual(output.split(),
+                         [f'[{cpu}]', str(os.nice(0) + 3), str(2 ** 40)])
+        self.assertEqual(ResourceLimits().command_prefix(), [])
+
+    def test_apply_to_tree(self):
+        cpu = min(os.sched_getaffinity(0))
+        limits = ResourceLimits([cpu], nice=3)
+        # Like Gradle, the process forks a child before it is limited
+        process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import subprocess, sys; child = subprocess.Popen([sys.executable,'
+             ' "-c", "import sys; sys.stdin.readline()"], '
+             'stdin=subprocess.PIPE); print(child.pid, flush=True); '
+             'sys.stdin.readline(); child.communicate(b"\\n")'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.addCleanup(process.wait, 30)
+        self.addCleanup(process.stdout.close)
+        self.addCleanup(process.stdin.close)
+        child = int(process.stdout.readline())
+        limits.apply_to_tree(process.pid)
+        for pid in (process.pid, child):
+            self.assertEqual(os.sched_getaffinity(pid), {cpu})
+            self.assertEqual(os.getpriority(os.PRIO_PROCESS, pid),
+                             os.nice(0) + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.monitoring.profiler import EPISODES_FILE_NAME, \
+    PHASES_FILE_NAME, Profiler, STACKS_FILE_NAME, WAITING_FRAME, \
+    format_summary
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+def _spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """Verify phases are timed and stacks are sampled."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_wait_and_compute(self):
+        profiler = Profiler(self.directory, sample_interval=0)
+        with profiler.phase('step'):
+            with profiler.phase('send'):
+                time.sleep(0.05)
+            _spin(0.05)
+        profiler.end_episode(mission='a.json')
+        summary = profiler.summary()
+        self.assertEqual(sorted(summary), ['step', 'step/send'])
+        send, step = summary['step/send'], summary['step']
+        self.assertGreater(send['wait'], 0.8 * send['wall'])
+        self.assertGreater(step['cpu'], 0.03)
+        self.assertGreaterEqual(step['wall'], 0.1)
+        self.assertIn('step/send', format_summary(summary))
+
+    def test_files(self):
+        with Profiler(self.directory, sample_interval=0) as profiler:
+            for _ in range(2):
+                with profiler.phase('reset'):
+                    pass
+                profiler.end_episode(steps=3)
+            self.assertIsNone(profiler.end_episode())
+        lines = (self.directory / EPISODES_FILE_NAME).read_text().splitlines()
+        episodes = [json.loads(line) for line in lines]
+        self.assertEqual([episode['steps'] for episode in episodes], [3, 3])
+        self.assertEqual([episode['episode'] for episode in episodes], [1, 2])
+        self.assertEqual(episodes[0]['phases']['reset']['count'], 1)
+        phases = json.loads((self.directory / PHASES_FILE_NAME).read_text())
+        self.assertEqual(phases['episodes'], 2)
+        self.assertEqual(phases['phases']['reset']['count'], 2)
+
+    def test_threads_have_separate_episodes(self):
+        profiler = Profiler(self.directory, sample_interval=0)
+
+        def work():
+            with profiler.phase('step'):
+                pass
+            profiler.end_episode()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(profiler.episodes, 4)
+        self.assertEqual(profiler.summary()['step']['count'], 4)
+
+    def test_sampled_stacks(self):
+        with Profiler(self.directory, sample_interval=0.002) as profiler:
+            with profiler.phase('send'):
+                time.sleep(0.1)
+        stacks = (self.directory / STACKS_FILE_NAME).read_text().splitlines()
+        waiting = [line for line in stacks if line.startswith('send;')]
+        self.assertTrue(waiting)
+        stack, count = waiting[0].rsplit(' ', 1)
+        self.assertIn('test_sampled_stacks (profiler_test.py)',
+                      stack.split(';'))
+        self.assertGreater(int(count), 0)
+        if hasattr(time, 'pthread_getcpuclockid'):
+            self.assertTrue(any(line.rsplit(' ', 1)[0].endswith(WAITING_FRAME)
+                                for line in waiting))
+
+
+class EnvProfilingTestCase(unittest.TestCase):
+    """Verify an environment profiles the phases of its episodes."""
+
+    def test_env_phases(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = Profiler(directory, sample_interval=0)
+            env = PolycraftEnv('mission.json', client=RecordingClient(),
+                               profiler=profiler)
+            with env:
+                for _ in range(2):
+                    env.reset()
+                    for _ in range(3):
+                        env.step('MOVE w')
+            summary = profiler.summary()
+            self.assertEqual(profiler.episodes, 2)
+            self.assertEqual(summary['reset']['count'], 2)
+            self.assertEqual(summary['step']['count'], 6)
+            self.assertEqual(summary['step/send']['count'], 6)
+            self.assertEqual(summary['step/reward']['count'], 6)
+            episode = json.loads((Path(directory) / EPISODES_FILE_NAME)
+                                 .read_text().splitlines()[0])
+            self.assertEqual(episode['mission'], 'mission.json')
+            self.assertEqual(episode['steps'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+"""A stand-in for PolycraftClient used by environment unit tests."""
+from typing import Callable, List, Sequence
+
+
+class RecordingClient:
+    """A client that records commands instead of sending them to a game."""
+
+    def __init__(self, reply: Callable[[str], object] = None):
+        """
+        Args:
+            reply: Builds the reply to each command, {} by default
+        """
+        self.commands = []
+        self.is_alive = True
+        self.instance_name = 'recording'
+        self._reply = reply
+
+    def send(self, message: str):
+        self.commands.append(message)
+        if self._reply is None:
+            return {}
+        return self._reply(message)
+
+    def stop(self):
+        pass
+
+    def send_many(self, messages: Sequence[str]) -> List[object]:
+        return [self.send(message) for message in messages]
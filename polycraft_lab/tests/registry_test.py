@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.ect.generator import MissionTemplate, generate_missions
+from polycraft_lab.envs.registry import MissionRegistry, UnknownMissionError, \
+    action_signature
+
+
+class MissionRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.missions = self.root / 'missions'
+        self.missions.mkdir()
+        self.index_path = self.root / 'index.json'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name: str, mission: dict, directory: Path = None):
+        path = (directory or self.missions) / name
+        with path.open('w') as file:
+            json.dump(mission, file)
+        return path
+
+    def registry(self, *directories):
+        return MissionRegistry(directories or [self.missions],
+                               index_path=self.index_path)
+
+    def test_resolve_by_file_name_and_version(self):
+        path = self.write('pogo_nonov.json', {'tags': ['pogo']})
+        registry = self.registry()
+        self.assertEqual(registry.resolve('pogo_nonov-v0'), path)
+        self.assertEqual(registry.resolve('pogo_stick-v0'), path)
+        self.assertEqual(registry.find(tag='pogo'), ['pogo_nonov-v0'])
+
+    def test_unversioned_name_resolves_to_latest(self):
+        self.write('a.json', {'name': 'hunt', 'version': 1})
+        latest = self.write('b.json', {'name': 'hunt', 'version': 2})
+        self.assertEqual(self.registry().resolve('hunt'), latest)
+
+    def test_malformed_missions_are_skipped(self):
+        path = self.write('hunt.json', {'name': 'hunt', 'version': 1})
+        self.write('bad_version.json', {'version': '1.2'})
+        self.write('bad_tags.json', {'tags': 3})
+        self.write('bad_variant.json', {'pal_variant': {'index': 0}})
+        registry = self.registry()
+        self.assertEqual(registry.resolve('hunt'), path)
+        self.assertEqual(registry.names(), ['hunt-v1'])
+
+    def test_unknown_mission(self):
+        with self.assertRaises(UnknownMissionError):
+            self.registry().resolve('missing-v0')
+
+    def test_index_is_reused_by_new_registries(self):
+        self.write('pogo_nonov.json', {})
+        self.registry().refresh()
+        self.assertTrue(self.index_path.exists())
+        registry = self.registry()
+        self.assertEqual(registry.names(), ['pogo_nonov-v0'])
+
+    def test_new_and_changed_files_are_picked_up(self):
+        path = self.write('a.json', {'name': 'first'})
+        registry = self.registry()
+        registry.refresh()
+        self.write('b.json', {'name': 'second'})
+        self.assertEqual(registry.resolve('second-v0').name, 'b.json')
+
+        with path.open('w') as file:
+            json.dump({'name': 'renamed', 'padding': 'x' * 10}, file)
+        os.utime(path, ns=(0, 1))
+        self.assertEqual(registry.resolve('renamed-v0'), path)
+        with self.assertRaises(UnknownMissionError):
+            registry.resolve('first-v0')
+
+    def test_earlier_directories_win(self):
+        other = self.root / 'other'
+        other.mkdir()
+        first = self.write('hunt.json', {})
+        self.write('hunt.json', {}, directory=other)
+        self.assertEqual(self.registry(self.missions, other)
+                         .resolve('hunt-v0'), first)
+
+    def test_generated_missions_keep_their_names(self):
+        template = MissionTemplate({
+            'name': 'trees', 'variants': 3,
+            'parameters': {'count': {'type': 'int', 'low': 1, 'high': 5}},
+            'mission': {'trees': '${count}', 'action_space': {'move': 4}},
+        })
+        generate_missions(template, self.missions / 'trees', workers=1)
+        registry = self.registry()
+        self.assertEqual(registry.find(tag='template:trees'),
+                         ['trees-0', 'trees-1', 'trees-2'])
+        signature = action_signature({'action_space': {'move': 4}})
+        self.assertEqual(registry.entry('trees-1')['action_signature'],
+                         signature)
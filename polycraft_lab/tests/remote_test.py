@@ -0,0 +1,86 @@
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.remote.env import RemotePolycraftEnv, RemoteVectorEnv
+from polycraft_lab.remote.protocol import RemoteError
+from polycraft_lab.remote.worker import PolycraftWorker
+
+
+def _echo(command: str) -> dict:
+    return {'command': command}
+
+
+class RemoteEnvTest(unittest.TestCase):
+    """Run several workers on localhost, each lending fake games."""
+
+    def setUp(self):
+        self.games = [FakePolycraftServer(handler=_echo) for _ in range(4)]
+        for game in self.games:
+            game.start()
+        self.workers = [
+            PolycraftWorker(port=0, capacity=2, name=f'worker-{index}',
+                            env_factory=self._factory(self.games[index * 2:
+                                                                 index * 2 + 2]))
+            for index in range(2)]
+        for worker in self.workers:
+            worker.start()
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.stop()
+        for game in self.games:
+            game.stop()
+
+    @staticmethod
+    def _factory(games):
+        def factory(slot, mission, options):
+            client = PolycraftClient.attach(*games[slot].address)
+            return PolycraftEnv(mission, client=client, **options)
+        return factory
+
+    def test_vector_env_steps_every_worker(self):
+        addresses = [worker.address for worker in self.workers]
+        with RemoteVectorEnv(addresses, 'mission.json',
+                             envs_per_worker=2) as envs:
+            self.assertEqual(envs.num_envs, 4)
+            observations = envs.reset()
+            self.assertEqual(observations,
+                             [{'command': 'RESET -d mission.json'}] * 4)
+            actions = ['MOVE w', 'MOVE a', 'MOVE s', 'MOVE d']
+            observations, rewards, dones, infos = envs.step(actions)
+        self.assertEqual(observations,
+                         [{'command': action} for action in actions])
+        self.assertEqual(rewards.tolist(), [0] * 4)
+        self.assertEqual(infos, [{'commands': 1}] * 4)
+        for game in self.games:
+            # START, RESET and one step each
+            self.assertEqual(game.commands_received, 3)
+
+    def test_single_env(self):
+        with RemotePolycraftEnv(self.workers[0].address, 'mission.json',
+                                options={'fast_reset': False}) as env:
+            env.reset()
+            observation, reward, done, info = env.step('MOVE w')
+        self.assertEqual(observation, {'command': 'MOVE w'})
+        self.assertEqual((reward, done), (0.0, False))
+
+    def test_slots_are_returned_on_close(self):
+        address = self.workers[0].address
+        with RemoteVectorEnv([address], 'mission.json', envs_per_worker=2):
+            with self.assertRaises(RemoteError):
+                RemoteVectorEnv([address], 'mission.json')
+        with RemoteVectorEnv([address], 'mission.json',
+                             envs_per_worker=2) as envs:
+            self.assertEqual(envs.num_envs, 2)
+
+    def test_token_is_required(self):
+        worker = PolycraftWorker(port=0, token='secret',
+                                 env_factory=self._factory(self.games))
+        with worker:
+            with self.assertRaises(RemoteError):
+                RemotePolycraftEnv(worker.address, 'mission.json')
+            with RemotePolycraftEnv(worker.address, 'mission.json',
+                                    token='secret') as env:
+                env.reset()
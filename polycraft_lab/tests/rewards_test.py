@@ -0,0 +1,78 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.ect.experiment_config import ExperimentConfig
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.envs.rewards import InvalidRewardSpecError, \
+    compile_reward_spec
+from polycraft_lab.tests.recording_client import RecordingClient
+
+POGO_STICK = 'polycraft:wooden_pogo_stick'
+
+SPEC = {
+    'terms': [
+        {'type': 'inventory', 'item': POGO_STICK, 'reward': 100,
+         'done': True},
+        {'type': 'position', 'target': [10, 4, 10], 'radius': 1,
+         'reward': 10},
+        {'type': 'step', 'reward': -1},
+    ],
+    'max_steps': 3,
+    'piggyback': True,
+}
+
+
+def _reply(pos=(0, 4, 0), items=()) -> dict:
+    inventory = {str(slot): {'item': item, 'count': 1}
+                 for slot, item in enumerate(items)}
+    return {'inventory': inventory, 'player': {'pos': list(pos)}}
+
+
+class RewardFunctionTestCase(unittest.TestCase):
+    """Verify compiled reward specs score replies correctly."""
+
+    def setUp(self):
+        self.reward_function = compile_reward_spec(SPEC)
+
+    def test_step_penalty_and_goal(self):
+        self.assertEqual(self.reward_function(_reply()), (-1, False, {}))
+        reward, done, info = self.reward_function(_reply(items=[POGO_STICK]))
+        self.assertEqual((reward, done), (99, True))
+        self.assertEqual(info['termination'], 'goal')
+
+    def test_position_rewarded_once(self):
+        self.assertEqual(self.reward_function(_reply((10, 4, 10)))[0], 9)
+        self.assertEqual(self.reward_function(_reply((10, 4, 10)))[0], -1)
+        self.reward_function.reset()
+        self.assertEqual(self.reward_function(_reply((10, 4, 10)))[0], 9)
+
+    def test_max_steps(self):
+        for _ in range(2):
+            self.assertFalse(self.reward_function(_reply())[1])
+        _, done, info = self.reward_function(_reply())
+        self.assertTrue(done)
+        self.assertEqual(info['termination'], 'max_steps')
+
+    def test_invalid_spec(self):
+        with self.assertRaises(InvalidRewardSpecError):
+            compile_reward_spec({'terms': [{'type': 'teleport'}]})
+
+    def test_env_piggybacks_sensor_fields(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config_path = Path(directory) / 'experiment.json'
+            config_path.write_text(json.dumps({'action_space': {'a': {}},
+                                               'reward': SPEC}))
+            config = ExperimentConfig(str(config_path), cache=None)
+        client = RecordingClient(lambda command: _reply(items=[POGO_STICK]))
+        env = PolycraftEnv('mission.json', client=client,
+                           experiment_config=config)
+        env.reset()
+        self.assertEqual(client.commands[1], 'PIGGYBACK inventory player')
+        _, reward, done, _ = env.step('CRAFT pogo_stick')
+        self.assertEqual((reward, done), (99, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+from polycraft_lab.envs.core import PolycraftEnv, StateUnavailableError
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+def _reply(command: str) -> dict:
+    return {'result': 'SUCCESS', 'command': command}
+
+
+def _no_states(command: str) -> dict:
+    if command.startswith(('SAVE_STATE', 'LOAD_STATE')):
+        return {'result': 'FAIL', 'message': 'Unknown command'}
+    return _reply(command)
+
+
+class WorldStateTest(unittest.TestCase):
+
+    def test_fast_reset_restores_initial_state(self):
+        client = RecordingClient(_reply)
+        env = PolycraftEnv('mission.json', client=client, fast_reset=True)
+        env.reset()
+        env.step('MOVE w')
+        observation = env.reset()
+        state_id = client.commands[2].split()[1]
+        self.assertEqual(client.commands, [
+            'START',
+            'RESET -d mission.json',
+            f'SAVE_STATE {state_id}',
+            'MOVE w',
+            f'LOAD_STATE {state_id}',
+        ])
+        self.assertEqual(observation['command'], f'LOAD_STATE {state_id}')
+
+    def test_fast_reset_falls_back_without_game_support(self):
+        client = RecordingClient(_no_states)
+        env = PolycraftEnv('mission.json', client=client, fast_reset=True)
+        env.reset()
+        env.reset()
+        self.assertEqual(client.commands[-2:],
+                         ['START', 'RESET -d mission.json'])
+
+    def test_branching_restores_reward_progress(self):
+        client = RecordingClient(_reply)
+        env = PolycraftEnv('mission.json', client=client)
+        env.reset()
+        env.step('MOVE w')
+        handle = env.save_state()
+        env.step('MOVE w')
+        env.step('MOVE w')
+        self.assertEqual(env._reward_function.steps, 3)
+        env.load_state(handle)
+        self.assertEqual(env._reward_function.steps, 1)
+
+    def test_released_state_cannot_be_loaded(self):
+        client = RecordingClient(_reply)
+        env = PolycraftEnv('mission.json', client=client)
+        handle = env.save_state()
+        env.release_state(handle)
+        self.assertEqual(client.commands[-1], f'DROP_STATE {handle.state_id}')
+        with self.assertRaises(StateUnavailableError):
+            env.load_state(handle)
+
+    def test_failed_save(self):
+        env = PolycraftEnv('mission.json',
+                           client=RecordingClient(_no_states))
+        with self.assertRaises(StateUnavailableError):
+            env.save_state()
@@ -0,0 +1,183 @@
+import json
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.installation.comms import PROTOCOL_JSON, \
+    PROTOCOL_MSGPACK, PolycraftBridge, msgpack
+from polycraft_lab.installation.streaming import ReplyTooLargeError, \
+    StreamingReply, ValueScanner
+
+REPLY = {
+    'result': 'SUCCESS',
+    'blocks': [{'name': 'minecraft:log', 'pos': [index, 4, -index],
+                'tag': 'a "quoted\\" ] name'} for index in range(50)],
+    'empty': [],
+    'inventory': {'slots': [1, 2, 3]},
+    'count': -12.5e1,
+}
+
+
+def _reply(command: str) -> dict:
+    if command == 'BIG':
+        # One block too large for the stream buffer, between two small ones
+        return dict(REPLY, command=command, blocks=[
+            {'tag': 'a'}, {'tag': 'b' * 32 * 1024}, {'tag': 'c'}])
+    return dict(REPLY, command=command)
+
+
+class _Chunks:
+    """Feeds an encoded reply into a buffer a few bytes at a time."""
+
+    def __init__(self, data: bytes, size: int):
+        self.buffer = bytearray()
+        self.fills = 0
+        self._data = data
+        self._size = size
+
+    def fill(self):
+        if not self._data:
+            raise EOFError
+        self.buffer += self._data[:self._size]
+        self._data = self._data[self._size:]
+        self.fills += 1
+
+
+class ValueScannerTestCase(unittest.TestCase):
+    """Verify the end of a value is found across chunk boundaries."""
+
+    def test_resumes_between_chunks(self):
+        data = json.dumps(REPLY).encode() + b' {"next": 1}'
+        end = len(json.dumps(REPLY))
+        for size in (1, 7, 64):
+            buffer = bytearray()
+            scanner = ValueScanner(0)
+            found = None
+            for start in range(0, len(data), size):
+                buffer += data[start:start + size]
+                found = scanner.scan(buffer)
+                if found is not None:
+                    break
+            self.assertEqual(found, end)
+
+    def test_escaped_quote_at_chunk_end(self):
+        scanner = ValueScanner(0)
+        buffer = bytearray(b'["a\\')
+        self.assertIsNone(scanner.scan(buffer))
+        buffer += b'"]"]'
+        self.assertEqual(scanner.scan(buffer), len(buffer))
+
+
+class StreamingReplyTestCase(unittest.TestCase):
+    """Verify replies are decoded value by value as they arrive."""
+
+    def _stream(self, size: int = 5, fields=('blocks', 'empty'),
+                **kwargs) -> StreamingReply:
+        self.chunks = _Chunks(json.dumps(REPLY).encode() + b'\n{"next"',
+                              size)
+        return StreamingReply(self.chunks.buffer, self.chunks.fill, fields,
+                              **kwargs)
+
+    def test_elements_and_fields(self):
+        reply = self._stream()
+        elements = list(reply)
+        self.assertTrue(reply.is_finished)
+        self.assertEqual(elements, [('blocks', block)
+                                    for block in REPLY['blocks']])
+        self.assertEqual(reply.fields, {key: value for key, value in
+                                        REPLY.items()
+                                        if key not in ('blocks', 'empty')})
+        # Bytes of the next reply are left in the buffer
+        self.assertTrue(self.chunks.buffer.lstrip().startswith(b'{'))
+
+    def test_reads_only_what_is_consumed(self):
+        reply = self._stream(size=64)
+        next(iter(reply))
+        self.assertLess(self.chunks.fills * 64, len(json.dumps(REPLY)) // 4)
+        self.assertFalse(reply.is_finished)
+        self.assertEqual(reply.finish()['inventory'], REPLY['inventory'])
+
+    def test_unstreamed_array_is_a_field(self):
+        with self._stream(fields=()) as reply:
+            self.assertEqual(list(reply), [])
+        self.assertEqual(reply.fields['blocks'], REPLY['blocks'])
+
+    def test_value_larger_than_buffer(self):
+        reply = self._stream(fields=(), max_buffer=256)
+        with self.assertRaises(ReplyTooLargeError):
+            reply.finish()
+        # The rest of the reply was skipped, up to the next one
+        self.assertTrue(reply.is_finished)
+        self._assert_next_reply_left()
+
+    def test_error_in_streamed_array_skips_rest(self):
+        reply = self._stream(max_buffer=64)
+        with self.assertRaises(ReplyTooLargeError):
+            list(reply)
+        self.assertNotIn('inventory', reply.finish())
+        self._assert_next_reply_left()
+
+    def _assert_next_reply_left(self):
+        self.assertEqual(
+            (bytes(self.chunks.buffer) + self.chunks._data).strip(),
+            b'{"next"')
+
+    def test_from_value(self):
+        reply = StreamingReply.from_value(REPLY, ['blocks'])
+        self.assertEqual(list(reply.elements('blocks')), REPLY['blocks'])
+        self.assertNotIn('blocks', reply.fields)
+
+
+class BridgeStreamTestCase(unittest.TestCase):
+    """Verify streamed commands on a bridge to a fake game."""
+
+    def _bridge(self, server: FakePolycraftServer,
+                protocol: str = PROTOCOL_JSON) -> PolycraftBridge:
+        bridge = PolycraftBridge(*server.address, None, buffer_size=4096,
+                                 protocol=protocol)
+        bridge.start(startup_delay=0)
+        self.addCleanup(bridge.disconnect)
+        return bridge
+
+    def test_stream_then_send(self):
+        with FakePolycraftServer(handler=_reply) as server:
+            bridge = self._bridge(server)
+            reply = bridge.stream('SENSE_ALL', ['blocks'])
+            self.assertEqual(next(reply.elements('blocks')),
+                             REPLY['blocks'][0])
+            # The rest of the streamed reply is read before the next one
+            self.assertEqual(bridge.send('SENSE_ALL')['command'], 'SENSE_ALL')
+            self.assertTrue(reply.is_finished)
+            self.assertEqual(reply.fields['count'], REPLY['count'])
+
+    def test_send_after_oversized_stream(self):
+        with FakePolycraftServer(handler=_reply) as server:
+            bridge = self._bridge(server)
+            with self.assertRaises(ReplyTooLargeError):
+                with bridge.stream('BIG', ['blocks'],
+                                   max_buffer=8192) as reply:
+                    list(reply)
+            self.assertEqual(bridge.send('MOVE w')['command'], 'MOVE w')
+            reply = bridge.stream('BIG', ['blocks'], max_buffer=8192)
+            with self.assertRaises(ReplyTooLargeError):
+                list(reply)
+            # Without finishing the stream, the next command skips its rest
+            self.assertEqual(bridge.send_many(['A', 'B'])[1]['command'], 'B')
+
+    def test_reply_split_over_many_chunks(self):
+        with FakePolycraftServer(reply_size=256 * 1024) as server:
+            bridge = self._bridge(server)
+            for _ in range(2):
+                self.assertEqual(bridge.send('SENSE_ALL')['result'],
+                                 'SUCCESS')
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_stream(self):
+        with FakePolycraftServer(handler=_reply) as server:
+            bridge = self._bridge(server, PROTOCOL_MSGPACK)
+            with bridge.stream('SENSE_ALL', ['blocks']) as reply:
+                self.assertEqual(len(list(reply)), len(REPLY['blocks']))
+            self.assertEqual(reply.fields['result'], 'SUCCESS')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.experiments.scheduler import WorkStealingQueue
+from polycraft_lab.experiments.sweep import SweepConfig, SweepRunner
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+class WorkStealingQueueTestCase(unittest.TestCase):
+    """Verify groups stay together and idle workers steal."""
+
+    def test_distribute_and_steal(self):
+        queue = WorkStealingQueue(2)
+        queue.distribute([[1, 2, 3], [4]])
+        self.assertEqual(queue.get(0), 1)
+        self.assertEqual(queue.get(1), 4)
+        self.assertEqual(queue.get(1), 3)  # Stolen from the back
+        self.assertEqual(queue.steals, 1)
+        self.assertEqual(queue.get(0), 2)
+        self.assertIsNone(queue.get(0))
+
+
+class SweepRunnerTestCase(unittest.TestCase):
+    """Verify sweeps run every trial once and resume after interruption."""
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        directory = Path(self._directory.name)
+        self.server = FakePolycraftServer(handler=lambda c: {'echo': c})
+        self.server.start()
+        sweep = {
+            'name': 'test',
+            'missions': ['a.json', 'b.json'],
+            'seeds': [0, 1, 2],
+            'agents': {'random': 'random'},
+            'actions': ['MOVE w', 'TURN 90'],
+            'max_steps': 5,
+            'instances': 2,
+        }
+        config_path = directory / 'sweep.json'
+        config_path.write_text(json.dumps(sweep))
+        self.config = SweepConfig.from_file(str(config_path))
+
+    def tearDown(self):
+        self.server.stop()
+        self._directory.cleanup()
+
+    def _env(self, index: int) -> PolycraftEnv:
+        return PolycraftEnv('a.json',
+                            client=PolycraftClient.attach(*self.server.address))
+
+    def _run(self) -> SweepRunner:
+        runner = SweepRunner(self.config, env_factory=self._env,
+                             report_interval=0.01, out=io.StringIO())
+        runner.run()
+        return runner
+
+    def _results(self, runner: SweepRunner):
+        lines = runner.results_path.read_text().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_runs_every_trial(self):
+        runner = self._run()
+        results = self._results(runner)
+        self.assertEqual(len({r['trial_id'] for r in results}), 6)
+        self.assertEqual(results[0]['episodes'][0]['steps'], 5)
+        self.assertEqual(runner.progress.steps, 30)
+
+    def test_resume(self):
+        runner = self._run()
+        lines = runner.results_path.read_text().splitlines()
+        # Simulate an interruption part way through writing the last trial
+        runner.results_path.write_text('\n'.join(lines[:4]) + '\n{"tri')
+        runner = self._run()
+        self.assertEqual(runner.progress.total_trials, 2)
+        self.assertEqual(len(self._results(runner)), 6)
+
+    def test_workers_without_env_fail_their_trials(self):
+        def failing_env(index: int) -> PolycraftEnv:
+            if index == 0:
+                return self._env(index)
+            raise ConnectionRefusedError()
+
+        runner = SweepRunner(self.config, env_factory=failing_env,
+                             report_interval=0, out=io.StringIO())
+        # The working worker takes over the trials of the failed one
+        self.assertEqual(runner.run().trials_done, 6)
+
+        runner = SweepRunner(self.config, report_interval=0,
+                             out=io.StringIO(),
+                             env_factory=lambda index: failing_env(1))
+        progress = runner.run(resume=False)
+        self.assertEqual((progress.trials_done, progress.trials_failed),
+                         (0, 6))
+
+    def test_trials_of_lost_games_count_once(self):
+        def dying_env(index: int) -> PolycraftEnv:
+            client = RecordingClient()
+
+            def reply(command):
+                client.is_alive = False
+                raise ConnectionResetError()
+
+            client._reply = reply
+            return PolycraftEnv('a.json', client=client)
+
+        for env_factory in (dying_env,
+                            lambda index: self._env(index) if index == 0
+                            else dying_env(index)):
+            runner = SweepRunner(self.config, env_factory=env_factory,
+                                 report_interval=0, out=io.StringIO())
+            progress = runner.run(resume=False)
+            self.assertEqual(progress.trials_done + progress.trials_failed,
+                             progress.total_trials)
+        # The game that kept running took over every trial
+        self.assertEqual(progress.trials_done, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
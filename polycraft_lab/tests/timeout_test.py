@@ -0,0 +1,162 @@
+import functools
+import time
+import unittest
+
+import numpy as np
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.envs.core import PolycraftEnv, StepTimeoutError, \
+    TIMEOUT_DONE
+from polycraft_lab.envs.vector import PolycraftVectorEnv, \
+    TERMINATION_TIMEOUT
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.installation.comms import CommandTimeoutError, \
+    PROTOCOL_JSON, PROTOCOL_MSGPACK, PolycraftBridge, msgpack
+
+STALL_SECONDS = 0.3
+
+
+def _reply(command: str) -> dict:
+    if command.startswith('STALL'):
+        time.sleep(STALL_SECONDS)
+    return {'echo': command, 'position': [len(command), 0, 0]}
+
+
+def _make_env(host: str, port: int) -> PolycraftEnv:
+    return PolycraftEnv('mission.json',
+                        client=PolycraftClient.attach(host, port))
+
+
+def _encode(reply: dict) -> np.ndarray:
+    return np.asarray(reply['position'], dtype=np.float32)
+
+
+class BridgeTimeoutTestCase(unittest.TestCase):
+    """Verify timed out commands fail and the stream stays in sync."""
+
+    def setUp(self):
+        self.server = FakePolycraftServer(handler=_reply)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def _bridge(self, protocol: str = PROTOCOL_JSON) -> PolycraftBridge:
+        bridge = PolycraftBridge(*self.server.address, None,
+                                 protocol=protocol)
+        bridge.start(startup_delay=0)
+        self.addCleanup(bridge.disconnect)
+        return bridge
+
+    def _check_resync(self, bridge: PolycraftBridge):
+        with self.assertRaises(CommandTimeoutError) as context:
+            bridge.send('STALL', timeout=0.05)
+        self.assertEqual(context.exception.command, 'STALL')
+        self.assertTrue(bridge.is_degraded)
+        # The late reply is skipped, not mistaken for this one
+        self.assertEqual(bridge.send('MOVE w')['echo'], 'MOVE w')
+        self.assertFalse(bridge.is_degraded)
+
+    def test_resync_json(self):
+        self._check_resync(self._bridge())
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_resync_msgpack(self):
+        self._check_resync(self._bridge(PROTOCOL_MSGPACK))
+
+    def test_pipelined_timeout(self):
+        bridge = self._bridge()
+        with self.assertRaises(CommandTimeoutError):
+            bridge.send_many(['A', 'STALL', 'B'], timeout=0.05)
+        self.assertFalse(bridge.resync(timeout=0))
+        self.assertTrue(bridge.resync(timeout=5))
+        self.assertEqual(bridge.send_many(['C', 'D'], timeout=5),
+                         [{'echo': 'C', 'position': [1, 0, 0]},
+                          {'echo': 'D', 'position': [1, 0, 0]}])
+
+    def test_no_timeout_waits(self):
+        bridge = self._bridge()
+        self.assertEqual(bridge.send('STALL')['echo'], 'STALL')
+
+
+class EnvTimeoutTestCase(unittest.TestCase):
+    """Verify the step timeout of an environment."""
+
+    def setUp(self):
+        self.server = FakePolycraftServer(handler=_reply)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def _env(self, **kwargs) -> PolycraftEnv:
+        client = PolycraftClient.attach(*self.server.address)
+        env = PolycraftEnv('mission.json', client=client, step_timeout=0.05,
+                           **kwargs)
+        self.addCleanup(env.__exit__, None, None, None)
+        return env
+
+    def test_raise(self):
+        env = self._env()
+        with self.assertRaises(StepTimeoutError):
+            env.step('STALL')
+        time.sleep(STALL_SECONDS)
+        self.assertEqual(env.step('MOVE w')[0]['echo'], 'MOVE w')
+
+    def test_done(self):
+        env = self._env(on_timeout=TIMEOUT_DONE)
+        first = env.step('MOVE w')[0]
+        observation, reward, done, info = env.step('STALL')
+        self.assertIs(observation, first)
+        self.assertEqual((reward, done), (0.0, True))
+        self.assertEqual(info['termination'], 'timeout')
+
+
+class VectorTimeoutTestCase(unittest.TestCase):
+    """Verify a stuck worker does not hold up the batch."""
+
+    def setUp(self):
+        self.server = FakePolycraftServer(handler=_reply)
+        self.server.start()
+        env_fn = functools.partial(_make_env, *self.server.address)
+        self.env = PolycraftVectorEnv([env_fn] * 2, _encode, (3,))
+
+    def tearDown(self):
+        self.env.close()
+        self.server.stop()
+
+    def test_partial_results(self):
+        # Starting the workers is not timed
+        self.env.reset()
+        self.env.step_timeout = STALL_SECONDS / 3
+        started = time.monotonic()
+        observations, rewards, dones, infos = self.env.step(['STALL', 'AB'])
+        self.assertLess(time.monotonic() - started, STALL_SECONDS)
+        self.assertEqual(observations[1, 0], 2)
+        np.testing.assert_array_equal(dones, [True, False])
+        self.assertEqual(infos[0]['termination'], TERMINATION_TIMEOUT)
+        self.assertEqual(self.env.degraded, [0])
+        time.sleep(STALL_SECONDS)
+        # The late result arrived, so the worker takes commands again
+        observations, _, dones, _ = self.env.step(['ABC', 'A'])
+        np.testing.assert_array_equal(observations[:, 0], [3, 1])
+        self.assertFalse(dones.any())
+        self.assertEqual(self.env.degraded, [])
+
+    def test_reset_skips_busy_worker(self):
+        self.env.reset()
+        self.env.step_timeout = STALL_SECONDS / 3
+        self.env.step(['STALL', 'AB'])
+        self.env.reset()
+        self.assertEqual(self.env.degraded, [0])
+        time.sleep(STALL_SECONDS)
+        # The late result arrived, but the environment was never reset
+        observations, _, dones, infos = self.env.step(['ABC', 'A'])
+        np.testing.assert_array_equal(dones, [True, False])
+        self.assertEqual(infos[0]['termination'], TERMINATION_TIMEOUT)
+        self.assertEqual(self.env.degraded, [0])
+        self.env.reset()
+        self.assertEqual(self.env.degraded, [])
+        observations, _, dones, _ = self.env.step(['ABC', 'A'])
+        np.testing.assert_array_equal(observations[:, 0], [3, 1])
+        self.assertFalse(dones.any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import io
+import unittest
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.cli.turtle import TurtleConsole, _batches
+from polycraft_lab.installation.client import PolycraftClient
+from polycraft_lab.tests.recording_client import RecordingClient
+
+
+class TurtleConsoleTest(unittest.TestCase):
+
+    def test_script_is_batched_and_stops_at_quit(self):
+        client = RecordingClient(reply=lambda command: {'command': command})
+        out = io.StringIO()
+        script = io.StringIO('# setup\nMOVE w\n\nMOVE a\nMOVE s\nquit\nMOVE d\n')
+        with TurtleConsole(client, out=out, pretty=False,
+                           batch_size=2) as console:
+            self.assertTrue(console.run_script(script))
+        self.assertEqual(client.commands, ['MOVE w', 'MOVE a', 'MOVE s'])
+        self.assertEqual(console.commands_sent, 3)
+        self.assertIn('{"command": "MOVE s"}', out.getvalue())
+        self.assertIn('# 2 command(s) in', out.getvalue())
+
+    def test_batches_end_without_quit(self):
+        batches = list(_batches(['a', 'b', 'c'], batch_size=2))
+        self.assertEqual(batches, [(['a', 'b'], False), (['c'], False)])
+
+    def test_send_async_over_socket(self):
+        with FakePolycraftServer(handler=lambda command: {'ok': command}) \
+                as server:
+            client = PolycraftClient.attach(*server.address)
+            try:
+                with TurtleConsole(client, out=io.StringIO()) as console:
+                    futures = [console.send_async(f'MOVE {direction}')
+                               for direction in 'wasd']
+                    replies = [future.result()[0] for future in futures]
+            finally:
+                client.stop()
+        self.assertEqual(replies, [{'ok': f'MOVE {direction}'}
+                                   for direction in 'wasd'])
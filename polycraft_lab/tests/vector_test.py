@@ -0,0 +1,78 @@
+import functools
+import unittest
+
+import numpy as np
+
+from polycraft_lab.bench.fake_server import FakePolycraftServer
+from polycraft_lab.envs.core import PolycraftEnv
+from polycraft_lab.envs.shared_memory import SharedStepBuffer
+from polycraft_lab.envs.vector import PolycraftVectorEnv, \
+    VectorEnvWorkerError
+from polycraft_lab.installation.client import PolycraftClient
+
+
+def _reply(command: str) -> dict:
+    if command == 'FAIL':
+        return {'broken': True}
+    return {'position': [len(command), 1, 2]}
+
+
+def _make_env(host: str, port: int) -> PolycraftEnv:
+    return PolycraftEnv('mission.json',
+                        client=PolycraftClient.attach(host, port))
+
+
+def _encode(reply: dict) -> np.ndarray:
+    return np.asarray(reply['position'], dtype=np.float32)
+
+
+class SharedStepBufferTestCase(unittest.TestCase):
+    """Verify writes are visible through an attached buffer."""
+
+    def test_attach_shares_memory(self):
+        buffer = SharedStepBuffer(2, (3,), capacity=2)
+        attached = SharedStepBuffer.attach(buffer.spec)
+        try:
+            attached.write(1, 0, [1, 2, 3], 0.5, True)
+            observations, rewards, dones = buffer.read(1)
+            np.testing.assert_array_equal(observations[0], [1, 2, 3])
+            self.assertEqual(rewards[0], 0.5)
+            self.assertTrue(dones[0])
+            self.assertFalse(dones[1])
+        finally:
+            attached.close()
+            buffer.close()
+
+
+class PolycraftVectorEnvTestCase(unittest.TestCase):
+    """Verify batched stepping across worker processes."""
+
+    def setUp(self):
+        self.server = FakePolycraftServer(handler=_reply)
+        self.server.start()
+        env_fn = functools.partial(_make_env, *self.server.address)
+        self.env = PolycraftVectorEnv([env_fn] * 3, _encode, (3,))
+
+    def tearDown(self):
+        self.env.close()
+        self.server.stop()
+
+    def test_step(self):
+        self.env.reset()
+        observations, rewards, dones, infos = \
+            self.env.step(['MOVE w', 'TURN 90', 'SENSE_ALL'])
+        np.testing.assert_array_equal(observations[:, 0], [6, 7, 9])
+        self.assertEqual(observations.shape, (3, 3))
+        self.assertEqual(infos, [{'commands': 1}] * 3)
+
+    def test_worker_error(self):
+        with self.assertRaises(VectorEnvWorkerError) as context:
+            self.env.step(['MOVE w', 'FAIL', 'MOVE w'])
+        self.assertEqual(context.exception.env_index, 1)
+        # The other workers stay usable
+        observations, _, _, _ = self.env.step(['A', 'BB', 'CCC'])
+        np.testing.assert_array_equal(observations[:, 0], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
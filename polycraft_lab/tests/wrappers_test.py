@@ -0,0 +1,114 @@
+import unittest
+
+import numpy as np
+
+from polycraft_lab.envs.wrappers import BLOCK_AIR, BLOCK_UNKNOWN, \
+    BlockGridEncoder, EncodeObservation, FrameStack, InventoryEncoder, \
+    NormalizeObservation
+
+LOG = 'minecraft:log'
+PLANKS = 'minecraft:planks'
+
+
+def _reply(blocks=(), pos=(10, 4, 10), items=()) -> dict:
+    return {
+        'blocks': [{'name': name, 'pos': list(block_pos)}
+                   for name, block_pos in blocks],
+        'player': {'pos': list(pos)},
+        'inventory': {str(slot): {'item': item, 'count': count}
+                      for slot, (item, count) in enumerate(items)},
+    }
+
+
+class _ScriptedEnv:
+    """Returns the given observations in order, batched if num_envs is set."""
+
+    def __init__(self, observations, num_envs: int = None):
+        self._observations = iter(observations)
+        if num_envs is not None:
+            self.num_envs = num_envs
+
+    def reset(self):
+        return next(self._observations)
+
+    def step(self, action):
+        return next(self._observations), 0, False, {}
+
+
+class EncoderTestCase(unittest.TestCase):
+    """Verify replies are encoded relative to the player."""
+
+    def test_block_grid(self):
+        encoder = BlockGridEncoder([LOG], radius=1)
+        grid = encoder(_reply([(LOG, (11, 4, 10)), ('other', (10, 3, 10)),
+                               (LOG, (20, 4, 10))]))
+        self.assertEqual(grid.shape, (3, 3, 3))
+        self.assertEqual(grid[2, 1, 1], 2)
+        self.assertEqual(grid[1, 0, 1], BLOCK_UNKNOWN)
+        self.assertEqual(np.count_nonzero(grid != BLOCK_AIR), 2)
+
+    def test_block_grid_one_hot_batch(self):
+        encoder = BlockGridEncoder([LOG], radius=1, one_hot=True)
+        grids = encoder.encode_batch([_reply([(LOG, (10, 4, 10))]),
+                                      _reply()])
+        self.assertEqual(grids.shape, (2, 3, 3, 3, 3))
+        np.testing.assert_array_equal(grids.sum(axis=1), 1)
+        self.assertEqual(grids[0, 2, 1, 1, 1], 1)
+        self.assertEqual(grids[1, BLOCK_AIR].sum(), 27)
+
+    def test_inventory(self):
+        encoder = InventoryEncoder([PLANKS, LOG])
+        counts = encoder.encode_batch([
+            _reply(items=[(LOG, 2), (LOG, 3), ('other', 1)]),
+            _reply(items=[(PLANKS, 4)]),
+        ])
+        np.testing.assert_array_equal(counts, [[0, 5], [4, 0]])
+
+
+class WrapperTestCase(unittest.TestCase):
+    """Verify wrappers work on single and vector environments."""
+
+    def test_encode_single_env(self):
+        env = EncodeObservation(
+            _ScriptedEnv([_reply(items=[(LOG, 1)])] * 2),
+            {'inventory': InventoryEncoder([LOG]),
+             'blocks': BlockGridEncoder([LOG], radius=1)})
+        observation = env.reset()
+        np.testing.assert_array_equal(observation['inventory'], [1])
+        self.assertEqual(observation['blocks'].shape, (3, 3, 3))
+
+    def test_frame_stack(self):
+        frames = [np.full((2, 1), value, dtype=np.float32)
+                  for value in range(5)]
+        env = FrameStack(_ScriptedEnv(frames, num_envs=2), 3)
+        np.testing.assert_array_equal(env.reset()[0, :, 0], [0, 0, 0])
+        env.step(None)
+        env.step(None)
+        observation, _, _, _ = env.step(None)
+        np.testing.assert_array_equal(observation[1, :, 0], [1, 2, 3])
+        observation, _, _, _ = env.step(None)
+        np.testing.assert_array_equal(observation[0, :, 0], [2, 3, 4])
+        self.assertTrue(observation.base is not None)
+
+    def test_frame_stack_key(self):
+        env = FrameStack(_ScriptedEnv([{'x': np.zeros(2)}, {'x': np.ones(2)}]),
+                         2, key='x')
+        env.reset()
+        observation, _, _, _ = env.step(None)
+        np.testing.assert_array_equal(observation['x'], [[0, 0], [1, 1]])
+
+    def test_normalize(self):
+        rng = np.random.default_rng(0)
+        batches = [rng.normal(5, 2, size=(64, 3)) for _ in range(50)]
+        env = NormalizeObservation(_ScriptedEnv(batches, num_envs=64))
+        env.reset()
+        for _ in range(48):
+            observation, _, _, _ = env.step(None)
+        self.assertEqual(observation.dtype, np.float32)
+        np.testing.assert_allclose(env.statistics.mean, 5, atol=0.1)
+        np.testing.assert_allclose(env.statistics.var, 4, rtol=0.1)
+        self.assertLess(abs(observation.mean()), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
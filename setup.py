@@ -41,11 +41,15 @@ setup(
         'install': PostInstallCommand,
     },
     install_requires=package_dependencies,
+    extras_require={
+        # Compact binary replies from the game, see PolycraftBridge
+        'msgpack': ['msgpack'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         # TODO: Set open source license
         'Operating System :: OS Independent',
         'Development Status :: 3 - Alpha'
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
 )